@@ -0,0 +1,6 @@
+"""Allows running ``python -m osm2pgsql_tuner``."""
+import sys
+
+from osm2pgsql_tuner.cli import main
+
+sys.exit(main())
@@ -0,0 +1,144 @@
+"""Evaluates many osm2pgsql recommendations at once using columnar inputs.
+
+Evaluates the same rule table (:data:`osm2pgsql_tuner.tuner.RULES`) as
+:class:`osm2pgsql_tuner.tuner.Recommendation`, but on NumPy arrays instead
+of building one object per combination.
+Requires the optional ``numpy`` dependency (``pip install osm2pgsql-tuner[batch]``).
+"""
+import types
+
+import numpy as np
+
+from osm2pgsql_tuner import tuner
+# Decision codes moved to the rules module, kept here for existing imports
+from osm2pgsql_tuner.rules import (CacheDecision, DropDecision, FlatNodesDecision,
+                                   SlimDecision)
+
+
+def evaluate_rule(rule: tuner.Rule, columns) -> tuple:
+    """Evaluates a rule for every row, the first matching outcome wins.
+
+    Parameters
+    -----------------------
+    rule : osm2pgsql_tuner.tuner.Rule
+    columns : object
+        Attributes read by the rule, NumPy arrays of the same shape.
+
+    Returns
+    -----------------------
+    result : tuple
+        ``(codes, values)`` arrays, codes as ``int8``.
+    """
+    conditions = [np.asarray(when(columns), dtype=bool)
+                  for _, when, _ in rule.outcomes[:-1]]
+    codes = [code for code, _, _ in rule.outcomes]
+    values = [value(columns) if callable(value) else value
+              for _, _, value in rule.outcomes]
+    return (np.select(conditions, codes[:-1], codes[-1]).astype(np.int8),
+            np.select(conditions, values[:-1], values[-1]))
+
+
+class BatchResult():
+    """Columnar results of :func:`recommend`.
+
+    Every attribute is a NumPy array with one element per input row.
+    Attribute names match the scalar ``Recommendation`` attributes.
+    """
+    def __init__(self, osm2pgsql_cache_max, osm2pgsql_noslim_cache,
+                 osm2pgsql_slim_cache, osm2pgsql_run_in_ram, osm2pgsql_drop,
+                 osm2pgsql_flat_nodes, osm2pgsql_limited_ram, cache_mb,
+                 slim_decision, drop_decision, flat_nodes_decision,
+                 cache_decision):
+        self.osm2pgsql_cache_max = osm2pgsql_cache_max
+        self.osm2pgsql_noslim_cache = osm2pgsql_noslim_cache
+        self.osm2pgsql_slim_cache = osm2pgsql_slim_cache
+        self.osm2pgsql_run_in_ram = osm2pgsql_run_in_ram
+        self.osm2pgsql_drop = osm2pgsql_drop
+        self.osm2pgsql_flat_nodes = osm2pgsql_flat_nodes
+        self.osm2pgsql_limited_ram = osm2pgsql_limited_ram
+        self.cache_mb = cache_mb
+        self.slim_decision = slim_decision
+        self.drop_decision = drop_decision
+        self.flat_nodes_decision = flat_nodes_decision
+        self.cache_decision = cache_decision
+
+    def __len__(self) -> int:
+        return len(self.cache_mb)
+
+    def to_dict(self) -> dict:
+        """Returns the columns as a dictionary of NumPy arrays.
+
+        Returns
+        ----------------------
+        columns : dict
+        """
+        return dict(vars(self))
+
+
+def recommend(system_ram_gb, osm_pbf_gb, slim_no_drop=False,
+              ssd=True) -> BatchResult:
+    """Evaluates the ``Recommendation`` rules for every input row.
+
+    Scalar inputs are broadcast against array inputs, so a single host can be
+    checked against many PBF sizes (or the reverse) without building a grid.
+
+    Parameters
+    -----------------------
+    system_ram_gb : array_like of float
+        How much total RAM each server has, in GB.
+
+    osm_pbf_gb : array_like of float
+        Size of each ``.osm.pbf`` file in GB.
+
+    slim_no_drop : array_like of bool
+        (Default False) Setup to use osm2pgsql ``--append``.
+
+    ssd : array_like of bool
+        (Default True) Is the osm2pgsql server using SSD for storage?
+
+    Returns
+    -----------------------
+    result : BatchResult
+    """
+    system_ram_gb, osm_pbf_gb, slim_no_drop, ssd = np.broadcast_arrays(
+        np.atleast_1d(np.asarray(system_ram_gb, dtype=np.float64)),
+        np.atleast_1d(np.asarray(osm_pbf_gb, dtype=np.float64)),
+        np.atleast_1d(np.asarray(slim_no_drop, dtype=bool)),
+        np.atleast_1d(np.asarray(ssd, dtype=bool)))
+
+    if np.any(system_ram_gb < 2.0):
+        url = 'https://osm2pgsql.org/doc/manual.html#main-memory'
+        msg = f'osm2pgsql requires a minimum of 2 GB RAM. See: {url}'
+        raise ValueError(msg)
+
+    # Same operation order as the scalar methods so floats match bit for bit
+    cache_max = system_ram_gb * tuner.CACHE_MAX_RATIO
+    noslim_cache = tuner.NOSLIM_BASE_GB + (tuner.NOSLIM_GB_PER_PBF_GB * osm_pbf_gb)
+    slim_cache = tuner.SLIM_CACHE_RATIO * noslim_cache
+
+    flat_nodes_gb = np.where(ssd, tuner.FLAT_NODES_THRESHOLD_GB, tuner.FLAT_NODES_ALWAYS_GB)
+
+    # Storage probes are not supported in batches, the ssd thresholds apply
+    columns = types.SimpleNamespace(osm_pbf_gb=osm_pbf_gb, slim_no_drop=slim_no_drop,
+                                    ssd=ssd, storage=None,
+                                    osm2pgsql_flat_nodes_gb=flat_nodes_gb,
+                                    osm2pgsql_cache_max=cache_max,
+                                    osm2pgsql_noslim_cache=noslim_cache,
+                                    osm2pgsql_slim_cache=slim_cache)
+    codes = {}
+    for rule in tuner.RULES:
+        codes[rule.attribute], values = evaluate_rule(rule, columns)
+        setattr(columns, rule.attribute, values)
+
+    return BatchResult(osm2pgsql_cache_max=cache_max,
+                       osm2pgsql_noslim_cache=noslim_cache,
+                       osm2pgsql_slim_cache=slim_cache,
+                       osm2pgsql_run_in_ram=columns.osm2pgsql_run_in_ram,
+                       osm2pgsql_drop=columns.osm2pgsql_drop,
+                       osm2pgsql_flat_nodes=columns.osm2pgsql_flat_nodes,
+                       osm2pgsql_limited_ram=columns.osm2pgsql_limited_ram,
+                       cache_mb=columns.osm2pgsql_cache_mb,
+                       slim_decision=codes['osm2pgsql_run_in_ram'],
+                       drop_decision=codes['osm2pgsql_drop'],
+                       flat_nodes_decision=codes['osm2pgsql_flat_nodes'],
+                       cache_decision=codes['osm2pgsql_cache_mb'])
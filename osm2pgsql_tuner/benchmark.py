@@ -0,0 +1,349 @@
+"""Benchmarks of the tuner hot paths with regression tracking.
+
+Times recommendation construction, batch sweeps, capacity thresholds,
+scanning a synthetic PBF (:mod:`osm2pgsql_tuner.synthetic`) and writing one.
+Each case reports the best of ``repeat`` runs, saved results act as the
+baseline for later runs and cases slower than the tolerance are reported as
+regressions.  Baselines depend on the machine, keep one per host.
+
+The scan of the synthetic file is also checked against the element counts
+it was written with.  With ``--import`` the synthetic file is loaded with
+osm2pgsql (:func:`osm2pgsql_tuner.supervisor.supervise`) and the measured
+peak RSS is reported next to the prediction.  Needs ``osm2pgsql`` on the
+``PATH`` and ``PGOSM_CONN`` set, the import is skipped otherwise.
+
+    python -m osm2pgsql_tuner.benchmark --save baseline.json
+    python -m osm2pgsql_tuner.benchmark --baseline baseline.json --tolerance 0.25
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from osm2pgsql_tuner import capacity, pbf, synthetic, tuner
+
+
+DEFAULT_REPEAT = 5
+"""int : Runs per case, the fastest is reported."""
+
+DEFAULT_TOLERANCE = 0.2
+"""float : Slowdown relative to the baseline reported as a regression."""
+
+DEFAULT_PBF_MB = 2.0
+"""float : Size of the synthetic PBF used by the scan cases, in MB."""
+
+DEFAULT_SYSTEM_RAM_GB = 8.0
+"""float : RAM used for the recommendation of the ``--import`` run."""
+
+
+class Case():
+    """A benchmark case.
+
+    Parameters
+    -----------------------
+    name : str
+    func : callable
+        Called without arguments, runs ``number`` operations.
+    number : int
+        (Default 1) Operations per call, timings are reported per operation.
+    """
+    def __init__(self, name: str, func, number: int=1):
+        self.name = name
+        self.func = func
+        self.number = number
+
+
+class CaseResult():
+    """Timings of one :class:`Case`.
+
+    Parameters
+    -----------------------
+    name : str
+    number : int
+    timings : list of float
+        Seconds of each run.
+    """
+    def __init__(self, name: str, number: int, timings: list):
+        self.name = name
+        self.number = number
+        self.timings = timings
+
+    @property
+    def best_seconds(self) -> float:
+        """Fastest run, least affected by other load on the host."""
+        return min(self.timings)
+
+    @property
+    def per_op_us(self) -> float:
+        """Microseconds per operation of the fastest run."""
+        return self.best_seconds / self.number * 1e6
+
+    def to_dict(self) -> dict:
+        """Returns the result as a dictionary.
+
+        Returns
+        ----------------------
+        result : dict
+        """
+        return {'number': self.number,
+                'best_seconds': self.best_seconds,
+                'per_op_us': self.per_op_us,
+                'timings': list(self.timings)}
+
+
+def _recommendation_inputs(count: int) -> list:
+    """Returns ``count`` varied ``(system_ram_gb, osm_pbf_gb, ssd)`` inputs."""
+    ram_sizes = (4, 8, 16, 32, 64, 128)
+    pbf_sizes = (0.05, 0.2, 1.99, 10.4, 30.1, 65.0)
+    return [(ram_sizes[number % len(ram_sizes)],
+             pbf_sizes[(number // len(ram_sizes)) % len(pbf_sizes)],
+             number % 3 != 0)
+            for number in range(count)]
+
+
+def default_cases(pbf_path: str, pbf_counts: tuple, workdir: str) -> list:
+    """Returns the standard cases.
+
+    The batch case is left out when NumPy is not installed.
+
+    Parameters
+    -----------------------
+    pbf_path : str
+        Synthetic PBF for the scan cases, see :func:`prepare_pbf`.
+    pbf_counts : tuple
+        ``(nodes, ways, relations)`` of ``pbf_path``.
+    workdir : str
+        Directory for files written by the cases.
+
+    Returns
+    -----------------------
+    cases : list of Case
+    """
+    inputs = _recommendation_inputs(1000)
+
+    def recommendation():
+        for system_ram_gb, osm_pbf_gb, ssd in inputs:
+            tuner.Recommendation(system_ram_gb, osm_pbf_gb, ssd=ssd)
+
+    def osm2pgsql_command():
+        for system_ram_gb, osm_pbf_gb, ssd in inputs:
+            tuner.Recommendation(system_ram_gb, osm_pbf_gb,
+                                 ssd=ssd).get_osm2pgsql_command(pbf_path)
+
+    model = capacity.CapacityModel()
+
+    def capacity_for_host():
+        for system_ram_gb, _, _ in inputs:
+            model.for_host(system_ram_gb)
+
+    def write_synthetic():
+        synthetic.write_pbf(os.path.join(workdir, 'write.osm.pbf'),
+                            *(count // 10 for count in pbf_counts))
+
+    cases = [Case('recommendation', recommendation, len(inputs)),
+             Case('osm2pgsql_command', osm2pgsql_command, len(inputs)),
+             Case('capacity_for_host', capacity_for_host, len(inputs)),
+             Case('pbf_scan', lambda: pbf.scan(pbf_path)),
+             Case('pbf_scan_exact', lambda: pbf.scan(pbf_path, sample_blocks=1_000_000)),
+             Case('synthetic_write', write_synthetic, sum(pbf_counts) // 10)]
+    try:
+        # Imported here, numpy is an optional dependency
+        from osm2pgsql_tuner import batch
+    except ImportError:
+        return cases
+
+    sweep = 100_000
+    ram = [4 + number % 124 for number in range(sweep)]
+    pbf_gb = [0.01 * (number % 7000) for number in range(sweep)]
+    cases.insert(2, Case('batch_recommend', lambda: batch.recommend(ram, pbf_gb), sweep))
+    return cases
+
+
+def prepare_pbf(path: str, size_mb: float=DEFAULT_PBF_MB) -> tuple:
+    """Writes the synthetic PBF used by the scan cases.
+
+    Returns
+    -----------------------
+    counts : tuple
+        ``(nodes, ways, relations)`` written.
+    """
+    return synthetic.write_pbf_of_size(path, int(size_mb * 1024**2))
+
+
+def run(cases: list, repeat: int=DEFAULT_REPEAT) -> dict:
+    """Times each case ``repeat`` times.
+
+    Parameters
+    -----------------------
+    cases : list of Case
+    repeat : int
+        (Default ``DEFAULT_REPEAT``)
+
+    Returns
+    -----------------------
+    results : dict
+        Case name to :class:`CaseResult`.
+    """
+    results = {}
+    for case in cases:
+        timings = []
+        for _ in range(max(1, repeat)):
+            start = time.perf_counter()
+            case.func()
+            timings.append(time.perf_counter() - start)
+        results[case.name] = CaseResult(case.name, case.number, timings)
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float=DEFAULT_TOLERANCE) -> list:
+    """Compares results with a saved baseline.
+
+    Parameters
+    -----------------------
+    results : dict
+        Returned by :func:`run`.
+    baseline : dict
+        ``results`` of a saved report, case name to :meth:`CaseResult.to_dict`.
+    tolerance : float
+        (Default ``DEFAULT_TOLERANCE``) A case is a regression when it is
+        more than this fraction slower per operation.
+
+    Returns
+    -----------------------
+    comparison : list of dict
+        One entry per case in both, keys ``name``, ``baseline_us``,
+        ``per_op_us``, ``ratio`` and ``regression``.
+    """
+    comparison = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        baseline_us = baseline[name]['per_op_us']
+        ratio = result.per_op_us / baseline_us if baseline_us else None
+        comparison.append({'name': name,
+                           'baseline_us': baseline_us,
+                           'per_op_us': result.per_op_us,
+                           'ratio': ratio,
+                           'regression': ratio is not None and ratio > 1 + tolerance})
+    return comparison
+
+
+def check_scan(pbf_path: str, counts: tuple) -> dict:
+    """Compares the sampled scan estimate with the known element counts.
+
+    Returns
+    -----------------------
+    errors : dict
+        Relative error of the ``nodes``, ``ways`` and ``relations`` estimates.
+    """
+    stats = pbf.scan(pbf_path)
+    estimates = (stats.node_count, stats.way_count, stats.relation_count)
+    return {name: (estimate - actual) / actual if actual else 0.0
+            for name, estimate, actual in zip(('nodes', 'ways', 'relations'),
+                                              estimates, counts)}
+
+
+def predicted_peak_mb(rec: tuner.Recommendation) -> float:
+    """Memory the recommendation expects osm2pgsql to use, in MB.
+
+    None with ``--flat-nodes``, ``--cache=0`` leaves the model w/out an
+    estimate of the peak.
+    """
+    if rec.osm2pgsql_run_in_ram:
+        return rec.osm2pgsql_noslim_cache * 1024
+    if rec.osm2pgsql_flat_nodes:
+        return None
+    return min(rec.osm2pgsql_slim_cache, rec.osm2pgsql_cache_max) * 1024
+
+
+def import_available(binary: str='osm2pgsql') -> bool:
+    """True when osm2pgsql and a database connection are available."""
+    return shutil.which(binary) is not None and bool(os.environ.get('PGOSM_CONN'))
+
+
+def run_import(pbf_path: str, system_ram_gb: float=DEFAULT_SYSTEM_RAM_GB,
+               binary='osm2pgsql') -> dict:
+    """Imports ``pbf_path`` with the recommended command and records peak RSS.
+
+    Parameters
+    -----------------------
+    pbf_path : str
+    system_ram_gb : float
+        (Default ``DEFAULT_SYSTEM_RAM_GB``)
+    binary : str or list of str
+        (Default osm2pgsql) See :func:`osm2pgsql_tuner.supervisor.build_args`.
+
+    Returns
+    -----------------------
+    result : dict
+    """
+    # Imported here to keep importing the benchmark module lightweight
+    from osm2pgsql_tuner import supervisor
+
+    stats = pbf.scan(pbf_path)
+    rec = tuner.Recommendation(system_ram_gb, stats.osm_pbf_gb, pbf_stats=stats)
+    supervised = supervisor.supervise(rec, pbf_path, binary=binary)
+    predicted_mb = predicted_peak_mb(rec)
+    peak_ratio = None
+    if predicted_mb and supervised.peak_rss_mb is not None:
+        peak_ratio = supervised.peak_rss_mb / predicted_mb
+    return {'osm_pbf_gb': stats.osm_pbf_gb,
+            'returncode': supervised.returncode,
+            'seconds': supervised.seconds,
+            'predicted_peak_mb': predicted_mb,
+            'peak_rss_mb': supervised.peak_rss_mb,
+            'peak_ratio': peak_ratio}
+
+
+def main(argv=None) -> int:
+    """Runs the benchmarks and prints the report as JSON.
+
+    Returns 1 when a case regressed against ``--baseline``.
+    """
+    parser = argparse.ArgumentParser(prog='python -m osm2pgsql_tuner.benchmark')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--pbf-mb', type=float, default=DEFAULT_PBF_MB,
+                        help='Size of the synthetic PBF to scan.')
+    parser.add_argument('--baseline', help='Report saved with --save to compare with.')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--save', help='Write the report to this file.')
+    parser.add_argument('--import', dest='run_import', action='store_true',
+                        help='Also import the synthetic PBF with osm2pgsql.')
+    parser.add_argument('--osm2pgsql', default='osm2pgsql')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        pbf_path = os.path.join(workdir, 'synthetic.osm.pbf')
+        counts = prepare_pbf(pbf_path, args.pbf_mb)
+        results = run(default_cases(pbf_path, counts, workdir), repeat=args.repeat)
+        report = {'results': {name: result.to_dict() for name, result in results.items()},
+                  'pbf': {'size_mb': os.path.getsize(pbf_path) / 1024**2,
+                          'counts': list(counts),
+                          'scan_errors': check_scan(pbf_path, counts)}}
+        if args.run_import:
+            if import_available(args.osm2pgsql):
+                report['import'] = run_import(pbf_path, binary=args.osm2pgsql)
+            else:
+                report['import'] = None
+                print('osm2pgsql or PGOSM_CONN not available, skipping import',
+                      file=sys.stderr)
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        report['comparison'] = compare(results, baseline, args.tolerance)
+        if any(entry['regression'] for entry in report['comparison']):
+            status = 1
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as report_file:
+            json.dump(report, report_file, indent=2)
+    print(json.dumps(report, indent=2))
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
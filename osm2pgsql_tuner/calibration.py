@@ -0,0 +1,493 @@
+"""Calibrates the osm2pgsql memory model from real run logs.
+
+osm2pgsql log output is parsed line by line into :class:`RunRecord` objects and
+stored in a local SQLite database.  Coefficients for the no-slim memory model
+(``noslim_base_gb + noslim_gb_per_pbf_gb * osm_pbf_gb``) and the slim cache
+ratio are fit per osm2pgsql version and output style.  Fitting uses SQL
+aggregates so the runs are never loaded into memory at once.
+
+The resulting :class:`CalibrationProfile` can be passed to
+:class:`osm2pgsql_tuner.tuner.Recommendation` to replace the hardcoded constants.
+Imports that ran out of memory are stored as corrections, factors raising the
+estimate for PBFs of similar size (see :mod:`osm2pgsql_tuner.fallback`).
+"""
+import json
+import re
+import sqlite3
+
+from osm2pgsql_tuner import tuner
+
+
+MIN_FIT_SAMPLES = 3
+"""int : Minimum in-RAM runs with peak memory required to fit a profile."""
+
+FIT_RELATIVE_TOLERANCE = 1e-9
+"""float : Spread of PBF sizes, relative to their magnitude, below which a fit is singular."""
+
+CORRECTION_PBF_RATIO = 2.0
+"""float : Corrections apply to PBFs within this factor of the failed PBF size."""
+
+# osm2pgsql prints seconds followed by a readable form, e.g. ``3961s (1h 6m 1s)``
+_DURATION = r'((?:\d+h\s*)?(?:\d+m\s*)?\d+s)(?: \([^)]*\))?'
+_RE_VERSION = re.compile(r'osm2pgsql version (\d+)\.(\d+)\.(\d+)')
+_RE_PROCESSED = re.compile(r'Processed (\d+) (nodes|ways|relations) in ' + _DURATION)
+_RE_READING_DONE = re.compile(r'Reading input files done in ' + _DURATION)
+_RE_POSTPROCESSING = re.compile(r'All postprocessing on table .* done in ' + _DURATION)
+_RE_OVERALL = re.compile(r'osm2pgsql took ' + _DURATION + ' overall')
+_RE_MEMORY = re.compile(r'Memory:\s+(\d+)MB current,\s+(\d+)MB peak')
+_RE_MIDDLE = re.compile(r'Mid: (ram|pgsql)')
+_RE_CACHE = re.compile(r'cache=(\d+)MB')
+_RE_FLAT_NODES = re.compile(r'flat node', re.IGNORECASE)
+_RE_DURATION_PART = re.compile(r'(\d+)([hms])')
+
+_COLUMNS = ('source', 'osm2pgsql_version', 'style', 'osm_pbf_gb', 'slim',
+            'flat_nodes', 'cache_mb', 'node_count', 'way_count',
+            'relation_count', 'seconds_nodes', 'seconds_ways',
+            'seconds_relations', 'seconds_reading', 'seconds_postprocessing',
+            'seconds_overall', 'reported_peak_mb', 'peak_rss_mb')
+
+_CORRECTION_COLUMNS = ('source', 'osm2pgsql_version', 'style', 'osm_pbf_gb',
+                       'kind', 'factor')
+
+_TEXT_COLUMNS = ('source', 'osm2pgsql_version', 'style', 'kind')
+_REAL_COLUMNS = ('osm_pbf_gb', 'reported_peak_mb', 'peak_rss_mb', 'factor')
+
+
+def _column_type(name: str) -> str:
+    """Returns the SQLite column type for a run column."""
+    if name in _TEXT_COLUMNS:
+        return 'TEXT'
+    if name in _REAL_COLUMNS:
+        return 'REAL'
+    return 'INTEGER'
+
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS osm2pgsql_run (
+    id INTEGER PRIMARY KEY,
+    {', '.join(f'{name} {_column_type(name)}' for name in _COLUMNS)}
+);
+CREATE INDEX IF NOT EXISTS ix_osm2pgsql_run_profile
+    ON osm2pgsql_run (osm2pgsql_version, style, slim);
+CREATE TABLE IF NOT EXISTS osm2pgsql_correction (
+    id INTEGER PRIMARY KEY,
+    {', '.join(f'{name} {_column_type(name)}' for name in _CORRECTION_COLUMNS)}
+);
+"""
+
+
+def parse_duration(value: str) -> int:
+    """Converts an osm2pgsql duration such as ``1h 2m 3s`` to seconds.
+
+    Parameters
+    -----------------------
+    value : str
+
+    Returns
+    -----------------------
+    seconds : int
+    """
+    multipliers = {'h': 3600, 'm': 60, 's': 1}
+    return sum(int(amount) * multipliers[unit]
+               for amount, unit in _RE_DURATION_PART.findall(value))
+
+
+class RunRecord():
+    """Details of one osm2pgsql run, parsed from its log.
+
+    Attributes are None when the log did not include them.  ``osm_pbf_gb``,
+    ``style`` and ``peak_rss_mb`` are not part of the osm2pgsql log and are
+    provided by the caller.
+    """
+    def __init__(self, **kwargs):
+        for name in _COLUMNS:
+            setattr(self, name, kwargs.get(name))
+
+    @property
+    def peak_mb(self) -> float:
+        """Measured peak RSS when available, otherwise osm2pgsql's reported peak."""
+        if self.peak_rss_mb is not None:
+            return self.peak_rss_mb
+        return self.reported_peak_mb
+
+    def to_dict(self) -> dict:
+        """Returns the record as a dictionary.
+
+        Returns
+        ----------------------
+        record : dict
+        """
+        return {name: getattr(self, name) for name in _COLUMNS}
+
+
+def parse_log(lines, source: str=None, osm_pbf_gb: float=None,
+              style: str=None, peak_rss_mb: float=None) -> RunRecord:
+    """Parses osm2pgsql log output into a :class:`RunRecord`.
+
+    Parameters
+    -----------------------
+    lines : iterable of str
+        Log lines, e.g. an open file.  Consumed in a single pass.
+    source : str
+        (Default None) Where the log came from, stored for reference.
+    osm_pbf_gb : float
+        (Default None) Size of the imported PBF in GB.
+    style : str
+        (Default None) Output style / PgOSM Flex layer set used.
+    peak_rss_mb : float or iterable of float
+        (Default None) Measured peak RSS, or RSS samples to take the max of.
+
+    Returns
+    -----------------------
+    record : RunRecord
+    """
+    if peak_rss_mb is not None and not isinstance(peak_rss_mb, (int, float)):
+        peak_rss_mb = max(peak_rss_mb, default=None)
+
+    record = RunRecord(source=source, osm_pbf_gb=osm_pbf_gb, style=style,
+                       peak_rss_mb=peak_rss_mb)
+    postprocessing = None
+    for line in lines:
+        match = _RE_PROCESSED.search(line)
+        if match:
+            # Progress lines repeat, the last one has the final values
+            kind = match.group(2)
+            setattr(record, f'{kind[:-1]}_count', int(match.group(1)))
+            setattr(record, f'seconds_{kind}', parse_duration(match.group(3)))
+            continue
+        match = _RE_POSTPROCESSING.search(line)
+        if match:
+            # Tables are post-processed in parallel, keep the slowest
+            postprocessing = max(postprocessing or 0, parse_duration(match.group(1)))
+            continue
+        match = _RE_VERSION.search(line)
+        if match:
+            record.osm2pgsql_version = f'{match.group(1)}.{match.group(2)}'
+            continue
+        match = _RE_READING_DONE.search(line)
+        if match:
+            record.seconds_reading = parse_duration(match.group(1))
+            continue
+        match = _RE_OVERALL.search(line)
+        if match:
+            record.seconds_overall = parse_duration(match.group(1))
+            continue
+        match = _RE_MEMORY.search(line)
+        if match:
+            record.reported_peak_mb = int(match.group(2))
+            continue
+        match = _RE_MIDDLE.search(line)
+        if match:
+            record.slim = match.group(1) == 'pgsql'
+            cache = _RE_CACHE.search(line)
+            if cache:
+                record.cache_mb = int(cache.group(1))
+            continue
+        if _RE_FLAT_NODES.search(line):
+            record.flat_nodes = True
+
+    record.seconds_postprocessing = postprocessing
+    if record.slim is not None and record.flat_nodes is None:
+        record.flat_nodes = False
+    return record
+
+
+class CalibrationProfile():
+    """Memory model coefficients for one osm2pgsql version and style.
+
+    Parameters
+    -----------------------
+    osm2pgsql_version : str
+        Major.minor version, e.g. ``1.5``.
+    style : str
+    noslim_base_gb : float
+    noslim_gb_per_pbf_gb : float
+    slim_cache_ratio : float
+    sample_count : int
+        (Default 0) Number of runs the coefficients were fit from.
+    """
+    def __init__(self, osm2pgsql_version: str, style: str,
+                 noslim_base_gb: float=tuner.NOSLIM_BASE_GB,
+                 noslim_gb_per_pbf_gb: float=tuner.NOSLIM_GB_PER_PBF_GB,
+                 slim_cache_ratio: float=tuner.SLIM_CACHE_RATIO,
+                 sample_count: int=0):
+        self.osm2pgsql_version = osm2pgsql_version
+        self.style = style
+        self.noslim_base_gb = noslim_base_gb
+        self.noslim_gb_per_pbf_gb = noslim_gb_per_pbf_gb
+        self.slim_cache_ratio = slim_cache_ratio
+        self.sample_count = sample_count
+
+    def to_dict(self) -> dict:
+        """Returns the profile as a JSON serializable dictionary.
+
+        Returns
+        ----------------------
+        profile : dict
+        """
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, profile: dict):
+        """Creates a profile from :meth:`to_dict` output.
+
+        Returns
+        ----------------------
+        profile : CalibrationProfile
+        """
+        return cls(**profile)
+
+    def scaled(self, factor: float):
+        """Returns a copy with the size dependent RAM estimate multiplied by ``factor``.
+
+        Returns
+        ----------------------
+        profile : CalibrationProfile
+        """
+        profile = self.to_dict()
+        profile['noslim_gb_per_pbf_gb'] *= factor
+        return self.from_dict(profile)
+
+    def save(self, path: str):
+        """Writes the profile to a JSON file."""
+        with open(path, 'w', encoding='utf-8') as file_out:
+            json.dump(self.to_dict(), file_out, indent=2)
+
+    @classmethod
+    def load(cls, path: str):
+        """Reads a profile from a JSON file written by :meth:`save`.
+
+        Returns
+        ----------------------
+        profile : CalibrationProfile
+        """
+        with open(path, 'r', encoding='utf-8') as file_in:
+            return cls.from_dict(json.load(file_in))
+
+
+class CalibrationStore():
+    """SQLite store of parsed osm2pgsql runs.
+
+    Parameters
+    -----------------------
+    path : str
+        (Default ``:memory:``) Path to the SQLite database file.
+    """
+    def __init__(self, path: str=':memory:'):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        """Closes the database connection."""
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add_runs(self, records) -> int:
+        """Inserts run records in a single transaction.
+
+        Parameters
+        -----------------------
+        records : iterable of RunRecord
+            Consumed lazily, e.g. a generator from :meth:`ingest_logs`.
+
+        Returns
+        -----------------------
+        count : int
+            Number of rows inserted.
+        """
+        placeholders = ', '.join('?' for _ in _COLUMNS)
+        sql = f'INSERT INTO osm2pgsql_run ({", ".join(_COLUMNS)}) VALUES ({placeholders})'
+        with self.conn:
+            cursor = self.conn.executemany(
+                sql, ([getattr(record, name) for name in _COLUMNS] for record in records))
+        return cursor.rowcount
+
+    def ingest_logs(self, paths, metadata: dict=None) -> int:
+        """Parses and stores many osm2pgsql log files, one at a time.
+
+        Parameters
+        -----------------------
+        paths : iterable of str
+        metadata : dict
+            (Default None) Maps a log path to keyword arguments for
+            :func:`parse_log` such as ``osm_pbf_gb``, ``style`` and ``peak_rss_mb``.
+
+        Returns
+        -----------------------
+        count : int
+            Number of runs stored.
+        """
+        metadata = metadata or {}
+
+        def records():
+            for path in paths:
+                with open(path, 'r', encoding='utf-8', errors='replace') as log_file:
+                    yield parse_log(log_file, source=str(path),
+                                    **metadata.get(path, {}))
+
+        return self.add_runs(records())
+
+    def add_correction(self, osm2pgsql_version: str, style: str, osm_pbf_gb: float,
+                       factor: float, kind: str, source: str=None):
+        """Stores a correction of the RAM estimate after a failed import.
+
+        Parameters
+        -----------------------
+        osm2pgsql_version : str
+            Major.minor version, None when unknown.
+        style : str
+        osm_pbf_gb : float
+        factor : float
+            Multiplier of the size dependent part of the estimate that
+            would have avoided the failure.
+        kind : str
+            Failure kind, see :class:`osm2pgsql_tuner.fallback.Failure`.
+        source : str
+            (Default None)
+        """
+        placeholders = ', '.join('?' for _ in _CORRECTION_COLUMNS)
+        sql = (f'INSERT INTO osm2pgsql_correction ({", ".join(_CORRECTION_COLUMNS)}) '
+               f'VALUES ({placeholders})')
+        with self.conn:
+            self.conn.execute(sql, (source, osm2pgsql_version, style, osm_pbf_gb,
+                                    kind, factor))
+
+    def correction_factor(self, osm2pgsql_version: str, style: str,
+                          osm_pbf_gb: float) -> float:
+        """Returns the largest stored correction for PBFs of similar size.
+
+        Parameters
+        -----------------------
+        osm2pgsql_version : str
+            When None, corrections for all versions are used.
+        style : str
+            When None, corrections for all styles are used.
+        osm_pbf_gb : float
+
+        Returns
+        -----------------------
+        factor : float
+            1.0 w/out corrections within ``CORRECTION_PBF_RATIO``.
+        """
+        where, params = self._profile_filter(osm2pgsql_version, style)
+        sql = f"""SELECT MAX(factor) FROM osm2pgsql_correction
+                    WHERE {where} AND osm_pbf_gb BETWEEN ? AND ?"""
+        params += [osm_pbf_gb / CORRECTION_PBF_RATIO, osm_pbf_gb * CORRECTION_PBF_RATIO]
+        factor = self.conn.execute(sql, params).fetchone()[0]
+        return max(1.0, factor or 1.0)
+
+    def corrected_profile(self, profile: CalibrationProfile,
+                          osm_pbf_gb: float) -> CalibrationProfile:
+        """Applies stored corrections for ``osm_pbf_gb`` to a profile.
+
+        Parameters
+        -----------------------
+        profile : CalibrationProfile
+            e.g. from :meth:`fit`, or default coefficients.
+        osm_pbf_gb : float
+
+        Returns
+        -----------------------
+        profile : CalibrationProfile
+            ``profile`` itself when no correction applies.
+        """
+        factor = self.correction_factor(profile.osm2pgsql_version, profile.style,
+                                        osm_pbf_gb)
+        if factor == 1.0:
+            return profile
+        return profile.scaled(factor)
+
+    def runs(self, osm2pgsql_version: str=None, style: str=None):
+        """Yields stored runs as :class:`RunRecord` objects.
+
+        Parameters
+        -----------------------
+        osm2pgsql_version : str
+            (Default None) Only return runs for this version.
+        style : str
+            (Default None) Only return runs for this style.
+        """
+        where, params = self._profile_filter(osm2pgsql_version, style)
+        sql = f'SELECT {", ".join(_COLUMNS)} FROM osm2pgsql_run WHERE {where}'
+        for row in self.conn.execute(sql, params):
+            yield RunRecord(**dict(zip(_COLUMNS, row)))
+
+    @staticmethod
+    def _profile_filter(osm2pgsql_version: str, style: str) -> tuple:
+        """Builds the WHERE clause selecting one profile's runs."""
+        clauses = ['1 = 1']
+        params = []
+        if osm2pgsql_version is not None:
+            clauses.append('osm2pgsql_version = ?')
+            params.append(osm2pgsql_version)
+        if style is not None:
+            clauses.append('style = ?')
+            params.append(style)
+        return ' AND '.join(clauses), params
+
+    def fit(self, osm2pgsql_version: str, style: str=None) -> CalibrationProfile:
+        """Fits memory model coefficients from the stored runs.
+
+        In-RAM runs fit ``noslim_base_gb`` and ``noslim_gb_per_pbf_gb`` with
+        ordinary least squares on peak memory against PBF size.  Slim runs
+        w/out flat nodes fit ``slim_cache_ratio`` as their mean peak memory
+        relative to the fitted no-slim estimate.
+
+        Parameters
+        -----------------------
+        osm2pgsql_version : str
+        style : str
+            (Default None) When None, runs for all styles are used.
+
+        Returns
+        -----------------------
+        profile : CalibrationProfile
+
+        Raises
+        -----------------------
+        ValueError
+            With too few runs, runs of (nearly) one PBF size, or when the fit
+            has a slope <= 0 or a negative intercept.
+        """
+        where, params = self._profile_filter(osm2pgsql_version, style)
+        peak_gb = 'COALESCE(peak_rss_mb, reported_peak_mb) / 1024.0'
+        sql = f"""SELECT COUNT(*), SUM(osm_pbf_gb), SUM({peak_gb}),
+                        SUM(osm_pbf_gb * osm_pbf_gb), SUM(osm_pbf_gb * {peak_gb})
+                    FROM osm2pgsql_run
+                    WHERE {where} AND slim = 0 AND osm_pbf_gb IS NOT NULL
+                        AND {peak_gb} IS NOT NULL"""
+        count, sum_x, sum_y, sum_xx, sum_xy = self.conn.execute(sql, params).fetchone()
+        if count < MIN_FIT_SAMPLES:
+            msg = (f'At least {MIN_FIT_SAMPLES} in-RAM runs with peak memory are required, '
+                   f'found {count}.')
+            raise ValueError(msg)
+        denominator = count * sum_xx - sum_x * sum_x
+        if denominator <= FIT_RELATIVE_TOLERANCE * count * sum_xx:
+            raise ValueError('In-RAM runs must cover more than one PBF size.')
+        slope = (count * sum_xy - sum_x * sum_y) / denominator
+        intercept = (sum_y - slope * sum_x) / count
+        if slope <= 0 or intercept < 0:
+            msg = (f'Fit of peak memory = {intercept:.2f} + {slope:.2f} * PBF GB is not usable, '
+                   'peak memory must grow with PBF size from a base >= 0.')
+            raise ValueError(msg)
+
+        sql = f"""SELECT COUNT(*), AVG({peak_gb} / (? + ? * osm_pbf_gb))
+                    FROM osm2pgsql_run
+                    WHERE {where} AND slim = 1 AND flat_nodes = 0
+                        AND osm_pbf_gb IS NOT NULL AND {peak_gb} IS NOT NULL"""
+        slim_count, slim_ratio = self.conn.execute(sql, [intercept, slope] + params).fetchone()
+        if not slim_count:
+            slim_ratio = tuner.SLIM_CACHE_RATIO
+
+        return CalibrationProfile(osm2pgsql_version=osm2pgsql_version,
+                                  style=style,
+                                  noslim_base_gb=intercept,
+                                  noslim_gb_per_pbf_gb=slope,
+                                  slim_cache_ratio=slim_ratio,
+                                  sample_count=count + slim_count)
@@ -0,0 +1,204 @@
+"""Capacity planning, inverting the :class:`osm2pgsql_tuner.tuner.Recommendation` rules.
+
+Answers the inverse questions directly instead of trying inputs one at a time:
+
+* How much RAM does a PBF need to run w/out ``--slim``?
+* How much RAM avoids limiting the slim ``--cache``?
+* What is the largest PBF a host can load in RAM?
+* At what PBF size is ``--flat-nodes`` used on SSD and on HDD?
+
+The no-slim RAM estimate is linear in the PBF size, also with a calibration
+profile or a style analysis, so :class:`CapacityModel` reads its intercept
+and slope from two probe recommendations and solves in closed form.  When a
+model is not linear, thresholds are found by bisection instead.  Answers
+take microseconds, fast enough to drive interactive charts.
+"""
+from osm2pgsql_tuner import tuner
+
+
+MIN_RAM_GB = 2.0
+"""float : osm2pgsql minimum RAM, :class:`osm2pgsql_tuner.tuner.Recommendation` rejects less."""
+
+MAX_PBF_GB = 1024.0
+"""float : Upper bound of PBF sizes searched by bisection."""
+
+BISECT_TOLERANCE_GB = 0.001
+"""float : Precision of thresholds found by bisection."""
+
+
+def _bisect(predicate, low: float, high: float) -> float:
+    """Returns the largest value in ``[low, high]`` where ``predicate`` holds.
+
+    ``predicate`` must hold at ``low`` and switch to False at most once.
+    """
+    if predicate(high):
+        return high
+    while high - low > BISECT_TOLERANCE_GB:
+        middle = (low + high) / 2
+        if predicate(middle):
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+class CapacityModel():
+    """Closed form view of the ``Recommendation`` memory model.
+
+    Parameters
+    -----------------------
+    ssd : bool
+        (Default True)
+    postgres_ram_gb : float
+        (Default None) RAM reserved for PostgreSQL, in GB.
+    kwargs
+        Remaining ``Recommendation`` parameters that shape the memory model,
+        e.g. ``calibration``, ``style_analysis``, ``osm2pgsql_version``,
+        ``storage`` or ``slim_no_drop``.  ``pbf_stats`` fixes the input and is rejected.
+    """
+    def __init__(self, ssd: bool=True, postgres_ram_gb: float=None, **kwargs):
+        if 'pbf_stats' in kwargs:
+            raise ValueError('pbf_stats fixes the PBF size, pass calibration or style_analysis instead.')
+        if kwargs.get('slim_no_drop') and kwargs.get('append_first_run') is None:
+            kwargs['append_first_run'] = True
+        self.ssd = ssd
+        self.postgres_ram_gb = postgres_ram_gb
+        self.kwargs = kwargs
+        self.slim_no_drop = bool(kwargs.get('slim_no_drop'))
+
+        probes = [self._recommendation(osm_pbf_gb) for osm_pbf_gb in (0.0, 1.0, 2.0)]
+        self.noslim_base_gb = probes[0].osm2pgsql_noslim_cache
+        self.noslim_gb_per_pbf_gb = (probes[1].osm2pgsql_noslim_cache
+                                     - self.noslim_base_gb)
+        self.slim_cache_ratio = probes[0].get_slim_cache_ratio()
+        self.flat_nodes_threshold_gb = probes[0].osm2pgsql_flat_nodes_gb
+        predicted = self.noslim_base_gb + 2 * self.noslim_gb_per_pbf_gb
+        self.linear = abs(predicted - probes[2].osm2pgsql_noslim_cache) < 1e-9
+
+    def _recommendation(self, osm_pbf_gb: float,
+                        system_ram_gb: float=MIN_RAM_GB) -> tuner.Recommendation:
+        """Builds a recommendation with the model inputs."""
+        return tuner.Recommendation(system_ram_gb, osm_pbf_gb, ssd=self.ssd,
+                                    postgres_ram_gb=self.postgres_ram_gb,
+                                    **self.kwargs)
+
+    def noslim_gb(self, osm_pbf_gb: float) -> float:
+        """RAM osm2pgsql needs w/out ``--slim``, see ``get_osm2pgsql_noslim_cache``."""
+        if self.linear:
+            return self.noslim_base_gb + self.noslim_gb_per_pbf_gb * osm_pbf_gb
+        return self._recommendation(osm_pbf_gb).osm2pgsql_noslim_cache
+
+    def cache_max_gb(self, system_ram_gb: float) -> float:
+        """RAM osm2pgsql may use, see ``calculate_max_osm2pgsql_cache``."""
+        available_gb = system_ram_gb
+        if self.postgres_ram_gb is not None:
+            available_gb = max(0.0, available_gb - self.postgres_ram_gb)
+        return available_gb * tuner.CACHE_MAX_RATIO
+
+    def _ram_for_cache(self, cache_gb: float) -> float:
+        """Smallest system RAM with ``cache_max_gb`` of at least ``cache_gb``."""
+        ram_gb = cache_gb / tuner.CACHE_MAX_RATIO + (self.postgres_ram_gb or 0.0)
+        return max(MIN_RAM_GB, ram_gb)
+
+    def ram_for_noslim_gb(self, osm_pbf_gb: float) -> float:
+        """Smallest system RAM that runs ``osm_pbf_gb`` w/out ``--slim``.
+
+        Returns
+        -----------------------
+        system_ram_gb : float or None
+            None with ``slim_no_drop``, append mode always uses ``--slim``.
+        """
+        if self.slim_no_drop:
+            return None
+        return self._ram_for_cache(self.noslim_gb(osm_pbf_gb))
+
+    def ram_for_full_cache_gb(self, osm_pbf_gb: float) -> float:
+        """Smallest system RAM where the slim ``--cache`` is not limited (``limited_ram_check``)."""
+        return self._ram_for_cache(self.slim_cache_ratio * self.noslim_gb(osm_pbf_gb))
+
+    def _max_pbf_gb(self, cache_gb: float, ratio: float) -> float:
+        """Largest PBF whose ``ratio * noslim_gb`` fits in ``cache_gb``, in GB."""
+        if ratio * self.noslim_gb(0.0) > cache_gb:
+            return 0.0
+        if self.linear:
+            if self.noslim_gb_per_pbf_gb <= 0:
+                return MAX_PBF_GB
+            return (cache_gb / ratio - self.noslim_base_gb) / self.noslim_gb_per_pbf_gb
+        return _bisect(lambda osm_pbf_gb: ratio * self.noslim_gb(osm_pbf_gb) <= cache_gb,
+                       0.0, MAX_PBF_GB)
+
+    def max_pbf_in_ram_gb(self, system_ram_gb: float) -> float:
+        """Largest PBF the host runs w/out ``--slim``, 0.0 when none fits."""
+        if self.slim_no_drop:
+            return 0.0
+        return self._max_pbf_gb(self.cache_max_gb(system_ram_gb), 1.0)
+
+    def max_pbf_full_cache_gb(self, system_ram_gb: float) -> float:
+        """Largest PBF the host runs in slim mode w/out limiting ``--cache``."""
+        return self._max_pbf_gb(self.cache_max_gb(system_ram_gb), self.slim_cache_ratio)
+
+    def flat_nodes_gb(self) -> float:
+        """PBF size from which ``--flat-nodes`` is used when not running in RAM, see ``use_flat_nodes``."""
+        return self.flat_nodes_threshold_gb
+
+    def regions(self, system_ram_gb: float) -> list:
+        """Splits PBF sizes into ranges with the same decisions on a host.
+
+        Parameters
+        -----------------------
+        system_ram_gb : float
+
+        Returns
+        -----------------------
+        regions : list of dict
+            Keys ``start_gb``, ``end_gb`` (None for the last region),
+            ``run_in_ram``, ``flat_nodes`` and ``limited_ram``.
+        """
+        in_ram_gb = self.max_pbf_in_ram_gb(system_ram_gb)
+        bounds = {0.0, in_ram_gb, self.flat_nodes_gb(),
+                  self.max_pbf_full_cache_gb(system_ram_gb)}
+        bounds = sorted(bound for bound in bounds if bound >= 0.0)
+        regions = []
+        for number, start in enumerate(bounds):
+            end = bounds[number + 1] if number + 1 < len(bounds) else None
+            if end is not None and end <= start:
+                continue
+            probe = (start + end) / 2 if end is not None else start + 1.0
+            run_in_ram = not self.slim_no_drop and probe <= in_ram_gb
+            decision = {'run_in_ram': run_in_ram,
+                        'flat_nodes': not run_in_ram and probe >= self.flat_nodes_gb(),
+                        'limited_ram': (not run_in_ram
+                                        and self.slim_cache_ratio * self.noslim_gb(probe)
+                                        > self.cache_max_gb(system_ram_gb))}
+            if regions and all(regions[-1][key] == value for key, value in decision.items()):
+                regions[-1]['end_gb'] = end
+                continue
+            regions.append(dict({'start_gb': start, 'end_gb': end}, **decision))
+        return regions
+
+    def for_host(self, system_ram_gb: float) -> dict:
+        """Returns the thresholds for a host.
+
+        Returns
+        -----------------------
+        capacity : dict
+        """
+        return {'system_ram_gb': system_ram_gb,
+                'osm2pgsql_cache_max': self.cache_max_gb(system_ram_gb),
+                'max_pbf_in_ram_gb': self.max_pbf_in_ram_gb(system_ram_gb),
+                'max_pbf_full_cache_gb': self.max_pbf_full_cache_gb(system_ram_gb),
+                'flat_nodes_gb': self.flat_nodes_gb(),
+                'regions': self.regions(system_ram_gb)}
+
+    def for_pbf(self, osm_pbf_gb: float) -> dict:
+        """Returns the RAM thresholds for a PBF.
+
+        Returns
+        -----------------------
+        capacity : dict
+        """
+        return {'osm_pbf_gb': osm_pbf_gb,
+                'osm2pgsql_noslim_cache': self.noslim_gb(osm_pbf_gb),
+                'ram_for_noslim_gb': self.ram_for_noslim_gb(osm_pbf_gb),
+                'ram_for_full_cache_gb': self.ram_for_full_cache_gb(osm_pbf_gb),
+                'flat_nodes_if_slim': osm_pbf_gb >= self.flat_nodes_gb()}
@@ -0,0 +1,352 @@
+"""Persistent index of local PBF files and their metadata.
+
+Walks a directory tree (e.g. a Geofabrik mirror), scans each ``.osm.pbf``
+with :func:`osm2pgsql_tuner.pbf.scan` and stores the header metadata and
+estimated element counts in SQLite.  Entries are keyed on path and are only
+re-scanned when the file size or modification time changes, so updating a
+catalog of thousands of extracts only reads the files that changed.
+
+Regions are named after the path relative to the catalog root without the
+``.osm.pbf`` and ``-latest`` suffixes, e.g. ``north-america/us/colorado``.
+Lookups accept the full region or, when unique, the last part (``colorado``).
+"""
+import json
+import os
+import sqlite3
+
+from osm2pgsql_tuner import pbf
+
+
+PBF_SUFFIXES = ('.osm.pbf', '.pbf')
+"""tuple : File name suffixes included in the catalog."""
+
+_STATS_COLUMNS = ('blob_count', 'node_count', 'way_count', 'relation_count',
+                  'max_node_id', 'exact')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pbf_catalog (
+    path TEXT PRIMARY KEY,
+    region TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    blob_count INTEGER,
+    node_count INTEGER,
+    way_count INTEGER,
+    relation_count INTEGER,
+    max_node_id INTEGER,
+    exact INTEGER,
+    bbox_left REAL,
+    bbox_bottom REAL,
+    bbox_right REAL,
+    bbox_top REAL,
+    replication_timestamp INTEGER,
+    replication_sequence INTEGER,
+    header TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_pbf_catalog_region ON pbf_catalog (region);
+CREATE INDEX IF NOT EXISTS ix_pbf_catalog_name ON pbf_catalog (name);
+"""
+
+_ENTRY_COLUMNS = ('path', 'region', 'name', 'size_bytes', 'mtime_ns') + _STATS_COLUMNS + ('header',)
+
+
+def region_name(path: str, root: str) -> str:
+    """Returns the region name of ``path`` relative to the catalog ``root``.
+
+    Parameters
+    -----------------------
+    path : str
+    root : str
+
+    Returns
+    -----------------------
+    region : str
+        e.g. ``north-america/us/colorado`` for
+        ``<root>/north-america/us/colorado-latest.osm.pbf``.
+    """
+    region = os.path.relpath(path, root).replace(os.sep, '/')
+    for suffix in PBF_SUFFIXES:
+        if region.endswith(suffix):
+            region = region[:-len(suffix)]
+            break
+    if region.endswith('-latest'):
+        region = region[:-len('-latest')]
+    return region
+
+
+class CatalogEntry():
+    """Metadata of one PBF file stored in the catalog.
+
+    Parameters
+    -----------------------
+    path : str
+    region : str
+    name : str
+        Last part of ``region``.
+    size_bytes : int
+    mtime_ns : int
+    blob_count : int
+    node_count : int
+    way_count : int
+    relation_count : int
+    max_node_id : int or None
+    exact : bool
+    header : dict
+        Header details, see :func:`osm2pgsql_tuner.pbf.decode_header`.
+    """
+    def __init__(self, path: str, region: str, name: str, size_bytes: int,
+                 mtime_ns: int, blob_count: int, node_count: int,
+                 way_count: int, relation_count: int, max_node_id: int,
+                 exact: bool, header: dict):
+        self.path = path
+        self.region = region
+        self.name = name
+        self.size_bytes = size_bytes
+        self.mtime_ns = mtime_ns
+        self.blob_count = blob_count
+        self.node_count = node_count
+        self.way_count = way_count
+        self.relation_count = relation_count
+        self.max_node_id = max_node_id
+        self.exact = bool(exact)
+        self.header = header
+
+    @property
+    def osm_pbf_gb(self) -> float:
+        """Size of the PBF file in GB."""
+        return self.size_bytes / 1024**3
+
+    @property
+    def bbox(self) -> tuple:
+        """Bounding box (left, bottom, right, top) from the header, or None."""
+        bbox = self.header.get('bbox')
+        return tuple(bbox) if bbox is not None else None
+
+    @property
+    def replication_timestamp(self) -> int:
+        """Replication timestamp (seconds since epoch) from the header, or None."""
+        return self.header.get('replication_timestamp')
+
+    @property
+    def replication_sequence(self) -> int:
+        """Replication sequence number from the header, or None."""
+        return self.header.get('replication_sequence')
+
+    def to_pbf_stats(self) -> pbf.PbfStats:
+        """Returns the stored statistics without reading the file.
+
+        Returns
+        ----------------------
+        stats : osm2pgsql_tuner.pbf.PbfStats
+        """
+        header = dict(self.header)
+        if header.get('bbox') is not None:
+            header['bbox'] = tuple(header['bbox'])
+        return pbf.PbfStats(path=self.path, file_size_bytes=self.size_bytes,
+                            blob_count=self.blob_count, node_count=self.node_count,
+                            way_count=self.way_count,
+                            relation_count=self.relation_count,
+                            max_node_id=self.max_node_id, exact=self.exact,
+                            header=header)
+
+    def to_dict(self) -> dict:
+        """Returns the entry as a JSON serializable dictionary.
+
+        Returns
+        ----------------------
+        entry : dict
+        """
+        return dict(vars(self))
+
+
+class UpdateResult():
+    """Counts of files handled by :meth:`PbfCatalog.update`."""
+    def __init__(self):
+        self.added = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.removed = 0
+        self.errors = {}
+
+    def to_dict(self) -> dict:
+        """Returns the counts as a dictionary.
+
+        Returns
+        ----------------------
+        result : dict
+        """
+        return dict(vars(self))
+
+
+class PbfCatalog():
+    """SQLite backed catalog of PBF files.
+
+    Parameters
+    -----------------------
+    path : str
+        (Default ``:memory:``) Path to the SQLite database file.
+    """
+    def __init__(self, path: str=':memory:'):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        """Closes the database connection."""
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM pbf_catalog').fetchone()[0]
+
+    def update(self, root: str, sample_blocks: int=pbf.DEFAULT_SAMPLE_BLOCKS,
+               workers: int=None) -> UpdateResult:
+        """Adds new and changed PBF files under ``root``, removes deleted ones.
+
+        Only files whose size or modification time differ from the catalog
+        are scanned.  Files that fail to scan are reported in ``errors`` and
+        left out of the catalog.
+
+        Parameters
+        -----------------------
+        root : str
+            Directory to walk.
+        sample_blocks : int
+            (Default ``DEFAULT_SAMPLE_BLOCKS``) Passed to :func:`osm2pgsql_tuner.pbf.scan`.
+        workers : int
+            (Default None) Passed to :func:`osm2pgsql_tuner.pbf.scan`.
+
+        Returns
+        -----------------------
+        result : UpdateResult
+        """
+        root = os.path.abspath(root)
+        # Range over the primary key selects every path below root/
+        prefix = os.path.join(root, '')
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        known = {path: (size_bytes, mtime_ns) for path, size_bytes, mtime_ns
+                 in self.conn.execute('SELECT path, size_bytes, mtime_ns FROM pbf_catalog '
+                                      'WHERE path >= ? AND path < ?', (prefix, upper))}
+        result = UpdateResult()
+        seen = set()
+        with self.conn:
+            for dir_path, dir_names, file_names in os.walk(root):
+                dir_names.sort()
+                for file_name in sorted(file_names):
+                    if not file_name.endswith(PBF_SUFFIXES):
+                        continue
+                    path = os.path.join(dir_path, file_name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    seen.add(path)
+                    if known.get(path) == (stat.st_size, stat.st_mtime_ns):
+                        result.unchanged += 1
+                        continue
+                    try:
+                        stats = pbf.scan(path, sample_blocks=sample_blocks,
+                                         workers=workers)
+                    except Exception as err:  # pylint: disable=broad-except
+                        # One unreadable file must not roll back the whole update
+                        result.errors[path] = str(err) or type(err).__name__
+                        # Stale metadata of a file that no longer scans is dropped
+                        seen.discard(path)
+                        continue
+                    self._upsert(path, region_name(path, root), stat, stats)
+                    if path in known:
+                        result.updated += 1
+                    else:
+                        result.added += 1
+
+            removed = [(path,) for path in known if path not in seen]
+            self.conn.executemany('DELETE FROM pbf_catalog WHERE path = ?', removed)
+            result.removed = len(removed)
+        return result
+
+    def _upsert(self, path: str, region: str, stat: os.stat_result,
+                stats: pbf.PbfStats):
+        """Stores one scanned file."""
+        header = stats.header
+        bbox = header.get('bbox') or (None, None, None, None)
+        values = {'path': path,
+                  'region': region,
+                  'name': region.rsplit('/', 1)[-1],
+                  'size_bytes': stat.st_size,
+                  'mtime_ns': stat.st_mtime_ns,
+                  'blob_count': stats.blob_count,
+                  'node_count': stats.node_count,
+                  'way_count': stats.way_count,
+                  'relation_count': stats.relation_count,
+                  'max_node_id': stats.max_node_id,
+                  'exact': int(stats.exact),
+                  'bbox_left': bbox[0],
+                  'bbox_bottom': bbox[1],
+                  'bbox_right': bbox[2],
+                  'bbox_top': bbox[3],
+                  'replication_timestamp': header.get('replication_timestamp'),
+                  'replication_sequence': header.get('replication_sequence'),
+                  'header': json.dumps(header)}
+        columns = ', '.join(values)
+        placeholders = ', '.join('?' for _ in values)
+        self.conn.execute(f'INSERT OR REPLACE INTO pbf_catalog ({columns}) '
+                          f'VALUES ({placeholders})', list(values.values()))
+
+    def _entries(self, where: str, params) -> list:
+        """Returns entries matching a WHERE clause."""
+        sql = f'SELECT {", ".join(_ENTRY_COLUMNS)} FROM pbf_catalog WHERE {where} ORDER BY region'
+        entries = []
+        for row in self.conn.execute(sql, params):
+            values = dict(zip(_ENTRY_COLUMNS, row))
+            values['header'] = json.loads(values['header'])
+            entries.append(CatalogEntry(**values))
+        return entries
+
+    def get(self, region: str) -> CatalogEntry:
+        """Returns the entry for a region using the indexes, no file access.
+
+        Parameters
+        -----------------------
+        region : str
+            Full region (``north-america/us/colorado``) or, when unique, the
+            last part (``colorado``).
+
+        Returns
+        -----------------------
+        entry : CatalogEntry
+        """
+        entries = self._entries('region = ?', (region,))
+        if not entries:
+            entries = self._entries('name = ?', (region,))
+        if not entries:
+            raise KeyError(f'Region not in catalog: {region}')
+        if len(entries) > 1:
+            regions = ', '.join(entry.region for entry in entries)
+            raise ValueError(f'Region {region} is ambiguous: {regions}')
+        return entries[0]
+
+    def entries(self) -> list:
+        """Returns all entries ordered by region.
+
+        Returns
+        ----------------------
+        entries : list of CatalogEntry
+        """
+        return self._entries('1 = 1', ())
+
+    def in_bbox(self, left: float, bottom: float, right: float, top: float) -> list:
+        """Returns entries whose header bounding box intersects the given one.
+
+        Returns
+        ----------------------
+        entries : list of CatalogEntry
+        """
+        return self._entries('bbox_left <= ? AND bbox_right >= ? '
+                             'AND bbox_bottom <= ? AND bbox_top >= ?',
+                             (right, left, top, bottom))
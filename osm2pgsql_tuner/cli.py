@@ -0,0 +1,340 @@
+"""Command line entry point, installed as ``osm2pgsql-tuner``.
+
+Prints the recommended osm2pgsql command, or a JSON document with the command,
+calculated attributes and decisions.  With ``--batch`` many jobs are read from
+stdin as JSON lines and answered in a single process, one JSON line per job.
+
+Startup is kept small: only :mod:`osm2pgsql_tuner.tuner` is imported up front,
+the PBF scanner and host detection are loaded only when used.
+"""
+import argparse
+import json
+import math
+import os
+import shlex
+import sys
+
+from osm2pgsql_tuner import tuner
+
+
+PBF_PATH_PLACEHOLDER = '$PBF_PATH'
+"""str : Used in the command when only ``--pbf-gb`` is given."""
+
+JOB_KEYS = ('system_ram_gb', 'osm_pbf_gb', 'pbf_path', 'scan', 'ssd',
+            'slim_no_drop', 'append_first_run', 'pgosm_layer_set', 'cpu_count',
+            'style_dir', 'osm2pgsql_version')
+"""tuple : Keys accepted in ``--batch`` JSON lines."""
+
+JOB_NUMBER_KEYS = {'system_ram_gb': float, 'osm_pbf_gb': float, 'cpu_count': int}
+"""dict : Numeric job keys and their type, strings like ``"1.5"`` are converted."""
+
+JOB_STRING_KEYS = ('pbf_path', 'style_dir', 'osm2pgsql_version', 'pgosm_layer_set')
+"""tuple : Job keys that take a string."""
+
+JOB_BOOL_KEYS = ('ssd', 'scan', 'slim_no_drop', 'append_first_run')
+"""tuple : Job keys that take a boolean."""
+
+DETECT_VERSION = 'detect'
+"""str : ``osm2pgsql_version`` value that runs ``osm2pgsql --version``."""
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Returns the argument parser for ``osm2pgsql-tuner``.
+
+    Returns
+    -----------------------
+    parser : argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(
+        prog='osm2pgsql-tuner',
+        description='Recommend an osm2pgsql command for the available resources.')
+    parser.add_argument('--ram', dest='system_ram_gb', type=float,
+                        help='Total RAM in GB. Detected from /proc and cgroups when omitted.')
+    parser.add_argument('--pbf', dest='pbf_path',
+                        help='Path to the .osm.pbf file. Size is read from the file unless --pbf-gb is set.')
+    parser.add_argument('--pbf-gb', dest='osm_pbf_gb', type=float,
+                        help='Size of the .osm.pbf file in GB.')
+    parser.add_argument('--scan', action='store_true', default=None,
+                        help='Scan the PBF for node/way/relation counts instead of using the file size.')
+    parser.add_argument('--no-ssd', dest='ssd', action='store_false', default=None,
+                        help='Storage is spinning disk.')
+    parser.add_argument('--append', choices=('first', 'subsequent'),
+                        help='Setup for --append. "first" for the initial --create run.')
+    parser.add_argument('--layer-set', dest='pgosm_layer_set',
+                        help='PgOSM Flex layer set / Lua style base name (default: run).')
+    parser.add_argument('--style-dir',
+                        help='Directory with the Lua styles (PgOSM Flex flex-config) to analyze the layer set.')
+    parser.add_argument('--osm2pgsql-version',
+                        help='Installed osm2pgsql version (e.g. 1.9.2), or "detect" to run the --osm2pgsql binary.')
+    parser.add_argument('--cpu-count', type=int,
+                        help='CPUs available to osm2pgsql, enables --number-processes.')
+    parser.add_argument('--json', action='store_true',
+                        help='Print a JSON document instead of only the command.')
+    parser.add_argument('--batch', action='store_true',
+                        help='Read jobs as JSON lines from stdin, write JSON lines to stdout.')
+    parser.add_argument('--supervise', action='store_true',
+                        help='Run the command and print memory/progress telemetry as JSON lines.')
+    parser.add_argument('--osm2pgsql', default='osm2pgsql',
+                        help='osm2pgsql binary (or command prefix) used with --supervise.')
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='Seconds between samples with --supervise.')
+    parser.add_argument('--fallback', type=int, default=0, metavar='N',
+                        help='With --supervise, re-run an import that ran out of memory '
+                             'up to N times with a downgraded plan.')
+    parser.add_argument('--calibration-db', metavar='PATH',
+                        help='With --supervise, SQLite calibration store. Stored corrections '
+                             'of the memory model are applied and --fallback records new ones.')
+    return parser
+
+
+def _args_to_job(args: argparse.Namespace) -> dict:
+    """Converts parsed arguments to a job dictionary, skipping unset values."""
+    job = {key: getattr(args, key, None) for key in JOB_KEYS}
+    if args.append is not None:
+        job['slim_no_drop'] = True
+        job['append_first_run'] = args.append == 'first'
+    return {key: value for key, value in job.items() if value is not None}
+
+
+def _detect_version(binary) -> str:
+    """Runs ``osm2pgsql --version``, raises ``ValueError`` when it fails."""
+    # Imported here so jobs with a known version skip loading the module
+    from osm2pgsql_tuner import versions
+    return versions.detect_version(binary)
+
+
+def _check_job(job: dict) -> dict:
+    """Returns ``job`` with numeric values converted, raises ``ValueError`` when invalid."""
+    job = dict(job)
+    for key in JOB_STRING_KEYS:
+        value = job.get(key)
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f'{key} must be a string, got {value!r}')
+    for key in JOB_BOOL_KEYS:
+        value = job.get(key)
+        if value is not None and not isinstance(value, bool):
+            raise ValueError(f'{key} must be true or false, got {value!r}')
+    for key, number_type in JOB_NUMBER_KEYS.items():
+        value = job.get(key)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise ValueError(f'{key} must be a number, got {value!r}')
+        try:
+            number = float(value)
+        except ValueError:
+            raise ValueError(f'{key} must be a number, got {value!r}') from None
+        if not math.isfinite(number) or number <= 0:
+            raise ValueError(f'{key} must be a positive number, got {value!r}')
+        if number_type is int:
+            if not number.is_integer():
+                raise ValueError(f'{key} must be a whole number, got {value!r}')
+            number = int(number)
+        job[key] = number
+    return job
+
+
+def build_recommendation(job: dict, calibration=None):
+    """Creates the ``Recommendation`` for one job.
+
+    Parameters
+    -----------------------
+    job : dict
+        Keys from ``JOB_KEYS``.  One of ``osm_pbf_gb`` or ``pbf_path`` is required.
+    calibration : osm2pgsql_tuner.calibration.CalibrationProfile
+        (Default None) Memory model passed to the recommendation.
+
+    Returns
+    -----------------------
+    rec : osm2pgsql_tuner.tuner.Recommendation
+    """
+    unknown = set(job) - set(JOB_KEYS) - {'id'}
+    if unknown:
+        raise ValueError(f'Unknown job keys: {", ".join(sorted(unknown))}')
+    job = _check_job(job)
+
+    kwargs = {key: job[key] for key in ('ssd', 'slim_no_drop', 'append_first_run',
+                                        'pgosm_layer_set', 'cpu_count',
+                                        'osm2pgsql_version')
+              if job.get(key) is not None}
+    if kwargs.get('osm2pgsql_version') == DETECT_VERSION:
+        kwargs['osm2pgsql_version'] = _detect_version('osm2pgsql')
+    if calibration is not None:
+        kwargs['calibration'] = calibration
+    pbf_path = job.get('pbf_path')
+    osm_pbf_gb = job.get('osm_pbf_gb')
+
+    if job.get('scan'):
+        if pbf_path is None:
+            raise ValueError('scan requires pbf_path.')
+        # Imported here so jobs without scanning skip loading the scanner
+        from osm2pgsql_tuner import pbf
+        kwargs['pbf_stats'] = pbf.scan(pbf_path)
+    elif osm_pbf_gb is None:
+        if pbf_path is None:
+            raise ValueError('One of osm_pbf_gb or pbf_path is required.')
+        osm_pbf_gb = os.path.getsize(pbf_path) / 1024**3
+
+    if job.get('style_dir') is not None:
+        # Imported here so jobs without a style skip loading the analyzer
+        from osm2pgsql_tuner import layerset
+        kwargs['style_analysis'] = layerset.analyze(job['style_dir'],
+                                                    job.get('pgosm_layer_set', 'run'))
+
+    if job.get('system_ram_gb') is None:
+        rec = tuner.Recommendation.from_host(osm_pbf_gb=osm_pbf_gb,
+                                             pbf_path=pbf_path, **kwargs)
+    else:
+        rec = tuner.Recommendation(job['system_ram_gb'], osm_pbf_gb, **kwargs)
+    return rec
+
+
+def recommend(job: dict) -> dict:
+    """Runs one job and returns the JSON document for it.
+
+    Parameters
+    -----------------------
+    job : dict
+        Keys from ``JOB_KEYS``.  One of ``osm_pbf_gb`` or ``pbf_path`` is required.
+
+    Returns
+    -----------------------
+    result : dict
+        Keys ``command``, ``recommendation`` and ``decisions``.  With an
+        ``osmium tags-filter`` pre-pass also ``tags_filter_command``, and
+        ``command`` reads the filtered file.
+    """
+    rec = build_recommendation(job)
+    pbf_path = job.get('pbf_path') or PBF_PATH_PLACEHOLDER
+    tags_filter_command = rec.get_tags_filter_command(pbf_path)
+    if tags_filter_command is not None:
+        # Imported here so jobs without a style skip loading the analyzer
+        from osm2pgsql_tuner import layerset
+        pbf_path = layerset.filtered_path(pbf_path)
+    command = rec.get_osm2pgsql_command(pbf_path=pbf_path)
+    result = {'command': command,
+              'recommendation': rec.to_dict(),
+              'decisions': rec.get_decisions()}
+    if tags_filter_command is not None:
+        result['tags_filter_command'] = tags_filter_command
+    if 'id' in job:
+        result['id'] = job['id']
+    return result
+
+
+def run_batch(defaults: dict, lines, out) -> int:
+    """Answers each JSON line job from ``lines`` with a JSON line on ``out``.
+
+    Values from ``defaults`` apply to every job unless the job overrides them.
+
+    Returns
+    -----------------------
+    failures : int
+        Number of jobs that returned an error.
+    """
+    failures = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        values = None
+        try:
+            values = json.loads(line)
+            if not isinstance(values, dict):
+                raise ValueError(f'Job must be a JSON object, got {line.strip()}')
+            job = dict(defaults)
+            job.update(values)
+            result = recommend(job)
+        except (ValueError, OSError) as err:
+            failures += 1
+            result = {'error': str(err)}
+            if isinstance(values, dict) and 'id' in values:
+                result['id'] = values['id']
+        out.write(json.dumps(result) + '\n')
+    return failures
+
+
+def _supervise(job: dict, args: argparse.Namespace) -> int:
+    """Runs osm2pgsql under the supervisor, returns its exit code.
+
+    With ``--calibration-db`` the recommendation starts from the memory model
+    corrected by earlier failed imports.
+    """
+    # Imported here so other modes skip loading the supervisor
+    import sqlite3
+    from osm2pgsql_tuner import calibration, fallback, supervisor
+    store = None
+    try:
+        if job.get('pbf_path') is None:
+            raise ValueError('--supervise requires --pbf.')
+        rec = build_recommendation(job)
+        if args.calibration_db is not None:
+            store = calibration.CalibrationStore(args.calibration_db)
+            corrected = fallback.corrected_calibration(store, rec)
+            if corrected is not rec.calibration:
+                rec = build_recommendation(job, calibration=corrected)
+    except (ValueError, OSError, sqlite3.Error) as err:
+        if store is not None:
+            store.close()
+        print(f'osm2pgsql-tuner: error: {err}', file=sys.stderr)
+        return 1
+    try:
+        if args.fallback:
+            result = fallback.run_with_fallback(rec, job['pbf_path'],
+                                                binary=shlex.split(args.osm2pgsql),
+                                                max_attempts=1 + args.fallback, store=store,
+                                                interval=args.interval, telemetry=sys.stdout)
+            return result.returncode
+        run = supervisor.supervise(rec, job['pbf_path'], binary=shlex.split(args.osm2pgsql),
+                                   interval=args.interval, telemetry=sys.stdout)
+        return run.returncode
+    finally:
+        if store is not None:
+            store.close()
+
+
+def main(argv=None) -> int:
+    """Runs ``osm2pgsql-tuner``.
+
+    Parameters
+    -----------------------
+    argv : list of str
+        (Default None) Arguments, ``sys.argv[1:]`` when None.
+
+    Returns
+    -----------------------
+    exit_code : int
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    job = _args_to_job(args)
+
+    if job.get('osm2pgsql_version') == DETECT_VERSION:
+        try:
+            job['osm2pgsql_version'] = _detect_version(shlex.split(args.osm2pgsql))
+        except (ValueError, OSError) as err:
+            print(f'osm2pgsql-tuner: error: {err}', file=sys.stderr)
+            return 1
+
+    if args.batch:
+        return 1 if run_batch(job, sys.stdin, sys.stdout) else 0
+
+    if args.supervise:
+        return _supervise(job, args)
+
+    try:
+        result = recommend(job)
+    except (ValueError, OSError) as err:
+        print(f'osm2pgsql-tuner: error: {err}', file=sys.stderr)
+        return 1
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        if 'tags_filter_command' in result:
+            print(result['tags_filter_command'])
+        print(result['command'])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,519 @@
+"""Classifies failed osm2pgsql imports and re-runs them with a downgraded plan.
+
+When the RAM estimate is too low, an import planned to run in RAM fails in
+one of a few ways.  The kernel OOM-kills osm2pgsql, osm2pgsql fails to
+allocate (``std::bad_alloc``), or PostgreSQL runs out of memory next to it.
+:func:`classify` tells these apart using the exit status, the kernel log
+(``dmesg``) and the tail of the osm2pgsql log.
+
+:func:`downgrade` builds the next plan, one step per failed attempt:
+
+* ``--slim`` with a reduced ``--cache``
+* ``--flat-nodes``
+* half the ``--number-processes``
+
+The memory model is corrected with the peak memory measured by
+:mod:`osm2pgsql_tuner.supervisor`.  The correction is stored with
+:meth:`osm2pgsql_tuner.calibration.CalibrationStore.add_correction`, so
+later recommendations for PBFs of similar size start from the safer
+estimate (:func:`corrected_calibration`).
+"""
+import json
+import re
+import signal
+import subprocess
+
+from osm2pgsql_tuner import calibration, supervisor, tuner, versions
+
+
+MEMORY_FAILURES = ('oom_killed', 'osm2pgsql_oom', 'postgres_oom')
+"""tuple : Failure kinds a downgraded plan can avoid."""
+
+LOG_TAIL_LINES = 200
+"""int : Last lines of the osm2pgsql log searched for errors."""
+
+KERNEL_LOG_LINES = 500
+"""int : Last lines of the kernel log searched for OOM kills."""
+
+CACHE_REDUCTION = 0.5
+"""float : ``--cache`` of the first slim fallback relative to the recommended value."""
+
+CORRECTION_MARGIN = 1.2
+"""float : Headroom added to the memory a failed import is known to need.
+
+Initial estimate, not measured.
+"""
+
+DEFAULT_MAX_ATTEMPTS = 4
+"""int : Imports run by :func:`run_with_fallback`, the first included."""
+
+# Shells and container runtimes report a signal as 128 + signal number
+_SHELL_SIGNAL_BASE = 128
+
+_RE_KERNEL_OOM = re.compile(r'(?:Out of memory|Memory cgroup out of memory): '
+                            r'Killed process (\d+) \(([^)]+)\)')
+_RE_POSTGRES_OOM = re.compile(r'(?:ERROR|FATAL):\s+out of memory|Failed on request of size'
+                              r'|could not resize shared memory segment')
+_RE_CONNECTION_LOST = re.compile(r'server closed the connection unexpectedly'
+                                 r'|terminating connection because of crash')
+_RE_OSM2PGSQL_OOM = re.compile(r'std::bad_alloc|Out of memory')
+_RE_DISK_FULL = re.compile(r'No space left on device|could not extend file')
+_POSTGRES_PROCESSES = ('postgres', 'postmaster')
+
+
+class Failure():
+    """Why an osm2pgsql run failed, see :func:`classify`.
+
+    Parameters
+    -----------------------
+    kind : str
+        ``oom_killed``, ``osm2pgsql_oom``, ``postgres_oom``, ``disk_full``
+        or ``error``.
+    returncode : int
+    signal_number : int or None
+        Signal that ended osm2pgsql.
+    evidence : str
+        Log line, kernel line or exit status the kind was derived from.
+    """
+    def __init__(self, kind: str, returncode: int, signal_number: int, evidence: str):
+        self.kind = kind
+        self.returncode = returncode
+        self.signal_number = signal_number
+        self.evidence = evidence
+
+    @property
+    def memory(self) -> bool:
+        """True when the failure is from running out of memory."""
+        return self.kind in MEMORY_FAILURES
+
+    def to_dict(self) -> dict:
+        """Returns the failure as a JSON serializable dictionary.
+
+        Returns
+        ----------------------
+        failure : dict
+        """
+        return {'kind': self.kind,
+                'memory': self.memory,
+                'returncode': self.returncode,
+                'signal_number': self.signal_number,
+                'evidence': self.evidence}
+
+
+def signal_number(returncode: int) -> int:
+    """Returns the signal that ended a process, None when it exited.
+
+    Parameters
+    -----------------------
+    returncode : int
+        Negative from :mod:`subprocess`, ``128 + N`` from a shell.
+
+    Returns
+    -----------------------
+    signal_number : int or None
+    """
+    if returncode < 0:
+        return -returncode
+    if _SHELL_SIGNAL_BASE < returncode < _SHELL_SIGNAL_BASE + signal.NSIG:
+        return returncode - _SHELL_SIGNAL_BASE
+    return None
+
+
+def read_kernel_log(binary: str='dmesg', lines: int=KERNEL_LOG_LINES) -> list:
+    """Returns the last lines of the kernel log.
+
+    Returns
+    -----------------------
+    lines : list of str
+        Empty when ``dmesg`` is missing or not permitted.
+    """
+    try:
+        result = subprocess.run([binary], capture_output=True, text=True,
+                                errors='replace', timeout=10, check=False)
+    except (OSError, subprocess.SubprocessError):
+        return []
+    if result.returncode != 0:
+        return []
+    return result.stdout.splitlines()[-lines:]
+
+
+def kernel_oom_kills(lines) -> list:
+    """Finds processes killed by the kernel OOM killer.
+
+    Parameters
+    -----------------------
+    lines : iterable of str
+        Kernel log lines.
+
+    Returns
+    -----------------------
+    kills : list of tuple
+        ``(pid, process_name, line)``
+    """
+    kills = []
+    for line in lines:
+        match = _RE_KERNEL_OOM.search(line)
+        if match:
+            kills.append((int(match.group(1)), match.group(2), line.strip()))
+    return kills
+
+
+def classify(returncode: int, log_lines, kernel_lines=(), pid: int=None) -> Failure:
+    """Classifies why an osm2pgsql run failed.
+
+    Kernel OOM kills of ``pid`` come first, then errors in the log tail.  A
+    ``SIGKILL`` w/out other evidence is treated as an OOM kill, ``dmesg``
+    usually needs root to confirm it.
+
+    Parameters
+    -----------------------
+    returncode : int
+    log_lines : iterable of str
+        osm2pgsql output, incl. errors reported from PostgreSQL.
+    kernel_lines : iterable of str
+        (Default empty) Kernel log, see :func:`read_kernel_log`.
+    pid : int
+        (Default None) osm2pgsql process ID.  When None, kills of any
+        ``osm2pgsql`` process count.
+
+    Returns
+    -----------------------
+    failure : Failure or None
+        None when ``returncode`` is 0.
+    """
+    if returncode == 0:
+        return None
+    number = signal_number(returncode)
+    tail = [line.strip() for line in list(log_lines)[-LOG_TAIL_LINES:]]
+    kills = kernel_oom_kills(kernel_lines)
+
+    def failure(kind, evidence):
+        return Failure(kind, returncode, number, evidence)
+
+    for kill_pid, name, line in kills:
+        if kill_pid == pid or (pid is None and name.startswith('osm2pgsql')):
+            return failure('oom_killed', line)
+    for line in reversed(tail):
+        if _RE_POSTGRES_OOM.search(line):
+            return failure('postgres_oom', line)
+    if any(_RE_CONNECTION_LOST.search(line) for line in tail):
+        for _, name, line in kills:
+            if name in _POSTGRES_PROCESSES:
+                return failure('postgres_oom', line)
+    for line in reversed(tail):
+        if _RE_OSM2PGSQL_OOM.search(line):
+            return failure('osm2pgsql_oom', line)
+        if _RE_DISK_FULL.search(line):
+            return failure('disk_full', line)
+    if number == signal.SIGKILL:
+        return failure('oom_killed', 'Killed by SIGKILL')
+    last_line = next((line for line in reversed(tail) if line), None)
+    return failure('error', last_line or f'Exit status {returncode}')
+
+
+def model_profile(rec: tuner.Recommendation) -> calibration.CalibrationProfile:
+    """Returns the memory model coefficients used by ``rec`` as a profile.
+
+    Returns
+    -----------------------
+    profile : osm2pgsql_tuner.calibration.CalibrationProfile
+        ``rec.calibration`` when set.
+    """
+    if rec.calibration is not None:
+        return rec.calibration
+    if rec.version_profile is None:
+        return calibration.CalibrationProfile(None, rec.pgosm_layer_set)
+    major, minor, _ = versions.parse_version(rec.osm2pgsql_version)
+    profile = rec.version_profile
+    return calibration.CalibrationProfile(f'{major}.{minor}', rec.pgosm_layer_set,
+                                          noslim_base_gb=profile.noslim_base_gb,
+                                          noslim_gb_per_pbf_gb=profile.noslim_gb_per_pbf_gb,
+                                          slim_cache_ratio=profile.slim_cache_ratio)
+
+
+def correction_factor(rec: tuner.Recommendation, failure: Failure,
+                      peak_mb: float=None) -> float:
+    """Returns how much the no-slim RAM estimate of ``rec`` was too low.
+
+    Only in-RAM imports correct the model.  When osm2pgsql itself ran out of
+    memory it needed more than ``osm2pgsql_cache_max``.  When PostgreSQL did,
+    only the measured peak is known to be needed.  ``CORRECTION_MARGIN`` is
+    added to the memory needed.
+
+    Parameters
+    -----------------------
+    rec : osm2pgsql_tuner.tuner.Recommendation
+        Recommendation of the failed import.
+    failure : Failure
+    peak_mb : float
+        (Default None) Peak memory measured, or projected, for the import.
+
+    Returns
+    -----------------------
+    factor : float
+        Multiplier of the size dependent part of the estimate, at least 1.0.
+    """
+    if not failure.memory or not rec.osm2pgsql_run_in_ram:
+        return 1.0
+    needed_gb = (peak_mb or 0.0) / 1024
+    if failure.kind != 'postgres_oom':
+        needed_gb = max(needed_gb, rec.osm2pgsql_cache_max)
+    base_gb = model_profile(rec).noslim_base_gb
+    size_gb = rec.osm2pgsql_noslim_cache - base_gb
+    if size_gb <= 0:
+        return 1.0
+    return max(1.0, (needed_gb * CORRECTION_MARGIN - base_gb) / size_gb)
+
+
+def record_correction(store: calibration.CalibrationStore, rec: tuner.Recommendation,
+                      failure: Failure, factor: float, source: str=None):
+    """Stores the correction of a failed import for later recommendations.
+
+    Parameters
+    -----------------------
+    store : osm2pgsql_tuner.calibration.CalibrationStore
+    rec : osm2pgsql_tuner.tuner.Recommendation
+        Recommendation of the failed import.
+    failure : Failure
+    factor : float
+        See :func:`correction_factor`.
+    source : str
+        (Default None)
+    """
+    profile = model_profile(rec)
+    store.add_correction(profile.osm2pgsql_version, profile.style, rec.osm_pbf_gb,
+                         factor, failure.kind, source=source)
+
+
+def corrected_calibration(store: calibration.CalibrationStore,
+                          rec: tuner.Recommendation) -> calibration.CalibrationProfile:
+    """Returns the memory model of ``rec`` with stored corrections applied.
+
+    Pass it as ``calibration`` to recommendations for similar inputs.
+
+    Returns
+    -----------------------
+    profile : osm2pgsql_tuner.calibration.CalibrationProfile or None
+        ``rec.calibration`` when no correction applies.
+    """
+    profile = model_profile(rec)
+    corrected = store.corrected_profile(profile, rec.osm_pbf_gb)
+    if corrected is profile:
+        return rec.calibration
+    return corrected
+
+
+def downgrade(rec: tuner.Recommendation, failure: Failure,
+              factor: float=1.0) -> tuner.Recommendation:
+    """Builds a more conservative recommendation after a failed import.
+
+    One step per failure: an in-RAM import moves to ``--slim`` with
+    ``--cache`` reduced by ``CACHE_REDUCTION``, a slim import adds
+    ``--flat-nodes`` and a slim import with flat nodes halves
+    ``--number-processes``.  Steps of earlier failures are kept.  The
+    failure and the step are recorded in ``decisions``.
+
+    Parameters
+    -----------------------
+    rec : osm2pgsql_tuner.tuner.Recommendation
+        Recommendation of the failed import.
+    failure : Failure
+    factor : float
+        (Default 1.0) Correction of the RAM estimate, see :func:`correction_factor`.
+
+    Returns
+    -----------------------
+    rec : osm2pgsql_tuner.tuner.Recommendation or None
+        None when the failure is not from memory or nothing is left to reduce.
+    """
+    if not failure.memory:
+        return None
+    processes = rec.osm2pgsql_number_processes
+    if rec.osm2pgsql_run_in_ram:
+        step = tuner.FallbackDecision.SLIM
+    elif not rec.osm2pgsql_flat_nodes:
+        step = tuner.FallbackDecision.FLAT_NODES
+    elif processes is not None and processes > 1:
+        step = tuner.FallbackDecision.PROCESSES
+    else:
+        return None
+
+    calibration_profile = rec.calibration
+    if factor > 1.0:
+        calibration_profile = model_profile(rec).scaled(factor)
+    downgraded = tuner.Recommendation(rec.system_ram_gb, rec.osm_pbf_gb,
+                                      slim_no_drop=rec.slim_no_drop,
+                                      append_first_run=rec.append_first_run,
+                                      pgosm_layer_set=rec.pgosm_layer_set,
+                                      ssd=rec.ssd, pbf_stats=rec.pbf_stats,
+                                      cpu_count=rec.cpu_count,
+                                      postgres_ram_gb=rec.postgres_ram_gb,
+                                      calibration=calibration_profile,
+                                      style_analysis=rec.style_analysis,
+                                      osm2pgsql_version=rec.osm2pgsql_version,
+                                      storage=rec.storage)
+    downgraded.flat_nodes_path = rec.flat_nodes_path
+    downgraded.tablespace_plan = rec.tablespace_plan
+
+    # Assigned values replace the rules, later attributes follow them
+    downgraded.osm2pgsql_run_in_ram = False
+    if step != tuner.FallbackDecision.SLIM:
+        downgraded.osm2pgsql_flat_nodes = True
+    cache_mb = downgraded.get_cache_mb()
+    if step == tuner.FallbackDecision.SLIM:
+        cache_mb = int(cache_mb * CACHE_REDUCTION)
+        downgraded.osm2pgsql_cache_mb = cache_mb
+    if processes is not None:
+        limit = processes // 2 if step == tuner.FallbackDecision.PROCESSES else processes
+        downgraded.osm2pgsql_number_processes = max(
+            1, min(downgraded.osm2pgsql_number_processes, limit))
+
+    decisions = downgraded.decisions
+    decisions.append(tuner.Decision(tuner.FallbackDecision.FAILED, kind=failure.kind,
+                                    evidence=failure.evidence))
+    if factor > 1.0:
+        decisions.append(tuner.Decision(tuner.FallbackDecision.CORRECTED, factor=factor))
+    if step == tuner.FallbackDecision.SLIM:
+        decisions.append(tuner.Decision(step, cache_mb=cache_mb))
+    elif step == tuner.FallbackDecision.FLAT_NODES:
+        decisions.append(tuner.Decision(step))
+    else:
+        decisions.append(tuner.Decision(
+            step, number_processes=downgraded.osm2pgsql_number_processes))
+    return downgraded
+
+
+class Attempt():
+    """One import run by :func:`run_with_fallback`.
+
+    Parameters
+    -----------------------
+    rec : osm2pgsql_tuner.tuner.Recommendation
+    command : str
+        Command before environment variables are expanded.
+    run : osm2pgsql_tuner.supervisor.SupervisedRun
+    failure : Failure or None
+    factor : float
+        (Default 1.0) Correction of the RAM estimate after ``failure``.
+    """
+    def __init__(self, rec: tuner.Recommendation, command: str,
+                 run: supervisor.SupervisedRun, failure: Failure, factor: float=1.0):
+        self.rec = rec
+        self.command = command
+        self.run = run
+        self.failure = failure
+        self.factor = factor
+
+    def to_dict(self) -> dict:
+        """Returns the attempt as a JSON serializable dictionary.
+
+        Returns
+        ----------------------
+        attempt : dict
+        """
+        return {'command': self.command,
+                'returncode': self.run.returncode,
+                'seconds': self.run.seconds,
+                'peak_rss_mb': self.run.peak_rss_mb,
+                'failure': self.failure.to_dict() if self.failure is not None else None,
+                'factor': self.factor}
+
+
+class FallbackRun():
+    """Result of :func:`run_with_fallback`."""
+    def __init__(self):
+        self.attempts = []
+
+    @property
+    def succeeded(self) -> bool:
+        """True when the last attempt exited with status 0."""
+        return bool(self.attempts) and self.attempts[-1].failure is None
+
+    @property
+    def returncode(self) -> int:
+        """Exit status of the last attempt."""
+        return self.attempts[-1].run.returncode
+
+    @property
+    def recommendation(self) -> tuner.Recommendation:
+        """Recommendation of the last attempt."""
+        return self.attempts[-1].rec
+
+    def to_dict(self) -> dict:
+        """Returns the result as a JSON serializable dictionary.
+
+        Returns
+        ----------------------
+        result : dict
+        """
+        return {'succeeded': self.succeeded,
+                'returncode': self.returncode,
+                'attempts': [attempt.to_dict() for attempt in self.attempts]}
+
+
+def run_with_fallback(rec: tuner.Recommendation, pbf_path: str, binary='osm2pgsql',
+                      env: dict=None, max_attempts: int=DEFAULT_MAX_ATTEMPTS,
+                      store: calibration.CalibrationStore=None,
+                      kernel_log=read_kernel_log,
+                      interval: float=supervisor.DEFAULT_INTERVAL_SECONDS,
+                      telemetry=None, proc_root: str='/proc') -> FallbackRun:
+    """Runs the import, re-running it with a downgraded plan after memory failures.
+
+    Stops at the first success, a failure not caused by memory, when nothing
+    is left to downgrade or after ``max_attempts``.  osm2pgsql runs with
+    ``--create``, each attempt replaces the tables of the failed one.
+
+    Parameters
+    -----------------------
+    rec : osm2pgsql_tuner.tuner.Recommendation
+    pbf_path : str
+    binary : str or list of str
+        (Default ``osm2pgsql``) See :func:`osm2pgsql_tuner.supervisor.build_args`.
+    env : dict
+        (Default None) Environment for the subprocess, inherits when None.
+    max_attempts : int
+        (Default ``DEFAULT_MAX_ATTEMPTS``)
+    store : osm2pgsql_tuner.calibration.CalibrationStore
+        (Default None) Corrections of the memory model are stored here.
+    kernel_log : callable
+        (Default :func:`read_kernel_log`) Returns kernel log lines, None to skip.
+    interval : float
+        (Default ``osm2pgsql_tuner.supervisor.DEFAULT_INTERVAL_SECONDS``)
+    telemetry : file-like
+        (Default None) Supervisor events and one ``fallback`` event per
+        failure are written as JSON lines.
+    proc_root : str
+        (Default ``/proc``)
+
+    Returns
+    -----------------------
+    result : FallbackRun
+    """
+    result = FallbackRun()
+    for _ in range(max(1, max_attempts)):
+        command = rec.get_osm2pgsql_command(pbf_path)
+        run = supervisor.supervise(rec, pbf_path, binary=binary, env=env,
+                                   interval=interval, telemetry=telemetry,
+                                   proc_root=proc_root)
+        kernel_lines = kernel_log() if kernel_log is not None and run.returncode else ()
+        failure = classify(run.returncode, run.log_lines, kernel_lines, pid=run.pid)
+        factor = 1.0
+        if failure is not None:
+            peak_mb = max((value for value in (run.peak_rss_mb, run.projected_peak_mb)
+                           if value is not None), default=None)
+            factor = correction_factor(rec, failure, peak_mb)
+        result.attempts.append(Attempt(rec, command, run, failure, factor))
+        if failure is None or not failure.memory:
+            break
+        if store is not None and factor > 1.0:
+            record_correction(store, rec, failure, factor, source=pbf_path)
+        rec = downgrade(rec, failure, factor)
+        if telemetry is not None:
+            next_command = rec.get_osm2pgsql_command(pbf_path) if rec is not None else None
+            telemetry.write(json.dumps({'type': 'fallback', 'failure': failure.to_dict(),
+                                        'factor': factor,
+                                        'next_command': next_command}) + '\n')
+            telemetry.flush()
+        if rec is None:
+            break
+    return result
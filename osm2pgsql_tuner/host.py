@@ -0,0 +1,317 @@
+"""Detects RAM, CPU and storage details of the host or container.
+
+Detection only reads files under ``/proc`` and ``/sys``, no subprocesses are
+started.  Results are cached per process.  Container limits set via cgroups
+(v1 or v2) take precedence over the physical host values because osm2pgsql
+running in Docker is OOM-killed at the cgroup limit, not at ``MemTotal``.
+"""
+import functools
+import math
+import os
+
+
+CGROUP_V1_UNLIMITED_BYTES = 2**60
+"""int : cgroup v1 reports "no limit" as a huge page-aligned number, treat
+anything at or above this value as unlimited."""
+
+
+class HostResources():
+    """Resources detected for the current process.
+
+    Parameters
+    -----------------------
+    ram_gb : float
+        Usable RAM in GB, the lower of ``MemTotal`` and any cgroup limit.
+
+    ram_source : str
+        Where ``ram_gb`` came from, e.g. ``/proc/meminfo`` or ``cgroup v2 memory.max``.
+
+    cpu_count : int
+        Usable CPUs, the lower of online CPUs, CPU affinity and any cgroup quota.
+
+    cpu_source : str
+        Where ``cpu_count`` came from.
+    """
+    def __init__(self, ram_gb: float, ram_source: str, cpu_count: int,
+                 cpu_source: str):
+        self.ram_gb = ram_gb
+        self.ram_source = ram_source
+        self.cpu_count = cpu_count
+        self.cpu_source = cpu_source
+
+    def to_dict(self) -> dict:
+        """Returns the detected values as a dictionary.
+
+        Returns
+        ----------------------
+        resources : dict
+        """
+        return dict(vars(self))
+
+
+def _read_text(path: str) -> str:
+    """Returns stripped contents of ``path`` or None when it cannot be read."""
+    try:
+        with open(path, 'r', encoding='utf-8') as file_in:
+            return file_in.read().strip()
+    except OSError:
+        return None
+
+
+def _join(root: str, path: str) -> str:
+    """Joins an absolute ``path`` under ``root``, used to test with fake trees."""
+    return os.path.join(root, path.lstrip('/'))
+
+
+def read_meminfo_gb(root: str='/') -> float:
+    """Returns ``MemTotal`` from ``/proc/meminfo`` in GB, or None if unavailable.
+
+    Parameters
+    -----------------------
+    root : str
+        (Default ``/``) Filesystem root to read from.
+
+    Returns
+    -----------------------
+    mem_total_gb : float or None
+    """
+    meminfo = _read_text(_join(root, '/proc/meminfo'))
+    if meminfo is None:
+        return None
+    for line in meminfo.splitlines():
+        if line.startswith('MemTotal:'):
+            # Value is reported in kB
+            return int(line.split()[1]) / 1024**2
+    return None
+
+
+def _cgroup_v2_dir(root: str) -> str:
+    """Returns the cgroup v2 directory of this process, or None for cgroup v1."""
+    base = _join(root, '/sys/fs/cgroup')
+    if not os.path.exists(os.path.join(base, 'cgroup.controllers')):
+        return None
+    cgroup = _read_text(_join(root, '/proc/self/cgroup')) or ''
+    for line in cgroup.splitlines():
+        if line.startswith('0::'):
+            candidate = os.path.join(base, line[3:].lstrip('/'))
+            if os.path.isdir(candidate):
+                return candidate
+    return base
+
+
+def read_cgroup_memory_limit_gb(root: str='/') -> tuple:
+    """Returns the cgroup memory limit in GB and the file it came from.
+
+    Parameters
+    -----------------------
+    root : str
+        (Default ``/``) Filesystem root to read from.
+
+    Returns
+    -----------------------
+    limit_source : tuple
+        ``(limit_gb, source)``, ``(None, None)`` when no limit is set.
+    """
+    v2_dir = _cgroup_v2_dir(root)
+    if v2_dir is not None:
+        value = _read_text(os.path.join(v2_dir, 'memory.max'))
+        if value and value != 'max':
+            return int(value) / 1024**3, 'cgroup v2 memory.max'
+        return None, None
+
+    value = _read_text(_join(root, '/sys/fs/cgroup/memory/memory.limit_in_bytes'))
+    if value and int(value) < CGROUP_V1_UNLIMITED_BYTES:
+        return int(value) / 1024**3, 'cgroup v1 memory.limit_in_bytes'
+    return None, None
+
+
+def read_cgroup_cpu_limit(root: str='/') -> tuple:
+    """Returns the cgroup CPU quota (in CPUs) and the file it came from.
+
+    Parameters
+    -----------------------
+    root : str
+        (Default ``/``) Filesystem root to read from.
+
+    Returns
+    -----------------------
+    limit_source : tuple
+        ``(cpus, source)``, ``(None, None)`` when no quota is set.
+    """
+    v2_dir = _cgroup_v2_dir(root)
+    if v2_dir is not None:
+        value = _read_text(os.path.join(v2_dir, 'cpu.max'))
+        if value:
+            quota, _, period = value.partition(' ')
+            if quota != 'max':
+                return int(quota) / int(period or 100000), 'cgroup v2 cpu.max'
+        return None, None
+
+    quota = _read_text(_join(root, '/sys/fs/cgroup/cpu/cpu.cfs_quota_us'))
+    period = _read_text(_join(root, '/sys/fs/cgroup/cpu/cpu.cfs_period_us'))
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period), 'cgroup v1 cpu.cfs_quota_us'
+    return None, None
+
+
+def _parse_cpu_list(cpu_list: str) -> int:
+    """Counts CPUs in a kernel CPU list such as ``0-3,8,10-11``."""
+    total = 0
+    for part in cpu_list.split(','):
+        if not part:
+            continue
+        start, _, end = part.partition('-')
+        total += int(end or start) - int(start) + 1
+    return total
+
+
+def read_online_cpus(root: str='/') -> tuple:
+    """Returns the number of online CPUs usable by this process and the source.
+
+    Parameters
+    -----------------------
+    root : str
+        (Default ``/``) Filesystem root to read from.
+
+    Returns
+    -----------------------
+    cpus_source : tuple
+    """
+    online = _read_text(_join(root, '/sys/devices/system/cpu/online'))
+    if online:
+        cpus, source = _parse_cpu_list(online), '/sys/devices/system/cpu/online'
+    else:
+        cpus, source = os.cpu_count() or 1, 'os.cpu_count()'
+
+    if root == '/' and hasattr(os, 'sched_getaffinity'):
+        affinity = len(os.sched_getaffinity(0))
+        if affinity < cpus:
+            cpus, source = affinity, 'CPU affinity'
+    return cpus, source
+
+
+@functools.lru_cache(maxsize=None)
+def detect(root: str='/') -> HostResources:
+    """Detects usable RAM and CPUs, cached per process.
+
+    Parameters
+    -----------------------
+    root : str
+        (Default ``/``) Filesystem root to read from.
+
+    Returns
+    -----------------------
+    resources : HostResources
+    """
+    ram_gb = read_meminfo_gb(root)
+    ram_source = '/proc/meminfo'
+    limit_gb, limit_source = read_cgroup_memory_limit_gb(root)
+    if limit_gb is not None and (ram_gb is None or limit_gb < ram_gb):
+        ram_gb, ram_source = limit_gb, limit_source
+    if ram_gb is None:
+        raise ValueError('Unable to detect system RAM, pass system_ram_gb instead.')
+
+    cpu_count, cpu_source = read_online_cpus(root)
+    cpu_limit, cpu_limit_source = read_cgroup_cpu_limit(root)
+    if cpu_limit is not None and cpu_limit < cpu_count:
+        # Fractional quotas still allow one process to run on a core
+        cpu_count, cpu_source = max(1, math.ceil(cpu_limit)), cpu_limit_source
+
+    return HostResources(ram_gb=ram_gb, ram_source=ram_source,
+                         cpu_count=cpu_count, cpu_source=cpu_source)
+
+
+@functools.lru_cache(maxsize=256)
+def _rotational_for_device(root: str, major: int, minor: int):
+    """Returns the rotational flag for a block device, None when unknown."""
+    device_dir = _join(root, f'/sys/dev/block/{major}:{minor}')
+    if not os.path.exists(device_dir):
+        return None
+    device_dir = os.path.realpath(device_dir)
+    # Partitions (e.g. sda1) keep the queue/ directory on the parent disk
+    for candidate in (device_dir, os.path.dirname(device_dir)):
+        value = _read_text(os.path.join(candidate, 'queue', 'rotational'))
+        if value is not None:
+            return value == '1'
+    return None
+
+
+def is_rotational(path: str, root: str='/'):
+    """Returns True when ``path`` lives on a spinning disk.
+
+    The nearest existing parent is used when ``path`` does not exist yet,
+    e.g. for a flat nodes file that osm2pgsql will create.
+
+    Parameters
+    -----------------------
+    path : str
+    root : str
+        (Default ``/``) Filesystem root to read ``/sys`` from.
+
+    Returns
+    -----------------------
+    rotational : bool or None
+        None when the device cannot be determined, e.g. overlay filesystems.
+    """
+    path = existing_parent(path)
+    if path is None:
+        return None
+    st_dev = os.stat(path).st_dev
+    return _rotational_for_device(root, os.major(st_dev), os.minor(st_dev))
+
+
+def existing_parent(path: str) -> str:
+    """Returns ``path`` or its nearest existing parent directory, absolute.
+
+    Parameters
+    -----------------------
+    path : str
+
+    Returns
+    -----------------------
+    path : str or None
+    """
+    path = os.path.abspath(os.path.expanduser(path))
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+    return path
+
+
+def filesystem_type(path: str, root: str='/') -> str:
+    """Returns the filesystem type (e.g. ``ext4``, ``tmpfs``) holding ``path``.
+
+    Reads ``/proc/self/mounts`` and picks the longest mount point containing
+    the path.
+
+    Parameters
+    -----------------------
+    path : str
+    root : str
+        (Default ``/``) Filesystem root to read ``/proc`` from.
+
+    Returns
+    -----------------------
+    fs_type : str or None
+    """
+    path = existing_parent(path)
+    mounts = _read_text(_join(root, '/proc/self/mounts'))
+    if path is None or mounts is None:
+        return None
+    path = os.path.realpath(path)
+    best_mount = ''
+    best_type = None
+    for line in mounts.splitlines():
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+        # Spaces in mount points are escaped as octal
+        mount_point = fields[1].replace('\\040', ' ')
+        inside = (path == mount_point
+                  or path.startswith(mount_point.rstrip('/') + '/'))
+        if inside and len(mount_point) >= len(best_mount):
+            best_mount = mount_point
+            best_type = fields[2]
+    return best_type
@@ -0,0 +1,319 @@
+"""Plans index builds and clustering after the osm2pgsql data phase.
+
+For large imports building indexes and clustering the output tables can take
+longer than reading the input.  The plan sizes ``maintenance_work_mem`` and
+``max_parallel_maintenance_workers`` for the host and groups the builds into
+batches that run concurrently within the RAM budget:
+
+* Each table gets a GIST index on the geometry column, optionally followed by
+  ``CLUSTER`` on it, then a B-tree index on the OSM id.  Steps of one table
+  run in that order, steps of different tables run concurrently.
+* Each concurrent build uses up to ``maintenance_work_mem``.  Only B-tree
+  builds use parallel workers in PostgreSQL, GIST builds and ``CLUSTER`` do not.
+* Table sizes split the output size estimate of
+  :func:`osm2pgsql_tuner.preflight.output_bytes` by the share of objects
+  matching each table's tag filter.
+
+Intended for styles that skip osm2pgsql's own index creation.  Build rates
+are initial estimates, not measured.
+"""
+from osm2pgsql_tuner import layerset, pgconfig, preflight, runtime
+
+
+MAINTENANCE_RAM_SHARE = 0.5
+"""float : Share of RAM not used by ``shared_buffers`` given to concurrent index builds.
+
+osm2pgsql has exited by the time indexes are built, its cache is free.
+"""
+
+MIN_MAINTENANCE_WORK_MEM_MB = 512
+"""int : Smallest ``maintenance_work_mem`` worth running another concurrent build for."""
+
+MAX_MAINTENANCE_WORK_MEM_MB = 10240
+"""int : Largest ``maintenance_work_mem`` recommended, same cap as :mod:`osm2pgsql_tuner.pgconfig`."""
+
+MAX_PARALLEL_MAINTENANCE_WORKERS = 8
+"""int : Largest ``max_parallel_maintenance_workers`` recommended."""
+
+INDEX_BYTES_SHARE = {'gist': 0.25, 'btree': 0.05}
+"""dict : Index size as a share of the table size, by index type."""
+
+SECONDS_PER_GB = {'gist': 300, 'cluster': 150, 'btree': 40}
+"""dict : Build seconds per GB of table on SSD with one process, by step.
+
+Initial estimates, not measured.
+"""
+
+BTREE_PARALLEL_FRACTION = 0.8
+"""float : Fraction of a B-tree build that scales with parallel workers (Amdahl's law)."""
+
+SPILL_FACTOR = 1.3
+"""float : Slowdown when the index does not fit in ``maintenance_work_mem`` and sorts on disk."""
+
+GEOMETRY_COLUMN = 'geom'
+"""str : Geometry column of the PgOSM Flex tables."""
+
+ID_COLUMN = 'osm_id'
+"""str : OSM id column of the PgOSM Flex tables."""
+
+
+class IndexStep():
+    """One index build or ``CLUSTER``.
+
+    Parameters
+    -----------------------
+    table : str
+    kind : str
+        ``gist``, ``cluster`` or ``btree``.
+    table_bytes : int
+    index_bytes : int
+        Disk added by the step, 0 for ``cluster``.
+    seconds : float
+    schema : str
+    """
+    def __init__(self, table: str, kind: str, table_bytes: int,
+                 index_bytes: int, seconds: float, schema: str):
+        self.table = table
+        self.kind = kind
+        self.table_bytes = table_bytes
+        self.index_bytes = index_bytes
+        self.seconds = seconds
+        self.schema = schema
+
+    @property
+    def gist_index_name(self) -> str:
+        """Name of the geometry index of the table."""
+        return f'ix_{self.table}_{GEOMETRY_COLUMN}'
+
+    def get_sql(self) -> str:
+        """Returns the SQL statement for the step.
+
+        Returns
+        ----------------------
+        sql : str
+        """
+        table = f'{self.schema}.{self.table}'
+        if self.kind == 'gist':
+            return (f'CREATE INDEX IF NOT EXISTS {self.gist_index_name} '
+                    f'ON {table} USING GIST ({GEOMETRY_COLUMN});')
+        if self.kind == 'cluster':
+            return f'CLUSTER {table} USING {self.gist_index_name};'
+        return (f'CREATE INDEX IF NOT EXISTS ix_{self.table}_{ID_COLUMN} '
+                f'ON {table} ({ID_COLUMN});')
+
+    def to_dict(self) -> dict:
+        """Returns the step as a dictionary.
+
+        Returns
+        ----------------------
+        step : dict
+        """
+        return dict(vars(self), sql=self.get_sql())
+
+
+class IndexPlan():
+    """Settings and batches returned by :func:`plan`.
+
+    Parameters
+    -----------------------
+    maintenance_work_mem_mb : int
+        Per build, set in each session.
+    max_parallel_maintenance_workers : int
+    concurrency : int
+        Builds running at the same time.
+    batches : list of list of IndexStep
+        Steps within a batch run concurrently, batches run in order.
+    tables : list of str
+        Tables to ``ANALYZE`` at the end.
+    schema : str
+    """
+    def __init__(self, maintenance_work_mem_mb: int,
+                 max_parallel_maintenance_workers: int, concurrency: int,
+                 batches: list, tables: list, schema: str):
+        self.maintenance_work_mem_mb = maintenance_work_mem_mb
+        self.max_parallel_maintenance_workers = max_parallel_maintenance_workers
+        self.concurrency = concurrency
+        self.batches = batches
+        self.tables = tables
+        self.schema = schema
+
+    @property
+    def total_seconds(self) -> float:
+        """Estimated wall-clock time, each batch takes as long as its longest step."""
+        return sum(max(step.seconds for step in batch) for batch in self.batches)
+
+    @property
+    def index_bytes(self) -> int:
+        """Disk used by the new indexes."""
+        return sum(step.index_bytes for batch in self.batches for step in batch)
+
+    @property
+    def peak_temp_bytes(self) -> int:
+        """Largest temporary disk of a batch, ``CLUSTER`` rewrites the table and its indexes."""
+        peaks = [sum(int(step.table_bytes * (1 + INDEX_BYTES_SHARE['gist']))
+                     for step in batch if step.kind == 'cluster')
+                 for batch in self.batches]
+        return max(peaks, default=0)
+
+    def get_settings(self) -> dict:
+        """Returns the session settings for the index builds.
+
+        Returns
+        ----------------------
+        settings : dict
+        """
+        return {'maintenance_work_mem': pgconfig.format_mb(self.maintenance_work_mem_mb),
+                'max_parallel_maintenance_workers': str(self.max_parallel_maintenance_workers)}
+
+    def get_batch_statements(self) -> list:
+        """Returns the SQL statements of each batch.
+
+        Returns
+        ----------------------
+        batches : list of list of str
+        """
+        return [[step.get_sql() for step in batch] for batch in self.batches]
+
+    def get_sql_script(self) -> str:
+        """Returns the ordered SQL script.
+
+        Statements of a batch are meant to run in separate sessions at the
+        same time, each session applying the ``SET`` lines first.
+
+        Returns
+        ----------------------
+        sql : str
+        """
+        lines = [f'-- Index build plan: {len(self.batches)} batches, '
+                 f'~{self.total_seconds / 60:.0f} min, '
+                 f'indexes {self.index_bytes / 1024**3:.1f} GB',
+                 f'-- Run the statements of a batch in up to {self.concurrency} '
+                 'concurrent sessions, finish a batch before starting the next.']
+        lines.extend(f"SET {name} = '{value}';" for name, value in self.get_settings().items())
+        for number, batch in enumerate(self.batches, start=1):
+            seconds = max(step.seconds for step in batch)
+            lines.append('')
+            lines.append(f'-- Batch {number}: {len(batch)} concurrent, ~{seconds:.0f} s')
+            lines.extend(step.get_sql() for step in batch)
+        lines.append('')
+        lines.extend(f'ANALYZE {self.schema}.{table};' for table in self.tables)
+        return '\n'.join(lines) + '\n'
+
+    def to_dict(self) -> dict:
+        """Returns the plan as a JSON serializable dictionary.
+
+        Returns
+        ----------------------
+        plan : dict
+        """
+        return {'maintenance_work_mem_mb': self.maintenance_work_mem_mb,
+                'max_parallel_maintenance_workers': self.max_parallel_maintenance_workers,
+                'concurrency': self.concurrency,
+                'total_seconds': self.total_seconds,
+                'index_bytes': self.index_bytes,
+                'peak_temp_bytes': self.peak_temp_bytes,
+                'batches': [[step.to_dict() for step in batch] for batch in self.batches]}
+
+
+def table_bytes(style_analysis: layerset.StyleAnalysis, osm_pbf_gb: float) -> dict:
+    """Splits the output size estimate between the tables of a layer set.
+
+    Parameters
+    -----------------------
+    style_analysis : osm2pgsql_tuner.layerset.StyleAnalysis
+    osm_pbf_gb : float
+
+    Returns
+    -----------------------
+    sizes : dict
+        Table name to estimated size in bytes.
+    """
+    total = preflight.output_bytes(osm_pbf_gb, style_analysis.output_factor)
+    weights = {}
+    for table in style_analysis.tables:
+        share = layerset.union_share(table.tag_keys) if table.tag_keys else 1.0
+        weights[table.name] = weights.get(table.name, 0.0) + share
+    weight_sum = sum(weights.values())
+    if not weight_sum:
+        return {}
+    return {name: int(total * weight / weight_sum) for name, weight in weights.items()}
+
+
+def _step_seconds(kind: str, size_bytes: int, index_bytes: int, maintenance_work_mem_mb: int,
+                  workers: int, ssd: bool) -> float:
+    """Estimated seconds for one step."""
+    seconds = size_bytes / 1024**3 * SECONDS_PER_GB[kind]
+    if not ssd:
+        seconds *= runtime.HDD_FACTOR['postprocessing']['slim']
+    if kind != 'cluster' and index_bytes > maintenance_work_mem_mb * 1024**2:
+        seconds *= SPILL_FACTOR
+    if kind == 'btree':
+        seconds *= (1 - BTREE_PARALLEL_FRACTION) + BTREE_PARALLEL_FRACTION / (1 + workers)
+    return seconds
+
+
+def plan(style_analysis: layerset.StyleAnalysis, osm_pbf_gb: float,
+         system_ram_gb: float, cpu_count: int=None, ssd: bool=True,
+         cluster: bool=True, schema: str='osm') -> IndexPlan:
+    """Plans the index builds for the tables of a layer set.
+
+    Parameters
+    -----------------------
+    style_analysis : osm2pgsql_tuner.layerset.StyleAnalysis
+    osm_pbf_gb : float
+    system_ram_gb : float
+    cpu_count : int
+        (Default None) When None builds run one at a time with the PostgreSQL
+        default of 2 parallel workers.
+    ssd : bool
+        (Default True)
+    cluster : bool
+        (Default True) ``CLUSTER`` each table on its geometry index.
+    schema : str
+        (Default osm) Schema of the output tables.
+
+    Returns
+    -----------------------
+    index_plan : IndexPlan
+    """
+    sizes = table_bytes(style_analysis, osm_pbf_gb)
+    geometry_tables = {table.name for table in style_analysis.tables
+                       if table.geometry_types}
+
+    shared_buffers_mb = pgconfig.PostgresLoadConfig(system_ram_gb, osm_pbf_gb).shared_buffers_mb
+    budget_mb = max(0, system_ram_gb * 1024 - shared_buffers_mb) * MAINTENANCE_RAM_SHARE
+    by_ram = max(1, int(budget_mb // MIN_MAINTENANCE_WORK_MEM_MB))
+    if cpu_count is None:
+        concurrency = 1
+        workers = 2
+    else:
+        concurrency = max(1, min(cpu_count, len(sizes), by_ram))
+        workers = min(MAX_PARALLEL_MAINTENANCE_WORKERS, max(0, cpu_count // concurrency - 1))
+    maintenance_work_mem_mb = int(min(MAX_MAINTENANCE_WORK_MEM_MB,
+                                      max(64, budget_mb // concurrency)))
+
+    chains = []
+    for name, size in sorted(sizes.items()):
+        kinds = ['gist', 'cluster', 'btree'] if name in geometry_tables else ['btree']
+        if not cluster and 'cluster' in kinds:
+            kinds.remove('cluster')
+        chain = []
+        for kind in kinds:
+            index_size = int(size * INDEX_BYTES_SHARE.get(kind, 0.0))
+            seconds = _step_seconds(kind, size, index_size, maintenance_work_mem_mb,
+                                    workers, ssd)
+            chain.append(IndexStep(table=name, kind=kind, table_bytes=size,
+                                   index_bytes=index_size, seconds=seconds,
+                                   schema=schema))
+        chains.append(chain)
+
+    batches = []
+    while chains:
+        # Tables with the most remaining work first, each table once per batch
+        chains.sort(key=lambda chain: -sum(step.seconds for step in chain))
+        batches.append([chain.pop(0) for chain in chains[:concurrency]])
+        chains = [chain for chain in chains if chain]
+    return IndexPlan(maintenance_work_mem_mb=maintenance_work_mem_mb,
+                     max_parallel_maintenance_workers=workers,
+                     concurrency=concurrency, batches=batches,
+                     tables=sorted(sizes), schema=schema)
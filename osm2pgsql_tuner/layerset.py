@@ -0,0 +1,371 @@
+"""Analyzes PgOSM Flex layer sets and Lua styles.
+
+``pgosm_layer_set`` selects the Lua style osm2pgsql runs.  A layer set with
+only roads produces a fraction of the output tables of the default ``run``
+layer set and only needs a fraction of the input.  The analysis reads the
+style statically (no Lua interpreter):
+
+* PgOSM Flex layer sets from ``layerset/<name>.ini``, enabling
+  ``style/<layer>.lua`` modules, or a Lua style with literal
+  ``require('style.<layer>')`` calls.
+* Tables from ``osm2pgsql.define_table()`` and ``define_*_table()`` calls,
+  with their geometry types.
+* Tag keys tested in ``if`` conditions (e.g. ``if object.tags.highway``) as
+  the tag filter of each module.  A module defining tables w/out any tag
+  condition keeps every object.
+
+Output size is scaled by the share of OSM objects matching the tag filters,
+relative to the ``run`` layer set.  When that share is small an
+``osmium tags-filter`` pre-pass is recommended, shrinking the input osm2pgsql
+reads and so its RAM, disk and runtime.
+"""
+import configparser
+import os
+import re
+
+
+KEY_SHARE = {'building': 0.45, 'highway': 0.20, 'addr:housenumber': 0.12,
+             'natural': 0.06, 'landuse': 0.04, 'barrier': 0.03, 'power': 0.03,
+             'amenity': 0.025, 'waterway': 0.02, 'leisure': 0.01,
+             'railway': 0.01, 'man_made': 0.01, 'water': 0.01,
+             'public_transport': 0.005, 'shop': 0.005, 'tourism': 0.004,
+             'place': 0.003, 'traffic_calming': 0.003, 'boundary': 0.002,
+             'emergency': 0.002, 'historic': 0.002, 'aeroway': 0.001,
+             'indoor': 0.001, 'office': 0.001, 'route': 0.001}
+"""dict : Approximate share of tagged OSM objects carrying each key.
+
+Rounded from taginfo statistics, initial estimates.
+"""
+
+DEFAULT_KEY_SHARE = 0.005
+"""float : Share used for keys not in ``KEY_SHARE``."""
+
+RUN_LAYERSET_KEYS = ('amenity', 'building', 'indoor', 'landuse', 'leisure',
+                     'natural', 'place', 'public_transport', 'highway',
+                     'shop', 'traffic_calming', 'water', 'waterway',
+                     'boundary', 'power', 'railway', 'man_made', 'tourism',
+                     'historic', 'emergency', 'aeroway', 'office')
+"""tuple : Tag keys filtered by the PgOSM Flex ``run`` layer set, the reference for scaling."""
+
+TAGS_FILTER_THRESHOLD = 0.5
+"""float : Recommend ``osmium tags-filter`` when the style needs at most this share of the input."""
+
+GEOMETRY_OBJECT_TYPES = {'point': 'n', 'linestring': 'w', 'polygon': 'w',
+                         'multipolygon': 'wr', 'multilinestring': 'wr',
+                         'multipoint': 'nwr', 'geometry': 'nwr',
+                         'geometrycollection': 'nwr'}
+"""dict : OSM object types (``osmium tags-filter`` prefix) that can produce each geometry type."""
+
+TABLE_FUNCTION_TYPES = {'define_node_table': 'point',
+                        'define_way_table': 'linestring',
+                        'define_area_table': 'multipolygon',
+                        'define_relation_table': 'geometry'}
+"""dict : Default geometry for tables defined w/out an explicit geometry column type."""
+
+_RE_REQUIRE = re.compile(r'''require\s*\(?\s*['"]([\w.]+)['"]''')
+_RE_TABLE = re.compile(r'''osm2pgsql\.(define_table|define_node_table|define_way_table|define_area_table|define_relation_table)\s*[({]''')
+_RE_TABLE_NAME = re.compile(r'''name\s*=\s*['"](\w+)['"]|^\s*['"](\w+)['"]''')
+_RE_GEOMETRY_TYPE = re.compile(r'''type\s*=\s*['"](point|linestring|polygon|multipolygon|multilinestring|multipoint|geometry|geometrycollection)['"]''')
+_RE_TAG_KEY = re.compile(r'''object\.tags\.([A-Za-z_]\w*)|object\.tags\[\s*['"]([^'"]+)['"]\s*\]|object:grab_tag\(\s*['"]([^'"]+)['"]''')
+_RE_CONDITION = re.compile(r'^\s*(?:if|elseif)\b|\bthen\b|\band\b|\bor\b')
+
+
+class TableInfo():
+    """A table defined by the style.
+
+    Parameters
+    -----------------------
+    name : str
+    geometry_types : list of str
+    module : str
+        Lua module (file) the table was defined in.
+    tag_keys : list of str
+        Keys filtering rows of the table, empty when unfiltered.
+    """
+    def __init__(self, name: str, geometry_types: list, module: str,
+                 tag_keys: list):
+        self.name = name
+        self.geometry_types = geometry_types
+        self.module = module
+        self.tag_keys = tag_keys
+
+    @property
+    def object_types(self) -> str:
+        """OSM object types (``n``, ``w``, ``r``) that can be stored in the table."""
+        types = set()
+        for geometry_type in self.geometry_types or ['geometry']:
+            types.update(GEOMETRY_OBJECT_TYPES[geometry_type])
+        return ''.join(sorted(types, key='nwr'.index))
+
+    def to_dict(self) -> dict:
+        """Returns the table details as a dictionary.
+
+        Returns
+        ----------------------
+        table : dict
+        """
+        return dict(vars(self), object_types=self.object_types)
+
+
+def union_share(keys) -> float:
+    """Share of OSM objects carrying at least one of ``keys``.
+
+    Keys are treated as independent.
+
+    Parameters
+    -----------------------
+    keys : iterable of str
+
+    Returns
+    -----------------------
+    share : float
+    """
+    missing = 1.0
+    for key in set(keys):
+        missing *= 1 - KEY_SHARE.get(key, DEFAULT_KEY_SHARE)
+    return 1 - missing
+
+
+class StyleAnalysis():
+    """Tables, geometry types and tag filters of a layer set.
+
+    Parameters
+    -----------------------
+    layer_set : str
+    modules : list of str
+        Lua files that were read.
+    tables : list of TableInfo
+    """
+    def __init__(self, layer_set: str, modules: list, tables: list):
+        self.layer_set = layer_set
+        self.modules = modules
+        self.tables = tables
+
+    @property
+    def catch_all(self) -> bool:
+        """True when a table stores objects w/out any tag filter."""
+        return any(not table.tag_keys for table in self.tables)
+
+    @property
+    def tag_keys(self) -> list:
+        """All keys used as tag filters, sorted."""
+        return sorted({key for table in self.tables for key in table.tag_keys})
+
+    @property
+    def geometry_types(self) -> list:
+        """All geometry types of the output tables, sorted."""
+        return sorted({geometry_type for table in self.tables
+                       for geometry_type in table.geometry_types})
+
+    @property
+    def input_share(self) -> float:
+        """Share of the input objects the style can store."""
+        if self.catch_all:
+            return 1.0
+        return union_share(self.tag_keys)
+
+    @property
+    def output_factor(self) -> float:
+        """Expected output size relative to the PgOSM Flex ``run`` layer set."""
+        return self.input_share / union_share(RUN_LAYERSET_KEYS)
+
+    @property
+    def tags_filter_recommended(self) -> bool:
+        """True when an ``osmium tags-filter`` pre-pass shrinks the input enough."""
+        return bool(self.tables) and self.input_share <= TAGS_FILTER_THRESHOLD
+
+    def get_tags_filter_expressions(self) -> list:
+        """Returns ``osmium tags-filter`` expressions, e.g. ``w/highway``.
+
+        Object types come from the geometry types of the tables filtering on
+        each key.
+
+        Returns
+        ----------------------
+        expressions : list of str
+        """
+        types_by_key = {}
+        for table in self.tables:
+            for key in table.tag_keys:
+                types_by_key.setdefault(key, set()).update(table.object_types)
+        return [f'{"".join(sorted(types, key="nwr".index))}/{key}'
+                for key, types in sorted(types_by_key.items())]
+
+    def get_tags_filter_command(self, pbf_path: str, output_path: str) -> str:
+        """Builds the ``osmium tags-filter`` pre-pass command.
+
+        Ways and relations kept pull in the nodes and members they reference,
+        osm2pgsql still sees complete geometries.
+
+        Parameters
+        -----------------------
+        pbf_path : str
+        output_path : str
+
+        Returns
+        -----------------------
+        cmd : str
+        """
+        expressions = ' '.join(self.get_tags_filter_expressions())
+        return f'osmium tags-filter {pbf_path} {expressions} -o {output_path} --overwrite'
+
+    def to_dict(self) -> dict:
+        """Returns the analysis as a JSON serializable dictionary.
+
+        Returns
+        ----------------------
+        analysis : dict
+        """
+        return {'layer_set': self.layer_set,
+                'modules': list(self.modules),
+                'tables': [table.to_dict() for table in self.tables],
+                'tag_keys': self.tag_keys,
+                'geometry_types': self.geometry_types,
+                'catch_all': self.catch_all,
+                'input_share': self.input_share,
+                'output_factor': self.output_factor,
+                'tags_filter_recommended': self.tags_filter_recommended,
+                'tags_filter_expressions': self.get_tags_filter_expressions()}
+
+
+def read_layerset_ini(path: str) -> list:
+    """Returns layers enabled in a PgOSM Flex layer set ``.ini`` file.
+
+    Parameters
+    -----------------------
+    path : str
+
+    Returns
+    -----------------------
+    layers : list of str
+    """
+    parser = configparser.ConfigParser()
+    with open(path, 'r', encoding='utf-8') as file_in:
+        parser.read_file(file_in)
+    layers = []
+    for section in parser.sections():
+        for layer, enabled in parser.items(section):
+            if enabled.strip().lower() == 'true':
+                layers.append(layer)
+    return layers
+
+
+def filtered_path(pbf_path: str) -> str:
+    """Returns the path for the ``osmium tags-filter`` output next to ``pbf_path``.
+
+    Parameters
+    -----------------------
+    pbf_path : str
+        e.g. ``colorado-latest.osm.pbf``
+
+    Returns
+    -----------------------
+    path : str
+        e.g. ``colorado-latest-filtered.osm.pbf``
+    """
+    for suffix in ('.osm.pbf', '.pbf'):
+        if pbf_path.endswith(suffix):
+            return pbf_path[:-len(suffix)] + '-filtered' + suffix
+    return pbf_path + '-filtered.osm.pbf'
+
+
+def _call_body(source: str, start: int) -> str:
+    """Returns the text of a call from its opening parenthesis to the matching one."""
+    depth = 0
+    for pos in range(start, len(source)):
+        char = source[pos]
+        if char in '({':
+            depth += 1
+        elif char in ')}':
+            depth -= 1
+            if depth == 0:
+                return source[start:pos + 1]
+    return source[start:]
+
+
+def _strip_comments(source: str) -> str:
+    """Removes Lua ``--`` comments, incl. ``--[[ ]]`` blocks."""
+    source = re.sub(r'--\[(=*)\[.*?\]\1\]', '', source, flags=re.DOTALL)
+    return re.sub(r'--[^\n]*', '', source)
+
+
+def analyze_module(path: str) -> list:
+    """Finds tables and tag filters in one Lua file.
+
+    Parameters
+    -----------------------
+    path : str
+
+    Returns
+    -----------------------
+    tables : list of TableInfo
+    """
+    with open(path, 'r', encoding='utf-8') as file_in:
+        source = _strip_comments(file_in.read())
+    module = os.path.splitext(os.path.basename(path))[0]
+
+    tag_keys = set()
+    for line in source.splitlines():
+        if not _RE_CONDITION.search(line):
+            continue
+        for match in _RE_TAG_KEY.finditer(line):
+            tag_keys.add(next(group for group in match.groups() if group))
+
+    tables = []
+    for match in _RE_TABLE.finditer(source):
+        body = _call_body(source, match.end() - 1)
+        name_match = _RE_TABLE_NAME.search(body[1:].lstrip())
+        name = next((group for group in name_match.groups() if group), None) if name_match else None
+        geometry_types = sorted(set(_RE_GEOMETRY_TYPE.findall(body)))
+        if not geometry_types and match.group(1) in TABLE_FUNCTION_TYPES:
+            geometry_types = [TABLE_FUNCTION_TYPES[match.group(1)]]
+        tables.append(TableInfo(name=name or module, geometry_types=geometry_types,
+                                module=module, tag_keys=sorted(tag_keys)))
+    return tables
+
+
+def _module_path(style_dir: str, module: str) -> str:
+    """Returns the file for a Lua module name such as ``style.road``."""
+    return os.path.join(style_dir, *module.split('.')) + '.lua'
+
+
+def analyze(style_dir: str, layer_set: str='run') -> StyleAnalysis:
+    """Analyzes a PgOSM Flex layer set or a Lua style.
+
+    Uses ``<style_dir>/layerset/<layer_set>.ini`` when it exists, reading
+    ``style/<layer>.lua`` for each enabled layer.  Otherwise reads
+    ``<style_dir>/<layer_set>.lua`` and follows its literal ``require`` calls.
+
+    Parameters
+    -----------------------
+    style_dir : str
+        Directory holding the Lua styles, e.g. PgOSM Flex ``flex-config``.
+    layer_set : str
+        (Default run)
+
+    Returns
+    -----------------------
+    analysis : StyleAnalysis
+    """
+    ini_path = os.path.join(style_dir, 'layerset', f'{layer_set}.ini')
+    if os.path.exists(ini_path):
+        pending = [_module_path(style_dir, f'style.{layer}')
+                   for layer in read_layerset_ini(ini_path)]
+    else:
+        pending = [os.path.join(style_dir, f'{layer_set}.lua')]
+        if not os.path.exists(pending[0]):
+            raise ValueError(f'No layer set {layer_set} in {style_dir}')
+
+    modules = []
+    tables = []
+    while pending:
+        path = pending.pop(0)
+        if path in modules or not os.path.exists(path):
+            continue
+        modules.append(path)
+        tables.extend(analyze_module(path))
+        with open(path, 'r', encoding='utf-8') as file_in:
+            source = _strip_comments(file_in.read())
+        pending.extend(_module_path(style_dir, module)
+                       for module in _RE_REQUIRE.findall(source))
+    return StyleAnalysis(layer_set=layer_set, modules=modules, tables=tables)
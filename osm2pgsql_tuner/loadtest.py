@@ -0,0 +1,188 @@
+"""Load test for :mod:`osm2pgsql_tuner.server` over loopback.
+
+Starts the service in-process on a free port (unless ``--port`` points to a
+running one) and sends requests over keep-alive connections, reporting
+p50/p99 latency and requests per second as JSON.
+
+    python -m osm2pgsql_tuner.loadtest --requests 20000 --concurrency 32
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+from osm2pgsql_tuner import server
+
+
+class LoadTestResult():
+    """Client side measurements of a load test.
+
+    Parameters
+    -----------------------
+    latencies_ms : list of float
+    errors : int
+    seconds : float
+        Wall time for all requests.
+    """
+    def __init__(self, latencies_ms: list, errors: int, seconds: float):
+        self.latencies_ms = latencies_ms
+        self.errors = errors
+        self.seconds = seconds
+
+    @property
+    def requests(self) -> int:
+        """Number of completed requests."""
+        return len(self.latencies_ms)
+
+    @property
+    def requests_per_sec(self) -> float:
+        """Completed requests per second of wall time."""
+        return self.requests / self.seconds if self.seconds else 0.0
+
+    def to_dict(self) -> dict:
+        """Returns the summary as a dictionary.
+
+        Returns
+        ----------------------
+        result : dict
+        """
+        return {'requests': self.requests,
+                'errors': self.errors,
+                'seconds': self.seconds,
+                'requests_per_sec': self.requests_per_sec,
+                'p50_ms': server.percentile(self.latencies_ms, 50),
+                'p99_ms': server.percentile(self.latencies_ms, 99),
+                'max_ms': max(self.latencies_ms) if self.latencies_ms else None}
+
+
+def generate_targets(count: int, seed: int=0) -> list:
+    """Returns request targets resembling repeated portal traffic.
+
+    Inputs are drawn from a few common RAM sizes and regions with small
+    jitter, so many requests share a quantized cache key.
+
+    Parameters
+    -----------------------
+    count : int
+    seed : int
+        (Default 0)
+
+    Returns
+    -----------------------
+    targets : list of str
+    """
+    rng = random.Random(seed)
+    ram_sizes = (4, 8, 16, 32, 64, 128)
+    pbf_sizes = (0.05, 0.2, 1.99, 10.4, 30.1, 65.0)
+    targets = []
+    for _ in range(count):
+        ram = rng.choice(ram_sizes) - rng.random() * 0.3
+        pbf = rng.choice(pbf_sizes) * (1 + rng.random() * 0.001)
+        ssd = rng.choice(('true', 'true', 'false'))
+        targets.append(f'{server.RECOMMENDATION_PATH}?system_ram_gb={ram:.3f}'
+                       f'&osm_pbf_gb={pbf:.5f}&ssd={ssd}')
+    return targets
+
+
+async def _read_response(reader: asyncio.StreamReader) -> int:
+    """Reads one response, returns the status code."""
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ')[1])
+    length = 0
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def _worker(host: str, port: int, targets: list, latencies_ms: list) -> int:
+    """Sends ``targets`` over one keep-alive connection, returns error count."""
+    reader, writer = await asyncio.open_connection(host, port)
+    errors = 0
+    try:
+        for target in targets:
+            start = time.perf_counter()
+            writer.write(f'GET {target} HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode('latin-1'))
+            status = await _read_response(reader)
+            latencies_ms.append((time.perf_counter() - start) * 1000)
+            if status != 200:
+                errors += 1
+    finally:
+        writer.close()
+    return errors
+
+
+async def run(host: str, port: int, targets: list, concurrency: int=16) -> LoadTestResult:
+    """Sends all ``targets`` using ``concurrency`` connections.
+
+    Parameters
+    -----------------------
+    host : str
+    port : int
+    targets : list of str
+    concurrency : int
+        (Default 16)
+
+    Returns
+    -----------------------
+    result : LoadTestResult
+    """
+    latencies_ms = []
+    chunks = [targets[i::concurrency] for i in range(concurrency)]
+    start = time.perf_counter()
+    errors = await asyncio.gather(*(_worker(host, port, chunk, latencies_ms)
+                                    for chunk in chunks if chunk))
+    return LoadTestResult(latencies_ms=latencies_ms, errors=sum(errors),
+                          seconds=time.perf_counter() - start)
+
+
+async def run_local(requests: int=10000, concurrency: int=16,
+                    cache_size: int=server.DEFAULT_CACHE_SIZE, seed: int=0) -> dict:
+    """Starts a service on loopback, runs the load test and returns both sides.
+
+    Returns
+    -----------------------
+    report : dict
+        Keys ``client`` (:meth:`LoadTestResult.to_dict`) and ``server``
+        (:meth:`osm2pgsql_tuner.server.RecommendationService.stats`).
+    """
+    service = server.RecommendationService(cache_size=cache_size)
+    listener = await service.start('127.0.0.1', 0)
+    port = listener.sockets[0].getsockname()[1]
+    try:
+        result = await run('127.0.0.1', port, generate_targets(requests, seed),
+                           concurrency)
+    finally:
+        listener.close()
+        await listener.wait_closed()
+    return {'client': result.to_dict(), 'server': service.stats()}
+
+
+def main(argv=None) -> int:
+    """Runs the load test and prints the report as JSON."""
+    parser = argparse.ArgumentParser(prog='python -m osm2pgsql_tuner.loadtest')
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--cache-size', type=int, default=server.DEFAULT_CACHE_SIZE)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int,
+                        help='Test a running service instead of starting one.')
+    args = parser.parse_args(argv)
+
+    if args.port is None:
+        report = asyncio.run(run_local(args.requests, args.concurrency, args.cache_size))
+    else:
+        result = asyncio.run(run(args.host, args.port, generate_targets(args.requests),
+                                 args.concurrency))
+        report = {'client': result.to_dict()}
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,452 @@
+"""Plans partitioned, concurrent imports of very large extracts.
+
+A single osm2pgsql run on a continent or the planet has to use ``--slim``
+and leaves most CPUs idle during its single threaded phases.  Above
+``PARTITION_MIN_PBF_GB`` the input can instead be split into geographic
+partitions with one ``osmium extract`` pass, each small enough to import
+w/out ``--slim`` while several run concurrently into separate schemas.
+The output tables are merged afterwards, removing the features
+``osmium extract --strategy smart`` copies into every partition they cross.
+
+Partitions are found by recursive bisection of the bounding box at the
+median of node locations sampled from the PBF
+(:func:`osm2pgsql_tuner.pbf.sample_node_locations`), so dense regions get
+smaller boxes.  Each concurrency level is tried: the host RAM is split
+evenly, :class:`osm2pgsql_tuner.capacity.CapacityModel` gives the largest
+partition that runs in RAM and the partition runtimes
+(:mod:`osm2pgsql_tuner.runtime`) are scheduled longest first.  The fastest
+level is compared with the single run, see :attr:`PartitionPlan.speedup`.
+"""
+import heapq
+import os
+
+from osm2pgsql_tuner import capacity, pbf, runtime, tuner, versions
+
+
+PARTITION_MIN_PBF_GB = 10.0
+"""float : PBF size from which splitting the import is considered."""
+
+MAX_PARTITIONS = 64
+"""int : Most partitions a plan may use."""
+
+BOUNDARY_OVERLAP = 0.02
+"""float : Share of each partition duplicated from its neighbors.
+
+``osmium extract --strategy smart`` completes ways and multipolygons crossing
+the boundary.  Initial estimate, not measured.
+"""
+
+EXTRACT_SECONDS_PER_PBF_GB = 120.0
+"""float : ``osmium extract`` time per GB of input, all partitions in one run.
+
+The smart strategy reads the input up to three times.  Initial estimate.
+"""
+
+MERGE_SECONDS_PER_WAY = 1 / 100_000
+"""float : Merge and deduplication time per way of the output.  Initial estimate."""
+
+DEFAULT_MAX_CONCURRENCY = 4
+"""int : Concurrent partitions considered when ``cpu_count`` is unknown."""
+
+UNIFORM_POINTS = 32
+"""int : Grid points per axis assumed w/out node locations, uniform density."""
+
+PLANET_BBOX = (-180.0, -90.0, 180.0, 90.0)
+"""tuple : ``(left, bottom, right, top)`` used when the PBF has no bounding box."""
+
+PARTITION_KWARGS = ('pgosm_layer_set', 'ssd', 'calibration', 'style_analysis',
+                    'osm2pgsql_version', 'storage')
+"""tuple : ``Recommendation`` parameters passed on to the partition recommendations."""
+
+
+class Partition():
+    """One geographic partition of the input.
+
+    Parameters
+    -----------------------
+    name : str
+        Used for the extract file and the schema, e.g. ``part_01``.
+    bbox : tuple
+        ``(left, bottom, right, top)`` in degrees.
+    share : float
+        Share of the input nodes inside ``bbox``.
+    rec : osm2pgsql_tuner.tuner.Recommendation
+        Recommendation for importing the partition.
+    schema : str
+    """
+    def __init__(self, name: str, bbox: tuple, share: float,
+                 rec: tuner.Recommendation, schema: str):
+        self.name = name
+        self.bbox = bbox
+        self.share = share
+        self.rec = rec
+        self.schema = schema
+        self.seconds = rec.get_runtime_estimate().total_seconds
+
+    @property
+    def filename(self) -> str:
+        """File name written by ``osmium extract``."""
+        return f'{self.name}.osm.pbf'
+
+    def to_dict(self) -> dict:
+        """Returns the partition as a JSON serializable dictionary.
+
+        Returns
+        ----------------------
+        partition : dict
+        """
+        return {'name': self.name,
+                'bbox': list(self.bbox),
+                'share': self.share,
+                'schema': self.schema,
+                'osm_pbf_gb': self.rec.osm_pbf_gb,
+                'run_in_ram': self.rec.osm2pgsql_run_in_ram,
+                'seconds': self.seconds}
+
+
+class PartitionPlan():
+    """Outcome of :func:`plan`, the single run and the best partitioned run.
+
+    Parameters
+    -----------------------
+    single : osm2pgsql_tuner.tuner.Recommendation
+    single_seconds : float
+    partitions : list of Partition
+        Empty when splitting is not worthwhile or not possible.
+    concurrency : int
+        Partitions imported at the same time.
+    extract_seconds : float
+    import_seconds : float
+        Wall-clock time of the concurrent partition imports.
+    merge_seconds : float
+    reason : str
+        (Default None) Why there are no partitions.
+    """
+    def __init__(self, single: tuner.Recommendation, single_seconds: float,
+                 partitions: list, concurrency: int, extract_seconds: float,
+                 import_seconds: float, merge_seconds: float, reason: str=None):
+        self.single = single
+        self.single_seconds = single_seconds
+        self.partitions = partitions
+        self.concurrency = concurrency
+        self.extract_seconds = extract_seconds
+        self.import_seconds = import_seconds
+        self.merge_seconds = merge_seconds
+        self.reason = reason
+
+    @property
+    def partitioned_seconds(self) -> float:
+        """End-to-end time of the partitioned route, None w/out partitions."""
+        if not self.partitions:
+            return None
+        return self.extract_seconds + self.import_seconds + self.merge_seconds
+
+    @property
+    def speedup(self) -> float:
+        """Single run time divided by the partitioned time, None w/out partitions."""
+        if not self.partitions:
+            return None
+        return self.single_seconds / self.partitioned_seconds
+
+    @property
+    def route(self) -> str:
+        """Faster route, ``partitioned`` or ``single``."""
+        if self.partitions and self.speedup > 1.0:
+            return 'partitioned'
+        return 'single'
+
+    def extract_config(self, output_dir: str) -> dict:
+        """Returns the ``osmium extract`` configuration, write it as JSON.
+
+        Parameters
+        -----------------------
+        output_dir : str
+            Directory for the partition files.
+
+        Returns
+        -----------------------
+        config : dict
+        """
+        return {'directory': output_dir,
+                'extracts': [{'output': partition.filename,
+                              'output_format': 'pbf',
+                              'description': partition.schema,
+                              'bbox': list(partition.bbox)}
+                             for partition in self.partitions]}
+
+    def get_extract_command(self, pbf_path: str, config_path: str) -> str:
+        """Builds the ``osmium extract`` command writing every partition in one run.
+
+        Parameters
+        -----------------------
+        pbf_path : str
+        config_path : str
+            :meth:`extract_config` saved as JSON.
+
+        Returns
+        -----------------------
+        cmd : str
+        """
+        return f'osmium extract --config {config_path} --strategy smart --overwrite {pbf_path}'
+
+    def get_osm2pgsql_commands(self, output_dir: str) -> list:
+        """Builds the osm2pgsql command of each partition, one schema each.
+
+        Parameters
+        -----------------------
+        output_dir : str
+            Directory holding the partition files.
+
+        Returns
+        -----------------------
+        commands : list of str
+        """
+        return [partition.rec.get_osm2pgsql_command(os.path.join(output_dir, partition.filename),
+                                                    schema=partition.schema)
+                for partition in self.partitions]
+
+    def merge_sql(self, tables: list=None, schema: str='osm',
+                  key_columns: tuple=('osm_id',)) -> list:
+        """Returns SQL merging the partition schemas into ``schema``.
+
+        Features in more than one partition are kept once.  Indexes are not
+        copied, see :meth:`osm2pgsql_tuner.tuner.Recommendation.get_index_plan`.
+
+        Parameters
+        -----------------------
+        tables : list of str
+            (Default None) Output tables.  Taken from the ``style_analysis``
+            of the single run recommendation when None.
+        schema : str
+            (Default osm) Schema for the merged tables.
+        key_columns : tuple
+            (Default ``('osm_id',)``) Columns identifying a feature, e.g.
+            ``('osm_type', 'osm_id')`` when a table stores several types.
+
+        Returns
+        -----------------------
+        statements : list of str
+        """
+        if tables is None:
+            if self.single.style_analysis is None:
+                raise ValueError('tables or style_analysis is required to merge partitions.')
+            tables = [table.name for table in self.single.style_analysis.tables]
+        keys = ', '.join(key_columns)
+        statements = [f'CREATE SCHEMA IF NOT EXISTS {schema};']
+        for table in tables:
+            parts = '\n        UNION ALL\n        '.join(f'SELECT * FROM {partition.schema}.{table}'
+                                                     for partition in self.partitions)
+            statements.append(f'CREATE TABLE {schema}.{table} AS\n'
+                              f'    SELECT DISTINCT ON ({keys}) *\n'
+                              f'    FROM (\n        {parts}\n    ) parts\n'
+                              f'    ORDER BY {keys};')
+        statements.extend(f'DROP SCHEMA {partition.schema} CASCADE;'
+                          for partition in self.partitions)
+        return statements
+
+    def to_dict(self) -> dict:
+        """Returns the plan as a JSON serializable dictionary.
+
+        Returns
+        ----------------------
+        plan : dict
+        """
+        return {'route': self.route,
+                'speedup': self.speedup,
+                'single_seconds': self.single_seconds,
+                'partitioned_seconds': self.partitioned_seconds,
+                'concurrency': self.concurrency,
+                'extract_seconds': self.extract_seconds,
+                'import_seconds': self.import_seconds,
+                'merge_seconds': self.merge_seconds,
+                'reason': self.reason,
+                'partitions': [partition.to_dict() for partition in self.partitions]}
+
+
+def uniform_points(bbox: tuple, per_axis: int=UNIFORM_POINTS) -> list:
+    """Returns a regular grid of ``(lon, lat)`` points inside ``bbox``."""
+    left, bottom, right, top = bbox
+    return [(left + (right - left) * (column + 0.5) / per_axis,
+             bottom + (top - bottom) * (row + 0.5) / per_axis)
+            for row in range(per_axis) for column in range(per_axis)]
+
+
+def split(points: list, bbox: tuple, max_share: float,
+          max_partitions: int=MAX_PARTITIONS) -> list:
+    """Bisects ``bbox`` until each box holds at most ``max_share`` of the points.
+
+    Boxes are cut across their longer side at the median point.  The box
+    with the largest share is cut first, so splitting stops early at
+    ``max_partitions`` with even boxes.
+
+    Parameters
+    -----------------------
+    points : list of tuple
+        ``(lon, lat)`` inside ``bbox``.
+    bbox : tuple
+        ``(left, bottom, right, top)``
+    max_share : float
+    max_partitions : int
+        (Default ``MAX_PARTITIONS``)
+
+    Returns
+    -----------------------
+    boxes : list of tuple
+        ``(bbox, share)``, west to east then south to north.
+    """
+    total = len(points)
+    if total == 0:
+        return [(bbox, 1.0)]
+    # Max heap on the number of points, the counter keeps the order stable.
+    # Once the largest box is small enough every box is.
+    heap = [(-total, 0, bbox, points)]
+    counter = 1
+    leaves = []
+    while heap and len(heap) + len(leaves) < max_partitions:
+        count, _, box, box_points = heapq.heappop(heap)
+        if -count / total <= max_share:
+            leaves.append((box, box_points))
+            break
+        left, bottom, right, top = box
+        axes = (0, 1) if (right - left) >= (top - bottom) else (1, 0)
+        for axis in axes:
+            cut = sorted(point[axis] for point in box_points)[len(box_points) // 2]
+            low = [point for point in box_points if point[axis] < cut]
+            if low:
+                break
+        else:
+            # Every point is at the same location, the box cannot be cut
+            leaves.append((box, box_points))
+            continue
+        high = [point for point in box_points if point[axis] >= cut]
+        if axis == 0:
+            halves = (((left, bottom, cut, top), low), ((cut, bottom, right, top), high))
+        else:
+            halves = (((left, bottom, right, cut), low), ((left, cut, right, top), high))
+        for half_box, half_points in halves:
+            heapq.heappush(heap, (-len(half_points), counter, half_box, half_points))
+            counter += 1
+    leaves.extend((box, box_points) for _, _, box, box_points in heap)
+    leaves.sort(key=lambda leaf: (leaf[0][1], leaf[0][0]))
+    return [(box, len(box_points) / total) for box, box_points in leaves]
+
+
+def _makespan(seconds: list, slots: int) -> float:
+    """Wall-clock time of running jobs longest first on ``slots`` parallel slots."""
+    finish = [0.0] * min(slots, max(1, len(seconds)))
+    for job_seconds in sorted(seconds, reverse=True):
+        heapq.heapreplace(finish, finish[0] + job_seconds)
+    return max(finish)
+
+
+def _partition_stats(stats, share: float, osm_pbf_gb: float):
+    """Scales element statistics of the whole input to one partition."""
+    if stats is None:
+        return None
+    return pbf.PbfStats(path=stats.path, file_size_bytes=int(osm_pbf_gb * 1024**3),
+                        blob_count=max(1, round(stats.blob_count * share)),
+                        node_count=round(stats.node_count * share),
+                        way_count=round(stats.way_count * share),
+                        relation_count=round(stats.relation_count * share),
+                        max_node_id=stats.max_node_id, header=stats.header)
+
+
+def _partitions(rec: tuner.Recommendation, boxes: list, concurrency: int,
+                schema_prefix: str) -> list:
+    """Builds the partition recommendations for one concurrency level."""
+    kwargs = {key: getattr(rec, key) for key in PARTITION_KWARGS}
+    if rec.cpu_count is not None:
+        kwargs['cpu_count'] = max(1, rec.cpu_count // concurrency)
+    if rec.postgres_ram_gb is not None:
+        kwargs['postgres_ram_gb'] = rec.postgres_ram_gb / concurrency
+    partitions = []
+    for number, (box, share) in enumerate(boxes, start=1):
+        osm_pbf_gb = rec.osm_pbf_gb * share * (1 + BOUNDARY_OVERLAP)
+        part_rec = tuner.Recommendation(rec.system_ram_gb / concurrency, osm_pbf_gb,
+                                        pbf_stats=_partition_stats(rec.pbf_stats, share,
+                                                                   osm_pbf_gb),
+                                        **kwargs)
+        name = f'part_{number:02d}'
+        partitions.append(Partition(name, box, share, part_rec, schema_prefix + name))
+    return partitions
+
+
+def plan(rec: tuner.Recommendation, pbf_path: str=None, points: list=None,
+         bbox: tuple=None, schema_prefix: str='osm_') -> PartitionPlan:
+    """Compares the single run with partitioned, concurrent imports.
+
+    Parameters
+    -----------------------
+    rec : osm2pgsql_tuner.tuner.Recommendation
+        Single run recommendation for the whole input.
+    pbf_path : str
+        (Default None) Input file, node locations are sampled from it.
+    points : list of tuple
+        (Default None) ``(lon, lat)`` node locations, density is assumed
+        uniform in ``bbox`` when neither ``points`` nor ``pbf_path`` is set.
+    bbox : tuple
+        (Default None) ``(left, bottom, right, top)`` of the input.  Read
+        from the PBF header when None, ``PLANET_BBOX`` when it has none.
+    schema_prefix : str
+        (Default ``osm_``) Prefix of the partition schemas.
+
+    Returns
+    -----------------------
+    plan : PartitionPlan
+    """
+    if rec.slim_no_drop:
+        raise ValueError('Partitions are imported once, --append updates need a single database.')
+    single_seconds = rec.get_runtime_estimate().total_seconds
+
+    def single_only(reason):
+        return PartitionPlan(rec, single_seconds, partitions=[], concurrency=1,
+                             extract_seconds=0.0, import_seconds=0.0,
+                             merge_seconds=0.0, reason=reason)
+
+    if rec.osm2pgsql_version is not None and not versions.supports_schema(rec.osm2pgsql_version):
+        return single_only('Partition schemas need osm2pgsql 1.9 or newer')
+    if rec.osm_pbf_gb < PARTITION_MIN_PBF_GB:
+        return single_only(f'PBF smaller than {PARTITION_MIN_PBF_GB:.0f} GB')
+
+    if bbox is None and rec.pbf_stats is not None:
+        bbox = rec.pbf_stats.header.get('bbox')
+    if pbf_path is not None:
+        if bbox is None:
+            bbox = pbf.scan(pbf_path, sample_blocks=1).header.get('bbox')
+        if points is None:
+            points = pbf.sample_node_locations(pbf_path)
+    bbox = tuple(bbox) if bbox is not None else PLANET_BBOX
+    if not points:
+        points = uniform_points(bbox)
+
+    kwargs = {key: getattr(rec, key) for key in PARTITION_KWARGS}
+    max_concurrency = rec.cpu_count or DEFAULT_MAX_CONCURRENCY
+    extract_seconds = rec.osm_pbf_gb * EXTRACT_SECONDS_PER_PBF_GB
+    way_count = runtime.element_counts(rec)[1]
+    merge_seconds = (way_count * rec.osm2pgsql_output_factor * (1 + BOUNDARY_OVERLAP)
+                     * MERGE_SECONDS_PER_WAY)
+
+    best = None
+    for concurrency in range(1, max_concurrency + 1):
+        ram_gb = rec.system_ram_gb / concurrency
+        if ram_gb < capacity.MIN_RAM_GB:
+            break
+        postgres_ram_gb = (rec.postgres_ram_gb / concurrency
+                           if rec.postgres_ram_gb is not None else None)
+        model = capacity.CapacityModel(postgres_ram_gb=postgres_ram_gb, **kwargs)
+        partition_gb = model.max_pbf_in_ram_gb(ram_gb)
+        max_share = partition_gb / (rec.osm_pbf_gb * (1 + BOUNDARY_OVERLAP))
+        if max_share * MAX_PARTITIONS < 1:
+            continue
+        partitions = _partitions(rec, split(points, bbox, max_share), concurrency,
+                                 schema_prefix)
+        import_seconds = _makespan([partition.seconds for partition in partitions],
+                                   concurrency)
+        if best is None or import_seconds < best.import_seconds:
+            best = PartitionPlan(rec, single_seconds, partitions, concurrency,
+                                 extract_seconds, import_seconds, merge_seconds)
+    if best is None:
+        return single_only('No partition of at most '
+                           f'{MAX_PARTITIONS} parts fits in RAM')
+    return best
+
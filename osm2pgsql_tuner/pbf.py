@@ -0,0 +1,653 @@
+"""Scans ``.osm.pbf`` files to estimate element counts without a full decode.
+
+The file is memory-mapped and only the small ``BlobHeader`` messages are read
+for every blob.  A handful of ``OSMData`` blocks are decoded to learn how many
+nodes, ways and relations a block holds.  For files sorted by type then ID
+(the norm for Geofabrik extracts and the planet) the node/way/relation
+boundaries are found with a binary search, so a planet file needs only a few
+dozen block decodes.
+
+Only the standard library is used.  The protobuf wire format is decoded by
+hand, just enough to read the messages defined in OSM's ``fileformat.proto``
+and ``osmformat.proto``.
+"""
+import concurrent.futures
+import lzma
+import mmap
+import os
+import struct
+import zlib
+
+
+SORTED_FEATURE = 'Sort.Type_then_ID'
+"""str : Optional feature set in the ``OSMHeader`` when a PBF is sorted."""
+
+DEFAULT_SAMPLE_BLOCKS = 16
+"""int : Minimum number of ``OSMData`` blocks decoded when scanning a file."""
+
+DEFAULT_LOCATION_BLOCKS = 64
+"""int : Node blocks decoded by :func:`sample_node_locations`."""
+
+DEFAULT_LOCATION_EVERY = 16
+"""int : :func:`sample_node_locations` keeps every n-th node of a decoded block."""
+
+NODE = 0
+WAY = 1
+RELATION = 2
+
+
+def _read_varint(buf, pos: int):
+    """Reads a base 128 varint from ``buf`` starting at ``pos``.
+
+    Returns
+    -----------------------
+    value_pos : tuple
+        Decoded value and the position after the varint.
+    """
+    result = 0
+    shift = 0
+    # Catching IndexError keeps the bounds check out of the per-byte loop
+    try:
+        while True:
+            byte = buf[pos]
+            pos += 1
+            result |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return result, pos
+            shift += 7
+    except IndexError:
+        raise ValueError(f'Truncated PBF: varint runs past the end at byte {pos}') from None
+
+
+def _zigzag(value: int) -> int:
+    """Decodes a protobuf ``sint64`` value."""
+    return (value >> 1) ^ -(value & 1)
+
+
+def _iter_fields(buf):
+    """Yields ``(field_number, value)`` for each field of a protobuf message.
+
+    Length delimited values are returned as slices of ``buf``, varints as int.
+    Fixed width values are returned as slices and are unused by this module.
+    """
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = _read_varint(buf, pos)
+        wire_type = key & 0x07
+        if wire_type == 0:
+            value, pos = _read_varint(buf, pos)
+        elif wire_type == 2:
+            length, pos = _read_varint(buf, pos)
+            if pos + length > end:
+                raise ValueError(f'Truncated PBF: field of {length} bytes at byte {pos} '
+                                 'runs past the end')
+            value = buf[pos:pos + length]
+            pos += length
+        elif wire_type in (1, 5):
+            length = 8 if wire_type == 1 else 4
+            if pos + length > end:
+                raise ValueError(f'Truncated PBF: fixed width field at byte {pos} '
+                                 'runs past the end')
+            value = buf[pos:pos + length]
+            pos += length
+        else:
+            raise ValueError(f'Unsupported protobuf wire type {wire_type}')
+        yield key >> 3, value
+
+
+class BlobInfo():
+    """Location of one blob within a PBF file.
+
+    Parameters
+    -----------------------
+    blob_type : str
+        Either ``OSMHeader`` or ``OSMData``.
+
+    offset : int
+        Byte offset of the ``Blob`` message within the file.
+
+    datasize : int
+        Size of the ``Blob`` message in bytes.
+    """
+    __slots__ = ('blob_type', 'offset', 'datasize')
+
+    def __init__(self, blob_type: str, offset: int, datasize: int):
+        self.blob_type = blob_type
+        self.offset = offset
+        self.datasize = datasize
+
+
+class BlockCounts():
+    """Element counts decoded from a single ``OSMData`` block."""
+    __slots__ = ('nodes', 'ways', 'relations', 'max_node_id')
+
+    def __init__(self, nodes: int=0, ways: int=0, relations: int=0,
+                 max_node_id: int=None):
+        self.nodes = nodes
+        self.ways = ways
+        self.relations = relations
+        self.max_node_id = max_node_id
+
+    @property
+    def kind(self) -> int:
+        """Lowest element type in the block: ``NODE``, ``WAY`` or ``RELATION``.
+
+        Empty blocks are treated as relations so they sort last.
+        """
+        if self.nodes:
+            return NODE
+        if self.ways:
+            return WAY
+        return RELATION
+
+
+class PbfStats():
+    """Element statistics for a PBF file, as returned by :func:`scan`.
+
+    Counts are estimates unless ``exact`` is True.
+
+    Parameters
+    -----------------------
+    path : str
+    file_size_bytes : int
+    blob_count : int
+        Number of ``OSMData`` blobs in the file.
+    node_count : int
+    way_count : int
+    relation_count : int
+    max_node_id : int or None
+        Largest node ID.  Exact for sorted files, a lower bound otherwise.
+    exact : bool
+        True when every data block was decoded.
+    header : dict
+        Details from the ``OSMHeader`` block, see :func:`decode_header`.
+    """
+    def __init__(self, path: str, file_size_bytes: int, blob_count: int,
+                 node_count: int, way_count: int, relation_count: int,
+                 max_node_id: int=None, exact: bool=False, header: dict=None):
+        self.path = path
+        self.file_size_bytes = file_size_bytes
+        self.blob_count = blob_count
+        self.node_count = node_count
+        self.way_count = way_count
+        self.relation_count = relation_count
+        self.max_node_id = max_node_id
+        self.exact = exact
+        self.header = header or {}
+
+    @property
+    def osm_pbf_gb(self) -> float:
+        """Size of the PBF file in GB."""
+        return self.file_size_bytes / 1024**3
+
+    @property
+    def sorted(self) -> bool:
+        """True when the header declares the file sorted by type then ID."""
+        return SORTED_FEATURE in self.header.get('optional_features', [])
+
+    def to_dict(self) -> dict:
+        """Returns the statistics as a JSON serializable dictionary.
+
+        Returns
+        ----------------------
+        stats : dict
+        """
+        return {'path': self.path,
+                'file_size_bytes': self.file_size_bytes,
+                'blob_count': self.blob_count,
+                'node_count': self.node_count,
+                'way_count': self.way_count,
+                'relation_count': self.relation_count,
+                'max_node_id': self.max_node_id,
+                'exact': self.exact,
+                'header': self.header}
+
+
+def read_blob_index(buf) -> list:
+    """Walks every ``BlobHeader`` in ``buf`` without reading blob contents.
+
+    Parameters
+    -----------------------
+    buf : buffer
+        The PBF file contents, typically a ``mmap.mmap``.
+
+    Returns
+    -----------------------
+    blobs : list of BlobInfo
+    """
+    blobs = []
+    pos = 0
+    end = len(buf)
+    unpack_from = struct.Struct('>I').unpack_from
+    while pos < end:
+        if pos + 4 > end:
+            raise ValueError(f'Truncated PBF: partial blob header at byte {pos}')
+        header_len = unpack_from(buf, pos)[0]
+        pos += 4
+        if pos + header_len > end:
+            raise ValueError(f'Truncated PBF: blob header at byte {pos} extends past end of file')
+        header = buf[pos:pos + header_len]
+        pos += header_len
+        blob_type = None
+        datasize = None
+        for field, value in _iter_fields(header):
+            if field == 1 and not isinstance(value, int):
+                blob_type = bytes(value).decode('utf-8', errors='replace')
+            elif field == 3:
+                datasize = value
+        if not isinstance(blob_type, str) or not isinstance(datasize, int):
+            raise ValueError(f'Invalid BlobHeader at byte {pos - header_len}')
+        if pos + datasize > end:
+            raise ValueError(f'Truncated PBF: blob at byte {pos} extends past end of file')
+        blobs.append(BlobInfo(blob_type, pos, datasize))
+        pos += datasize
+    return blobs
+
+
+def read_blob_data(blob) -> bytes:
+    """Returns the uncompressed payload of a ``Blob`` message.
+
+    Parameters
+    -----------------------
+    blob : bytes
+        Serialized ``Blob`` message.
+
+    Returns
+    -----------------------
+    data : bytes
+    """
+    for field, value in _iter_fields(blob):
+        if field in (1, 3, 4) and isinstance(value, int):
+            raise ValueError(f'Invalid Blob: field {field} is not length delimited')
+        if field == 1:
+            return bytes(value)
+        try:
+            if field == 3:
+                return zlib.decompress(value)
+            if field == 4:
+                return lzma.decompress(value)
+        except (zlib.error, lzma.LZMAError) as err:
+            raise ValueError(f'Corrupt PBF blob: {err}') from None
+        if field in (5, 6, 7):
+            raise ValueError('Blob compression (bzip2/lz4/zstd) is not supported')
+    raise ValueError('Blob contains no data')
+
+
+def decode_header(data: bytes) -> dict:
+    """Decodes a ``HeaderBlock`` message.
+
+    Parameters
+    -----------------------
+    data : bytes
+        Uncompressed payload of the ``OSMHeader`` blob.
+
+    Returns
+    -----------------------
+    header : dict
+        Keys ``bbox`` (left, bottom, right, top in degrees, or None),
+        ``required_features``, ``optional_features``, ``writing_program``,
+        ``source``, ``replication_timestamp``, ``replication_sequence``
+        and ``replication_base_url``.
+    """
+    header = {'bbox': None,
+              'required_features': [],
+              'optional_features': [],
+              'writing_program': None,
+              'source': None,
+              'replication_timestamp': None,
+              'replication_sequence': None,
+              'replication_base_url': None}
+    for field, value in _iter_fields(data):
+        if field == 1:
+            bbox = {}
+            for bbox_field, bbox_value in _iter_fields(value):
+                bbox[bbox_field] = _zigzag(bbox_value) / 1e9
+            # HeaderBBox fields: left=1, right=2, top=3, bottom=4
+            header['bbox'] = (bbox.get(1), bbox.get(4), bbox.get(2), bbox.get(3))
+        elif field == 4:
+            header['required_features'].append(bytes(value).decode('utf-8'))
+        elif field == 5:
+            header['optional_features'].append(bytes(value).decode('utf-8'))
+        elif field == 16:
+            header['writing_program'] = bytes(value).decode('utf-8')
+        elif field == 17:
+            header['source'] = bytes(value).decode('utf-8')
+        elif field == 32:
+            header['replication_timestamp'] = value
+        elif field == 33:
+            header['replication_sequence'] = value
+        elif field == 34:
+            header['replication_base_url'] = bytes(value).decode('utf-8')
+    return header
+
+
+def decode_block_counts(data: bytes) -> BlockCounts:
+    """Counts the elements in a ``PrimitiveBlock`` message.
+
+    Parameters
+    -----------------------
+    data : bytes
+        Uncompressed payload of an ``OSMData`` blob.
+
+    Returns
+    -----------------------
+    counts : BlockCounts
+    """
+    counts = BlockCounts()
+    view = memoryview(data)
+    for field, group in _iter_fields(view):
+        if field != 2:
+            continue
+        for group_field, value in _iter_fields(group):
+            if group_field == 1:
+                counts.nodes += 1
+                for node_field, node_value in _iter_fields(value):
+                    if node_field == 1:
+                        node_id = _zigzag(node_value)
+                        if counts.max_node_id is None or node_id > counts.max_node_id:
+                            counts.max_node_id = node_id
+                        break
+            elif group_field == 2:
+                _count_dense_nodes(value, counts)
+            elif group_field == 3:
+                counts.ways += 1
+            elif group_field == 4:
+                counts.relations += 1
+    return counts
+
+
+def _count_dense_nodes(dense, counts: BlockCounts):
+    """Adds the nodes of a ``DenseNodes`` message to ``counts``."""
+    for field, ids in _iter_fields(dense):
+        if field != 1:
+            continue
+        pos = 0
+        end = len(ids)
+        node_id = 0
+        max_id = counts.max_node_id
+        while pos < end:
+            delta, pos = _read_varint(ids, pos)
+            node_id += (delta >> 1) ^ -(delta & 1)
+            counts.nodes += 1
+            if max_id is None or node_id > max_id:
+                max_id = node_id
+        counts.max_node_id = max_id
+
+
+def _int64(value: int) -> int:
+    """Decodes a protobuf ``int64`` value, negative values use 10 byte varints."""
+    return value - 2**64 if value >= 2**63 else value
+
+
+def _packed_sint64(buf):
+    """Yields the values of a packed ``sint64`` field."""
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        value, pos = _read_varint(buf, pos)
+        yield (value >> 1) ^ -(value & 1)
+
+
+def decode_block_locations(data: bytes, every: int=1) -> list:
+    """Decodes node locations from a ``PrimitiveBlock`` message.
+
+    Parameters
+    -----------------------
+    data : bytes
+        Uncompressed payload of an ``OSMData`` blob.
+    every : int
+        (Default 1) Keep every n-th node of the block.
+
+    Returns
+    -----------------------
+    locations : list of tuple
+        ``(lon, lat)`` in degrees.
+    """
+    granularity = 100
+    lat_offset = 0
+    lon_offset = 0
+    raw = []
+    view = memoryview(data)
+    for field, value in _iter_fields(view):
+        if field == 2:
+            for group_field, group_value in _iter_fields(value):
+                if group_field == 1:
+                    node = dict(_iter_fields(group_value))
+                    raw.append((_zigzag(node.get(9, 0)), _zigzag(node.get(8, 0))))
+                elif group_field == 2:
+                    dense = dict(_iter_fields(group_value))
+                    lon = lat = 0
+                    for lon_delta, lat_delta in zip(_packed_sint64(dense.get(9, b'')),
+                                                    _packed_sint64(dense.get(8, b''))):
+                        lon += lon_delta
+                        lat += lat_delta
+                        raw.append((lon, lat))
+        elif field == 17:
+            granularity = value
+        elif field == 19:
+            lat_offset = _int64(value)
+        elif field == 20:
+            lon_offset = _int64(value)
+    # Granularity and offsets follow the groups, applied once all are read
+    return [((lon_offset + granularity * lon) / 1e9, (lat_offset + granularity * lat) / 1e9)
+            for lon, lat in raw[::max(1, every)]]
+
+
+def sample_node_locations(path: str, sample_blocks: int=DEFAULT_LOCATION_BLOCKS,
+                          every: int=DEFAULT_LOCATION_EVERY) -> list:
+    """Samples node locations from evenly spaced blocks of a PBF file.
+
+    For sorted files only the node section is sampled, found with the same
+    binary search as :func:`scan`.
+
+    Parameters
+    -----------------------
+    path : str
+    sample_blocks : int
+        (Default ``DEFAULT_LOCATION_BLOCKS``) Node blocks to decode.
+    every : int
+        (Default ``DEFAULT_LOCATION_EVERY``) Keep every n-th node of a block.
+
+    Returns
+    -----------------------
+    locations : list of tuple
+        ``(lon, lat)`` in degrees.
+    """
+    path = os.fspath(path)
+    with open(path, 'rb') as pbf_file, \
+            mmap.mmap(pbf_file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        blobs = read_blob_index(buf)
+        header_blobs = [blob for blob in blobs if blob.blob_type == 'OSMHeader']
+        data_blobs = [blob for blob in blobs if blob.blob_type == 'OSMData']
+        stop = len(data_blobs)
+        if header_blobs:
+            first = header_blobs[0]
+            header = decode_header(read_blob_data(buf[first.offset:first.offset + first.datasize]))
+            if SORTED_FEATURE in header['optional_features']:
+                stop = _BlockSampler(path, buf, data_blobs).first_index_of_kind(WAY)
+        locations = []
+        for index in _evenly_spaced(0, stop, sample_blocks):
+            blob = data_blobs[index]
+            data = read_blob_data(buf[blob.offset:blob.offset + blob.datasize])
+            locations.extend(decode_block_locations(data, every))
+    return locations
+
+
+def _decode_blob_counts(path: str, offset: int, datasize: int) -> BlockCounts:
+    """Reads and counts one blob.  Module level so it can run in a process pool."""
+    with open(path, 'rb') as pbf_file:
+        pbf_file.seek(offset)
+        blob = pbf_file.read(datasize)
+    return decode_block_counts(read_blob_data(blob))
+
+
+class _BlockSampler():
+    """Decodes ``OSMData`` blocks on demand and remembers the results."""
+    def __init__(self, path: str, buf, blobs: list):
+        self.path = path
+        self.buf = buf
+        self.blobs = blobs
+        self.decoded = {}
+
+    def __len__(self) -> int:
+        return len(self.blobs)
+
+    def get(self, index: int) -> BlockCounts:
+        """Returns the counts for the block at ``index``, decoding if needed."""
+        if index not in self.decoded:
+            blob = self.blobs[index]
+            data = read_blob_data(self.buf[blob.offset:blob.offset + blob.datasize])
+            self.decoded[index] = decode_block_counts(data)
+        return self.decoded[index]
+
+    def prefetch(self, indexes, workers: int=None):
+        """Decodes several blocks, using a process pool when ``workers`` > 1."""
+        todo = [i for i in sorted(set(indexes)) if i not in self.decoded]
+        if workers is None or workers <= 1 or len(todo) <= 1:
+            for index in todo:
+                self.get(index)
+            return
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(_decode_blob_counts,
+                               [self.path] * len(todo),
+                               [self.blobs[i].offset for i in todo],
+                               [self.blobs[i].datasize for i in todo],
+                               chunksize=max(1, len(todo) // (workers * 4)))
+            for index, counts in zip(todo, results):
+                self.decoded[index] = counts
+
+    def first_index_of_kind(self, kind: int, low: int=0) -> int:
+        """Binary search for the first block whose kind is >= ``kind``.
+
+        Only valid for files sorted by type then ID.
+        """
+        high = len(self.blobs)
+        while low < high:
+            mid = (low + high) // 2
+            if self.get(mid).kind < kind:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+
+def _evenly_spaced(start: int, stop: int, count: int) -> list:
+    """Returns up to ``count`` indexes spread evenly across ``range(start, stop)``."""
+    size = stop - start
+    if size <= 0 or count <= 0:
+        return []
+    if count >= size:
+        return list(range(start, stop))
+    step = size / count
+    return [start + int(i * step) for i in range(count)]
+
+
+def _estimate_section(sampler: _BlockSampler, start: int, stop: int,
+                      attr: str) -> int:
+    """Estimates total elements of one type across blocks ``start:stop``.
+
+    Every block in the section but the last is assumed to be full, and is
+    estimated from the mean of the decoded blocks.  The last block is always
+    decoded because writers leave it partially filled.
+    """
+    if stop <= start:
+        return 0
+    last = getattr(sampler.get(stop - 1), attr)
+    full_blocks = stop - start - 1
+    if full_blocks == 0:
+        return last
+    sampled = [getattr(counts, attr) for index, counts in sampler.decoded.items()
+               if start <= index < stop - 1]
+    if not sampled:
+        sampled = [getattr(sampler.get(start), attr)]
+    return round(full_blocks * sum(sampled) / len(sampled)) + last
+
+
+def _estimate_unsorted(sampler: _BlockSampler) -> tuple:
+    """Extrapolates counts from the decoded blocks of an unsorted file."""
+    decoded = list(sampler.decoded.values())
+    scale = len(sampler) / len(decoded)
+    nodes = round(scale * sum(counts.nodes for counts in decoded))
+    ways = round(scale * sum(counts.ways for counts in decoded))
+    relations = round(scale * sum(counts.relations for counts in decoded))
+    return nodes, ways, relations
+
+
+def scan(path: str, sample_blocks: int=DEFAULT_SAMPLE_BLOCKS,
+         workers: int=None) -> PbfStats:
+    """Estimates node, way and relation counts of a PBF file.
+
+    Parameters
+    -----------------------
+    path : str
+        Path to the ``.osm.pbf`` file.
+
+    sample_blocks : int
+        (Default ``DEFAULT_SAMPLE_BLOCKS``) Number of evenly spaced data
+        blocks to decode in addition to those needed to find the type
+        boundaries.  Larger values improve precision; a value at least the
+        number of blocks in the file gives exact counts.
+
+    workers : int or None
+        (Default None) When > 1, decode the sample in a process pool of this size.
+
+    Returns
+    -----------------------
+    stats : PbfStats
+    """
+    path = os.fspath(path)
+    file_size = os.path.getsize(path)
+    if file_size == 0:
+        raise ValueError(f'PBF file is empty: {path}')
+
+    with open(path, 'rb') as pbf_file, \
+            mmap.mmap(pbf_file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        blobs = read_blob_index(buf)
+        header_blobs = [blob for blob in blobs if blob.blob_type == 'OSMHeader']
+        if not header_blobs:
+            raise ValueError(f'PBF file has no OSMHeader block: {path}')
+        first = header_blobs[0]
+        header = decode_header(read_blob_data(buf[first.offset:first.offset + first.datasize]))
+
+        data_blobs = [blob for blob in blobs if blob.blob_type == 'OSMData']
+        sampler = _BlockSampler(path, buf, data_blobs)
+        stats = PbfStats(path=path, file_size_bytes=file_size,
+                         blob_count=len(data_blobs), node_count=0, way_count=0,
+                         relation_count=0, header=header)
+        if not data_blobs:
+            stats.exact = True
+            return stats
+
+        sampler.prefetch(_evenly_spaced(0, len(sampler), sample_blocks),
+                         workers=workers)
+        stats.exact = len(sampler.decoded) == len(sampler)
+
+        if stats.exact:
+            decoded = sampler.decoded.values()
+            stats.node_count = sum(counts.nodes for counts in decoded)
+            stats.way_count = sum(counts.ways for counts in decoded)
+            stats.relation_count = sum(counts.relations for counts in decoded)
+        elif stats.sorted:
+            first_way = sampler.first_index_of_kind(WAY)
+            first_relation = sampler.first_index_of_kind(RELATION, low=first_way)
+            stats.node_count = _estimate_section(sampler, 0, first_way, 'nodes')
+            stats.way_count = _estimate_section(sampler, first_way,
+                                                first_relation, 'ways')
+            stats.relation_count = _estimate_section(sampler, first_relation,
+                                                     len(sampler), 'relations')
+        else:
+            counts = _estimate_unsorted(sampler)
+            stats.node_count, stats.way_count, stats.relation_count = counts
+
+        # The last node block holds the highest node ID in sorted files,
+        # otherwise this is the highest ID seen in the decoded sample.
+        max_ids = [counts.max_node_id for counts in sampler.decoded.values()
+                   if counts.max_node_id is not None]
+        stats.max_node_id = max(max_ids) if max_ids else None
+        if stats.sorted and not stats.exact:
+            first_way = sampler.first_index_of_kind(WAY)
+            if first_way > 0:
+                stats.max_node_id = sampler.get(first_way - 1).max_node_id
+
+    return stats
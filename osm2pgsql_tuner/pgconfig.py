@@ -0,0 +1,241 @@
+"""Generates PostgreSQL configuration for the osm2pgsql load window.
+
+Settings follow the osm2pgsql manual's tuning advice for imports:
+https://osm2pgsql.org/doc/manual.html#tuning-the-postgresql-server
+
+The RAM reserved for PostgreSQL is exposed as ``postgres_ram_gb`` so it can be
+passed to :class:`osm2pgsql_tuner.tuner.Recommendation`, which subtracts it
+before sizing the osm2pgsql cache.
+"""
+
+RESTART_REQUIRED = ('shared_buffers', 'wal_level', 'max_wal_senders')
+"""tuple : Settings that only take effect after a PostgreSQL restart."""
+
+PREVIOUS_SETTINGS_SQL = """SELECT name, setting
+    FROM pg_file_settings
+    WHERE sourcefile LIKE '%postgresql.auto.conf' AND error IS NULL;"""
+"""str : Query for the ``ALTER SYSTEM`` values in place before the load.
+
+Pass the rows as ``previous_settings``, e.g. ``dict(cursor.fetchall())``.
+"""
+
+
+def format_mb(value_mb: int) -> str:
+    """Formats MB as a PostgreSQL memory setting, using GB when even.
+
+    Parameters
+    -----------------------
+    value_mb : int
+
+    Returns
+    -----------------------
+    setting : str
+        e.g. ``512MB`` or ``2GB``.
+    """
+    if value_mb >= 1024 and value_mb % 1024 == 0:
+        return f'{value_mb // 1024}GB'
+    return f'{value_mb}MB'
+
+
+def _quote(value: str) -> str:
+    """Quotes a setting value for ``ALTER SYSTEM`` and ``postgresql.conf``."""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def parse_auto_conf(text: str) -> dict:
+    """Parses ``postgresql.auto.conf``, the file ``ALTER SYSTEM`` writes.
+
+    Parameters
+    -----------------------
+    text : str
+        File contents.
+
+    Returns
+    -----------------------
+    settings : dict
+        Setting name to value.
+    """
+    settings = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#') or '=' not in line:
+            continue
+        name, _, value = line.partition('=')
+        value = value.strip()
+        if value.startswith("'"):
+            end = value.rfind("'")
+            value = value[1:end].replace("''", "'").replace("\\'", "'")
+        else:
+            value = value.split('#', 1)[0].strip()
+        settings[name.strip().lower()] = value
+    return settings
+
+
+class PostgresLoadConfig():
+    """Recommends PostgreSQL settings for the duration of an osm2pgsql load.
+
+    Parameters
+    -----------------------
+    system_ram_gb : float
+        How much total RAM the server has, in GB.
+
+    osm_pbf_gb : float
+        Size of the ``.osm.pbf`` file in GB.
+
+    cpu_count : int
+        (Default None) Number of CPUs.  Used for ``max_parallel_maintenance_workers``.
+
+    wal_minimal : bool
+        (Default True) Use ``wal_level = minimal``.  Set False when the
+        server is a replication primary or uses WAL archiving.
+
+    previous_settings : dict
+        (Default None) ``ALTER SYSTEM`` values in place before the load,
+        from :func:`parse_auto_conf` or ``PREVIOUS_SETTINGS_SQL``.  The revert
+        script restores them instead of resetting to ``postgresql.conf``.
+    """
+    def __init__(self, system_ram_gb: float, osm_pbf_gb: float,
+                 cpu_count: int=None, wal_minimal: bool=True,
+                 previous_settings: dict=None):
+        self.system_ram_gb = system_ram_gb
+        self.osm_pbf_gb = osm_pbf_gb
+        self.cpu_count = cpu_count
+        self.wal_minimal = wal_minimal
+        self.previous_settings = {name.lower(): value for name, value
+                                  in (previous_settings or {}).items()}
+
+        self.shared_buffers_mb = self.get_shared_buffers_mb()
+        self.maintenance_work_mem_mb = self.get_maintenance_work_mem_mb()
+        self.max_wal_size_mb = self.get_max_wal_size_mb()
+        self.max_parallel_maintenance_workers = self.get_max_parallel_maintenance_workers()
+
+        self.postgres_ram_gb = (self.shared_buffers_mb
+                                + self.maintenance_work_mem_mb) / 1024
+
+    def get_shared_buffers_mb(self) -> int:
+        """Returns ``shared_buffers`` in MB.
+
+        osm2pgsql writes with ``COPY`` and reads little during the load, so a
+        large buffer pool mostly competes with the osm2pgsql cache.
+        Uses 10% of RAM, between 128 MB and 4 GB.
+
+        Returns
+        ----------------------
+        shared_buffers_mb : int
+        """
+        return int(min(max(self.system_ram_gb * 1024 * 0.10, 128), 4096))
+
+    def get_maintenance_work_mem_mb(self) -> int:
+        """Returns ``maintenance_work_mem`` in MB.
+
+        Used by the index builds at the end of the load.
+        Uses 10% of RAM, between 256 MB and 10 GB.
+
+        Returns
+        ----------------------
+        maintenance_work_mem_mb : int
+        """
+        return int(min(max(self.system_ram_gb * 1024 * 0.10, 256), 10240))
+
+    def get_max_wal_size_mb(self) -> int:
+        """Returns ``max_wal_size`` in MB.
+
+        Larger values reduce checkpoints during the load.  Scales with the
+        PBF size, between 1 GB and 50 GB.
+
+        Returns
+        ----------------------
+        max_wal_size_mb : int
+        """
+        return int(min(max(self.osm_pbf_gb * 2, 1), 50) * 1024)
+
+    def get_max_parallel_maintenance_workers(self) -> int:
+        """Returns ``max_parallel_maintenance_workers``.
+
+        Half the CPUs, up to 8.  Uses the PostgreSQL default of 2 when
+        ``cpu_count`` is unknown.
+
+        Returns
+        ----------------------
+        workers : int
+        """
+        if self.cpu_count is None:
+            return 2
+        return max(1, min(self.cpu_count // 2, 8))
+
+    def get_settings(self) -> dict:
+        """Returns the load window settings.
+
+        Returns
+        ----------------------
+        settings : dict
+            Setting name to value, in ``postgresql.conf`` format.
+        """
+        settings = {'shared_buffers': format_mb(self.shared_buffers_mb),
+                    'maintenance_work_mem': format_mb(self.maintenance_work_mem_mb),
+                    'max_wal_size': format_mb(self.max_wal_size_mb),
+                    'checkpoint_timeout': '60min',
+                    'synchronous_commit': 'off',
+                    'autovacuum': 'off',
+                    'max_parallel_maintenance_workers': str(self.max_parallel_maintenance_workers)}
+        if self.wal_minimal:
+            # wal_level = minimal refuses to start unless max_wal_senders = 0
+            settings['wal_level'] = 'minimal'
+            settings['max_wal_senders'] = '0'
+        return settings
+
+    def get_postgresql_conf(self) -> str:
+        """Returns a ``postgresql.conf`` snippet for the load window.
+
+        Returns
+        ----------------------
+        conf : str
+        """
+        lines = ['# osm2pgsql load window settings, revert after the import']
+        for name, value in self.get_settings().items():
+            lines.append(f'{name} = {_quote(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def get_alter_system_sql(self) -> str:
+        """Returns an ``ALTER SYSTEM`` script applying the load window settings.
+
+        Returns
+        ----------------------
+        sql : str
+        """
+        settings = self.get_settings()
+        lines = [f'ALTER SYSTEM SET {name} = {_quote(value)};'
+                 for name, value in settings.items()]
+        lines.append('SELECT pg_reload_conf();')
+        lines.append(self._restart_comment(settings))
+        return '\n'.join(lines) + '\n'
+
+    def get_revert_sql(self) -> str:
+        """Returns the ``ALTER SYSTEM`` script to run after the load.
+
+        Settings found in ``previous_settings`` are set back to their
+        previous value, the others are reset.
+
+        Returns
+        ----------------------
+        sql : str
+        """
+        settings = self.get_settings()
+        lines = []
+        for name in settings:
+            if name in self.previous_settings:
+                previous = _quote(self.previous_settings[name])
+                lines.append(f'ALTER SYSTEM SET {name} = {previous};')
+            else:
+                lines.append(f'ALTER SYSTEM RESET {name};')
+        lines.append('SELECT pg_reload_conf();')
+        lines.append(self._restart_comment(settings))
+        lines.append('-- Autovacuum was off during the load, refresh statistics')
+        lines.append('ANALYZE;')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _restart_comment(settings: dict) -> str:
+        """Returns a SQL comment listing settings that need a restart."""
+        restart = ', '.join(name for name in RESTART_REQUIRED if name in settings)
+        return f'-- Restart PostgreSQL for these to take effect: {restart}'
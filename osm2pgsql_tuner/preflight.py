@@ -0,0 +1,318 @@
+"""Disk space preflight checks and ``--flat-nodes`` placement.
+
+The flat nodes file is sized from the highest node ID, not the number of nodes
+in the extract, because osm2pgsql stores one location per possible ID.  Even
+small extracts therefore need a planet sized file once ``--flat-nodes`` is on.
+
+Candidate directories are checked with ``os.statvfs`` for free space and with
+:mod:`osm2pgsql_tuner.host` for the rotational flag and filesystem type.
+RAM backed filesystems such as ``tmpfs`` are rejected because the flat nodes
+file would compete with osm2pgsql for RAM.
+"""
+import os
+
+from osm2pgsql_tuner import host
+
+
+FLAT_NODES_BYTES_PER_ID = 8
+"""int : Bytes used in the flat nodes file for each possible node ID."""
+
+PLANET_MAX_NODE_ID = 12_500_000_000
+"""int : Highest node ID to plan for when the PBF has not been scanned."""
+
+FLAT_NODES_FILENAME = 'nodes'
+"""str : File name used for the flat nodes file within the chosen directory."""
+
+SLIM_MIDDLE_GB_PER_PBF_GB = 6.0
+"""float : Disk used by the slim middle tables per GB of PBF, incl. indexes."""
+
+SLIM_MIDDLE_NODES_SHARE = 0.5
+"""float : Share of the slim middle tables used by the nodes table.
+
+Not created when using ``--flat-nodes``.
+"""
+
+OUTPUT_GB_PER_PBF_GB = 2.5
+"""float : Disk used by the output tables per GB of PBF for the PgOSM Flex ``run`` layer set."""
+
+DISK_HEADROOM = 1.1
+"""float : Safety factor applied to estimated disk usage."""
+
+RAM_FILESYSTEMS = ('tmpfs', 'ramfs')
+"""tuple : Filesystems that store files in RAM."""
+
+
+class CandidateDir():
+    """Details of a directory considered for the flat nodes file.
+
+    Parameters
+    -----------------------
+    path : str
+    free_bytes : int or None
+    rotational : bool or None
+    fs_type : str or None
+    """
+    def __init__(self, path: str, free_bytes: int, rotational: bool,
+                 fs_type: str):
+        self.path = path
+        self.free_bytes = free_bytes
+        self.rotational = rotational
+        self.fs_type = fs_type
+        self.reason = None
+
+    @property
+    def in_ram(self) -> bool:
+        """True when the directory is on a RAM backed filesystem."""
+        return self.fs_type in RAM_FILESYSTEMS
+
+    def speed_rank(self) -> int:
+        """Lower is faster: SSD, unknown, then spinning disk."""
+        if self.rotational is False:
+            return 0
+        if self.rotational is None:
+            return 1
+        return 2
+
+    def to_dict(self) -> dict:
+        """Returns the candidate details as a dictionary.
+
+        Returns
+        ----------------------
+        candidate : dict
+        """
+        return dict(vars(self))
+
+
+def inspect_dir(path: str, root: str='/') -> CandidateDir:
+    """Collects free space, rotational flag and filesystem type for ``path``.
+
+    Parameters
+    -----------------------
+    path : str
+        Directory, need not exist yet.  The nearest existing parent is used.
+    root : str
+        (Default ``/``) Filesystem root to read ``/proc`` and ``/sys`` from.
+
+    Returns
+    -----------------------
+    candidate : CandidateDir
+    """
+    existing = host.existing_parent(path)
+    free_bytes = None
+    if existing is not None:
+        stat = os.statvfs(existing)
+        free_bytes = stat.f_bavail * stat.f_frsize
+    return CandidateDir(path=path, free_bytes=free_bytes,
+                        rotational=host.is_rotational(path, root=root),
+                        fs_type=host.filesystem_type(path, root=root))
+
+
+def flat_nodes_bytes(max_node_id: int=None) -> int:
+    """Returns the size of the flat nodes file in bytes.
+
+    Parameters
+    -----------------------
+    max_node_id : int
+        (Default None) Highest node ID, ``PLANET_MAX_NODE_ID`` when None.
+
+    Returns
+    -----------------------
+    size_bytes : int
+    """
+    if max_node_id is None:
+        max_node_id = PLANET_MAX_NODE_ID
+    return (max_node_id + 1) * FLAT_NODES_BYTES_PER_ID
+
+
+def known_max_node_id(pbf_stats) -> int:
+    """Returns the highest node ID of a scan when it is reliable.
+
+    Sampled scans of unsorted files only see a lower bound of the highest
+    node ID, sizing flat nodes from it would underestimate the file.
+
+    Parameters
+    -----------------------
+    pbf_stats : osm2pgsql_tuner.pbf.PbfStats or None
+
+    Returns
+    -----------------------
+    max_node_id : int or None
+        None when the scan is missing or not reliable.
+    """
+    if pbf_stats is None or not (pbf_stats.sorted or pbf_stats.exact):
+        return None
+    return pbf_stats.max_node_id
+
+
+def middle_bytes(osm_pbf_gb: float, flat_nodes: bool,
+                 middle_gb_factor: float=1.0) -> int:
+    """Estimates disk used by the slim middle tables in bytes.
+
+    Parameters
+    -----------------------
+    osm_pbf_gb : float
+    flat_nodes : bool
+        When True the nodes table is not created.
+    middle_gb_factor : float
+        (Default 1.0) Middle format size relative to osm2pgsql v1.5, see
+        :class:`osm2pgsql_tuner.versions.VersionProfile`.
+
+    Returns
+    -----------------------
+    size_bytes : int
+    """
+    size_gb = osm_pbf_gb * SLIM_MIDDLE_GB_PER_PBF_GB * middle_gb_factor
+    if flat_nodes:
+        size_gb *= 1 - SLIM_MIDDLE_NODES_SHARE
+    return int(size_gb * 1024**3)
+
+
+def output_bytes(osm_pbf_gb: float, output_factor: float=1.0) -> int:
+    """Estimates disk used by the output tables in bytes.
+
+    Parameters
+    -----------------------
+    osm_pbf_gb : float
+    output_factor : float
+        (Default 1.0) Output size relative to the PgOSM Flex ``run`` layer
+        set, see :attr:`osm2pgsql_tuner.layerset.StyleAnalysis.output_factor`.
+
+    Returns
+    -----------------------
+    size_bytes : int
+    """
+    return int(osm_pbf_gb * OUTPUT_GB_PER_PBF_GB * output_factor * 1024**3)
+
+
+def _gb(size_bytes: int) -> str:
+    """Formats bytes as GB for messages."""
+    return f'{size_bytes / 1024**3:.1f} GB'
+
+
+class PreflightResult():
+    """Outcome of :func:`check`.
+
+    Parameters
+    -----------------------
+    flat_nodes_path : str or None
+        Chosen flat nodes file, None when not needed or nothing fits.
+    flat_nodes_bytes : int
+        Size of the flat nodes file, 0 when not using ``--flat-nodes``.
+    middle_bytes : int
+        Estimated size of the slim middle tables, 0 when running in RAM.
+    output_bytes : int
+        Estimated size of the output tables.
+    candidates : list of CandidateDir
+    """
+    def __init__(self, flat_nodes_path: str, flat_nodes_bytes: int,
+                 middle_bytes: int, output_bytes: int, candidates: list):
+        self.flat_nodes_path = flat_nodes_path
+        self.flat_nodes_bytes = flat_nodes_bytes
+        self.middle_bytes = middle_bytes
+        self.output_bytes = output_bytes
+        self.candidates = candidates
+        self.problems = []
+
+    @property
+    def fits(self) -> bool:
+        """True when the plan fits the available disk space."""
+        return not self.problems
+
+    @property
+    def total_bytes(self) -> int:
+        """Total estimated disk used by the import."""
+        return self.flat_nodes_bytes + self.middle_bytes + self.output_bytes
+
+    def to_dict(self) -> dict:
+        """Returns the result as a JSON serializable dictionary.
+
+        Returns
+        ----------------------
+        result : dict
+        """
+        return {'flat_nodes_path': self.flat_nodes_path,
+                'flat_nodes_bytes': self.flat_nodes_bytes,
+                'middle_bytes': self.middle_bytes,
+                'output_bytes': self.output_bytes,
+                'total_bytes': self.total_bytes,
+                'fits': self.fits,
+                'problems': list(self.problems),
+                'candidates': [candidate.to_dict() for candidate in self.candidates]}
+
+
+def _same_filesystem(path_a: str, path_b: str) -> bool:
+    """True when both paths (or their nearest parents) share a device."""
+    parent_a = host.existing_parent(path_a)
+    parent_b = host.existing_parent(path_b)
+    if parent_a is None or parent_b is None:
+        return False
+    return os.stat(parent_a).st_dev == os.stat(parent_b).st_dev
+
+
+def check(rec, candidate_dirs, database_dir: str=None,
+          root: str='/') -> PreflightResult:
+    """Sizes the import's disk usage and picks a flat nodes location.
+
+    The fastest candidate with room for the flat nodes file wins: SSD first,
+    then unknown storage, then spinning disks, ties broken by free space.
+
+    Parameters
+    -----------------------
+    rec : osm2pgsql_tuner.tuner.Recommendation
+    candidate_dirs : list of str
+        Directories to consider for the flat nodes file.
+    database_dir : str
+        (Default None) PostgreSQL data directory (or tablespace) to check
+        for room for the middle and output tables.
+    root : str
+        (Default ``/``) Filesystem root to read ``/proc`` and ``/sys`` from.
+
+    Returns
+    -----------------------
+    result : PreflightResult
+    """
+    use_flat_nodes = rec.osm2pgsql_flat_nodes
+    nodes_bytes = flat_nodes_bytes(known_max_node_id(rec.pbf_stats)) if use_flat_nodes else 0
+    # Middle tables hold what osm2pgsql reads, after any tags-filter pre-pass
+    input_gb = rec.osm_pbf_gb * rec.osm2pgsql_input_share
+    middle_gb_factor = 1.0
+    if rec.version_profile is not None:
+        middle_gb_factor = rec.version_profile.middle_gb_factor
+    slim_bytes = 0 if rec.osm2pgsql_run_in_ram else middle_bytes(input_gb,
+                                                                 use_flat_nodes,
+                                                                 middle_gb_factor)
+    result = PreflightResult(flat_nodes_path=None, flat_nodes_bytes=nodes_bytes,
+                             middle_bytes=slim_bytes,
+                             output_bytes=output_bytes(rec.osm_pbf_gb,
+                                                         rec.osm2pgsql_output_factor),
+                             candidates=[inspect_dir(path, root=root)
+                                         for path in candidate_dirs])
+    database_bytes = int((slim_bytes + result.output_bytes) * DISK_HEADROOM)
+
+    if use_flat_nodes:
+        required = int(nodes_bytes * DISK_HEADROOM)
+        usable = []
+        for candidate in result.candidates:
+            needed = required
+            if database_dir is not None and _same_filesystem(candidate.path, database_dir):
+                needed += database_bytes
+            if candidate.in_ram:
+                candidate.reason = f'{candidate.fs_type} uses RAM'
+            elif candidate.free_bytes is None:
+                candidate.reason = 'Unable to check free space'
+            elif candidate.free_bytes < needed:
+                candidate.reason = f'Needs {_gb(needed)}, {_gb(candidate.free_bytes)} free'
+            else:
+                usable.append(candidate)
+        if usable:
+            best = min(usable, key=lambda c: (c.speed_rank(), -c.free_bytes))
+            result.flat_nodes_path = os.path.join(best.path, FLAT_NODES_FILENAME)
+        else:
+            result.problems.append(f'No candidate directory has {_gb(required)} free for --flat-nodes')
+
+    if database_dir is not None:
+        database = inspect_dir(database_dir, root=root)
+        if database.free_bytes is not None and database.free_bytes < database_bytes:
+            result.problems.append(f'Database needs {_gb(database_bytes)} for middle and output tables, '
+                                   f'{_gb(database.free_bytes)} free at {database_dir}')
+    return result
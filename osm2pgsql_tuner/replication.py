@@ -0,0 +1,200 @@
+"""Recommendations for applying replication diffs with ``--append``.
+
+A minutely or hourly diff touches a tiny fraction of the data, so sizing the
+cache from the full PBF (as :class:`osm2pgsql_tuner.tuner.Recommendation` does
+for the initial import) reserves far more RAM than updates need.  Here the
+cache, process count and ``osm2pgsql-replication`` batch size are sized from
+the change file instead.
+"""
+from osm2pgsql_tuner import tuner
+
+
+OSC_CHANGES_PER_MB = 20_000
+"""int : Typical changes (node, way or relation versions) per MB of ``.osc.gz``."""
+
+CACHE_BYTES_PER_CHANGE = 2048
+"""int : Cache needed per change, incl. locations of dependent nodes pulled in
+to rebuild changed ways and relations.  Initial estimate, not measured."""
+
+MIN_UPDATE_CACHE_MB = 128
+"""int : Smallest ``--cache`` recommended for updates, in MB."""
+
+CHANGES_PER_PROCESS = 50_000
+"""int : Changes worth one additional process while reprocessing dependent objects."""
+
+DEFAULT_MAX_DIFF_SIZE_MB = 500
+"""int : ``osm2pgsql-replication`` default for ``--max-diff-size``, in MB."""
+
+
+class UpdateRecommendation():
+    """Recommends osm2pgsql settings for applying a diff to an existing import.
+
+    Parameters
+    -----------------------
+    system_ram_gb : float
+        How much total RAM the replica host has, in GB.
+
+    osc_mb : float
+        (Default None) Size of a typical ``.osc.gz`` change file in MB.
+
+    change_count : int
+        (Default None) Number of changed elements in a typical diff.  One of
+        ``osc_mb`` or ``change_count`` must be set.
+
+    cpu_count : int
+        (Default None) CPUs available to osm2pgsql.
+
+    flat_nodes_path : str
+        (Default None) Flat nodes file used by the initial import.  Updates
+        must use the same file.
+
+    pgosm_layer_set : str
+        (Default run) Base name of ``.lua`` script to run.
+
+    postgres_ram_gb : float
+        (Default None) RAM reserved for a PostgreSQL server on the same host, in GB.
+    """
+    def __init__(self, system_ram_gb: float, osc_mb: float=None,
+                 change_count: int=None, cpu_count: int=None,
+                 flat_nodes_path: str=None, pgosm_layer_set: str='run',
+                 postgres_ram_gb: float=None):
+        tuner.check_system_ram(system_ram_gb)
+        if osc_mb is None and change_count is None:
+            raise ValueError('Either osc_mb or change_count must be set.')
+
+        self.system_ram_gb = system_ram_gb
+        self.osc_mb = osc_mb
+        self.cpu_count = cpu_count
+        self.flat_nodes_path = flat_nodes_path
+        self.pgosm_layer_set = pgosm_layer_set
+        self.postgres_ram_gb = postgres_ram_gb
+
+        self.decisions = []
+
+        if change_count is None:
+            change_count = int(osc_mb * OSC_CHANGES_PER_MB)
+        self.change_count = change_count
+
+        self.osm2pgsql_cache_max = self.calculate_max_osm2pgsql_cache()
+        self.osm2pgsql_cache_mb = self.get_cache_mb()
+        self.osm2pgsql_number_processes = self.get_number_processes()
+        self.max_diff_size_mb = self.get_max_diff_size_mb()
+
+    def calculate_max_osm2pgsql_cache(self) -> float:
+        """Calculates the max RAM available to the osm2pgsql cache, in GB.
+
+        Same budget as the initial import, see :func:`osm2pgsql_tuner.tuner.max_cache_gb`.
+
+        Returns
+        -----------------------
+        osm2pgsql_cache_max : float
+        """
+        return tuner.max_cache_gb(self.system_ram_gb, self.postgres_ram_gb)
+
+    def get_cache_mb(self) -> int:
+        """Returns ``--cache`` in MB sized from the diff.
+
+        With ``--flat-nodes`` node locations are read from the file and the
+        cache is set to 0, as for the initial import.
+
+        Returns
+        ----------------------
+        cache : int
+        """
+        if self.flat_nodes_path is not None:
+            self.decisions.append(tuner.shared_decision(tuner.CacheDecision.FLAT_NODES))
+            return 0
+
+        needed_mb = int(self.change_count * CACHE_BYTES_PER_CHANGE / 1024**2)
+        max_mb = int(self.osm2pgsql_cache_max * 1024)
+        if needed_mb > max_mb:
+            self.decisions.append(tuner.shared_decision(tuner.CacheDecision.LIMITED_RAM))
+            return max_mb
+
+        cache = max(needed_mb, MIN_UPDATE_CACHE_MB)
+        self.decisions.append(tuner.Decision(tuner.ReplicationDecision.CACHE_FROM_DIFF,
+                                             change_count=self.change_count, cache_mb=cache))
+        return min(cache, max_mb)
+
+    def get_number_processes(self) -> int:
+        """Picks ``--number-processes`` for reprocessing dependent objects.
+
+        Small diffs finish faster with few processes because each one opens
+        its own database connections.
+
+        Returns
+        ----------------------
+        number_processes : int or None
+            None when ``cpu_count`` was not provided.
+        """
+        if self.cpu_count is None:
+            code = tuner.ProcessesDecision.CPU_COUNT_UNKNOWN
+            self.decisions.append(tuner.shared_decision(code))
+            return None
+
+        by_changes = 1 + self.change_count // CHANGES_PER_PROCESS
+        headroom_gb = max(0.0, self.osm2pgsql_cache_max - self.osm2pgsql_cache_mb / 1024)
+        by_ram = 1 + int(headroom_gb / tuner.PROCESS_RAM_GB_SLIM)
+        number_processes = max(1, min(int(self.cpu_count), by_changes, by_ram))
+        self.decisions.append(tuner.Decision(tuner.ReplicationDecision.PROCESSES_FROM_DIFF,
+                                             number_processes=number_processes,
+                                             change_count=self.change_count))
+        return number_processes
+
+    def get_max_diff_size_mb(self) -> int:
+        """Returns ``osm2pgsql-replication --max-diff-size`` in MB.
+
+        Catching up after downtime downloads several diffs at once.  The batch
+        is limited so its changes still fit the cache, keeping each update
+        short instead of one very long catch-up run.
+
+        Returns
+        ----------------------
+        max_diff_size_mb : int
+        """
+        if self.flat_nodes_path is not None:
+            return DEFAULT_MAX_DIFF_SIZE_MB
+        fits_changes = self.osm2pgsql_cache_mb * 1024**2 / CACHE_BYTES_PER_CHANGE
+        max_diff_mb = int(fits_changes / OSC_CHANGES_PER_MB)
+        return max(1, min(max_diff_mb, DEFAULT_MAX_DIFF_SIZE_MB))
+
+    def _osm2pgsql_args(self) -> str:
+        """Returns the osm2pgsql options shared by both commands."""
+        args = f' --slim  --cache={self.osm2pgsql_cache_mb} '
+        if self.flat_nodes_path is not None:
+            args += f' --flat-nodes={self.flat_nodes_path} '
+        if self.osm2pgsql_number_processes is not None:
+            args += f' --number-processes={self.osm2pgsql_number_processes} '
+        args += f' --output=flex --style=./{self.pgosm_layer_set}.lua '
+        return args
+
+    def get_osm2pgsql_command(self, osc_path: str) -> str:
+        """Builds the osm2pgsql command to apply one change file.
+
+        Parameters
+        -----------------------
+        osc_path : str
+
+        Returns
+        -----------------------
+        cmd : str
+        """
+        cmd = 'osm2pgsql -d $PGOSM_CONN  --append '
+        cmd += self._osm2pgsql_args()
+        cmd += f' {osc_path}'
+        return cmd
+
+    def get_replication_command(self) -> str:
+        """Builds the ``osm2pgsql-replication update`` command.
+
+        Options after ``--`` are passed through to osm2pgsql.
+
+        Returns
+        -----------------------
+        cmd : str
+        """
+        cmd = 'osm2pgsql-replication update -d $PGOSM_CONN '
+        cmd += f' --max-diff-size={self.max_diff_size_mb} '
+        cmd += ' -- '
+        cmd += self._osm2pgsql_args()
+        return cmd.rstrip()
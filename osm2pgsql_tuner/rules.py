@@ -0,0 +1,451 @@
+"""Decision codes, decision records and the rule table of the tuner.
+
+The ``--slim``, ``--drop``, ``--flat-nodes`` and ``--cache`` choices of
+:class:`osm2pgsql_tuner.tuner.Recommendation` are a declarative table
+(:data:`RULES`): each :class:`Rule` lists its outcomes in order and the first
+whose condition holds sets the decision code and the value.  Conditions only
+use comparisons and ``_both()``, so the same table evaluates one
+``Recommendation`` and NumPy columns in :mod:`osm2pgsql_tuner.batch`.
+
+Decisions are recorded as :class:`Decision`, an immutable record of an enum
+code and the values its text needs.  The ``option``, ``name`` and ``desc``
+text is looked up in :data:`DECISION_TEXT` only when read or serialized.
+Codes w/out text are not recorded.
+"""
+import enum
+
+
+FLAT_NODES_THRESHOLD_GB = 8.0
+"""float : Sets threshold size for when to use ``--flat-nodes``.
+
+8-10 GB appears to be an appropriate threshold when using modern SSDs for storage.
+"""
+
+FLAT_NODES_ALWAYS_GB = 30.0
+"""float : PBF size from which ``--flat-nodes`` is used regardless of storage type."""
+
+
+class SlimDecision(enum.IntEnum):
+    """Decision codes explaining the ``--slim`` choice."""
+    IN_RAM = 0
+    USING_APPEND = 1
+    INSUFFICIENT_RAM = 2
+
+
+class DropDecision(enum.IntEnum):
+    """Decision codes explaining the ``--drop`` choice."""
+    SUFFICIENT_RAM = 0
+    USING_APPEND = 1
+    USING_DROP = 2
+
+
+class FlatNodesDecision(enum.IntEnum):
+    """Decision codes explaining the ``--flat-nodes`` choice."""
+    SUFFICIENT_RAM = 0
+    SIZE_WITH_SSD = 1
+    SIZE_ALWAYS = 2
+    NOT_USING = 3
+    SIZE_MEASURED = 4
+    BELOW_MEASURED = 5
+
+
+class LimitedRamDecision(enum.IntEnum):
+    """Decision codes explaining ``osm2pgsql_limited_ram``."""
+    SUFFICIENT_RAM = 0
+    CACHE_EXCEEDS_MAX = 1
+    CACHE_FITS = 2
+
+
+class CacheDecision(enum.IntEnum):
+    """Decision codes explaining the ``--cache`` value."""
+    FLAT_NODES = 0
+    LIMITED_RAM = 1
+    SUFFICIENT_RAM = 2
+
+
+class CacheMaxDecision(enum.IntEnum):
+    """Decision codes explaining ``osm2pgsql_cache_max``."""
+    CO_LOCATED_POSTGRES = 0
+
+
+class EstimateDecision(enum.IntEnum):
+    """Decision codes explaining the source of the no-slim RAM estimate."""
+    CALIBRATED = 0
+    ELEMENT_STATISTICS = 1
+
+
+class ProcessesDecision(enum.IntEnum):
+    """Decision codes explaining the ``--number-processes`` value."""
+    CPU_COUNT_UNKNOWN = 0
+    LIMITED_RAM = 1
+    ONE_PER_CPU = 2
+
+
+class TagsFilterDecision(enum.IntEnum):
+    """Decision codes explaining the ``osmium tags-filter`` pre-pass."""
+    SMALL_LAYER_SET = 0
+    CATCH_ALL = 1
+    LARGE_SHARE = 2
+    USING_APPEND = 3
+
+
+class VersionDecision(enum.IntEnum):
+    """Decision codes explaining the osm2pgsql version profile."""
+    PROFILE = 0
+
+
+class SourceDecision(enum.IntEnum):
+    """Decision codes explaining where host details came from."""
+    RAM_DETECTED = 0
+    RAM_USER_PROVIDED = 1
+    CPU_DETECTED = 2
+    CPU_USER_PROVIDED = 3
+    SSD_DETECTED = 4
+    SSD_DEFAULT = 5
+    SSD_USER_PROVIDED = 6
+
+
+class DiskDecision(enum.IntEnum):
+    """Decision codes from the disk preflight."""
+    FLAT_NODES_PLACEMENT = 0
+    INSUFFICIENT_DISK = 1
+
+
+class StorageDecision(enum.IntEnum):
+    """Decision codes from :mod:`osm2pgsql_tuner.storage`."""
+    MEASURED = 0
+    PLACEMENT = 1
+
+
+class ScheduleDecision(enum.IntEnum):
+    """Decision codes from :mod:`osm2pgsql_tuner.scheduler`."""
+    HOST = 0
+
+
+class FallbackDecision(enum.IntEnum):
+    """Decision codes from :mod:`osm2pgsql_tuner.fallback`."""
+    FAILED = 0
+    CORRECTED = 1
+    SLIM = 2
+    FLAT_NODES = 3
+    PROCESSES = 4
+
+
+class ReplicationDecision(enum.IntEnum):
+    """Decision codes from :mod:`osm2pgsql_tuner.replication`."""
+    CACHE_FROM_DIFF = 0
+    PROCESSES_FROM_DIFF = 1
+
+
+_USER_PROVIDED = 'Value passed by caller'
+_SUFFICIENT_SIZE = ('--flat-node', 'File of sufficient size',
+                    'File is large enough to consider --flat-nodes')
+
+DECISION_TEXT = {
+    SlimDecision: {
+        SlimDecision.USING_APPEND: ('--slim', 'Using Append',
+                                    'Use of --append mode requires --slim')},
+    DropDecision: {
+        DropDecision.SUFFICIENT_RAM: ('--drop', 'Sufficient RAM',
+                                      'Import can run entirely in RAM, --drop not needed.'),
+        DropDecision.USING_APPEND: ('--drop', 'Using Append', 'Using --append, cannot use --drop'),
+        DropDecision.USING_DROP: ('--drop', 'Using Drop', 'No reason not to use --drop')},
+    FlatNodesDecision: {
+        FlatNodesDecision.SUFFICIENT_RAM: ('--flat-node', 'Sufficient RAM',
+                                           'No reason to consider --flat-nodes'),
+        FlatNodesDecision.SIZE_WITH_SSD: _SUFFICIENT_SIZE,
+        FlatNodesDecision.SIZE_ALWAYS: _SUFFICIENT_SIZE,
+        FlatNodesDecision.NOT_USING: ('--flat-node', 'Not using', 'No reason to use --flat-nodes'),
+        FlatNodesDecision.SIZE_MEASURED: ('--flat-node', 'File of sufficient size',
+                                          'File is large enough to consider --flat-nodes on the '
+                                          'measured storage'),
+        FlatNodesDecision.BELOW_MEASURED: ('--flat-node', 'Not using',
+                                           'File is below the --flat-nodes threshold of the '
+                                           'measured storage')},
+    CacheDecision: {
+        CacheDecision.FLAT_NODES: ('--cache', 'Using --flat-nodes', 'Set --cache 0.'),
+        CacheDecision.LIMITED_RAM: ('--cache', 'Limited RAM', 'Setting --cache to max available.'),
+        CacheDecision.SUFFICIENT_RAM: ('--cache', 'Sufficient RAM',
+                                       'Set --cache to expected requirement for given PBF size.')},
+    CacheMaxDecision: {
+        CacheMaxDecision.CO_LOCATED_POSTGRES: ('--cache', 'Co-located PostgreSQL',
+                                               'Reserving {postgres_ram_gb:.2f} GB RAM for '
+                                               'PostgreSQL')},
+    EstimateDecision: {
+        EstimateDecision.CALIBRATED: ('--slim', 'Calibrated',
+                                      'RAM estimate from calibration profile for osm2pgsql '
+                                      '{version} ({sample_count} runs)'),
+        EstimateDecision.ELEMENT_STATISTICS: ('--slim', 'Element statistics',
+                                              'RAM estimate based on node, way and relation '
+                                              'counts')},
+    ProcessesDecision: {
+        ProcessesDecision.CPU_COUNT_UNKNOWN: ('--number-processes', 'CPU count unknown',
+                                              'Using osm2pgsql default'),
+        ProcessesDecision.LIMITED_RAM: ('--number-processes', 'Limited RAM',
+                                        'RAM headroom of {headroom_gb:.1f} GB supports '
+                                        '{number_processes} of {cpu_count} CPUs'),
+        ProcessesDecision.ONE_PER_CPU: ('--number-processes', 'One per CPU',
+                                        'Sufficient RAM for {number_processes} processes')},
+    TagsFilterDecision: {
+        TagsFilterDecision.SMALL_LAYER_SET: ('osmium tags-filter', 'Small layer set',
+                                             'Layer set {layer_set} needs ~{share:.0%} of the '
+                                             'input, filter before osm2pgsql'),
+        TagsFilterDecision.CATCH_ALL: ('osmium tags-filter', 'Not using',
+                                       'Layer set {layer_set} keeps objects w/out tag filter'),
+        TagsFilterDecision.LARGE_SHARE: ('osmium tags-filter', 'Not using',
+                                         'Layer set {layer_set} needs ~{share:.0%} of the input'),
+        TagsFilterDecision.USING_APPEND: ('osmium tags-filter', 'Using Append',
+                                          'Diffs applied with --append need the complete input '
+                                          'in the middle tables')},
+    VersionDecision: {
+        VersionDecision.PROFILE: ('osm2pgsql', 'Version {version}',
+                                  'Using rule profile for osm2pgsql {profile} and newer')},
+    SourceDecision: {
+        SourceDecision.RAM_DETECTED: ('system_ram_gb', 'Detected', '{ram_gb:.2f} GB from {source}'),
+        SourceDecision.RAM_USER_PROVIDED: ('system_ram_gb', 'User provided', _USER_PROVIDED),
+        SourceDecision.CPU_DETECTED: ('cpu_count', 'Detected', '{cpu_count} CPUs from {source}'),
+        SourceDecision.CPU_USER_PROVIDED: ('cpu_count', 'User provided', _USER_PROVIDED),
+        SourceDecision.SSD_DETECTED: ('ssd', 'Detected',
+                                      'From /sys/block rotational flag: {details}'),
+        SourceDecision.SSD_DEFAULT: ('ssd', 'Default', 'Storage type unknown, assuming SSD'),
+        SourceDecision.SSD_USER_PROVIDED: ('ssd', 'User provided', _USER_PROVIDED)},
+    DiskDecision: {
+        DiskDecision.FLAT_NODES_PLACEMENT: ('--flat-nodes', 'Placement',
+                                            'Using {path}, needs {size_gb:.1f} GB'),
+        DiskDecision.INSUFFICIENT_DISK: ('disk', 'Insufficient disk', '{problem}')},
+    StorageDecision: {
+        StorageDecision.MEASURED: ('--flat-nodes', 'Measured storage',
+                                   '{tier} at {path}: {read_iops:.0f} random 4K reads/s, '
+                                   '--flat-nodes from {threshold_gb:.1f} GB'),
+        StorageDecision.PLACEMENT: ('tablespace', 'Placement', '{role} at {path}, {tablespace}')},
+    ScheduleDecision: {
+        ScheduleDecision.HOST: ('schedule', 'Host {host}',
+                                '{mode} mode with {ram_gb:.1f} GB RAM and {processes} processes')},
+    FallbackDecision: {
+        FallbackDecision.FAILED: ('osm2pgsql', 'Failed: {kind}', '{evidence}'),
+        FallbackDecision.CORRECTED: ('--slim', 'Corrected estimate',
+                                     'RAM estimate raised {factor:.2f}x after the failed import'),
+        FallbackDecision.SLIM: ('--slim', 'Fallback',
+                                'In-RAM import failed, using --slim with --cache={cache_mb}'),
+        FallbackDecision.FLAT_NODES: ('--flat-nodes', 'Fallback',
+                                      'Slim import failed, using --flat-nodes'),
+        FallbackDecision.PROCESSES: ('--number-processes', 'Fallback',
+                                     'Import failed, reducing to {number_processes} processes')},
+    ReplicationDecision: {
+        ReplicationDecision.CACHE_FROM_DIFF: ('--cache', 'Sized from diff',
+                                              '{change_count} changes need about {cache_mb} MB'),
+        ReplicationDecision.PROCESSES_FROM_DIFF: ('--number-processes', 'Sized from diff',
+                                                  '{number_processes} processes for '
+                                                  '{change_count} changes')},
+}
+"""dict : Decision enum to code to ``(option, name, desc)`` templates."""
+
+
+# Enum members hash in Python, (enum, int) keys hash in C
+_DECISION_TEXT_BY_KEY = {(enum_type, int(code)): text
+                         for enum_type, texts in DECISION_TEXT.items()
+                         for code, text in texts.items()}
+
+
+def get_decision_text(code) -> tuple:
+    """Returns the ``(option, name, desc)`` templates of a code, None when not recorded."""
+    return _DECISION_TEXT_BY_KEY.get((type(code), int(code)))
+
+
+class Decision():
+    """Immutable record of one decision.
+
+    Reads like the ``{'option', 'name', 'desc'}`` dictionaries used before,
+    ``decision['name']`` works and records compare equal to those dictionaries.
+
+    Parameters
+    -----------------------
+    code : enum.IntEnum
+        Member of one of the decision enums in this module.
+    detail
+        Values for the text templates of ``code``.
+    """
+    __slots__ = ('code', 'detail')
+
+    def __init__(self, code, **detail):
+        if (type(code), int(code)) not in _DECISION_TEXT_BY_KEY:
+            raise ValueError(f'No decision text for {code!r}')
+        object.__setattr__(self, 'code', code)
+        object.__setattr__(self, 'detail', tuple(detail.items()))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Decision is immutable')
+
+    @property
+    def option(self) -> str:
+        """Option the decision applies to, e.g. ``--slim``."""
+        return get_decision_text(self.code)[0]
+
+    @property
+    def name(self) -> str:
+        """Short label of the decision."""
+        return get_decision_text(self.code)[1].format(**dict(self.detail))
+
+    @property
+    def desc(self) -> str:
+        """Explanation of the decision."""
+        return get_decision_text(self.code)[2].format(**dict(self.detail))
+
+    def __getitem__(self, key: str) -> str:
+        if key not in ('option', 'name', 'desc'):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def to_dict(self) -> dict:
+        """Returns the decision as an ``{'option', 'name', 'desc'}`` dictionary.
+
+        Returns
+        ----------------------
+        decision : dict
+        """
+        return {'option': self.option, 'name': self.name, 'desc': self.desc}
+
+    def __eq__(self, other):
+        if isinstance(other, Decision):
+            return (type(self.code) is type(other.code) and self.code == other.code
+                    and self.detail == other.detail)
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((type(self.code).__name__, int(self.code), self.detail))
+
+    def __repr__(self):
+        return f'Decision({self.code!r}, {dict(self.detail)!r})'
+
+
+_SHARED_DECISIONS = {}
+
+
+def shared_decision(code) -> Decision:
+    """Returns one shared record per code for decisions w/out detail.
+
+    Records are immutable, so one instance per code serves every recommendation.
+    """
+    key = (type(code), int(code))
+    decision = _SHARED_DECISIONS.get(key)
+    if decision is None:
+        decision = _SHARED_DECISIONS[key] = Decision(code)
+    return decision
+
+
+def decisions_to_dicts(decisions) -> list:
+    """Returns decisions as JSON serializable dictionaries.
+
+    Parameters
+    -----------------------
+    decisions : list of Decision or dict
+
+    Returns
+    -----------------------
+    decisions : list of dict
+    """
+    return [decision.to_dict() if isinstance(decision, Decision) else dict(decision)
+            for decision in decisions]
+
+
+def _both(left, right):
+    """Logical and of two bools or two NumPy bool arrays."""
+    if hasattr(left, 'dtype') or hasattr(right, 'dtype'):
+        return left & right
+    return bool(left and right)
+
+
+def _mb(gb):
+    """Converts GB to whole MB, truncating like ``int()``."""
+    if hasattr(gb, 'astype'):
+        return (gb * 1024).astype('int64')
+    return int(gb * 1024)
+
+
+class Rule():
+    """Ordered outcomes of one calculated attribute.
+
+    Parameters
+    -----------------------
+    attribute : str
+        ``Recommendation`` attribute set by the rule.
+    outcomes : tuple of tuple
+        ``(code, when, value)``.  ``when`` takes the recommendation (or
+        columns with the same attribute names) and returns a bool (or bool
+        array), it is None for the last outcome.  ``value`` is a constant or
+        a callable taking the recommendation.
+    """
+    def __init__(self, attribute: str, outcomes: tuple):
+        if outcomes[-1][1] is not None:
+            raise ValueError('The last outcome of a rule must not have a condition.')
+        self.attribute = attribute
+        self.outcomes = outcomes
+        # Rule decisions have no detail, records are shared
+        self._selectable = tuple(
+            (code, when, value, callable(value),
+             shared_decision(code) if get_decision_text(code) is not None else None)
+            for code, when, value in outcomes)
+
+    def select(self, source) -> tuple:
+        """Evaluates the rule for one recommendation.
+
+        Returns
+        -----------------------
+        outcome : tuple
+            ``(code, value, decision)``, ``decision`` is None for codes
+            that are not recorded.
+        """
+        for code, when, value, computed, decision in self._selectable:
+            if when is None or when(source):
+                return code, value(source) if computed else value, decision
+
+    def evaluate(self, source) -> tuple:
+        """Evaluates the rule for one recommendation.
+
+        Returns
+        -----------------------
+        outcome : tuple
+            ``(code, value)``
+        """
+        return self.select(source)[:2]
+
+
+RULES = (
+    Rule('osm2pgsql_run_in_ram', (
+        (SlimDecision.USING_APPEND, lambda rec: rec.slim_no_drop, False),
+        (SlimDecision.IN_RAM,
+         lambda rec: rec.osm2pgsql_noslim_cache <= rec.osm2pgsql_cache_max, True),
+        (SlimDecision.INSUFFICIENT_RAM, None, False))),
+    Rule('osm2pgsql_drop', (
+        (DropDecision.SUFFICIENT_RAM, lambda rec: rec.osm2pgsql_run_in_ram, False),
+        (DropDecision.USING_APPEND, lambda rec: rec.slim_no_drop, False),
+        (DropDecision.USING_DROP, None, True))),
+    Rule('osm2pgsql_flat_nodes', (
+        (FlatNodesDecision.SUFFICIENT_RAM, lambda rec: rec.osm2pgsql_run_in_ram, False),
+        # A storage probe replaces the SSD/HDD thresholds
+        (FlatNodesDecision.SIZE_MEASURED,
+         lambda rec: _both(rec.storage is not None,
+                           rec.osm_pbf_gb >= rec.osm2pgsql_flat_nodes_gb), True),
+        (FlatNodesDecision.BELOW_MEASURED, lambda rec: rec.storage is not None, False),
+        (FlatNodesDecision.SIZE_WITH_SSD,
+         lambda rec: _both(rec.osm_pbf_gb >= FLAT_NODES_THRESHOLD_GB, rec.ssd), True),
+        (FlatNodesDecision.SIZE_ALWAYS,
+         lambda rec: rec.osm_pbf_gb >= FLAT_NODES_ALWAYS_GB, True),
+        (FlatNodesDecision.NOT_USING, None, False))),
+    Rule('osm2pgsql_limited_ram', (
+        (LimitedRamDecision.SUFFICIENT_RAM, lambda rec: rec.osm2pgsql_run_in_ram, False),
+        (LimitedRamDecision.CACHE_EXCEEDS_MAX,
+         lambda rec: rec.osm2pgsql_slim_cache > rec.osm2pgsql_cache_max, True),
+        (LimitedRamDecision.CACHE_FITS, None, False))),
+    Rule('osm2pgsql_cache_mb', (
+        (CacheDecision.FLAT_NODES, lambda rec: rec.osm2pgsql_flat_nodes, 0),
+        (CacheDecision.LIMITED_RAM, lambda rec: rec.osm2pgsql_limited_ram,
+         lambda rec: _mb(rec.osm2pgsql_cache_max)),
+        (CacheDecision.SUFFICIENT_RAM, None, lambda rec: _mb(rec.osm2pgsql_slim_cache)))),
+)
+"""tuple : Rules in evaluation order, later rules read attributes set by earlier ones."""
+
+RULES_BY_ATTRIBUTE = {rule.attribute: rule for rule in RULES}
+"""dict : Attribute name to :class:`Rule`."""
@@ -0,0 +1,285 @@
+"""Estimates osm2pgsql import wall-clock time per phase.
+
+Each phase is modeled as ``element count * seconds per element``, adjusted for
+storage, ``--flat-nodes``, ``--drop`` and the number of processes.  The
+seconds per element are :class:`RuntimeCoefficients` that can be fit from
+recorded runs (see :mod:`osm2pgsql_tuner.calibration`) so estimates reflect
+the hardware actually used.
+
+Phases are ``nodes``, ``ways`` and ``relations`` (reading the input) followed
+by ``postprocessing`` (clustering and index creation).
+"""
+
+PHASES = ('nodes', 'ways', 'relations', 'postprocessing')
+"""tuple : Import phases in the order osm2pgsql runs them."""
+
+NODES_PER_PBF_GB = 128_000_000
+"""int : Typical nodes per GB of PBF, used when element counts are unknown."""
+
+WAYS_PER_PBF_GB = 14_000_000
+"""int : Typical ways per GB of PBF, used when element counts are unknown."""
+
+RELATIONS_PER_PBF_GB = 160_000
+"""int : Typical relations per GB of PBF, used when element counts are unknown."""
+
+DEFAULT_SECONDS_PER_ELEMENT = {
+    'nodes': {'ram': 1 / 1_500_000, 'slim': 1 / 500_000},
+    'ways': {'ram': 1 / 60_000, 'slim': 1 / 30_000},
+    'relations': {'ram': 1 / 3_000, 'slim': 1 / 1_500},
+    'postprocessing': {'ram': 1 / 50_000, 'slim': 1 / 50_000},
+}
+"""dict : Seconds per element by phase and middle, SSD storage, one process.
+
+``postprocessing`` is per way, ways make up most of the output tables.
+Initial estimates from planet and continent imports, not measured.
+"""
+
+PARALLEL_FRACTION = {'nodes': 0.0, 'ways': 0.3, 'relations': 0.3,
+                     'postprocessing': 0.8}
+"""dict : Fraction of each phase that scales with ``--number-processes`` (Amdahl's law)."""
+
+HDD_FACTOR = {'nodes': {'ram': 1.0, 'slim': 3.0},
+              'ways': {'ram': 1.0, 'slim': 4.0},
+              'relations': {'ram': 1.0, 'slim': 3.0},
+              'postprocessing': {'ram': 2.0, 'slim': 2.0}}
+"""dict : Slowdown of each phase on spinning disks compared to SSD."""
+
+FLAT_NODES_NODE_FACTOR = 0.5
+"""float : Node phase time with ``--flat-nodes`` relative to slim w/out it."""
+
+SLIM_NO_DROP_POSTPROCESSING_FACTOR = 1.5
+"""float : Extra post-processing time for building middle table indexes w/out ``--drop``."""
+
+
+class RuntimeCoefficients():
+    """Seconds per element for each phase and middle (``ram`` or ``slim``).
+
+    Parameters
+    -----------------------
+    seconds_per_element : dict
+        (Default ``DEFAULT_SECONDS_PER_ELEMENT``) Same shape as the default.
+
+    sample_count : int
+        (Default 0) Number of runs the coefficients were fit from.
+    """
+    def __init__(self, seconds_per_element: dict=None, sample_count: int=0):
+        if seconds_per_element is None:
+            seconds_per_element = DEFAULT_SECONDS_PER_ELEMENT
+        self.seconds_per_element = {phase: dict(values)
+                                    for phase, values in seconds_per_element.items()}
+        self.sample_count = sample_count
+
+    def to_dict(self) -> dict:
+        """Returns the coefficients as a JSON serializable dictionary.
+
+        Returns
+        ----------------------
+        coefficients : dict
+        """
+        return {'seconds_per_element': self.seconds_per_element,
+                'sample_count': self.sample_count}
+
+    @classmethod
+    def from_dict(cls, coefficients: dict):
+        """Creates coefficients from :meth:`to_dict` output.
+
+        Returns
+        ----------------------
+        coefficients : RuntimeCoefficients
+        """
+        return cls(**coefficients)
+
+
+class RuntimeEstimate():
+    """Estimated seconds for each import phase.
+
+    Parameters
+    -----------------------
+    phases : dict
+        Phase name to estimated seconds.
+    """
+    def __init__(self, phases: dict):
+        self.phases = phases
+
+    @property
+    def total_seconds(self) -> float:
+        """Estimated wall-clock time of the whole import, in seconds."""
+        return sum(self.phases.values())
+
+    def to_dict(self) -> dict:
+        """Returns the estimate as a dictionary.
+
+        Returns
+        ----------------------
+        estimate : dict
+        """
+        return {'phases': dict(self.phases), 'total_seconds': self.total_seconds}
+
+
+def _speedup(phase: str, processes: int) -> float:
+    """Amdahl's law speedup of ``phase`` with ``processes`` processes."""
+    parallel = PARALLEL_FRACTION[phase]
+    return 1 / ((1 - parallel) + parallel / max(1, processes))
+
+
+def _phase_factor(phase: str, slim: bool, flat_nodes: bool, drop: bool,
+                  ssd: bool, processes: int) -> float:
+    """Returns the multiplier applied to ``count * seconds_per_element``."""
+    middle = 'slim' if slim else 'ram'
+    factor = 1.0 if ssd else HDD_FACTOR[phase][middle]
+    if phase == 'nodes' and slim and flat_nodes:
+        factor *= FLAT_NODES_NODE_FACTOR
+    if phase == 'postprocessing' and slim and not drop:
+        factor *= SLIM_NO_DROP_POSTPROCESSING_FACTOR
+    return factor / _speedup(phase, processes)
+
+
+def _phase_counts(node_count: int, way_count: int, relation_count: int,
+                  output_factor: float=1.0) -> dict:
+    """Maps each phase to the element count its time scales with.
+
+    Counts missing from partial run records stay None.
+    """
+    postprocessing = None if way_count is None else way_count * output_factor
+    return {'nodes': node_count, 'ways': way_count,
+            'relations': relation_count,
+            'postprocessing': postprocessing}
+
+
+def estimate(node_count: int, way_count: int, relation_count: int,
+             slim: bool, flat_nodes: bool=False, drop: bool=True,
+             ssd: bool=True, processes: int=1,
+             coefficients: RuntimeCoefficients=None,
+             output_factor: float=1.0) -> RuntimeEstimate:
+    """Estimates the time for each import phase.
+
+    Parameters
+    -----------------------
+    node_count : int
+    way_count : int
+    relation_count : int
+    slim : bool
+        True when running with ``--slim``.
+    flat_nodes : bool
+        (Default False) True when using ``--flat-nodes``.
+    drop : bool
+        (Default True) True when using ``--drop``.
+    ssd : bool
+        (Default True)
+    processes : int
+        (Default 1) Value of ``--number-processes``.
+    coefficients : RuntimeCoefficients
+        (Default None) Uses ``DEFAULT_SECONDS_PER_ELEMENT`` when None.
+    output_factor : float
+        (Default 1.0) Output size relative to the PgOSM Flex ``run`` layer
+        set for these element counts.  Scales the post-processing phase
+        (indexes and clustering).
+
+    Returns
+    -----------------------
+    estimate : RuntimeEstimate
+    """
+    if coefficients is None:
+        coefficients = RuntimeCoefficients()
+    middle = 'slim' if slim else 'ram'
+    counts = _phase_counts(node_count, way_count, relation_count, output_factor)
+    phases = {}
+    for phase in PHASES:
+        factor = _phase_factor(phase, slim, flat_nodes, drop, ssd, processes)
+        phases[phase] = counts[phase] * coefficients.seconds_per_element[phase][middle] * factor
+    return RuntimeEstimate(phases)
+
+
+def element_counts(rec) -> tuple:
+    """Returns node, way and relation counts for a ``Recommendation``.
+
+    Uses ``rec.pbf_stats`` when available, otherwise typical counts per GB.
+
+    Returns
+    -----------------------
+    counts : tuple
+    """
+    if rec.pbf_stats is not None:
+        return (rec.pbf_stats.node_count, rec.pbf_stats.way_count,
+                rec.pbf_stats.relation_count)
+    return (int(rec.osm_pbf_gb * NODES_PER_PBF_GB),
+            int(rec.osm_pbf_gb * WAYS_PER_PBF_GB),
+            int(rec.osm_pbf_gb * RELATIONS_PER_PBF_GB))
+
+
+def estimate_for(rec, coefficients: RuntimeCoefficients=None) -> RuntimeEstimate:
+    """Estimates import time for the plan chosen by a ``Recommendation``.
+
+    Parameters
+    -----------------------
+    rec : osm2pgsql_tuner.tuner.Recommendation
+    coefficients : RuntimeCoefficients
+        (Default None)
+
+    Returns
+    -----------------------
+    estimate : RuntimeEstimate
+    """
+    share = rec.osm2pgsql_input_share
+    node_count, way_count, relation_count = (int(count * share) for count
+                                             in element_counts(rec))
+    processes = rec.osm2pgsql_number_processes or 1
+    # Output does not change with a tags-filter pre-pass, only the input shrinks
+    return estimate(node_count, way_count, relation_count,
+                    slim=not rec.osm2pgsql_run_in_ram,
+                    flat_nodes=rec.osm2pgsql_flat_nodes,
+                    drop=rec.osm2pgsql_drop, ssd=rec.ssd,
+                    processes=processes, coefficients=coefficients,
+                    output_factor=rec.osm2pgsql_output_factor / share)
+
+
+def fit(runs, ssd: bool=True, processes: int=1, drop: bool=True) -> RuntimeCoefficients:
+    """Fits seconds per element from recorded runs in a single pass.
+
+    Each phase and middle is fit with least squares through the origin.
+    Phases without any usable runs keep the default coefficient.  Phases
+    missing their count or seconds, e.g. in runs parsed from a log cut off
+    by the OOM killer, are skipped.
+
+    Parameters
+    -----------------------
+    runs : iterable of osm2pgsql_tuner.calibration.RunRecord
+        Runs with element counts and per-phase seconds, e.g.
+        ``CalibrationStore.runs()``.
+    ssd : bool
+        (Default True) Storage the runs were recorded on.
+    processes : int
+        (Default 1) ``--number-processes`` the runs used.
+    drop : bool
+        (Default True) Whether slim runs used ``--drop``.
+
+    Returns
+    -----------------------
+    coefficients : RuntimeCoefficients
+    """
+    sums = {(phase, middle): [0.0, 0.0]
+            for phase in PHASES for middle in ('ram', 'slim')}
+    sample_count = 0
+    for run in runs:
+        if run.slim is None:
+            continue
+        middle = 'slim' if run.slim else 'ram'
+        counts = _phase_counts(run.node_count, run.way_count, run.relation_count)
+        used = False
+        for phase in PHASES:
+            seconds = getattr(run, f'seconds_{phase}')
+            if seconds is None or not counts[phase]:
+                continue
+            x = counts[phase] * _phase_factor(phase, bool(run.slim),
+                                              bool(run.flat_nodes), drop, ssd,
+                                              processes)
+            sums[(phase, middle)][0] += x * seconds
+            sums[(phase, middle)][1] += x * x
+            used = True
+        sample_count += used
+
+    coefficients = RuntimeCoefficients(sample_count=sample_count)
+    for (phase, middle), (sum_xy, sum_xx) in sums.items():
+        if sum_xx > 0:
+            coefficients.seconds_per_element[phase][middle] = sum_xy / sum_xx
+    return coefficients
@@ -0,0 +1,512 @@
+"""Schedules many osm2pgsql imports concurrently across a set of hosts.
+
+:class:`osm2pgsql_tuner.tuner.Recommendation` sizes one import on an otherwise
+empty machine.  Here each host's osm2pgsql RAM budget (``osm2pgsql_cache_max``),
+CPUs and disk are shared between concurrent imports.
+
+The heuristic is list scheduling in longest-processing-time-first order, a
+standard approximation for minimizing makespan.  Imports are simulated in
+time; whenever resources are released the queue is scanned and each import
+that fits is started on the host and in the mode that finishes it earliest:
+
+* ``ram`` - w/out ``--slim``, needs ``osm2pgsql_noslim_cache``.
+* ``slim`` - with ``--slim --drop``, needs the slim cache (shrunk down to
+  ``MIN_SLIM_CACHE_GB`` when RAM is short, or 0 with ``--flat-nodes``) but
+  also disk for the middle tables and flat nodes file.
+
+Trading an in-RAM import for slim mode lets it start now instead of waiting
+for RAM held by other imports.  CPUs are split evenly while the queue is long
+and handed out generously as it drains, using ``--number-processes``.
+Disk used by the middle tables and flat nodes file is released when an import
+finishes, disk used by the output tables is not.
+
+With ``plan_indexes`` the post-processing phase of imports with a
+``style_analysis`` is replaced by the :mod:`osm2pgsql_tuner.indexplan` build
+time and the index disk is added to the output.
+"""
+import heapq
+import os
+
+from osm2pgsql_tuner import indexplan, preflight, runtime, tuner
+
+
+MIN_SLIM_CACHE_GB = 0.5
+"""float : Smallest ``--cache`` the scheduler shrinks a slim import to, in GB."""
+
+LOOKAHEAD = 32
+"""int : Queued imports that may fail to fit before a scheduling step gives up."""
+
+MODES = ('ram', 'slim')
+"""tuple : Import modes considered for each job."""
+
+
+class HostSpec():
+    """Host available to the scheduler.
+
+    Parameters
+    -----------------------
+    name : str
+    ram_gb : float
+    cpu_count : int
+    disk_gb : float
+        Free disk for the database and flat nodes files, in GB.
+    ssd : bool
+        (Default True)
+    postgres_ram_gb : float
+        (Default None) RAM reserved for PostgreSQL on the host, in GB.
+    flat_nodes_dir : str
+        (Default None) Directory for the per-import flat nodes files, the
+        directory of ``osm2pgsql_tuner.tuner.FLAT_NODES_DEFAULT_PATH`` when None.
+    """
+    def __init__(self, name: str, ram_gb: float, cpu_count: int,
+                 disk_gb: float, ssd: bool=True, postgres_ram_gb: float=None,
+                 flat_nodes_dir: str=None):
+        if flat_nodes_dir is None:
+            flat_nodes_dir = os.path.dirname(tuner.FLAT_NODES_DEFAULT_PATH)
+        self.name = name
+        self.ram_gb = ram_gb
+        self.cpu_count = cpu_count
+        self.disk_gb = disk_gb
+        self.ssd = ssd
+        self.postgres_ram_gb = postgres_ram_gb
+        self.flat_nodes_dir = flat_nodes_dir
+
+    def check_flat_nodes_dir(self, root: str='/') -> str:
+        """Inspects ``flat_nodes_dir`` with :func:`osm2pgsql_tuner.preflight.inspect_dir`.
+
+        A flat nodes file on a RAM backed filesystem, e.g. ``/tmp`` on
+        ``tmpfs``, takes RAM the scheduler hands to osm2pgsql.  The directory
+        is inspected on the machine running the scheduler.
+
+        Parameters
+        -----------------------
+        root : str
+            (Default ``/``) Filesystem root to read ``/proc`` and ``/sys`` from.
+
+        Returns
+        -----------------------
+        problem : str or None
+            None when the directory can hold flat nodes files.
+        """
+        candidate = preflight.inspect_dir(self.flat_nodes_dir, root=root)
+        if candidate.in_ram:
+            return f'{self.flat_nodes_dir} on {self.name} is {candidate.fs_type}, uses RAM'
+        return None
+
+    def to_dict(self) -> dict:
+        """Returns the host as a dictionary.
+
+        Returns
+        ----------------------
+        host : dict
+        """
+        return dict(vars(self))
+
+
+class ImportJob():
+    """One PBF to import.
+
+    Parameters
+    -----------------------
+    name : str
+        Unique name, used for the flat nodes file.
+    osm_pbf_gb : float
+    pbf_path : str
+        (Default None) Used in the command, ``$PBF_PATH`` when None.
+    pbf_stats : osm2pgsql_tuner.pbf.PbfStats
+        (Default None)
+    pgosm_layer_set : str
+        (Default run)
+    style_analysis : osm2pgsql_tuner.layerset.StyleAnalysis
+        (Default None) Output tables, used to plan index builds.
+    """
+    def __init__(self, name: str, osm_pbf_gb: float, pbf_path: str=None,
+                 pbf_stats=None, pgosm_layer_set: str='run',
+                 style_analysis=None):
+        self.name = name
+        self.osm_pbf_gb = osm_pbf_gb
+        self.pbf_path = pbf_path
+        self.pbf_stats = pbf_stats
+        self.pgosm_layer_set = pgosm_layer_set
+        self.style_analysis = style_analysis
+
+
+def get_index_plan(job: ImportJob, host: HostSpec):
+    """Plans the index builds of ``job`` on ``host``.
+
+    Returns
+    -----------------------
+    index_plan : osm2pgsql_tuner.indexplan.IndexPlan
+    """
+    return indexplan.plan(job.style_analysis, job.osm_pbf_gb, host.ram_gb,
+                          cpu_count=host.cpu_count, ssd=host.ssd)
+
+
+def _recommendation(job: ImportJob, host: HostSpec) -> tuner.Recommendation:
+    """Returns the recommendation for ``job`` alone on ``host``."""
+    return tuner.Recommendation(host.ram_gb, job.osm_pbf_gb, ssd=host.ssd,
+                                pbf_stats=job.pbf_stats,
+                                pgosm_layer_set=job.pgosm_layer_set,
+                                postgres_ram_gb=host.postgres_ram_gb)
+
+
+class _JobOnHost():
+    """Sizes of one job on one host, independent of what else is running.
+
+    ``flat_nodes_problem`` from :meth:`HostSpec.check_flat_nodes_dir` rules
+    out slim mode when it needs ``--flat-nodes``.
+    """
+    def __init__(self, job: ImportJob, host: HostSpec, plan_indexes: bool=False,
+                 flat_nodes_problem: str=None):
+        rec = _recommendation(job, host)
+        self.cache_max_gb = rec.osm2pgsql_cache_max
+        self.noslim_gb = rec.osm2pgsql_noslim_cache
+        self.slim_cache_gb = rec.osm2pgsql_slim_cache
+        self.counts = runtime.element_counts(rec)
+        self.ssd = host.ssd
+        # Flat nodes rule of slim mode, the scheduler picks the mode
+        rec.osm2pgsql_run_in_ram = False
+        self.flat_nodes = tuner.RULES_BY_ATTRIBUTE['osm2pgsql_flat_nodes'].evaluate(rec)[1]
+        self.problem = flat_nodes_problem if self.flat_nodes else None
+        self.modes = MODES if self.problem is None else ('ram',)
+        max_node_id = preflight.known_max_node_id(job.pbf_stats)
+        output_gb = preflight.output_bytes(job.osm_pbf_gb) / 1024**3
+        temp_gb = preflight.middle_bytes(job.osm_pbf_gb, self.flat_nodes) / 1024**3
+        if self.flat_nodes:
+            temp_gb += preflight.flat_nodes_bytes(max_node_id) / 1024**3
+        self.index_plan = None
+        if plan_indexes and job.style_analysis is not None:
+            self.index_plan = get_index_plan(job, host)
+            output_gb += self.index_plan.index_bytes / 1024**3
+        output_gb *= preflight.DISK_HEADROOM
+        self.disk_gb = {'ram': (0.0, output_gb),
+                        'slim': (temp_gb * preflight.DISK_HEADROOM, output_gb)}
+        self._seconds = {}
+
+    def seconds(self, mode: str, processes: int) -> float:
+        """Estimated runtime, cached per mode and process count."""
+        key = (mode, processes)
+        if key not in self._seconds:
+            slim = mode == 'slim'
+            estimate = runtime.estimate(*self.counts, slim=slim,
+                                        flat_nodes=slim and self.flat_nodes,
+                                        drop=True, ssd=self.ssd, processes=processes)
+            seconds = estimate.total_seconds
+            if self.index_plan is not None:
+                seconds += self.index_plan.total_seconds - estimate.phases['postprocessing']
+            self._seconds[key] = seconds
+        return self._seconds[key]
+
+    def ram_gb(self, mode: str, processes: int, free_ram_gb: float) -> tuple:
+        """Returns ``(ram_gb, cache_gb)`` for the mode or None when it does not fit."""
+        if mode == 'ram':
+            need = self.noslim_gb + (processes - 1) * tuner.PROCESS_RAM_GB_NOSLIM
+            return (need, 0.0) if need <= free_ram_gb else None
+        overhead = processes * tuner.PROCESS_RAM_GB_SLIM
+        if self.flat_nodes:
+            cache = 0.0
+        else:
+            cache = min(self.slim_cache_gb, free_ram_gb - overhead)
+            if cache < min(self.slim_cache_gb, MIN_SLIM_CACHE_GB):
+                return None
+        need = cache + overhead
+        return (need, cache) if need <= free_ram_gb else None
+
+
+class ScheduledJob():
+    """An import placed by :func:`schedule`.
+
+    Attributes
+    -----------------------
+    job : ImportJob
+    host : HostSpec
+    mode : str
+        ``ram`` or ``slim``.
+    start_seconds : float
+    end_seconds : float
+    ram_gb : float
+        RAM reserved on the host while running.
+    cache_gb : float
+        ``--cache`` in slim mode.
+    processes : int
+    temp_disk_gb : float
+        Middle tables and flat nodes file, released at the end.
+    output_disk_gb : float
+    flat_nodes : bool
+    """
+    def __init__(self, job: ImportJob, host: HostSpec, mode: str,
+                 start_seconds: float, end_seconds: float, ram_gb: float,
+                 cache_gb: float, processes: int, temp_disk_gb: float,
+                 output_disk_gb: float, flat_nodes: bool):
+        self.job = job
+        self.host = host
+        self.mode = mode
+        self.start_seconds = start_seconds
+        self.end_seconds = end_seconds
+        self.ram_gb = ram_gb
+        self.cache_gb = cache_gb
+        self.processes = processes
+        self.temp_disk_gb = temp_disk_gb
+        self.output_disk_gb = output_disk_gb
+        self.flat_nodes = flat_nodes
+
+    @property
+    def flat_nodes_path(self) -> str:
+        """Flat nodes file for this import, None when not used."""
+        if not self.flat_nodes:
+            return None
+        return os.path.join(self.host.flat_nodes_dir, f'{self.job.name}.nodes')
+
+    def get_recommendation(self) -> tuner.Recommendation:
+        """Returns a ``Recommendation`` set to the scheduled mode and resources.
+
+        Returns
+        -----------------------
+        rec : osm2pgsql_tuner.tuner.Recommendation
+        """
+        rec = _recommendation(self.job, self.host)
+        rec.osm2pgsql_run_in_ram = self.mode == 'ram'
+        rec.osm2pgsql_drop = self.mode == 'slim'
+        rec.osm2pgsql_flat_nodes = self.flat_nodes
+        rec.osm2pgsql_limited_ram = False
+        rec.osm2pgsql_slim_cache = self.cache_gb
+        rec.osm2pgsql_number_processes = self.processes
+        if self.flat_nodes:
+            rec.flat_nodes_path = self.flat_nodes_path
+        rec.decisions.append(tuner.Decision(tuner.ScheduleDecision.HOST,
+                                           host=self.host.name, mode=self.mode,
+                                           ram_gb=self.ram_gb, processes=self.processes))
+        return rec
+
+    def get_index_plan(self):
+        """Returns the index build plan on the scheduled host.
+
+        Returns
+        -----------------------
+        index_plan : osm2pgsql_tuner.indexplan.IndexPlan or None
+            None w/out a ``style_analysis`` on the job.
+        """
+        if self.job.style_analysis is None:
+            return None
+        return get_index_plan(self.job, self.host)
+
+    def get_osm2pgsql_command(self) -> str:
+        """Builds the osm2pgsql command for the scheduled mode.
+
+        Returns
+        -----------------------
+        cmd : str
+        """
+        pbf_path = self.job.pbf_path or '$PBF_PATH'
+        return self.get_recommendation().get_osm2pgsql_command(pbf_path=pbf_path)
+
+    def to_dict(self) -> dict:
+        """Returns the placement as a JSON serializable dictionary.
+
+        Returns
+        ----------------------
+        scheduled : dict
+        """
+        return {'name': self.job.name,
+                'host': self.host.name,
+                'mode': self.mode,
+                'start_seconds': self.start_seconds,
+                'end_seconds': self.end_seconds,
+                'ram_gb': self.ram_gb,
+                'cache_gb': self.cache_gb,
+                'processes': self.processes,
+                'temp_disk_gb': self.temp_disk_gb,
+                'output_disk_gb': self.output_disk_gb,
+                'flat_nodes_path': self.flat_nodes_path,
+                'command': self.get_osm2pgsql_command()}
+
+
+class SchedulePlan():
+    """Execution plan returned by :func:`schedule`.
+
+    Attributes
+    -----------------------
+    scheduled : list of ScheduledJob
+        Sorted by start time.
+    unscheduled : list of tuple
+        ``(ImportJob, reason)`` for imports that fit no host.
+    """
+    def __init__(self, scheduled: list, unscheduled: list):
+        self.scheduled = sorted(scheduled, key=lambda s: (s.start_seconds, s.host.name))
+        self.unscheduled = unscheduled
+
+    @property
+    def makespan_seconds(self) -> float:
+        """Time until the last import finishes."""
+        return max((s.end_seconds for s in self.scheduled), default=0.0)
+
+    def by_host(self) -> dict:
+        """Returns scheduled imports grouped by host name.
+
+        Returns
+        ----------------------
+        plan : dict
+        """
+        plan = {}
+        for scheduled in self.scheduled:
+            plan.setdefault(scheduled.host.name, []).append(scheduled)
+        return plan
+
+    def to_dict(self) -> dict:
+        """Returns the plan as a JSON serializable dictionary.
+
+        Returns
+        ----------------------
+        plan : dict
+        """
+        return {'makespan_seconds': self.makespan_seconds,
+                'scheduled': [scheduled.to_dict() for scheduled in self.scheduled],
+                'unscheduled': [{'name': job.name, 'reason': reason}
+                                for job, reason in self.unscheduled]}
+
+
+class _HostState():
+    """Free resources of a host during the simulation."""
+    def __init__(self, host: HostSpec):
+        # Empty input, only the RAM budget of the host is needed
+        rec = tuner.Recommendation(host.ram_gb, 0.0, postgres_ram_gb=host.postgres_ram_gb)
+        self.host = host
+        self.free_ram_gb = rec.osm2pgsql_cache_max
+        self.free_cpu = host.cpu_count
+        self.free_disk_gb = host.disk_gb
+
+
+def _best_option(sizes: dict, states: list, processes_wanted: int, now: float):
+    """Returns the placement finishing earliest, None when nothing fits now."""
+    best = None
+    for state in states:
+        if state.free_cpu < 1:
+            continue
+        size = sizes[state.host.name]
+        processes = max(1, min(state.free_cpu, processes_wanted))
+        for mode in size.modes:
+            temp_gb, output_gb = size.disk_gb[mode]
+            if temp_gb + output_gb > state.free_disk_gb:
+                continue
+            for candidate in sorted({processes, 1}, reverse=True):
+                ram = size.ram_gb(mode, candidate, state.free_ram_gb)
+                if ram is None:
+                    continue
+                end = now + size.seconds(mode, candidate)
+                if best is None or end < best[0]:
+                    best = (end, state, mode, candidate, ram, temp_gb, output_gb, size.flat_nodes)
+                break
+    return best
+
+
+def _fits_empty_host(sizes: dict, hosts: list) -> bool:
+    """True when the job fits at least one idle host."""
+    for host in hosts:
+        size = sizes[host.name]
+        for mode in size.modes:
+            temp_gb, output_gb = size.disk_gb[mode]
+            if (temp_gb + output_gb <= host.disk_gb
+                    and size.ram_gb(mode, 1, size.cache_max_gb) is not None):
+                return True
+    return False
+
+
+def schedule(jobs, hosts, plan_indexes: bool=False, root: str='/') -> SchedulePlan:
+    """Packs imports onto hosts to minimize the total makespan.
+
+    Parameters
+    -----------------------
+    jobs : list of ImportJob
+    hosts : list of HostSpec
+    plan_indexes : bool
+        (Default False) Use :mod:`osm2pgsql_tuner.indexplan` for the
+        post-processing time and index disk of jobs with a ``style_analysis``.
+    root : str
+        (Default ``/``) Filesystem root to read ``/proc`` and ``/sys`` from
+        when checking ``flat_nodes_dir`` of the hosts.
+
+    Returns
+    -----------------------
+    plan : SchedulePlan
+    """
+    hosts = list(hosts)
+    if not hosts:
+        raise ValueError('At least one host is required.')
+    names = [job.name for job in jobs]
+    if len(set(names)) != len(names):
+        raise ValueError('Job names must be unique.')
+
+    problems = {host.name: host.check_flat_nodes_dir(root=root) for host in hosts}
+    sizes = {}
+    unscheduled = []
+    queue = []
+    for job in jobs:
+        job_sizes = {host.name: _JobOnHost(job, host, plan_indexes, problems[host.name])
+                     for host in hosts}
+        if not _fits_empty_host(job_sizes, hosts):
+            reason = 'Does not fit the RAM or disk of any host'
+            flat_nodes_problems = sorted({size.problem for size in job_sizes.values()
+                                          if size.problem is not None})
+            if flat_nodes_problems:
+                reason += ', --flat-nodes: ' + '; '.join(flat_nodes_problems)
+            unscheduled.append((job, reason))
+            continue
+        sizes[job.name] = job_sizes
+        best_seconds = min(size.seconds('ram' if size.noslim_gb <= size.cache_max_gb else 'slim', 1)
+                           for size in job_sizes.values())
+        queue.append((best_seconds, job))
+    # Longest processing time first
+    queue.sort(key=lambda item: (-item[0], item[1].name))
+    queue = [job for _, job in queue]
+
+    states = [_HostState(host) for host in hosts]
+    total_cpu = sum(host.cpu_count for host in hosts)
+    running = []
+    scheduled = []
+    now = 0.0
+    while queue:
+        index = 0
+        misses = 0
+        free_cpu = sum(state.free_cpu for state in states)
+        while index < len(queue) and misses < LOOKAHEAD and free_cpu > 0:
+            job = queue[index]
+            processes_wanted = max(1, total_cpu // (len(queue) - index + len(running)))
+            best = _best_option(sizes[job.name], states, processes_wanted, now)
+            if best is None:
+                index += 1
+                misses += 1
+                continue
+            end, state, mode, processes, (ram_gb, cache_gb), temp_gb, output_gb, flat_nodes = best
+            state.free_ram_gb -= ram_gb
+            state.free_cpu -= processes
+            state.free_disk_gb -= temp_gb + output_gb
+            free_cpu -= processes
+            entry = ScheduledJob(job=job, host=state.host, mode=mode,
+                                 start_seconds=now, end_seconds=end, ram_gb=ram_gb,
+                                 cache_gb=cache_gb, processes=processes,
+                                 temp_disk_gb=temp_gb, output_disk_gb=output_gb,
+                                 flat_nodes=flat_nodes and mode == 'slim')
+            scheduled.append(entry)
+            heapq.heappush(running, (end, len(scheduled), entry, state))
+            del queue[index]
+        if not queue:
+            break
+        if not running:
+            # Output tables of finished imports left too little disk
+            unscheduled.extend((job, 'Not enough disk left after earlier imports')
+                               for job in queue)
+            break
+        now, _, entry, state = heapq.heappop(running)
+        _release(entry, state)
+        while running and running[0][0] <= now:
+            _, _, entry, state = heapq.heappop(running)
+            _release(entry, state)
+
+    return SchedulePlan(scheduled, unscheduled)
+
+
+def _release(entry: ScheduledJob, state: _HostState):
+    """Returns resources of a finished import to its host."""
+    state.free_ram_gb += entry.ram_gb
+    state.free_cpu += entry.processes
+    state.free_disk_gb += entry.temp_disk_gb
@@ -0,0 +1,391 @@
+"""Asyncio HTTP service returning recommendations as JSON.
+
+Uses only the standard library.  Most requests repeat with nearly identical
+inputs, so inputs are quantized (RAM down to ``RAM_STEP_GB``, PBF size up to
+``PBF_STEP_GB``) and the serialized response is kept in a bounded LRU cache.
+Rounding RAM down and the PBF size up keeps the cached advice on the safe side.
+
+Endpoints
+-----------------------
+``GET /api/v1/recommendation?system_ram_gb=8&osm_pbf_gb=0.2``
+    Optional parameters: ``ssd``, ``slim_no_drop``, ``append_first_run``,
+    ``pgosm_layer_set``, ``cpu_count`` and ``pbf_path`` (only used in the command).
+
+``GET /api/v1/stats``
+    Cache hit/miss counters and request latency.
+"""
+import asyncio
+import collections
+import json
+import math
+import time
+import urllib.parse
+
+from osm2pgsql_tuner import tuner
+
+
+RAM_STEP_GB = 0.5
+"""float : RAM is rounded down to a multiple of this value before lookup."""
+
+PBF_STEP_GB = 10 / 1024
+"""float : PBF size is rounded up to a multiple of this value (10 MB) before lookup."""
+
+DEFAULT_CACHE_SIZE = 4096
+"""int : Number of responses kept by :class:`LRUCache`."""
+
+LATENCY_WINDOW = 4096
+"""int : Number of recent request latencies used for percentiles in ``/api/v1/stats``."""
+
+MAX_HEADER_BYTES = 16384
+"""int : Requests with larger headers are rejected."""
+
+MAX_BODY_BYTES = 1024
+"""int : Requests with a larger body are rejected; the API only serves ``GET``."""
+
+RECOMMENDATION_PATH = '/api/v1/recommendation'
+STATS_PATH = '/api/v1/stats'
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+            405: 'Method Not Allowed', 413: 'Payload Too Large',
+            431: 'Request Header Fields Too Large'}
+
+_BOOL_VALUES = {'true': True, '1': True, 'yes': True,
+                'false': False, '0': False, 'no': False}
+
+
+class LRUCache():
+    """Least recently used cache with a bounded number of entries.
+
+    Parameters
+    -----------------------
+    maxsize : int
+        (Default ``DEFAULT_CACHE_SIZE``) Entries kept before evicting the
+        least recently used.
+    """
+    def __init__(self, maxsize: int=DEFAULT_CACHE_SIZE):
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1.')
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        """Returns the cached value for ``key`` or None, counting hits and misses."""
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Stores ``value``, evicting the least recently used entry when full."""
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def to_dict(self) -> dict:
+        """Returns the cache counters.
+
+        Returns
+        ----------------------
+        counters : dict
+        """
+        lookups = self.hits + self.misses
+        return {'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else None}
+
+
+def percentile(values, pct: float) -> float:
+    """Returns the nearest-rank percentile of ``values``, None when empty.
+
+    Parameters
+    -----------------------
+    values : iterable of float
+    pct : float
+        Percentile between 0 and 100.
+
+    Returns
+    -----------------------
+    value : float or None
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def quantize_ram_gb(system_ram_gb: float) -> float:
+    """Rounds RAM down to a multiple of ``RAM_STEP_GB``."""
+    return (system_ram_gb // RAM_STEP_GB) * RAM_STEP_GB
+
+
+def quantize_pbf_gb(osm_pbf_gb: float) -> float:
+    """Rounds the PBF size up to a multiple of ``PBF_STEP_GB``."""
+    steps = -(-osm_pbf_gb // PBF_STEP_GB)
+    return round(steps * PBF_STEP_GB, 6)
+
+
+def _parse_bool(params: dict, name: str, default):
+    """Returns a boolean query parameter."""
+    value = params.get(name)
+    if value is None:
+        return default
+    try:
+        return _BOOL_VALUES[value.lower()]
+    except KeyError:
+        raise ValueError(f'{name} must be true or false, got {value!r}') from None
+
+
+def _parse_number(params: dict, name: str, cast, default=None):
+    """Returns a numeric query parameter."""
+    value = params.get(name)
+    if value is None:
+        if default is None:
+            raise ValueError(f'{name} is required.')
+        return default
+    try:
+        number = cast(value)
+    except ValueError:
+        raise ValueError(f'{name} must be a number, got {value!r}') from None
+    # float() accepts nan and inf, nan passes every comparison
+    if not math.isfinite(number) or number <= 0:
+        raise ValueError(f'{name} must be a positive number, got {value!r}')
+    return number
+
+
+def parse_query(query: str) -> dict:
+    """Parses and quantizes the recommendation query string.
+
+    Parameters
+    -----------------------
+    query : str
+        URL query string without the leading ``?``.
+
+    Returns
+    -----------------------
+    inputs : dict
+        Keyword arguments for :class:`osm2pgsql_tuner.tuner.Recommendation`
+        plus ``pbf_path``.
+    """
+    params = {key: values[-1] for key, values
+              in urllib.parse.parse_qs(query, keep_blank_values=True).items()}
+    cpu_count = params.get('cpu_count')
+    return {'system_ram_gb': quantize_ram_gb(_parse_number(params, 'system_ram_gb', float)),
+            'osm_pbf_gb': quantize_pbf_gb(_parse_number(params, 'osm_pbf_gb', float)),
+            'ssd': _parse_bool(params, 'ssd', True),
+            'slim_no_drop': _parse_bool(params, 'slim_no_drop', False),
+            'append_first_run': _parse_bool(params, 'append_first_run', None),
+            'pgosm_layer_set': params.get('pgosm_layer_set') or 'run',
+            'cpu_count': None if cpu_count is None else _parse_number(params, 'cpu_count', int),
+            'pbf_path': params.get('pbf_path') or '$PBF_PATH'}
+
+
+def build_response(inputs: dict) -> bytes:
+    """Runs the recommendation and returns the serialized JSON body.
+
+    Parameters
+    -----------------------
+    inputs : dict
+        Output of :func:`parse_query`.
+
+    Returns
+    -----------------------
+    body : bytes
+    """
+    kwargs = dict(inputs)
+    pbf_path = kwargs.pop('pbf_path')
+    rec = tuner.Recommendation(**kwargs)
+    result = {'command': rec.get_osm2pgsql_command(pbf_path=pbf_path),
+              'recommendation': rec.to_dict(),
+              'decisions': rec.get_decisions()}
+    return json.dumps(result).encode('utf-8')
+
+
+class RecommendationService():
+    """HTTP/1.1 service with keep-alive, one instance per listening socket.
+
+    Parameters
+    -----------------------
+    cache_size : int
+        (Default ``DEFAULT_CACHE_SIZE``) Responses kept in the LRU cache.
+    """
+    def __init__(self, cache_size: int=DEFAULT_CACHE_SIZE):
+        self.cache = LRUCache(cache_size)
+        self.requests = 0
+        self.errors = 0
+        self.latencies_ms = collections.deque(maxlen=LATENCY_WINDOW)
+        self.started = time.monotonic()
+
+    def stats(self) -> dict:
+        """Returns request, latency and cache counters.
+
+        Returns
+        ----------------------
+        stats : dict
+        """
+        latencies = list(self.latencies_ms)
+        return {'requests': self.requests,
+                'errors': self.errors,
+                'uptime_seconds': time.monotonic() - self.started,
+                'latency_ms': {'window': len(latencies),
+                               'p50': percentile(latencies, 50),
+                               'p99': percentile(latencies, 99),
+                               'max': max(latencies) if latencies else None},
+                'cache': self.cache.to_dict()}
+
+    def handle(self, method: str, target: str) -> tuple:
+        """Routes one request.
+
+        Parameters
+        -----------------------
+        method : str
+        target : str
+            Request target incl. query string.
+
+        Returns
+        -----------------------
+        response : tuple
+            ``(status, body, cache_status)``, ``cache_status`` is ``HIT``,
+            ``MISS`` or None.
+        """
+        url = urllib.parse.urlsplit(target)
+        if url.path not in (RECOMMENDATION_PATH, STATS_PATH):
+            return 404, _error_body(f'Unknown path {url.path}'), None
+        if method != 'GET':
+            return 405, _error_body('Only GET is supported'), None
+        if url.path == STATS_PATH:
+            return 200, json.dumps(self.stats()).encode('utf-8'), None
+
+        try:
+            inputs = parse_query(url.query)
+        except ValueError as err:
+            return 400, _error_body(str(err)), None
+        key = tuple(sorted(inputs.items()))
+        body = self.cache.get(key)
+        if body is not None:
+            return 200, body, 'HIT'
+        try:
+            body = build_response(inputs)
+        except ValueError as err:
+            return 400, _error_body(str(err)), None
+        self.cache.put(key, body)
+        return 200, body, 'MISS'
+
+    async def serve_client(self, reader: asyncio.StreamReader,
+                           writer: asyncio.StreamWriter):
+        """Serves requests on one connection until it closes."""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except asyncio.IncompleteReadError:
+                    break
+                except asyncio.LimitOverrunError:
+                    writer.write(_http_response(431, _error_body('Headers too large'),
+                                                None, keep_alive=False))
+                    break
+                start = time.perf_counter()
+                lines = head.decode('latin-1').split('\r\n')
+                parts = lines[0].split(' ')
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = headers.get('content-length') or '0'
+                if not length.isdigit():
+                    # Body length unknown, the connection cannot be reused
+                    self.requests += 1
+                    self.errors += 1
+                    writer.write(_http_response(400, _error_body('Invalid Content-Length'),
+                                                None, keep_alive=False))
+                    break
+                if int(length) > MAX_BODY_BYTES:
+                    # Rejected before reading, the unread body makes the connection unusable
+                    self.requests += 1
+                    self.errors += 1
+                    writer.write(_http_response(413, _error_body('Request body too large'),
+                                                None, keep_alive=False))
+                    break
+                if int(length):
+                    await reader.readexactly(int(length))
+
+                if len(parts) != 3:
+                    status, body, cache_status = 400, _error_body('Malformed request line'), None
+                else:
+                    status, body, cache_status = self.handle(parts[0], parts[1])
+                keep_alive = (headers.get('connection', '').lower() != 'close'
+                              and len(parts) == 3 and parts[2] == 'HTTP/1.1')
+
+                self.requests += 1
+                if status != 200:
+                    self.errors += 1
+                writer.write(_http_response(status, body, cache_status, keep_alive))
+                self.latencies_ms.append((time.perf_counter() - start) * 1000)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str='127.0.0.1', port: int=8080) -> asyncio.AbstractServer:
+        """Starts listening, port 0 picks a free port.
+
+        Returns
+        -----------------------
+        server : asyncio.AbstractServer
+        """
+        return await asyncio.start_server(self.serve_client, host, port,
+                                          limit=MAX_HEADER_BYTES)
+
+
+def _error_body(message: str) -> bytes:
+    """Returns a JSON error body."""
+    return json.dumps({'error': message}).encode('utf-8')
+
+
+def _http_response(status: int, body: bytes, cache_status: str,
+                   keep_alive: bool) -> bytes:
+    """Builds the raw HTTP response."""
+    head = (f'HTTP/1.1 {status} {_REASONS[status]}\r\n'
+            'Content-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f'Connection: {"keep-alive" if keep_alive else "close"}\r\n')
+    if cache_status is not None:
+        head += f'X-Cache: {cache_status}\r\n'
+    return head.encode('latin-1') + b'\r\n' + body
+
+
+async def serve(host: str='127.0.0.1', port: int=8080,
+                cache_size: int=DEFAULT_CACHE_SIZE):
+    """Runs the service until cancelled.
+
+    Parameters
+    -----------------------
+    host : str
+        (Default ``127.0.0.1``)
+    port : int
+        (Default 8080)
+    cache_size : int
+        (Default ``DEFAULT_CACHE_SIZE``)
+    """
+    service = RecommendationService(cache_size=cache_size)
+    server = await service.start(host, port)
+    async with server:
+        await server.serve_forever()
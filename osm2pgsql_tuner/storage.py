@@ -0,0 +1,531 @@
+"""Storage I/O probe and tablespace layout for osm2pgsql.
+
+The ``ssd`` flag only separates spinning disks from everything else, while
+NVMe, SATA SSD and network block storage differ by an order of magnitude
+in random reads.  :func:`probe` measures a candidate directory in a few
+seconds: sequential writes of a scratch file, then random 4K and 8K reads
+of it, bypassing the page cache with ``O_DIRECT`` where supported.  Reads
+are issued one at a time (queue depth 1), like the lookups osm2pgsql makes
+in the flat nodes file and the slim middle tables.
+
+:func:`flat_nodes_gb` turns the measured 4K random reads into the PBF size
+from which ``--flat-nodes`` is used, replacing the SSD/HDD thresholds when
+a probe is passed as ``Recommendation(storage=...)``.  :func:`plan` places
+the flat nodes file and the ``--tablespace-slim-data/index`` and
+``--tablespace-main-data/index`` tablespaces on the probed directories.
+"""
+import errno
+import math
+import mmap
+import os
+import random
+import tempfile
+import time
+
+from osm2pgsql_tuner import host, preflight, tuner
+
+
+PROBE_MB = 64
+"""int : Size of the scratch file written by :func:`probe`, in MB."""
+
+PROBE_READS = 2000
+"""int : Random reads per block size made by :func:`probe`."""
+
+PROBE_SECONDS = 3.0
+"""float : Time limit of each probe phase, the phase stops early when reached."""
+
+WRITE_CHUNK_BYTES = 1024**2
+"""int : Size of each sequential write."""
+
+READ_BLOCK_SIZES = (4096, 8192)
+"""tuple : Random read sizes, the flat nodes page and the PostgreSQL page."""
+
+SCRATCH_PREFIX = '.osm2pgsql-tuner-probe-'
+"""str : Prefix of the scratch file, removed when the probe ends."""
+
+FAST_READ_IOPS = 10_000
+"""float : 4K random reads/s from which ``--flat-nodes`` is used from ``FLAT_NODES_THRESHOLD_GB``.
+
+Typical of NVMe at queue depth 1.
+"""
+
+SLOW_READ_IOPS = 200
+"""float : 4K random reads/s up to which ``--flat-nodes`` is used only from ``FLAT_NODES_ALWAYS_GB``.
+
+Typical of a spinning disk.
+"""
+
+STORAGE_TIERS = ((10_000, 'nvme'), (2_500, 'ssd'), (500, 'network'), (0, 'hdd'))
+"""tuple : ``(min_read_4k_iops, tier)``, labels the probed storage."""
+
+SHARED_DEVICE_PENALTY = 0.5
+"""float : Share of its score a device keeps for each role already placed on it."""
+
+MIDDLE_INDEX_SHARE = 0.4
+"""float : Share of the slim middle tables used by their indexes."""
+
+OUTPUT_INDEX_SHARE = 0.25
+"""float : Share of the output tables used by their indexes."""
+
+TABLESPACE_PREFIX = 'osm2pgsql_'
+"""str : Prefix of the planned tablespace names, e.g. ``osm2pgsql_slim_data``."""
+
+ROLES = ('flat_nodes', 'slim_data', 'slim_index', 'main_data', 'main_index')
+"""tuple : Roles in the order :func:`plan` places them, most latency sensitive first."""
+
+ROLE_METRIC = {'flat_nodes': 'read_4k_iops',
+               'slim_data': 'read_8k_iops',
+               'slim_index': 'read_8k_iops',
+               'main_data': 'seq_write_mb_s',
+               'main_index': 'read_8k_iops'}
+"""dict : :class:`IoProbe` attribute ranking the directories for each role."""
+
+SLIM_ROLES = ('slim_data', 'slim_index')
+"""tuple : Roles of the slim middle tables, not used when running in RAM."""
+
+_DIRECT_SUPPORTED = hasattr(os, 'O_DIRECT') and hasattr(os, 'preadv')
+
+
+class IoProbe():
+    """Measured throughput of one directory.
+
+    Parameters
+    -----------------------
+    path : str
+    seq_write_mb_s : float
+        Sequential write throughput, incl. ``fsync``, in MB/s.
+    read_4k_iops : float
+        Random 4K reads per second at queue depth 1.
+    read_8k_iops : float
+        Random 8K reads per second at queue depth 1.
+    direct : bool
+        (Default True) Measured with ``O_DIRECT``.  When False reads may
+        have been served from the page cache and overstate the storage.
+    probe_bytes : int
+        (Default None) Size of the scratch file.
+    """
+    def __init__(self, path: str, seq_write_mb_s: float, read_4k_iops: float,
+                 read_8k_iops: float, direct: bool=True, probe_bytes: int=None):
+        self.path = path
+        self.seq_write_mb_s = seq_write_mb_s
+        self.read_4k_iops = read_4k_iops
+        self.read_8k_iops = read_8k_iops
+        self.direct = direct
+        self.probe_bytes = probe_bytes
+
+    @property
+    def tier(self) -> str:
+        """Storage label from ``STORAGE_TIERS``, e.g. ``nvme`` or ``hdd``."""
+        for min_iops, tier in STORAGE_TIERS:
+            if self.read_4k_iops >= min_iops:
+                return tier
+        return STORAGE_TIERS[-1][1]
+
+    def flat_nodes_gb(self) -> float:
+        """PBF size from which ``--flat-nodes`` is used on this storage, see :func:`flat_nodes_gb`."""
+        return flat_nodes_gb(self.read_4k_iops)
+
+    def to_dict(self) -> dict:
+        """Returns the measurements as a dictionary.
+
+        Returns
+        ----------------------
+        probe : dict
+        """
+        probe = dict(vars(self))
+        probe['tier'] = self.tier
+        return probe
+
+
+def flat_nodes_gb(read_4k_iops: float) -> float:
+    """Returns the PBF size from which ``--flat-nodes`` is used in slim mode.
+
+    ``FLAT_NODES_THRESHOLD_GB`` from ``FAST_READ_IOPS``, ``FLAT_NODES_ALWAYS_GB``
+    up to ``SLOW_READ_IOPS`` and interpolated on a log scale in between.
+
+    Parameters
+    -----------------------
+    read_4k_iops : float
+
+    Returns
+    -----------------------
+    threshold_gb : float
+    """
+    if read_4k_iops >= FAST_READ_IOPS:
+        return tuner.FLAT_NODES_THRESHOLD_GB
+    if read_4k_iops <= SLOW_READ_IOPS:
+        return tuner.FLAT_NODES_ALWAYS_GB
+    share = math.log(read_4k_iops / SLOW_READ_IOPS) / math.log(FAST_READ_IOPS / SLOW_READ_IOPS)
+    return (tuner.FLAT_NODES_ALWAYS_GB
+            - share * (tuner.FLAT_NODES_ALWAYS_GB - tuner.FLAT_NODES_THRESHOLD_GB))
+
+
+def _write(scratch: str, buffer, size_bytes: int, time_limit: float,
+           direct: bool) -> tuple:
+    """Writes ``buffer`` to ``scratch`` until ``size_bytes`` or ``time_limit``.
+
+    Returns
+    -----------------------
+    written_seconds : tuple
+        ``(written_bytes, seconds)``, seconds incl. ``fsync``.
+    """
+    flags = os.O_WRONLY | (os.O_DIRECT if direct else 0)
+    fd = os.open(scratch, flags)
+    try:
+        written = 0
+        start = time.perf_counter()
+        while written < size_bytes:
+            written += os.write(fd, buffer)
+            if time.perf_counter() - start > time_limit:
+                break
+        os.fsync(fd)
+        seconds = time.perf_counter() - start
+        if not direct and hasattr(os, 'posix_fadvise'):
+            # Best effort, drops the written pages so reads reach the storage
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return written, seconds
+
+
+def _random_reads(scratch: str, buffer, size_bytes: int, block_size: int,
+                  reads: int, time_limit: float, direct: bool, rng) -> float:
+    """Reads random aligned blocks of ``scratch``, returns reads per second."""
+    blocks = size_bytes // block_size
+    flags = os.O_RDONLY | (os.O_DIRECT if direct else 0)
+    fd = os.open(scratch, flags)
+    try:
+        with memoryview(buffer)[:block_size] as view:
+            count = 0
+            start = time.perf_counter()
+            for _ in range(reads):
+                offset = rng.randrange(blocks) * block_size
+                if direct:
+                    # O_DIRECT needs the page aligned mmap buffer
+                    os.preadv(fd, [view], offset)
+                else:
+                    os.pread(fd, block_size, offset)
+                count += 1
+                if time.perf_counter() - start > time_limit:
+                    break
+            seconds = time.perf_counter() - start
+    finally:
+        os.close(fd)
+    return count / seconds if seconds > 0 else float('inf')
+
+
+def probe(path: str, size_mb: float=PROBE_MB, reads: int=PROBE_READS,
+          time_limit: float=PROBE_SECONDS, seed: int=0) -> IoProbe:
+    """Measures sequential writes and random reads of the storage holding ``path``.
+
+    A scratch file is written in the nearest existing directory and removed
+    afterwards.  Each phase stops at ``time_limit``, so slow storage is
+    measured on a smaller file instead of blocking.
+
+    Parameters
+    -----------------------
+    path : str
+        Directory to measure, need not exist yet.
+    size_mb : float
+        (Default ``PROBE_MB``) Size of the scratch file.  Larger files make
+        it less likely that reads hit a drive cache.
+    reads : int
+        (Default ``PROBE_READS``) Random reads per block size.
+    time_limit : float
+        (Default ``PROBE_SECONDS``)
+    seed : int
+        (Default 0) Seed of the random read offsets.
+
+    Returns
+    -----------------------
+    probe : IoProbe
+    """
+    directory = host.existing_parent(path)
+    if directory is None:
+        raise ValueError(f'No existing directory to probe for {path}')
+    size_bytes = max(WRITE_CHUNK_BYTES,
+                     int(size_mb * 1024**2) // WRITE_CHUNK_BYTES * WRITE_CHUNK_BYTES)
+
+    fd, scratch = tempfile.mkstemp(prefix=SCRATCH_PREFIX, dir=directory)
+    os.close(fd)
+    # Anonymous maps are page aligned as O_DIRECT requires, random data
+    # keeps compressing or deduplicating storage honest
+    buffer = mmap.mmap(-1, WRITE_CHUNK_BYTES)
+    buffer.write(os.urandom(WRITE_CHUNK_BYTES))
+    try:
+        direct = _DIRECT_SUPPORTED
+        try:
+            written, write_seconds = _write(scratch, buffer, size_bytes,
+                                            time_limit, direct)
+        except OSError as err:
+            # e.g. tmpfs rejects O_DIRECT
+            if not direct or err.errno != errno.EINVAL:
+                raise
+            direct = False
+            written, write_seconds = _write(scratch, buffer, size_bytes,
+                                            time_limit, direct)
+        rng = random.Random(seed)
+        iops = {block_size: _random_reads(scratch, buffer, written, block_size,
+                                          reads, time_limit, direct, rng)
+                for block_size in READ_BLOCK_SIZES}
+    finally:
+        buffer.close()
+        os.remove(scratch)
+
+    return IoProbe(path=path, seq_write_mb_s=written / 1024**2 / write_seconds,
+                   read_4k_iops=iops[4096], read_8k_iops=iops[8192],
+                   direct=direct, probe_bytes=written)
+
+
+def probe_dirs(paths, **kwargs) -> dict:
+    """Probes each directory, see :func:`probe`.
+
+    Returns
+    -----------------------
+    probes : dict
+        Path to :class:`IoProbe`.
+    """
+    return {path: probe(path, **kwargs) for path in paths}
+
+
+def fastest(probes) -> IoProbe:
+    """Returns the probe with the most 4K random reads, the best flat nodes location.
+
+    Parameters
+    -----------------------
+    probes : iterable of IoProbe
+
+    Returns
+    -----------------------
+    probe : IoProbe
+    """
+    return max(probes, key=lambda io_probe: io_probe.read_4k_iops)
+
+
+class Placement():
+    """Location planned for one role.
+
+    Parameters
+    -----------------------
+    role : str
+        One of ``ROLES``.
+    path : str
+        Directory holding the role's data.
+    size_bytes : int
+        Estimated size.
+    tablespace : str
+        Tablespace name, None for the flat nodes file and for roles kept in
+        the default tablespace of ``database_dir``.
+    """
+    def __init__(self, role: str, path: str, size_bytes: int, tablespace: str):
+        self.role = role
+        self.path = path
+        self.size_bytes = size_bytes
+        self.tablespace = tablespace
+
+    @property
+    def location(self) -> str:
+        """Directory for ``CREATE TABLESPACE``, None w/out a tablespace."""
+        if self.tablespace is None:
+            return None
+        return os.path.join(self.path, self.tablespace)
+
+    def to_dict(self) -> dict:
+        """Returns the placement as a dictionary.
+
+        Returns
+        ----------------------
+        placement : dict
+        """
+        placement = dict(vars(self))
+        placement['location'] = self.location
+        return placement
+
+
+class TablespacePlan():
+    """Outcome of :func:`plan`.
+
+    Parameters
+    -----------------------
+    placements : dict
+        Role to :class:`Placement`, roles not needed by the import are missing.
+    probes : dict
+        Path to :class:`IoProbe` of the candidates.
+    """
+    def __init__(self, placements: dict, probes: dict):
+        self.placements = placements
+        self.probes = probes
+        self.problems = []
+
+    @property
+    def fits(self) -> bool:
+        """True when every role has a location."""
+        return not self.problems
+
+    @property
+    def flat_nodes_path(self) -> str:
+        """Planned flat nodes file, None when not used or nothing fits."""
+        placement = self.placements.get('flat_nodes')
+        if placement is None:
+            return None
+        return os.path.join(placement.path, preflight.FLAT_NODES_FILENAME)
+
+    def osm2pgsql_args(self, output: str='flex') -> list:
+        """Returns the ``--tablespace-*`` options for osm2pgsql.
+
+        ``--tablespace-main-data/index`` only apply to the ``pgsql`` output.
+        Flex styles set ``data_tablespace`` and ``index_tablespace`` of their
+        tables instead, see ``placements``.
+
+        Parameters
+        -----------------------
+        output : str
+            (Default flex) osm2pgsql ``--output``.
+
+        Returns
+        -----------------------
+        args : list of str
+        """
+        roles = ROLES[1:] if output == 'pgsql' else SLIM_ROLES
+        return [f'--tablespace-{role.replace("_", "-")}={self.placements[role].tablespace}'
+                for role in roles
+                if role in self.placements and self.placements[role].tablespace is not None]
+
+    def create_sql(self) -> list:
+        """Returns ``CREATE TABLESPACE`` statements for the planned tablespaces.
+
+        The locations must exist, be empty and be owned by the ``postgres``
+        user before running them.
+
+        Returns
+        -----------------------
+        statements : list of str
+        """
+        return [f"CREATE TABLESPACE {placement.tablespace} LOCATION '{placement.location}';"
+                for placement in self.placements.values()
+                if placement.tablespace is not None]
+
+    def to_dict(self) -> dict:
+        """Returns the plan as a JSON serializable dictionary.
+
+        Returns
+        ----------------------
+        plan : dict
+        """
+        return {'placements': {role: placement.to_dict()
+                               for role, placement in self.placements.items()},
+                'flat_nodes_path': self.flat_nodes_path,
+                'osm2pgsql_args': self.osm2pgsql_args(),
+                'create_sql': self.create_sql(),
+                'fits': self.fits,
+                'problems': list(self.problems),
+                'probes': {path: io_probe.to_dict()
+                           for path, io_probe in self.probes.items()}}
+
+
+def role_sizes(rec) -> dict:
+    """Estimates the disk used by each role of an import, in bytes.
+
+    Uses the sizing of :mod:`osm2pgsql_tuner.preflight`.
+
+    Parameters
+    -----------------------
+    rec : osm2pgsql_tuner.tuner.Recommendation
+
+    Returns
+    -----------------------
+    sizes : dict
+        Role to bytes, only the roles the import uses.
+    """
+    sizes = {}
+    use_flat_nodes = rec.osm2pgsql_flat_nodes
+    if use_flat_nodes:
+        max_node_id = preflight.known_max_node_id(rec.pbf_stats)
+        sizes['flat_nodes'] = preflight.flat_nodes_bytes(max_node_id)
+    if not rec.osm2pgsql_run_in_ram:
+        middle_gb_factor = 1.0
+        if rec.version_profile is not None:
+            middle_gb_factor = rec.version_profile.middle_gb_factor
+        middle = preflight.middle_bytes(rec.osm_pbf_gb * rec.osm2pgsql_input_share,
+                                        use_flat_nodes, middle_gb_factor)
+        sizes['slim_data'] = int(middle * (1 - MIDDLE_INDEX_SHARE))
+        sizes['slim_index'] = middle - sizes['slim_data']
+    output = preflight.output_bytes(rec.osm_pbf_gb, rec.osm2pgsql_output_factor)
+    sizes['main_data'] = int(output * (1 - OUTPUT_INDEX_SHARE))
+    sizes['main_index'] = output - sizes['main_data']
+    return sizes
+
+
+def _device(path: str):
+    """Returns the device of ``path`` (or its nearest parent), None when unknown."""
+    existing = host.existing_parent(path)
+    if existing is None:
+        return None
+    return os.stat(existing).st_dev
+
+
+def plan(rec, candidate_dirs, database_dir: str=None, probes: dict=None,
+         root: str='/', **probe_kwargs) -> TablespacePlan:
+    """Places the flat nodes file and the osm2pgsql tablespaces.
+
+    Roles are placed in ``ROLES`` order on the directory scoring highest in
+    the role's ``ROLE_METRIC``.  Each role already placed on a device
+    multiplies its score by ``SHARED_DEVICE_PENALTY``, spreading the load
+    when several devices are fast enough.  Directories on RAM backed
+    filesystems or w/out free space for the role are skipped.  Roles placed
+    on the device of ``database_dir`` stay in the default tablespace.
+
+    Parameters
+    -----------------------
+    rec : osm2pgsql_tuner.tuner.Recommendation
+    candidate_dirs : list of str
+    database_dir : str
+        (Default None) PostgreSQL data directory.  When None every table
+        role gets a tablespace.
+    probes : dict
+        (Default None) Path to :class:`IoProbe` measured earlier, missing
+        candidates are probed.
+    root : str
+        (Default ``/``) Filesystem root to read ``/proc`` and ``/sys`` from.
+    probe_kwargs
+        Passed to :func:`probe`.
+
+    Returns
+    -----------------------
+    result : TablespacePlan
+    """
+    probes = dict(probes or {})
+    for path in candidate_dirs:
+        if path not in probes:
+            probes[path] = probe(path, **probe_kwargs)
+
+    database_device = _device(database_dir) if database_dir is not None else None
+    usable = []
+    free_bytes = {}
+    for path in candidate_dirs:
+        candidate = preflight.inspect_dir(path, root=root)
+        if candidate.in_ram or candidate.free_bytes is None:
+            continue
+        device = _device(path)
+        usable.append((path, device))
+        free_bytes.setdefault(device, candidate.free_bytes)
+
+    result = TablespacePlan(placements={}, probes=probes)
+    placed_on = {}
+    for role, size_bytes in role_sizes(rec).items():
+        needed = int(size_bytes * preflight.DISK_HEADROOM)
+        metric = ROLE_METRIC[role]
+        scored = [(getattr(probes[path], metric)
+                   * SHARED_DEVICE_PENALTY ** placed_on.get(device, 0), path, device)
+                  for path, device in usable if free_bytes[device] >= needed]
+        if not scored:
+            result.problems.append(f'No candidate directory has {needed / 1024**3:.1f} GB free for {role}')
+            continue
+        _, path, device = max(scored, key=lambda entry: entry[0])
+        free_bytes[device] -= needed
+        placed_on[device] = placed_on.get(device, 0) + 1
+        tablespace = None
+        if role != 'flat_nodes' and (database_device is None or device != database_device):
+            tablespace = TABLESPACE_PREFIX + role
+        result.placements[role] = Placement(role, path, size_bytes, tablespace)
+    return result
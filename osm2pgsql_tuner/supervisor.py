@@ -0,0 +1,416 @@
+"""Runs osm2pgsql as a subprocess and records memory and progress.
+
+A wrong recommendation usually shows up as the kernel OOM-killing osm2pgsql
+hours into an import.  The supervisor samples memory of the running process
+from ``/proc/<pid>/status`` (``VmRSS`` and the ``VmHWM`` high water mark, so
+peaks between samples are not missed) and, less often, PSS from
+``/proc/<pid>/smaps_rollup``.  osm2pgsql progress lines are parsed for the
+element counts and rates of each phase.
+
+While reading the input, memory is extrapolated linearly over elements
+processed to the expected element count of the PBF.  A warning is recorded
+once when the projected peak exceeds ``osm2pgsql_cache_max``.
+
+Samples and warnings can be streamed as JSON lines and the finished run
+exported as a :class:`osm2pgsql_tuner.calibration.RunRecord`.
+"""
+import json
+import os
+import re
+import shlex
+import string
+import subprocess
+import threading
+import time
+
+from osm2pgsql_tuner import calibration, runtime
+
+
+DEFAULT_INTERVAL_SECONDS = 1.0
+"""float : Seconds between memory samples."""
+
+PSS_SAMPLE_EVERY = 10
+"""int : Read ``smaps_rollup`` every Nth sample, it is more expensive than ``status``."""
+
+READ_PHASES = ('nodes', 'ways', 'relations')
+"""tuple : Phases reported by osm2pgsql progress lines."""
+
+_RE_PROGRESS = re.compile(r'(Node|Way|Relation)\((\d+)(k?) ([\d.]+)(k?)/s\)')
+_PROGRESS_PHASES = {'Node': 'nodes', 'Way': 'ways', 'Relation': 'relations'}
+
+
+def read_memory_mb(pid: int, proc_root: str='/proc', pss: bool=False) -> dict:
+    """Reads current and peak RSS (and optionally PSS) of a process in MB.
+
+    Parameters
+    -----------------------
+    pid : int
+    proc_root : str
+        (Default ``/proc``)
+    pss : bool
+        (Default False) Also read PSS from ``smaps_rollup``.
+
+    Returns
+    -----------------------
+    memory : dict
+        Keys ``rss_mb``, ``hwm_mb`` and ``pss_mb``, None when unavailable,
+        e.g. after the process exited.
+    """
+    memory = {'rss_mb': None, 'hwm_mb': None, 'pss_mb': None}
+    files = [('status', {'VmRSS:': 'rss_mb', 'VmHWM:': 'hwm_mb'})]
+    if pss:
+        files.append(('smaps_rollup', {'Pss:': 'pss_mb'}))
+    for filename, fields in files:
+        try:
+            with open(os.path.join(proc_root, str(pid), filename), 'r',
+                      encoding='utf-8') as file_in:
+                for line in file_in:
+                    parts = line.split()
+                    if parts and parts[0] in fields:
+                        # Values are reported in kB
+                        memory[fields[parts[0]]] = int(parts[1]) / 1024
+        except (OSError, ValueError):
+            continue
+    return memory
+
+
+def parse_progress(line: str) -> dict:
+    """Parses an osm2pgsql progress line.
+
+    osm2pgsql reports progress as
+    ``Processing: Node(25630k 366.1k/s) Way(0k 0.00k/s) Relation(0 0.0/s)``.
+
+    Parameters
+    -----------------------
+    line : str
+
+    Returns
+    -----------------------
+    progress : dict or None
+        ``{phase: (count, per_second)}``, None when ``line`` is not a progress line.
+    """
+    progress = {}
+    for kind, count, count_k, rate, rate_k in _RE_PROGRESS.findall(line):
+        count = int(count) * (1000 if count_k else 1)
+        rate = float(rate) * (1000 if rate_k else 1)
+        progress[_PROGRESS_PHASES[kind]] = (count, rate)
+    return progress or None
+
+
+class Sample():
+    """One point of the supervisor time series.
+
+    Parameters
+    -----------------------
+    elapsed_seconds : float
+    rss_mb : float or None
+    hwm_mb : float or None
+        Peak RSS of the process so far.
+    pss_mb : float or None
+        Only read every ``PSS_SAMPLE_EVERY`` samples.
+    phase : str or None
+        Current phase, one of ``READ_PHASES`` or ``postprocessing``.
+    processed : dict
+        Elements processed per phase.
+    rates : dict
+        Elements per second per phase, as reported by osm2pgsql.
+    projected_peak_mb : float or None
+    """
+    def __init__(self, elapsed_seconds: float, rss_mb: float, hwm_mb: float,
+                 pss_mb: float, phase: str, processed: dict, rates: dict,
+                 projected_peak_mb: float=None):
+        self.elapsed_seconds = elapsed_seconds
+        self.rss_mb = rss_mb
+        self.hwm_mb = hwm_mb
+        self.pss_mb = pss_mb
+        self.phase = phase
+        self.processed = processed
+        self.rates = rates
+        self.projected_peak_mb = projected_peak_mb
+
+    @property
+    def processed_total(self) -> int:
+        """Elements processed in all read phases."""
+        return sum(self.processed.values())
+
+    def to_dict(self) -> dict:
+        """Returns the sample as a JSON serializable dictionary.
+
+        Returns
+        ----------------------
+        sample : dict
+        """
+        return {'elapsed_seconds': self.elapsed_seconds,
+                'rss_mb': self.rss_mb,
+                'hwm_mb': self.hwm_mb,
+                'pss_mb': self.pss_mb,
+                'phase': self.phase,
+                'processed': dict(self.processed),
+                'rates': dict(self.rates),
+                'projected_peak_mb': self.projected_peak_mb}
+
+
+def project_peak_mb(baseline: Sample, sample: Sample, total_elements: int) -> float:
+    """Extrapolates memory to the end of the read phases.
+
+    Memory growth per element between ``baseline`` and ``sample`` is applied
+    to the elements not yet processed.  Never lower than the peak so far.
+
+    Parameters
+    -----------------------
+    baseline : Sample
+        Usually the first sample of the run.
+    sample : Sample
+        Latest sample.
+    total_elements : int
+        Expected nodes + ways + relations in the input.
+
+    Returns
+    -----------------------
+    projected_peak_mb : float or None
+        None when the samples do not include memory values.
+    """
+    if sample.rss_mb is None:
+        return None
+    peak = max(sample.hwm_mb or 0.0, sample.rss_mb)
+    processed = sample.processed_total - baseline.processed_total
+    if (baseline.rss_mb is None or processed <= 0
+            or sample.phase not in READ_PHASES):
+        return peak
+    slope = max(0.0, (sample.rss_mb - baseline.rss_mb) / processed)
+    remaining = max(0, total_elements - sample.processed_total)
+    return max(peak, sample.rss_mb + slope * remaining)
+
+
+class SupervisedRun():
+    """Result of :func:`supervise`.
+
+    Parameters
+    -----------------------
+    args : list of str
+        Command that was run.
+    """
+    def __init__(self, args: list):
+        self.args = args
+        self.pid = None
+        self.returncode = None
+        self.samples = []
+        self.warnings = []
+        self.log_lines = []
+        self.seconds = None
+        self.processed = {}
+        self.rates = {}
+
+    @property
+    def peak_rss_mb(self) -> float:
+        """Highest RSS observed, incl. the kernel's high water mark."""
+        values = [value for sample in self.samples
+                  for value in (sample.rss_mb, sample.hwm_mb) if value is not None]
+        return max(values, default=None)
+
+    @property
+    def projected_peak_mb(self) -> float:
+        """Highest peak projected to the end of the read phases."""
+        values = [sample.projected_peak_mb for sample in self.samples
+                  if sample.projected_peak_mb is not None]
+        return max(values, default=None)
+
+    def phase_throughput(self) -> dict:
+        """Returns the last reported elements per second for each read phase.
+
+        Returns
+        ----------------------
+        throughput : dict
+        """
+        return dict(self.rates)
+
+    def to_dict(self) -> dict:
+        """Returns the run as a JSON serializable dictionary.
+
+        Returns
+        ----------------------
+        run : dict
+        """
+        return {'args': list(self.args),
+                'returncode': self.returncode,
+                'seconds': self.seconds,
+                'peak_rss_mb': self.peak_rss_mb,
+                'processed': dict(self.processed),
+                'phase_throughput': self.phase_throughput(),
+                'warnings': list(self.warnings),
+                'samples': [sample.to_dict() for sample in self.samples]}
+
+    def to_run_record(self, osm_pbf_gb: float=None, style: str=None,
+                      source: str=None) -> calibration.RunRecord:
+        """Exports the run for :class:`osm2pgsql_tuner.calibration.CalibrationStore`.
+
+        The captured log is parsed with :func:`osm2pgsql_tuner.calibration.parse_log`
+        and the measured peak RSS is attached.
+
+        Parameters
+        -----------------------
+        osm_pbf_gb : float
+            (Default None)
+        style : str
+            (Default None)
+        source : str
+            (Default None) Defaults to the command line.
+
+        Returns
+        -----------------------
+        record : osm2pgsql_tuner.calibration.RunRecord
+        """
+        if source is None:
+            source = ' '.join(self.args)
+        return calibration.parse_log(self.log_lines, source=source,
+                                     osm_pbf_gb=osm_pbf_gb, style=style,
+                                     peak_rss_mb=self.peak_rss_mb)
+
+
+def build_args(rec, pbf_path: str, binary='osm2pgsql', env: dict=None) -> list:
+    """Builds the argument list from :meth:`Recommendation.get_osm2pgsql_command`.
+
+    Environment variables such as ``$PGOSM_CONN`` are expanded within each
+    argument after splitting, their values are never split or parsed.  The
+    PBF path is added as the last argument as is.
+
+    Parameters
+    -----------------------
+    rec : osm2pgsql_tuner.tuner.Recommendation
+    pbf_path : str
+    binary : str or list of str
+        (Default ``osm2pgsql``) Replaces ``osm2pgsql`` at the start of the
+        command, e.g. a full path or an interpreter and script.
+    env : dict
+        (Default None) Variables to expand, ``os.environ`` when None.
+
+    Returns
+    -----------------------
+    args : list of str
+    """
+    mapping = os.environ if env is None else env
+    # Without a path the command ends after the options
+    command = rec.get_osm2pgsql_command(pbf_path='')
+    args = [string.Template(arg).safe_substitute(mapping)
+            for arg in shlex.split(command)[1:]]
+    args.append(pbf_path)
+    if isinstance(binary, str):
+        binary = [binary]
+    return list(binary) + args
+
+
+class _OutputReader(threading.Thread):
+    """Collects output lines and the latest progress of the subprocess."""
+    def __init__(self, stream, run: SupervisedRun):
+        super().__init__(daemon=True)
+        self.stream = stream
+        self.run_result = run
+        self.lock = threading.Lock()
+        self.phase = None
+        self.processed = {}
+        self.rates = {}
+
+    def run(self):
+        for line in self.stream:
+            self.run_result.log_lines.append(line)
+            progress = parse_progress(line)
+            if progress is None:
+                if self.phase in READ_PHASES and 'postprocessing' in line.lower():
+                    with self.lock:
+                        self.phase = 'postprocessing'
+                continue
+            with self.lock:
+                for phase, (count, rate) in progress.items():
+                    self.processed[phase] = count
+                    if count:
+                        self.rates[phase] = rate
+                        self.phase = phase
+
+    def snapshot(self) -> tuple:
+        """Returns phase, processed and rates at this moment."""
+        with self.lock:
+            return self.phase, dict(self.processed), dict(self.rates)
+
+
+def supervise(rec, pbf_path: str, binary='osm2pgsql', env: dict=None,
+              interval: float=DEFAULT_INTERVAL_SECONDS, telemetry=None,
+              proc_root: str='/proc') -> SupervisedRun:
+    """Runs the recommended osm2pgsql command and samples it until it exits.
+
+    Parameters
+    -----------------------
+    rec : osm2pgsql_tuner.tuner.Recommendation
+    pbf_path : str
+    binary : str or list of str
+        (Default ``osm2pgsql``) See :func:`build_args`.
+    env : dict
+        (Default None) Environment for the subprocess, inherits when None.
+    interval : float
+        (Default ``DEFAULT_INTERVAL_SECONDS``) Seconds between samples.
+    telemetry : file-like
+        (Default None) Samples and warnings are written as JSON lines.
+    proc_root : str
+        (Default ``/proc``)
+
+    Returns
+    -----------------------
+    run : SupervisedRun
+    """
+    args = build_args(rec, pbf_path, binary=binary, env=env)
+    cache_max_mb = rec.osm2pgsql_cache_max * 1024
+    total_elements = sum(runtime.element_counts(rec))
+    run = SupervisedRun(args)
+
+    def emit(event_type: str, values: dict):
+        if telemetry is not None:
+            telemetry.write(json.dumps({'type': event_type, **values}) + '\n')
+            telemetry.flush()
+
+    start = time.monotonic()
+    # osm2pgsql logs to stderr, progress lines end in \r which text mode turns into lines
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            env=env, text=True, errors='replace')
+    run.pid = proc.pid
+    reader = _OutputReader(proc.stdout, run)
+    reader.start()
+    try:
+        while True:
+            phase, processed, rates = reader.snapshot()
+            memory = read_memory_mb(proc.pid, proc_root=proc_root,
+                                    pss=len(run.samples) % PSS_SAMPLE_EVERY == 0)
+            if memory['rss_mb'] is not None:
+                sample = Sample(elapsed_seconds=time.monotonic() - start,
+                                phase=phase, processed=processed, rates=rates,
+                                **memory)
+                baseline = run.samples[0] if run.samples else sample
+                sample.projected_peak_mb = project_peak_mb(baseline, sample,
+                                                           total_elements)
+                run.samples.append(sample)
+                emit('sample', sample.to_dict())
+                if (not run.warnings and sample.projected_peak_mb is not None
+                        and sample.projected_peak_mb > cache_max_mb):
+                    warning = {'elapsed_seconds': sample.elapsed_seconds,
+                               'projected_peak_mb': sample.projected_peak_mb,
+                               'cache_max_mb': cache_max_mb,
+                               'message': (f'Projected peak {sample.projected_peak_mb:.0f} MB '
+                                           f'exceeds osm2pgsql_cache_max {cache_max_mb:.0f} MB')}
+                    run.warnings.append(warning)
+                    emit('warning', warning)
+            try:
+                proc.wait(timeout=interval)
+                break
+            except subprocess.TimeoutExpired:
+                continue
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        reader.join()
+        proc.stdout.close()
+
+    _, run.processed, run.rates = reader.snapshot()
+    run.returncode = proc.returncode
+    run.seconds = time.monotonic() - start
+    emit('exit', {'returncode': run.returncode, 'seconds': run.seconds,
+                  'peak_rss_mb': run.peak_rss_mb})
+    return run
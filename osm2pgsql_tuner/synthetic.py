@@ -0,0 +1,372 @@
+"""Writes synthetic ``.osm.pbf`` files with a controlled element mix.
+
+Used to check the estimators against inputs of known shape and to benchmark
+the scanner.  Files are streamed one block at a time, so memory use does not
+depend on the file size and files from MBs to tens of GB can be written.
+
+The data is valid OSM:
+
+* Nodes on a grid inside the bounding box, every ``NODE_TAG_EVERY`` node
+  tagged ``amenity=bench``.
+* Ways alternating ``highway=residential`` lines over consecutive nodes and
+  ``building=yes`` squares of neighboring grid nodes.
+* ``type=multipolygon`` relations with ways as ``outer`` members.
+
+Elements are written sorted by type then id (``Sort.Type_then_ID``) unless
+``sorted_file`` is False, then blocks of the types are interleaved.
+"""
+import math
+import struct
+import zlib
+
+from osm2pgsql_tuner import runtime
+
+
+DEFAULT_PER_BLOCK = 8000
+"""int : Elements per block, same as osmium and osm2pgsql output."""
+
+DEFAULT_BBOX = (-105.0, 39.0, -104.0, 40.0)
+"""tuple : Bounding box (left, bottom, right, top) of generated nodes."""
+
+NODES_PER_WAY = 8
+"""int : Node references per highway way, buildings have 5."""
+
+MEMBERS_PER_RELATION = 4
+"""int : Way members per relation."""
+
+NODE_TAG_EVERY = 50
+"""int : Every n-th node is tagged."""
+
+GRANULARITY = 100
+"""int : Coordinate granularity in nanodegrees, the PBF default."""
+
+_STRINGS = ('', 'amenity', 'bench', 'highway', 'residential', 'building',
+            'yes', 'type', 'multipolygon', 'outer')
+_STRING_ID = {value: index for index, value in enumerate(_STRINGS)}
+
+
+def _mix(value: int) -> int:
+    """Deterministic 64 bit hash (splitmix64 finalizer)."""
+    value = (value * 0x9e3779b97f4a7c15) & 0xffffffffffffffff
+    value = ((value ^ (value >> 30)) * 0xbf58476d1ce4e5b9) & 0xffffffffffffffff
+    value = ((value ^ (value >> 27)) * 0x94d049bb133111eb) & 0xffffffffffffffff
+    return value ^ (value >> 31)
+
+
+def _varint(value: int) -> bytes:
+    """Encodes a base 128 varint."""
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _zigzag(value: int) -> int:
+    """Encodes a protobuf ``sint64`` value."""
+    return (value << 1) ^ (value >> 63)
+
+
+def _packed(values) -> bytes:
+    """Encodes unsigned values as a packed repeated field body."""
+    out = bytearray()
+    append = out.append
+    for value in values:
+        while value > 0x7f:
+            append((value & 0x7f) | 0x80)
+            value >>= 7
+        append(value)
+    return bytes(out)
+
+
+def _packed_delta(values) -> bytes:
+    """Delta and zigzag encodes values as a packed ``sint64`` field body."""
+    # Inlined varint and zigzag, this is the hot loop for large files
+    out = bytearray()
+    append = out.append
+    previous = 0
+    for value in values:
+        delta = value - previous
+        previous = value
+        value = (delta << 1) ^ (delta >> 63)
+        while value > 0x7f:
+            append((value & 0x7f) | 0x80)
+            value >>= 7
+        append(value)
+    return bytes(out)
+
+
+def _field_varint(number: int, value: int) -> bytes:
+    return _varint(number << 3) + _varint(value)
+
+
+def _field_bytes(number: int, value: bytes) -> bytes:
+    return _varint((number << 3) | 2) + _varint(len(value)) + value
+
+
+def _blob(blob_type: str, data: bytes, compress_level: int) -> bytes:
+    """Wraps a block in ``BlobHeader`` and zlib compressed ``Blob`` messages."""
+    blob = (_field_varint(2, len(data))
+            + _field_bytes(3, zlib.compress(data, compress_level)))
+    header = _field_bytes(1, blob_type.encode()) + _field_varint(3, len(blob))
+    return struct.pack('>I', len(header)) + header + blob
+
+
+def _primitive_block(group: bytes) -> bytes:
+    """Builds a ``PrimitiveBlock`` holding one ``PrimitiveGroup``."""
+    string_table = b''.join(_field_bytes(1, value.encode()) for value in _STRINGS)
+    return _field_bytes(1, string_table) + _field_bytes(2, group)
+
+
+def header_block(sorted_file: bool=True, bbox: tuple=DEFAULT_BBOX,
+                 replication_timestamp: int=None, replication_sequence: int=None,
+                 compress_level: int=6) -> bytes:
+    """Builds the ``OSMHeader`` blob.
+
+    Returns
+    -----------------------
+    blob : bytes
+    """
+    left, bottom, right, top = (_zigzag(int(value * 1e9)) for value in bbox)
+    bbox_msg = (_field_varint(1, left) + _field_varint(2, right)
+                + _field_varint(3, top) + _field_varint(4, bottom))
+    data = _field_bytes(1, bbox_msg)
+    data += _field_bytes(4, b'OsmSchema-V0.6') + _field_bytes(4, b'DenseNodes')
+    if sorted_file:
+        data += _field_bytes(5, b'Sort.Type_then_ID')
+    data += _field_bytes(16, b'osm2pgsql-tuner synthetic')
+    if replication_timestamp is not None:
+        data += _field_varint(32, replication_timestamp)
+    if replication_sequence is not None:
+        data += _field_varint(33, replication_sequence)
+    return _blob('OSMHeader', data, compress_level)
+
+
+class _Grid():
+    """Places node ids on a grid inside the bounding box."""
+    def __init__(self, nodes: int, bbox: tuple):
+        self.columns = max(1, math.ceil(math.sqrt(max(nodes, 1))))
+        left, bottom, right, top = bbox
+        self.left = int(left * 1e9 / GRANULARITY)
+        self.bottom = int(bottom * 1e9 / GRANULARITY)
+        self.step_lon = max(1, int((right - left) * 1e9 / GRANULARITY / self.columns))
+        self.step_lat = max(1, int((top - bottom) * 1e9 / GRANULARITY / self.columns))
+
+    def position(self, node_id: int) -> tuple:
+        """Returns ``(lat, lon)`` in granularity units.
+
+        Coordinates are jittered within the grid cell, so blocks compress
+        like real data instead of to nearly nothing.
+        """
+        row, column = divmod(node_id - 1, self.columns)
+        jitter = _mix(node_id)
+        return (self.bottom + row * self.step_lat + (jitter & 0xffffffff) % self.step_lat,
+                self.left + column * self.step_lon + (jitter >> 32) % self.step_lon)
+
+
+def dense_node_block(first_id: int, count: int, grid: _Grid,
+                     compress_level: int=6) -> bytes:
+    """Builds an ``OSMData`` blob with ``count`` dense nodes.
+
+    Returns
+    -----------------------
+    blob : bytes
+    """
+    ids = range(first_id, first_id + count)
+    positions = [grid.position(node_id) for node_id in ids]
+    keys_vals = []
+    for node_id in ids:
+        if node_id % NODE_TAG_EVERY == 0:
+            keys_vals.extend((_STRING_ID['amenity'], _STRING_ID['bench']))
+        keys_vals.append(0)
+    dense = (_field_bytes(1, _packed_delta(ids))
+             + _field_bytes(8, _packed_delta(lat for lat, _ in positions))
+             + _field_bytes(9, _packed_delta(lon for _, lon in positions))
+             + _field_bytes(10, _packed(keys_vals)))
+    return _blob('OSMData', _primitive_block(_field_bytes(2, dense)), compress_level)
+
+
+def way_refs(way_id: int, nodes: int, columns: int=None) -> list:
+    """Returns the node ids referenced by a way.
+
+    ``columns`` of the node grid is computed from ``nodes`` when None.
+    """
+    if nodes == 0:
+        return []
+    first = ((way_id - 1) * NODES_PER_WAY) % nodes
+    if way_id % 2 == 0:
+        # Buildings are closed squares of neighboring grid nodes
+        if columns is None:
+            columns = _Grid(nodes, DEFAULT_BBOX).columns
+        offsets = (0, 1, columns + 1, columns, 0)
+    else:
+        offsets = range(NODES_PER_WAY)
+    return [(first + offset) % nodes + 1 for offset in offsets]
+
+
+def way_block(first_id: int, count: int, nodes: int, compress_level: int=6) -> bytes:
+    """Builds an ``OSMData`` blob with ``count`` ways.
+
+    Returns
+    -----------------------
+    blob : bytes
+    """
+    highway = _packed((_STRING_ID['highway'],)), _packed((_STRING_ID['residential'],))
+    building = _packed((_STRING_ID['building'],)), _packed((_STRING_ID['yes'],))
+    columns = _Grid(nodes, DEFAULT_BBOX).columns if nodes else None
+    ways = []
+    for way_id in range(first_id, first_id + count):
+        keys, vals = building if way_id % 2 == 0 else highway
+        ways.append(_field_bytes(3, _field_varint(1, way_id)
+                                 + _field_bytes(2, keys) + _field_bytes(3, vals)
+                                 + _field_bytes(8, _packed_delta(way_refs(way_id, nodes, columns)))))
+    return _blob('OSMData', _primitive_block(b''.join(ways)), compress_level)
+
+
+def relation_block(first_id: int, count: int, ways: int, compress_level: int=6) -> bytes:
+    """Builds an ``OSMData`` blob with ``count`` multipolygon relations.
+
+    Returns
+    -----------------------
+    blob : bytes
+    """
+    keys = _field_bytes(2, _packed((_STRING_ID['type'],)))
+    vals = _field_bytes(3, _packed((_STRING_ID['multipolygon'],)))
+    relations = []
+    for relation_id in range(first_id, first_id + count):
+        members = []
+        if ways:
+            first = ((relation_id - 1) * MEMBERS_PER_RELATION) % ways
+            members = [(first + offset) % ways + 1 for offset in range(MEMBERS_PER_RELATION)]
+        body = _field_varint(1, relation_id) + keys + vals
+        if members:
+            body += (_field_bytes(8, _packed([_STRING_ID['outer']] * len(members)))
+                     + _field_bytes(9, _packed_delta(members))
+                     + _field_bytes(10, _packed([1] * len(members))))
+        relations.append(_field_bytes(4, body))
+    return _blob('OSMData', _primitive_block(b''.join(relations)), compress_level)
+
+
+def _blocks(builder, total: int, per_block: int):
+    """Yields blobs of ``per_block`` elements from ``builder(first_id, count)``."""
+    first = 1
+    while first <= total:
+        count = min(per_block, total - first + 1)
+        yield builder(first, count)
+        first += count
+
+
+def _interleave(*generators):
+    """Yields from the generators round robin until all are exhausted."""
+    generators = list(generators)
+    while generators:
+        for generator in list(generators):
+            try:
+                yield next(generator)
+            except StopIteration:
+                generators.remove(generator)
+
+
+def write_pbf(path: str, nodes: int, ways: int, relations: int,
+              per_block: int=DEFAULT_PER_BLOCK, sorted_file: bool=True,
+              bbox: tuple=DEFAULT_BBOX, replication_timestamp: int=None,
+              replication_sequence: int=None, compress_level: int=6) -> str:
+    """Streams a PBF with the given element counts to ``path``.
+
+    Parameters
+    -----------------------
+    path : str
+    nodes : int
+    ways : int
+    relations : int
+    per_block : int
+        (Default ``DEFAULT_PER_BLOCK``) Elements per block.
+    sorted_file : bool
+        (Default True) When False the node, way and relation blocks are
+        interleaved and the header does not claim sorting.
+    bbox : tuple
+        (Default ``DEFAULT_BBOX``)
+    replication_timestamp : int
+        (Default None) Written to the header when set.
+    replication_sequence : int
+        (Default None) Written to the header when set.
+    compress_level : int
+        (Default 6) zlib level, lower is faster.
+
+    Returns
+    -----------------------
+    path : str
+    """
+    grid = _Grid(nodes, bbox)
+    node_blocks = _blocks(lambda first, count: dense_node_block(first, count, grid, compress_level),
+                          nodes, per_block)
+    way_blocks = _blocks(lambda first, count: way_block(first, count, nodes, compress_level),
+                         ways, per_block)
+    relation_blocks = _blocks(lambda first, count: relation_block(first, count, ways, compress_level),
+                              relations, per_block)
+    if sorted_file:
+        data_blocks = (block for blocks in (node_blocks, way_blocks, relation_blocks)
+                       for block in blocks)
+    else:
+        data_blocks = _interleave(way_blocks, relation_blocks, node_blocks)
+
+    with open(path, 'wb') as pbf_file:
+        pbf_file.write(header_block(sorted_file=sorted_file, bbox=bbox,
+                                    replication_timestamp=replication_timestamp,
+                                    replication_sequence=replication_sequence,
+                                    compress_level=compress_level))
+        for block in data_blocks:
+            pbf_file.write(block)
+    return path
+
+
+def counts_for_size(size_bytes: int, per_block: int=DEFAULT_PER_BLOCK,
+                    compress_level: int=6) -> tuple:
+    """Returns element counts that produce a file of about ``size_bytes``.
+
+    The mix follows the typical counts per GB of
+    :mod:`osm2pgsql_tuner.runtime` (about 9 nodes per way).  Bytes per
+    element are measured from one block of each type, then measured again
+    on a node grid of the estimated size since coordinate deltas shrink as
+    the grid gets denser.
+
+    Returns
+    -----------------------
+    counts : tuple
+        ``(nodes, ways, relations)``
+    """
+    mix = (runtime.NODES_PER_PBF_GB, runtime.WAYS_PER_PBF_GB, runtime.RELATIONS_PER_PBF_GB)
+    sample = max(1, per_block)
+    nodes = sample
+    for _ in range(2):
+        grid = _Grid(max(nodes, sample), DEFAULT_BBOX)
+        node_bytes = len(dense_node_block(1, sample, grid, compress_level)) / sample
+        way_bytes = len(way_block(1, sample, max(nodes, sample), compress_level)) / sample
+        relation_bytes = len(relation_block(1, sample, sample, compress_level)) / sample
+        bytes_per_unit = (mix[0] * node_bytes + mix[1] * way_bytes
+                          + mix[2] * relation_bytes) / mix[0]
+        nodes = max(1, int(size_bytes / bytes_per_unit))
+    return (nodes, int(nodes * mix[1] / mix[0]), int(nodes * mix[2] / mix[0]))
+
+
+def write_pbf_of_size(path: str, size_bytes: int, **kwargs) -> tuple:
+    """Streams a PBF of about ``size_bytes`` with a typical element mix.
+
+    Parameters
+    -----------------------
+    path : str
+    size_bytes : int
+    kwargs
+        Passed to :func:`write_pbf`.
+
+    Returns
+    -----------------------
+    counts : tuple
+        ``(nodes, ways, relations)`` written.
+    """
+    counts = counts_for_size(size_bytes,
+                             per_block=kwargs.get('per_block', DEFAULT_PER_BLOCK),
+                             compress_level=kwargs.get('compress_level', 6))
+    write_pbf(path, *counts, **kwargs)
+    return counts
@@ -1,25 +1,167 @@
 """Contains osm2pgsql class to help provide osm2pgsql tuning advice.
 
-Recommendations are targeted for osm2pgsql v1.5.0 and newer.
+Recommendations are targeted for osm2pgsql v1.5.0 and newer.  Flags and
+memory model defaults for newer releases are picked with ``osm2pgsql_version``,
+see :mod:`osm2pgsql_tuner.versions`.
+
+Decision codes, decision records and the rule table behind the ``--slim``,
+``--drop``, ``--flat-nodes`` and ``--cache`` choices are in
+:mod:`osm2pgsql_tuner.rules`, imported here so existing imports keep working.
+"""
+import os
+
+from osm2pgsql_tuner.rules import (FLAT_NODES_ALWAYS_GB, FLAT_NODES_THRESHOLD_GB,
+                                   DECISION_TEXT, RULES, RULES_BY_ATTRIBUTE,
+                                   CacheDecision, CacheMaxDecision, Decision,
+                                   DiskDecision, DropDecision, EstimateDecision,
+                                   FallbackDecision, FlatNodesDecision,
+                                   LimitedRamDecision, ProcessesDecision,
+                                   ReplicationDecision, Rule, ScheduleDecision,
+                                   SlimDecision, SourceDecision,
+                                   StorageDecision, TagsFilterDecision,
+                                   VersionDecision, decisions_to_dicts,
+                                   get_decision_text, shared_decision)
+
+
+FLAT_NODES_DEFAULT_PATH = '/tmp/nodes'
+"""str : Path used for ``--flat-nodes`` until :meth:`Recommendation.preflight` picks one."""
+
+CACHE_MAX_RATIO = 0.66
+"""float : Share of RAM (not reserved for PostgreSQL) osm2pgsql may use."""
+
+NOSLIM_BASE_GB = 1.0
+"""float : Fixed RAM osm2pgsql uses w/out slim regardless of input size, in GB."""
+
+NOSLIM_GB_PER_PBF_GB = 2.5
+"""float : RAM osm2pgsql uses w/out slim per GB of PBF input.
+
+Justification: https://blog.rustprooflabs.com/2021/05/osm2pgsql-reduced-ram-load-to-postgis
+"""
+
+SLIM_CACHE_RATIO = 0.75
+"""float : Slim mode ``--cache`` as a fraction of the no-slim RAM requirement.
+
+No real method to this value, initial gut instinct.  Can be replaced by
+fitting a profile with :mod:`osm2pgsql_tuner.calibration`.
+"""
+
+NOSLIM_BYTES_PER_NODE = 12
+"""int : Estimated osm2pgsql RAM per node when running w/out slim, in bytes.
+
+Used when element statistics from :func:`osm2pgsql_tuner.pbf.scan` are available.
+The per-element values are scaled so a file with planet-like node/way ratios
+lands close to the file size based ``1 + 2.5 * osm_pbf_gb`` estimate.
 """
 
+NOSLIM_BYTES_PER_WAY = 64
+"""int : Estimated osm2pgsql RAM per way (incl. node list) when running w/out slim, in bytes."""
 
-FLAT_NODES_THRESHOLD_GB = 8.0
-"""float : Sets threshold size for when to use ``--flat-nodes``.
+NOSLIM_BYTES_PER_RELATION = 200
+"""int : Estimated osm2pgsql RAM per relation when running w/out slim, in bytes."""
 
-8-10 GB appears to be an appropriate threshold when using modern SSDs for storage.
+PROCESS_RAM_GB_SLIM = 0.5
+"""float : Estimated RAM for each additional osm2pgsql process in slim mode, in GB.
+
+Each process keeps its own Lua state, output buffers and connections to the
+middle tables.  Initial estimate, not measured.
 """
 
+PROCESS_RAM_GB_NOSLIM = 0.25
+"""float : Estimated RAM for each additional osm2pgsql process w/out slim, in GB.
+
+The RAM middle is shared between processes, only the Lua state and output
+buffers are per process.  Initial estimate, not measured.
+"""
+
+
+CALCULATED_ATTRIBUTES = ('osm2pgsql_tags_filter', 'osm2pgsql_input_share',
+                         'osm2pgsql_output_factor', 'osm2pgsql_cache_max',
+                         'osm2pgsql_noslim_cache', 'osm2pgsql_slim_cache',
+                         'osm2pgsql_flat_nodes_gb', 'osm2pgsql_run_in_ram',
+                         'osm2pgsql_drop', 'osm2pgsql_flat_nodes',
+                         'osm2pgsql_limited_ram', 'osm2pgsql_number_processes')
+"""tuple : Calculated attributes in the order :meth:`Recommendation.evaluate` calculates them."""
+
+
+def check_system_ram(system_ram_gb: float):
+    """Raises ValueError when ``system_ram_gb`` is below the osm2pgsql minimum of 2 GB.
+
+    Parameters
+    -----------------------
+    system_ram_gb : float
+    """
+    if system_ram_gb < 2.0:
+        url = 'https://osm2pgsql.org/doc/manual.html#main-memory'
+        msg = f'osm2pgsql requires a minimum of 2 GB RAM. See: {url}'
+        raise ValueError(msg)
+
+
+def max_cache_gb(system_ram_gb: float, postgres_ram_gb: float=None) -> float:
+    """Returns the max RAM available to the osm2pgsql cache, in GB.
+
+    Parameters
+    -----------------------
+    system_ram_gb : float
+
+    postgres_ram_gb : float
+        (Default None) RAM reserved for PostgreSQL on the same host, in GB.
+
+    Returns
+    -----------------------
+    osm2pgsql_cache_max : float
+    """
+    if postgres_ram_gb is not None:
+        system_ram_gb = max(0.0, system_ram_gb - postgres_ram_gb)
+    return system_ram_gb * CACHE_MAX_RATIO
+
+
+class _Calculated():
+    """Attribute calculated on first access and memoized on the instance.
+
+    Assigning the attribute replaces the calculated value, attributes
+    calculated later use the assigned value.
+    """
+    def __init__(self, calculate):
+        self.calculate = calculate
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        value = self.calculate(instance)
+        instance.__dict__[self.name] = value
+        return value
+
+
+def _rule(attribute: str):
+    """Returns a calculation applying the rule for ``attribute`` from :data:`RULES`."""
+    rule = RULES_BY_ATTRIBUTE[attribute]
+
+    def calculate(rec):
+        _, value, decision = rule.select(rec)
+        if decision is not None:
+            rec._decisions.append(decision)
+        return value
+    return calculate
+
+
 class Recommendation():
     """Takes basic inputs to generate command recommendations for osm2pgsql.
 
+    Calculated attributes, e.g. ``osm2pgsql_run_in_ram``, are evaluated on
+    first access and memoized, each records its decisions once.
+
     Parameters
     -----------------------
     system_ram_gb : float
         How much total RAM the server has, in GB.
 
     osm_pbf_gb : float
-        Size of the ``.osm.pbf`` file in GB.
+        Size of the ``.osm.pbf`` file in GB.  Can be omitted when ``pbf_stats``
+        is provided.
 
     slim_no_drop : bool
         (Default False) Setup to use osm2pgsql ``--append``. When true ``--slim`` must be used.
@@ -35,61 +177,419 @@ class Recommendation():
 
     ssd : bool
         (Default True) Is the osm2pgsql server using SSD for storage? Value determines threshold
-        for decision to use ``--flat-nodes``
+        for decision to use ``--flat-nodes``, unless ``storage`` is set.
+
+    pbf_stats : osm2pgsql_tuner.pbf.PbfStats
+        (Default None) Element statistics from :func:`osm2pgsql_tuner.pbf.scan`.
+        When provided, memory estimates use node, way and relation counts
+        instead of the file size.
+
+    cpu_count : int
+        (Default None) Number of CPUs available to osm2pgsql.  When set,
+        ``--number-processes`` is recommended.  When None, osm2pgsql's
+        default is left in place.
+
+    postgres_ram_gb : float
+        (Default None) RAM reserved for a PostgreSQL server on the same host,
+        in GB.  See :class:`osm2pgsql_tuner.pgconfig.PostgresLoadConfig`.
+
+    calibration : osm2pgsql_tuner.calibration.CalibrationProfile
+        (Default None) Memory model coefficients fit from real runs, replacing
+        ``NOSLIM_BASE_GB``, ``NOSLIM_GB_PER_PBF_GB`` and ``SLIM_CACHE_RATIO``.
+
+    style_analysis : osm2pgsql_tuner.layerset.StyleAnalysis
+        (Default None) Tables and tag filters of the layer set, see
+        :func:`osm2pgsql_tuner.layerset.analyze`.  When it only needs a small
+        share of the input an ``osmium tags-filter`` pre-pass is recommended
+        and the RAM, disk and runtime estimates are scaled down.
+
+    osm2pgsql_version : str
+        (Default None) Installed osm2pgsql version, e.g. ``1.9.2``, see
+        :func:`osm2pgsql_tuner.versions.detect_version`.  Selects the
+        :class:`osm2pgsql_tuner.versions.VersionProfile` used for flags and
+        memory model defaults.  When None, v1.5 flags and the module level
+        defaults are used.
+
+    storage : osm2pgsql_tuner.storage.IoProbe
+        (Default None) Storage measured where the flat nodes file goes, see
+        :func:`osm2pgsql_tuner.storage.probe`.  The measured random reads set
+        the ``--flat-nodes`` threshold instead of ``ssd``.
     """
-    def __init__(self, system_ram_gb: float, osm_pbf_gb: float,
+    def __init__(self, system_ram_gb: float, osm_pbf_gb: float=None,
                  slim_no_drop: bool=False,
                  append_first_run: bool=None,
-                 pgosm_layer_set: str='run', ssd: bool=True):
+                 pgosm_layer_set: str='run', ssd: bool=True,
+                 pbf_stats=None, cpu_count: int=None,
+                 postgres_ram_gb: float=None, calibration=None,
+                 style_analysis=None, osm2pgsql_version: str=None,
+                 storage=None):
         """Bootstrap the class"""
-        if system_ram_gb < 2.0:
-            url = 'https://osm2pgsql.org/doc/manual.html#main-memory'
-            msg = f'osm2pgsql requires a minimum of 2 GB RAM. See: {url}'
-            raise ValueError(msg)
+        check_system_ram(system_ram_gb)
 
         if slim_no_drop and append_first_run is None:
             raise ValueError('append_first_run must be set when slim_no_drop is true.')
 
+        if osm_pbf_gb is None:
+            if pbf_stats is None:
+                raise ValueError('Either osm_pbf_gb or pbf_stats must be set.')
+            osm_pbf_gb = pbf_stats.osm_pbf_gb
+
         self.system_ram_gb = system_ram_gb
         self.osm_pbf_gb = osm_pbf_gb
+        self.pbf_stats = pbf_stats
+        self.cpu_count = cpu_count
+        self.postgres_ram_gb = postgres_ram_gb
+        self.calibration = calibration
+        self.style_analysis = style_analysis
+        self.osm2pgsql_version = osm2pgsql_version
+        self.flat_nodes_path = FLAT_NODES_DEFAULT_PATH
         self.slim_no_drop = slim_no_drop
         self.append_first_run = append_first_run
         self.pgosm_layer_set = pgosm_layer_set
         self.ssd = ssd
+        self.storage = storage
+        self.tablespace_plan = None
+
+        self._decisions = []
+        # Validates the version, not deferred like the calculated attributes
+        self.version_profile = self.get_version_profile()
+
+    # Calculated attributes, see CALCULATED_ATTRIBUTES
+    osm2pgsql_tags_filter = _Calculated(lambda rec: rec.use_tags_filter())
+    osm2pgsql_input_share = _Calculated(lambda rec: rec.get_input_share())
+    osm2pgsql_output_factor = _Calculated(lambda rec: rec.get_output_factor())
+    osm2pgsql_cache_max = _Calculated(lambda rec: rec.calculate_max_osm2pgsql_cache())
+    osm2pgsql_noslim_cache = _Calculated(lambda rec: rec.get_osm2pgsql_noslim_cache())
+    osm2pgsql_slim_cache = _Calculated(
+        lambda rec: rec.get_slim_cache_ratio() * rec.osm2pgsql_noslim_cache)
+    osm2pgsql_flat_nodes_gb = _Calculated(lambda rec: rec.get_flat_nodes_gb())
+    osm2pgsql_run_in_ram = _Calculated(_rule('osm2pgsql_run_in_ram'))
+    osm2pgsql_drop = _Calculated(_rule('osm2pgsql_drop'))
+    osm2pgsql_flat_nodes = _Calculated(_rule('osm2pgsql_flat_nodes'))
+    osm2pgsql_limited_ram = _Calculated(_rule('osm2pgsql_limited_ram'))
+    osm2pgsql_number_processes = _Calculated(lambda rec: rec.get_number_processes())
+    osm2pgsql_cache_mb = _Calculated(_rule('osm2pgsql_cache_mb'))
+
+    @property
+    def decisions(self) -> list:
+        """Decisions of every calculated attribute, see :class:`Decision`.
+
+        Calculates attributes not used yet, so the list is complete.  Other
+        modules append their own decisions to it.
+        """
+        self.evaluate()
+        return self._decisions
+
+    def evaluate(self):
+        """Calculates every attribute of ``CALCULATED_ATTRIBUTES`` not calculated yet."""
+        values = self.__dict__
+        for attribute, calculated in _CALCULATED:
+            if attribute not in values:
+                # Dependencies come earlier in the order, skip the descriptor
+                values[attribute] = calculated.calculate(self)
 
-        self.decisions = []
+    def get_decisions(self) -> list:
+        """Returns the decisions as JSON serializable dictionaries.
 
-        # Calculated attributes
-        self.osm2pgsql_cache_max = self.calculate_max_osm2pgsql_cache()
-        self.osm2pgsql_noslim_cache = self.get_osm2pgsql_noslim_cache()
-        # No real method to this calculation, initial gut instinct
-        self.osm2pgsql_slim_cache = 0.75 * self.osm2pgsql_noslim_cache
+        Returns
+        ----------------------
+        decisions : list of dict
+            Keys ``option``, ``name`` and ``desc``.
+        """
+        return decisions_to_dicts(self.decisions)
+
+    def _record(self, code, **detail):
+        """Records the decision for ``code``."""
+        if detail:
+            self._decisions.append(Decision(code, **detail))
+        else:
+            self._decisions.append(shared_decision(code))
+
+    @classmethod
+    def from_pbf(cls, system_ram_gb: float, pbf_path: str,
+                 sample_blocks: int=None, workers: int=None, **kwargs):
+        """Creates a recommendation from element statistics of a PBF file.
+
+        Parameters
+        -----------------------
+        system_ram_gb : float
+        pbf_path : str
+            Path to the ``.osm.pbf`` file to scan.
+        sample_blocks : int
+            (Default None) Passed to :func:`osm2pgsql_tuner.pbf.scan`.
+        workers : int
+            (Default None) Passed to :func:`osm2pgsql_tuner.pbf.scan`.
+        kwargs
+            Remaining ``Recommendation`` parameters.
+
+        Returns
+        -----------------------
+        rec : Recommendation
+        """
+        # Imported here to keep importing the tuner module lightweight
+        from osm2pgsql_tuner import pbf
+        scan_kwargs = {'workers': workers}
+        if sample_blocks is not None:
+            scan_kwargs['sample_blocks'] = sample_blocks
+        pbf_stats = pbf.scan(pbf_path, **scan_kwargs)
+        return cls(system_ram_gb, pbf_stats=pbf_stats, **kwargs)
+
+    @classmethod
+    def from_catalog(cls, system_ram_gb: float, catalog, region: str, **kwargs):
+        """Creates a recommendation from a PBF catalog entry.
+
+        Uses the element statistics stored in the catalog, the PBF file is
+        not read.
+
+        Parameters
+        -----------------------
+        system_ram_gb : float
+        catalog : osm2pgsql_tuner.catalog.PbfCatalog
+        region : str
+            Region name, see :meth:`osm2pgsql_tuner.catalog.PbfCatalog.get`.
+        kwargs
+            Remaining ``Recommendation`` parameters.
+
+        Returns
+        -----------------------
+        rec : Recommendation
+        """
+        entry = catalog.get(region)
+        return cls(system_ram_gb, pbf_stats=entry.to_pbf_stats(), **kwargs)
+
+    @classmethod
+    def from_host(cls, osm_pbf_gb: float=None, pbf_path: str=None,
+                  flat_nodes_path: str=FLAT_NODES_DEFAULT_PATH, root: str='/',
+                  **kwargs):
+        """Creates a recommendation using RAM and storage detected on this host.
+
+        ``system_ram_gb`` is the lower of ``/proc/meminfo`` and any cgroup memory
+        limit, so the recommendation fits inside a Docker container.  ``ssd``
+        is False when either the PBF or the flat nodes path is on a rotational
+        disk.  The source of each value is recorded in ``decisions``.
+
+        Parameters
+        -----------------------
+        osm_pbf_gb : float
+            (Default None) Size of the PBF in GB.  Taken from the size of
+            ``pbf_path`` when not set.
+        pbf_path : str
+            (Default None) Path to the ``.osm.pbf`` file.
+        flat_nodes_path : str
+            (Default ``/tmp/nodes``) Path for the ``--flat-nodes`` file.
+        root : str
+            (Default ``/``) Filesystem root to read ``/proc`` and ``/sys`` from.
+        kwargs
+            Remaining ``Recommendation`` parameters.  Values passed for
+            ``system_ram_gb`` or ``ssd`` override detection.
+
+        Returns
+        -----------------------
+        rec : Recommendation
+        """
+        # Imported here to keep importing the tuner module lightweight
+        from osm2pgsql_tuner import host
+        source_decisions = []
+
+        resources = None
+        if kwargs.get('system_ram_gb') is None or kwargs.get('cpu_count') is None:
+            resources = host.detect(root)
+
+        if resources is not None and kwargs.get('system_ram_gb') is None:
+            kwargs['system_ram_gb'] = resources.ram_gb
+            source_decisions.append(Decision(SourceDecision.RAM_DETECTED,
+                                             ram_gb=resources.ram_gb,
+                                             source=resources.ram_source))
+        else:
+            source_decisions.append(Decision(SourceDecision.RAM_USER_PROVIDED))
+
+        if resources is not None and kwargs.get('cpu_count') is None:
+            kwargs['cpu_count'] = resources.cpu_count
+            source_decisions.append(Decision(SourceDecision.CPU_DETECTED,
+                                             cpu_count=resources.cpu_count,
+                                             source=resources.cpu_source))
+        else:
+            source_decisions.append(Decision(SourceDecision.CPU_USER_PROVIDED))
+
+        if osm_pbf_gb is None and kwargs.get('pbf_stats') is None:
+            if pbf_path is None:
+                raise ValueError('One of osm_pbf_gb, pbf_path or pbf_stats must be set.')
+            osm_pbf_gb = os.path.getsize(pbf_path) / 1024**3
+
+        if kwargs.get('ssd') is None:
+            paths = [path for path in (pbf_path, flat_nodes_path) if path]
+            rotational = {path: host.is_rotational(path, root=root) for path in paths}
+            known = {path: flag for path, flag in rotational.items() if flag is not None}
+            if known:
+                kwargs['ssd'] = not any(known.values())
+                details = ', '.join(f'{path}={"HDD" if flag else "SSD"}'
+                                    for path, flag in known.items())
+                source_decisions.append(Decision(SourceDecision.SSD_DETECTED,
+                                                 details=details))
+            else:
+                kwargs['ssd'] = True
+                source_decisions.append(Decision(SourceDecision.SSD_DEFAULT))
+        else:
+            source_decisions.append(Decision(SourceDecision.SSD_USER_PROVIDED))
+
+        rec = cls(osm_pbf_gb=osm_pbf_gb, **kwargs)
+        rec.flat_nodes_path = flat_nodes_path
+        rec.decisions[0:0] = source_decisions
+        return rec
+
+    def preflight(self, candidate_dirs, database_dir: str=None,
+                  strict: bool=False, root: str='/'):
+        """Checks disk space and picks the ``--flat-nodes`` location.
 
-        self.osm2pgsql_run_in_ram = self.run_in_ram()
-        self.osm2pgsql_drop = self.use_drop()
-        self.osm2pgsql_flat_nodes = self.use_flat_nodes()
+        Sets ``flat_nodes_path`` to the fastest candidate directory with room
+        for the flat nodes file and records the outcome in ``decisions``.
 
-        self.osm2pgsql_limited_ram = self.limited_ram_check()
+        Parameters
+        -----------------------
+        candidate_dirs : list of str
+            Directories to consider for the flat nodes file.
+        database_dir : str
+            (Default None) PostgreSQL data directory to check for room for
+            the middle and output tables.
+        strict : bool
+            (Default False) Raise ``ValueError`` when the plan does not fit
+            instead of only recording a warning in ``decisions``.
+        root : str
+            (Default ``/``) Filesystem root to read ``/proc`` and ``/sys`` from.
 
+        Returns
+        -----------------------
+        result : osm2pgsql_tuner.preflight.PreflightResult
+        """
+        # Imported here to keep importing the tuner module lightweight
+        from osm2pgsql_tuner import preflight
+        result = preflight.check(self, candidate_dirs, database_dir=database_dir,
+                                 root=root)
+        decisions = self.decisions
+        if result.flat_nodes_path is not None:
+            self.flat_nodes_path = result.flat_nodes_path
+            decisions.append(Decision(DiskDecision.FLAT_NODES_PLACEMENT,
+                                      path=result.flat_nodes_path,
+                                      size_gb=result.flat_nodes_bytes / 1024**3))
+
+        for problem in result.problems:
+            decisions.append(Decision(DiskDecision.INSUFFICIENT_DISK,
+                                      problem=problem))
+
+        if strict and not result.fits:
+            raise ValueError('Import does not fit available disk: ' + '; '.join(result.problems))
+        return result
+
+    def plan_tablespaces(self, candidate_dirs, database_dir: str=None,
+                         probes: dict=None, root: str='/', **probe_kwargs):
+        """Places the flat nodes file and tablespaces on measured storage.
+
+        Sets ``flat_nodes_path`` and ``tablespace_plan``, the slim tablespaces
+        are added to the osm2pgsql command.  Placements and problems are
+        recorded in ``decisions``.
+
+        Parameters
+        -----------------------
+        candidate_dirs : list of str
+        database_dir : str
+            (Default None) PostgreSQL data directory, roles placed on its
+            device stay in the default tablespace.
+        probes : dict
+            (Default None) Path to :class:`osm2pgsql_tuner.storage.IoProbe`,
+            missing candidates are probed.
+        root : str
+            (Default ``/``) Filesystem root to read ``/proc`` and ``/sys`` from.
+        probe_kwargs
+            Passed to :func:`osm2pgsql_tuner.storage.probe`.
+
+        Returns
+        -----------------------
+        result : osm2pgsql_tuner.storage.TablespacePlan
+        """
+        # Imported here to keep importing the tuner module lightweight
+        from osm2pgsql_tuner import storage
+        result = storage.plan(self, candidate_dirs, database_dir=database_dir,
+                              probes=probes, root=root, **probe_kwargs)
+        decisions = self.decisions
+        self.tablespace_plan = result
+        if result.flat_nodes_path is not None:
+            self.flat_nodes_path = result.flat_nodes_path
+        for placement in result.placements.values():
+            decisions.append(Decision(StorageDecision.PLACEMENT, role=placement.role,
+                                      path=placement.path,
+                                      tablespace=placement.tablespace or 'default tablespace'))
+        for problem in result.problems:
+            decisions.append(Decision(DiskDecision.INSUFFICIENT_DISK, problem=problem))
+        return result
 
     def limited_ram_check(self) -> bool:
         """Decide if osm2pgsql can use more RAM than the system has available.
 
+        Evaluates the ``osm2pgsql_limited_ram`` rule w/out recording a decision.
+
         Returns
         -------------------------
         limited_ram : boolean
         """
+        return RULES_BY_ATTRIBUTE['osm2pgsql_limited_ram'].evaluate(self)[1]
+
+    def get_number_processes(self) -> int:
+        """Picks the value for ``--number-processes``.
+
+        Uses one process per CPU, limited by the RAM left over after the
+        osm2pgsql cache (or the in-RAM middle) has been sized.  Each process
+        after the first costs ``PROCESS_RAM_GB_SLIM`` or ``PROCESS_RAM_GB_NOSLIM``.
+
+        Returns
+        ---------------------
+        number_processes : int or None
+            None when ``cpu_count`` was not provided, osm2pgsql then uses its
+            default and no decision is recorded.
+        """
+        if self.cpu_count is None:
+            return None
+
         if self.osm2pgsql_run_in_ram:
-            # If running w/out slim is possible, already determined there is
-            # enough RAM.
-            return False
+            planned_gb = self.osm2pgsql_noslim_cache
+            process_gb = PROCESS_RAM_GB_NOSLIM
+        else:
+            if self.osm2pgsql_flat_nodes:
+                planned_gb = 0.0
+            elif self.osm2pgsql_limited_ram:
+                planned_gb = self.osm2pgsql_cache_max
+            else:
+                planned_gb = self.osm2pgsql_slim_cache
+            process_gb = PROCESS_RAM_GB_SLIM
+
+        headroom_gb = max(0.0, self.osm2pgsql_cache_max - planned_gb)
+        ram_limit = 1 + int(headroom_gb / process_gb)
+        number_processes = max(1, min(int(self.cpu_count), ram_limit))
+
+        if number_processes < self.cpu_count:
+            self._record(ProcessesDecision.LIMITED_RAM, headroom_gb=headroom_gb,
+                         number_processes=number_processes, cpu_count=self.cpu_count)
+        else:
+            self._record(ProcessesDecision.ONE_PER_CPU,
+                         number_processes=number_processes)
+        return number_processes
 
-        if self.osm2pgsql_slim_cache > self.osm2pgsql_cache_max:
-            return True
+    def get_flat_nodes_gb(self) -> float:
+        """Returns the PBF size from which ``--flat-nodes`` is used in slim mode.
 
-        # Is this possible to reach? Does self.osm2pgsql_run_in_ram provide
-        # enough info already?
-        return False
+        From the measured random reads with ``storage``, otherwise
+        ``FLAT_NODES_THRESHOLD_GB`` on SSD and ``FLAT_NODES_ALWAYS_GB`` on HDD.
+
+        Returns
+        ---------------------
+        flat_nodes_gb : float
+        """
+        if self.storage is None:
+            return FLAT_NODES_THRESHOLD_GB if self.ssd else FLAT_NODES_ALWAYS_GB
+        threshold_gb = self.storage.flat_nodes_gb()
+        self._record(StorageDecision.MEASURED, tier=self.storage.tier,
+                     path=self.storage.path, read_iops=self.storage.read_4k_iops,
+                     threshold_gb=threshold_gb)
+        return threshold_gb
 
     def use_flat_nodes(self) -> bool:
         """Returns `True` if ``--flat-nodes`` should be used.
@@ -97,86 +597,148 @@ class Recommendation():
         Use ``--flat-nodes`` when:
             * PBF size is larger than config'd threshold AND SSD
             * PBF >= 30 GB (regardless of SSD)
+            * With ``storage``, PBF size is at least ``osm2pgsql_flat_nodes_gb``
 
         If the load can run entirely in-memory, no need to use flat nodes.
+        Evaluates the ``osm2pgsql_flat_nodes`` rule w/out recording a decision.
 
         Returns
         ---------------------
         use_flat_nodes : bool
         """
-        if self.osm2pgsql_run_in_ram:
-            decision = {'option': '--flat-node',
-                        'name': 'Sufficient RAM',
-                        'desc': 'No reason to consider --flat-nodes'}
-            self.decisions.append(decision)
-            return False
+        return RULES_BY_ATTRIBUTE['osm2pgsql_flat_nodes'].evaluate(self)[1]
 
-        if self.osm_pbf_gb >= FLAT_NODES_THRESHOLD_GB and self.ssd:
-            decision = {'option': '--flat-node',
-                        'name': 'File of sufficient size',
-                        'desc': 'File is large enough to consider --flat-nodes'}
-            self.decisions.append(decision)
-            return True
 
-        if self.osm_pbf_gb >= 30.0:
-            decision = {'option': '--flat-node',
-                        'name': 'File of sufficient size',
-                        'desc': 'File is large enough to consider --flat-nodes'}
-            self.decisions.append(decision)
+    def use_drop(self) -> bool:
+        """Checks other parameters to determine if ``--drop`` should be used.
+
+        Evaluates the ``osm2pgsql_drop`` rule w/out recording a decision.
+
+        Returns
+        -----------------------
+        use_drop : bool
+        """
+        return RULES_BY_ATTRIBUTE['osm2pgsql_drop'].evaluate(self)[1]
+
+
+    def get_version_profile(self):
+        """Returns the rule profile for ``osm2pgsql_version``.
+
+        Returns
+        -----------------------
+        profile : osm2pgsql_tuner.versions.VersionProfile or None
+            None when ``osm2pgsql_version`` is not set.
+        """
+        if self.osm2pgsql_version is None:
+            return None
+        # Imported here to keep importing the tuner module lightweight
+        from osm2pgsql_tuner import versions
+        profile = versions.get_profile(self.osm2pgsql_version)
+        self._record(VersionDecision.PROFILE, version=self.osm2pgsql_version,
+                     profile=profile.name)
+        return profile
+
+    def use_tags_filter(self) -> bool:
+        """Decides if an ``osmium tags-filter`` pre-pass should shrink the input.
+
+        Only with a ``style_analysis`` whose tag filters match a small share
+        of the input, see :attr:`osm2pgsql_tuner.layerset.StyleAnalysis.tags_filter_recommended`.
+        Never with ``slim_no_drop``, diffs applied later reference objects
+        the filter removed.
+
+        Returns
+        -----------------------
+        use_tags_filter : bool
+        """
+        if self.style_analysis is None:
+            return False
+        if self.slim_no_drop:
+            self._record(TagsFilterDecision.USING_APPEND)
+            return False
+
+        layer_set = self.style_analysis.layer_set
+        share = self.style_analysis.input_share
+        if self.style_analysis.tags_filter_recommended:
+            self._record(TagsFilterDecision.SMALL_LAYER_SET,
+                         layer_set=layer_set, share=share)
             return True
 
-        decision = {'option': '--flat-node',
-                    'name': 'Not using',
-                    'desc': 'No reason to use --flat-nodes'}
-        self.decisions.append(decision)
+        if self.style_analysis.catch_all:
+            self._record(TagsFilterDecision.CATCH_ALL, layer_set=layer_set)
+        else:
+            self._record(TagsFilterDecision.LARGE_SHARE,
+                         layer_set=layer_set, share=share)
         return False
 
+    def get_input_share(self) -> float:
+        """Returns the share of the PBF osm2pgsql reads.
 
-    def use_drop(self) -> bool:
-        """Checks other parameters to determine if ``--drop`` should be used.
+        Returns
+        -----------------------
+        input_share : float
+            1.0 unless ``osmium tags-filter`` is used.
+        """
+        if self.osm2pgsql_tags_filter:
+            return self.style_analysis.input_share
+        return 1.0
+
+    def get_output_factor(self) -> float:
+        """Returns the output size relative to the PgOSM Flex ``run`` layer set.
 
         Returns
         -----------------------
-        use_drop : bool
+        output_factor : float
+            1.0 w/out a ``style_analysis``.
         """
-        if self.osm2pgsql_run_in_ram:
-            use_drop = False
-            decision = {'option': '--drop',
-                        'name': 'Sufficient RAM',
-                        'desc': 'Import can run entirely in RAM, --drop not needed.'}
-            self.decisions.append(decision)
-        elif self.slim_no_drop:
-            use_drop = False
-            decision = {'option': '--drop',
-                        'name': 'Using Append',
-                        'desc': 'Using --append, cannot use --drop'}
-            self.decisions.append(decision)
-        else:
-            use_drop = True
-            decision = {'option': '--drop',
-                        'name': 'Using Drop',
-                        'desc': 'No reason not to use --drop'}
-            self.decisions.append(decision)
+        if self.style_analysis is None:
+            return 1.0
+        return self.style_analysis.output_factor
 
-        return use_drop
+    def get_tags_filter_command(self, pbf_path: str, output_path: str=None) -> str:
+        """Builds the ``osmium tags-filter`` pre-pass command, when used.
 
+        Parameters
+        -----------------------
+        pbf_path : str
+        output_path : str
+            (Default None) Filtered file, see :func:`osm2pgsql_tuner.layerset.filtered_path`.
+
+        Returns
+        -----------------------
+        cmd : str or None
+            None when no pre-pass is recommended.
+        """
+        if not self.osm2pgsql_tags_filter:
+            return None
+        # Imported here to keep importing the tuner module lightweight
+        from osm2pgsql_tuner import layerset
+        if output_path is None:
+            output_path = layerset.filtered_path(pbf_path)
+        return self.style_analysis.get_tags_filter_command(pbf_path, output_path)
 
     def calculate_max_osm2pgsql_cache(self) -> float:
         """Calculates the max RAM server has available to dedicate to osm2pgsql cache.
 
-        Using 2/3 of reported system total.
+        Using 2/3 of reported system total.  When ``postgres_ram_gb`` is set,
+        using 2/3 of the RAM not reserved for PostgreSQL.
 
 		Returns
 		-----------------------
 		osm2pgsql_cache_max : float
         """
-        osm2pgsql_cache_max = self.system_ram_gb * 0.66
-        return osm2pgsql_cache_max
+        if self.postgres_ram_gb is not None:
+            self._record(CacheMaxDecision.CO_LOCATED_POSTGRES,
+                         postgres_ram_gb=self.postgres_ram_gb)
+        return max_cache_gb(self.system_ram_gb, self.postgres_ram_gb)
 
     def get_osm2pgsql_noslim_cache(self) -> float:
         """Calculates cache required by osm2pgsql in order to run w/out slim.
 
         Uses basic calculation based on the size of the PBF size being imported.
+        When ``pbf_stats`` is set, the node, way and relation counts are used instead.
+        With a ``calibration`` profile the per-element bytes are scaled by the
+        calibrated per GB factor relative to ``NOSLIM_GB_PER_PBF_GB``.
+        The size dependent part is scaled by ``osm2pgsql_input_share``.
 
         Justification: https://blog.rustprooflabs.com/2021/05/osm2pgsql-reduced-ram-load-to-postgis
 
@@ -185,44 +747,82 @@ class Recommendation():
         required_gb : float
             Estimated memory (in GB) osm2pgsql will use if running w/out slim mode.
         """
-        required_gb = 1 + (2.5 * self.osm_pbf_gb)
+        base_gb = NOSLIM_BASE_GB
+        per_pbf_gb = NOSLIM_GB_PER_PBF_GB
+        if self.version_profile is not None:
+            base_gb = self.version_profile.noslim_base_gb
+            per_pbf_gb = self.version_profile.noslim_gb_per_pbf_gb
+        if self.calibration is not None:
+            base_gb = self.calibration.noslim_base_gb
+            per_pbf_gb = self.calibration.noslim_gb_per_pbf_gb
+            self._record(EstimateDecision.CALIBRATED,
+                         version=self.calibration.osm2pgsql_version,
+                         sample_count=self.calibration.sample_count)
+
+        if self.pbf_stats is not None:
+            element_bytes = (self.pbf_stats.node_count * NOSLIM_BYTES_PER_NODE
+                             + self.pbf_stats.way_count * NOSLIM_BYTES_PER_WAY
+                             + self.pbf_stats.relation_count * NOSLIM_BYTES_PER_RELATION)
+            element_bytes *= per_pbf_gb / NOSLIM_GB_PER_PBF_GB
+            element_bytes *= self.osm2pgsql_input_share
+            self._record(EstimateDecision.ELEMENT_STATISTICS)
+            return base_gb + (element_bytes / 1024**3)
+
+        required_gb = base_gb + (per_pbf_gb * self.osm_pbf_gb * self.osm2pgsql_input_share)
         return required_gb
 
+    def get_slim_cache_ratio(self) -> float:
+        """Returns slim mode cache as a fraction of the no-slim requirement.
+
+        Returns
+        --------------------
+        ratio : float
+        """
+        if self.calibration is not None:
+            return self.calibration.slim_cache_ratio
+        if self.version_profile is not None:
+            return self.version_profile.slim_cache_ratio
+        return SLIM_CACHE_RATIO
+
 
     def run_in_ram(self) -> bool:
         """Determines if bypassing ``--slim`` is an option with the given details.
 
         Uses details about append mode, RAM available and the size of the input
-        PBF to make determination.
+        PBF to make determination.  Evaluates the ``osm2pgsql_run_in_ram``
+        rule w/out recording a decision.
 
         Returns
         --------------------
         in_ram_possible : bool
         """
-        if self.slim_no_drop:
-            in_ram_possible = False
-            decision = {'option': '--slim',
-                        'name': 'Using Append',
-                        'desc': 'Use of --append mode requires --slim'}
-            self.decisions.append(decision)
-        elif self.osm2pgsql_noslim_cache <= self.osm2pgsql_cache_max:
-            in_ram_possible = True
-        else:
-            in_ram_possible = False
-        return in_ram_possible
+        return RULES_BY_ATTRIBUTE['osm2pgsql_run_in_ram'].evaluate(self)[1]
 
 
-    def get_osm2pgsql_command(self, pbf_path: str) -> str:
+    def get_osm2pgsql_command(self, pbf_path: str, schema: str=None) -> str:
         """Builds the recommended osm2pgsql command.
 
         Parameters
         -----------------------
         pbf_path : str
+        schema : str
+            (Default None) Schema for the output tables and, with ``--slim``,
+            the middle tables, e.g. for concurrent imports into one database.
+            ``--schema`` needs osm2pgsql 1.9 or newer, ``ValueError`` is
+            raised when ``osm2pgsql_version`` is older.
 
         Returns
         -----------------------
         cmd : str
         """
+        if schema is not None and self.osm2pgsql_version is not None:
+            # Imported here to keep importing the tuner module lightweight
+            from osm2pgsql_tuner import versions
+            if not versions.supports_schema(self.osm2pgsql_version):
+                raise ValueError(f'--schema needs osm2pgsql 1.9 or newer, '
+                                 f'got {self.osm2pgsql_version}.')
+        # Keeps the order of decisions independent of the attributes used here
+        self.evaluate()
         cmd = 'osm2pgsql -d $PGOSM_CONN '
 
         if not self.osm2pgsql_run_in_ram:
@@ -232,8 +832,20 @@ class Recommendation():
             if self.osm2pgsql_drop:
                 cmd += ' --drop '
             if self.osm2pgsql_flat_nodes:
-                nodes_path = '/tmp/nodes'
-                cmd += f' --flat-nodes={nodes_path} '
+                cmd += f' --flat-nodes={self.flat_nodes_path} '
+            if self.tablespace_plan is not None:
+                for arg in self.tablespace_plan.osm2pgsql_args():
+                    cmd += f' {arg} '
+            if self.version_profile is not None and self.version_profile.middle_database_format:
+                cmd += f' --middle-database-format={self.version_profile.middle_database_format} '
+            if schema is not None:
+                cmd += f' --middle-schema={schema} '
+
+        if self.osm2pgsql_number_processes is not None:
+            cmd += f' --number-processes={self.osm2pgsql_number_processes} '
+
+        if schema is not None:
+            cmd += f' --schema={schema} '
 
         # Create is default, being extra verbose and always adding it now
         osm2pgsql_mode = ' --create '
@@ -250,31 +862,112 @@ class Recommendation():
         return cmd
 
 
+    def get_runtime_estimate(self, coefficients=None):
+        """Estimates how long the recommended osm2pgsql command will run.
+
+        Parameters
+        -----------------------
+        coefficients : osm2pgsql_tuner.runtime.RuntimeCoefficients
+            (Default None) Coefficients fit from recorded runs.  Uses the
+            defaults in :mod:`osm2pgsql_tuner.runtime` when None.
+
+        Returns
+        -----------------------
+        estimate : osm2pgsql_tuner.runtime.RuntimeEstimate
+        """
+        # Imported here to keep importing the tuner module lightweight
+        from osm2pgsql_tuner import runtime
+        return runtime.estimate_for(self, coefficients=coefficients)
+
+
+    def get_index_plan(self, cluster: bool=True, schema: str='osm'):
+        """Plans index builds and clustering for the tables of the layer set.
+
+        Requires ``style_analysis``.
+
+        Parameters
+        -----------------------
+        cluster : bool
+            (Default True) ``CLUSTER`` each table on its geometry index.
+        schema : str
+            (Default osm)
+
+        Returns
+        -----------------------
+        index_plan : osm2pgsql_tuner.indexplan.IndexPlan
+        """
+        if self.style_analysis is None:
+            raise ValueError('style_analysis is required to plan index builds.')
+        # Imported here to keep importing the tuner module lightweight
+        from osm2pgsql_tuner import indexplan
+        return indexplan.plan(self.style_analysis, self.osm_pbf_gb,
+                              self.system_ram_gb, cpu_count=self.cpu_count,
+                              ssd=self.ssd, cluster=cluster, schema=schema)
+
+
+    def get_partition_plan(self, pbf_path: str=None, bbox: tuple=None):
+        """Compares this import with splitting the input into concurrent imports.
+
+        Parameters
+        -----------------------
+        pbf_path : str
+            (Default None) Input file, partitions follow its node density.
+        bbox : tuple
+            (Default None) ``(left, bottom, right, top)`` of the input.
+
+        Returns
+        -----------------------
+        partition_plan : osm2pgsql_tuner.partition.PartitionPlan
+        """
+        # Imported here to keep importing the tuner module lightweight
+        from osm2pgsql_tuner import partition
+        return partition.plan(self, pbf_path=pbf_path, bbox=bbox)
+
+
     def get_cache_mb(self) -> int:
         """Returns cache size to set in MB.
 
         osm2pgsql will only use a cache value > 0 while in slim mode.
+        Memoized as ``osm2pgsql_cache_mb``, the decision is recorded once.
 
         Returns
         ----------------------
         cache : int
             Size in MB to set --cache
         """
-        if self.osm2pgsql_flat_nodes:
-            cache = 0
-            decision = {'option': '--cache',
-                        'name': 'Using --flat-nodes',
-                        'desc': 'Set --cache 0.'}
-        elif self.osm2pgsql_limited_ram:
-            cache = int(self.osm2pgsql_cache_max * 1024)
-            decision = {'option': '--cache',
-                        'name': 'Limited RAM',
-                        'desc': 'Setting --cache to max available.'}
-        else:
-            cache = int(self.osm2pgsql_slim_cache * 1024)
-            decision = {'option': '--cache',
-                        'name': 'Sufficient RAM',
-                        'desc': 'Set --cache to expected requirement for given PBF size.'}
+        return self.osm2pgsql_cache_mb
+
+
+    def to_dict(self) -> dict:
+        """Returns the inputs and calculated attributes as a dictionary.
 
-        self.decisions.append(decision)
-        return cache
+        Returns
+        ----------------------
+        recommendation : dict
+            JSON serializable, ``decisions`` are not included.
+        """
+        return {'system_ram_gb': self.system_ram_gb,
+                'osm_pbf_gb': self.osm_pbf_gb,
+                'slim_no_drop': self.slim_no_drop,
+                'append_first_run': self.append_first_run,
+                'pgosm_layer_set': self.pgosm_layer_set,
+                'ssd': self.ssd,
+                'cpu_count': self.cpu_count,
+                'postgres_ram_gb': self.postgres_ram_gb,
+                'osm2pgsql_version': self.osm2pgsql_version,
+                'osm2pgsql_tags_filter': self.osm2pgsql_tags_filter,
+                'osm2pgsql_input_share': self.osm2pgsql_input_share,
+                'osm2pgsql_output_factor': self.osm2pgsql_output_factor,
+                'osm2pgsql_cache_max': self.osm2pgsql_cache_max,
+                'osm2pgsql_noslim_cache': self.osm2pgsql_noslim_cache,
+                'osm2pgsql_slim_cache': self.osm2pgsql_slim_cache,
+                'osm2pgsql_run_in_ram': self.osm2pgsql_run_in_ram,
+                'osm2pgsql_drop': self.osm2pgsql_drop,
+                'osm2pgsql_flat_nodes': self.osm2pgsql_flat_nodes,
+                'osm2pgsql_limited_ram': self.osm2pgsql_limited_ram,
+                'osm2pgsql_number_processes': self.osm2pgsql_number_processes,
+                'flat_nodes_path': self.flat_nodes_path}
+
+
+_CALCULATED = tuple((attribute, vars(Recommendation)[attribute])
+                    for attribute in CALCULATED_ATTRIBUTES)
@@ -0,0 +1,163 @@
+"""Per osm2pgsql version rule profiles.
+
+Recommendations were written against osm2pgsql v1.5.0.  Later releases
+change which flags are valid and fastest:
+
+* 1.9.0 added the new middle database format
+  (``--middle-database-format=new``), smaller slim middle tables.
+* 2.0.0 made the new middle format the default.
+
+Each :class:`VersionProfile` holds the flags and memory model defaults for a
+range of versions.  Calibration profiles
+(:mod:`osm2pgsql_tuner.calibration`) are fit per version and replace the
+memory model defaults.  The installed version can be read with
+:func:`detect_version`.
+"""
+import re
+import subprocess
+
+
+MIN_VERSION = (1, 5, 0)
+"""tuple : Oldest osm2pgsql version recommendations support."""
+
+SCHEMA_MIN_VERSION = (1, 9, 0)
+"""tuple : First version with ``--schema`` and ``--middle-schema``."""
+
+_RE_VERSION = re.compile(r'osm2pgsql version (\d+)\.(\d+)\.(\d+)')
+
+
+class VersionProfile():
+    """Flags and memory model defaults for a range of osm2pgsql versions.
+
+    Parameters
+    -----------------------
+    name : str
+    min_version : tuple
+        First version the profile applies to, ``(major, minor, patch)``.
+    middle_database_format : str
+        Value for ``--middle-database-format`` in slim mode, None to leave
+        the default in place.
+    middle_gb_factor : float
+        Slim middle table size relative to the v1.5 format.
+    noslim_base_gb : float
+    noslim_gb_per_pbf_gb : float
+    slim_cache_ratio : float
+    """
+    def __init__(self, name: str, min_version: tuple,
+                 middle_database_format: str, middle_gb_factor: float,
+                 noslim_base_gb: float, noslim_gb_per_pbf_gb: float,
+                 slim_cache_ratio: float):
+        self.name = name
+        self.min_version = min_version
+        self.middle_database_format = middle_database_format
+        self.middle_gb_factor = middle_gb_factor
+        self.noslim_base_gb = noslim_base_gb
+        self.noslim_gb_per_pbf_gb = noslim_gb_per_pbf_gb
+        self.slim_cache_ratio = slim_cache_ratio
+
+    def to_dict(self) -> dict:
+        """Returns the profile as a dictionary.
+
+        Returns
+        ----------------------
+        profile : dict
+        """
+        return dict(vars(self), min_version='.'.join(str(part) for part in self.min_version))
+
+
+PROFILES = (
+    VersionProfile('1.5', (1, 5, 0), middle_database_format=None,
+                   middle_gb_factor=1.0, noslim_base_gb=1.0,
+                   noslim_gb_per_pbf_gb=2.5, slim_cache_ratio=0.75),
+    # New middle format is opt-in, middle size is an initial estimate
+    VersionProfile('1.9', (1, 9, 0), middle_database_format='new',
+                   middle_gb_factor=0.8, noslim_base_gb=1.0,
+                   noslim_gb_per_pbf_gb=2.5, slim_cache_ratio=0.75),
+    VersionProfile('2.0', (2, 0, 0), middle_database_format=None,
+                   middle_gb_factor=0.8, noslim_base_gb=1.0,
+                   noslim_gb_per_pbf_gb=2.5, slim_cache_ratio=0.75),
+)
+"""tuple : Profiles ordered by ``min_version``."""
+
+
+def parse_version(version) -> tuple:
+    """Parses a version string or ``osm2pgsql --version`` output.
+
+    Parameters
+    -----------------------
+    version : str or tuple
+        e.g. ``1.9.2``, ``2.0`` or ``osm2pgsql version 1.8.1``.
+
+    Returns
+    -----------------------
+    version : tuple
+        ``(major, minor, patch)``
+    """
+    if isinstance(version, tuple):
+        return tuple(version) + (0,) * (3 - len(version))
+    match = _RE_VERSION.search(version)
+    if match is None:
+        match = re.fullmatch(r'\s*v?(\d+)\.(\d+)(?:\.(\d+))?\s*', version)
+    if match is None:
+        raise ValueError(f'Cannot parse osm2pgsql version: {version!r}')
+    return tuple(int(part or 0) for part in match.groups())
+
+
+def get_profile(version) -> VersionProfile:
+    """Returns the profile for an osm2pgsql version.
+
+    Parameters
+    -----------------------
+    version : str or tuple
+
+    Returns
+    -----------------------
+    profile : VersionProfile
+    """
+    version = parse_version(version)
+    if version < MIN_VERSION:
+        minimum = '.'.join(str(part) for part in MIN_VERSION)
+        raise ValueError(f'osm2pgsql {minimum} or newer is required.')
+    return [profile for profile in PROFILES if profile.min_version <= version][-1]
+
+
+def supports_schema(version) -> bool:
+    """Returns True when the osm2pgsql version has ``--schema``.
+
+    Parameters
+    -----------------------
+    version : str or tuple
+
+    Returns
+    -----------------------
+    supported : bool
+    """
+    return parse_version(version) >= SCHEMA_MIN_VERSION
+
+
+def detect_version(binary='osm2pgsql') -> str:
+    """Returns the version reported by ``osm2pgsql --version``.
+
+    Older versions print the version to stderr, both streams are read.
+
+    Parameters
+    -----------------------
+    binary : str or list of str
+        (Default osm2pgsql) Binary, or command prefix such as
+        ``['docker', 'exec', 'pgosm', 'osm2pgsql']``.
+
+    Returns
+    -----------------------
+    version : str
+        e.g. ``1.9.2``
+    """
+    command = [binary] if isinstance(binary, str) else list(binary)
+    try:
+        completed = subprocess.run(command + ['--version'], capture_output=True,
+                                   text=True, timeout=30, check=False)
+    except subprocess.TimeoutExpired as err:
+        raise ValueError(f'{" ".join(command)} --version did not finish') from err
+    match = _RE_VERSION.search(completed.stdout + completed.stderr)
+    if match is None:
+        raise ValueError(f'No version in output of {" ".join(command)} --version')
+    return '.'.join(match.groups())
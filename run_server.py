@@ -0,0 +1,21 @@
+"""Runs the osm2pgsql-tuner web service.
+
+    python run_server.py --host 0.0.0.0 --port 8080
+"""
+import argparse
+import asyncio
+
+from osm2pgsql_tuner import server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='osm2pgsql-tuner web service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--cache-size', type=int, default=server.DEFAULT_CACHE_SIZE)
+    args = parser.parse_args()
+    asyncio.run(server.serve(args.host, args.port, args.cache_size))
+
+
+if __name__ == '__main__':
+    main()
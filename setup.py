@@ -7,4 +7,6 @@ setup(name='osm2pgsql_tuner',
       author='RustProof Labs',
       author_email='support@rustprooflabs.com',
       packages=['osm2pgsql_tuner'],
+      extras_require={'batch': ['numpy']},
+      entry_points={'console_scripts': ['osm2pgsql-tuner=osm2pgsql_tuner.cli:main']},
       zip_safe=False)
\ No newline at end of file
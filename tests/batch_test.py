@@ -0,0 +1,88 @@
+""" Unit tests to cover the batch module."""
+import itertools
+import time
+import unittest
+
+from osm2pgsql_tuner import tuner
+
+try:
+    import numpy as np
+    from osm2pgsql_tuner import batch
+except ImportError:
+    np = None
+
+# Load configurables for tests
+from .test_params import *
+
+
+@unittest.skipIf(np is None, 'numpy is not installed')
+class BatchTests(unittest.TestCase):
+
+    def test_batch_recommend_matches_scalar_recommendation(self):
+        ram_values = [SYSTEM_RAM_GB_SMALL, 4, 8.5, 16, 32, SYSTEM_RAM_GB_MAIN, 128]
+        pbf_values = [OSM_PBF_GB_CO, OSM_PBF_GB_USWEST, 2.6, 7.99, 8.0,
+                      OSM_PBF_GB_US, 29.99, OSM_PBF_GB_ALWAYS_FLAT_FILE, 70.0]
+        rows = list(itertools.product(ram_values, pbf_values,
+                                      [False, True], [False, True]))
+        ram, pbf, slim_no_drop, ssd = (list(col) for col in zip(*rows))
+        result = batch.recommend(ram, pbf, slim_no_drop=slim_no_drop, ssd=ssd)
+
+        for i, row in enumerate(rows):
+            rec = tuner.Recommendation(row[0], row[1], slim_no_drop=row[2],
+                                       append_first_run=True, ssd=row[3])
+            self.assertEqual(rec.osm2pgsql_cache_max, result.osm2pgsql_cache_max[i])
+            self.assertEqual(rec.osm2pgsql_noslim_cache, result.osm2pgsql_noslim_cache[i])
+            self.assertEqual(rec.osm2pgsql_slim_cache, result.osm2pgsql_slim_cache[i])
+            self.assertEqual(rec.osm2pgsql_run_in_ram, result.osm2pgsql_run_in_ram[i])
+            self.assertEqual(rec.osm2pgsql_drop, result.osm2pgsql_drop[i])
+            self.assertEqual(rec.osm2pgsql_flat_nodes, result.osm2pgsql_flat_nodes[i])
+            self.assertEqual(rec.osm2pgsql_limited_ram, result.osm2pgsql_limited_ram[i])
+            self.assertEqual(rec.get_cache_mb(), result.cache_mb[i])
+
+    def test_batch_recommend_broadcasts_scalar_inputs(self):
+        result = batch.recommend(SYSTEM_RAM_GB_MAIN, [OSM_PBF_GB_CO, OSM_PBF_GB_US])
+        self.assertEqual(2, len(result))
+
+    def test_batch_recommend_all_scalar_inputs_returns_one_row(self):
+        result = batch.recommend(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_US)
+        self.assertEqual(1, len(result))
+        self.assertEqual(20736, result.cache_mb[0])
+
+    def test_batch_recommend_decision_codes(self):
+        result = batch.recommend([SYSTEM_RAM_GB_MAIN, SYSTEM_RAM_GB_SMALL,
+                                  SYSTEM_RAM_GB_SMALL],
+                                 [OSM_PBF_GB_US, OSM_PBF_GB_US, OSM_PBF_GB_USWEST])
+        self.assertEqual([batch.SlimDecision.IN_RAM,
+                          batch.SlimDecision.INSUFFICIENT_RAM,
+                          batch.SlimDecision.INSUFFICIENT_RAM],
+                         result.slim_decision.tolist())
+        self.assertEqual([batch.CacheDecision.SUFFICIENT_RAM,
+                          batch.CacheDecision.FLAT_NODES,
+                          batch.CacheDecision.LIMITED_RAM],
+                         result.cache_decision.tolist())
+
+    def test_batch_decision_codes_match_scalar_rules(self):
+        ram = [SYSTEM_RAM_GB_MAIN, SYSTEM_RAM_GB_SMALL, SYSTEM_RAM_GB_SMALL]
+        pbf = [OSM_PBF_GB_US, OSM_PBF_GB_US, OSM_PBF_GB_USWEST]
+        result = batch.recommend(ram, pbf)
+        for i, (system_ram_gb, osm_pbf_gb) in enumerate(zip(ram, pbf)):
+            rec = tuner.Recommendation(system_ram_gb, osm_pbf_gb)
+            codes = [tuner.RULES_BY_ATTRIBUTE[attribute].evaluate(rec)[0]
+                     for attribute in ('osm2pgsql_run_in_ram', 'osm2pgsql_drop',
+                                       'osm2pgsql_flat_nodes', 'osm2pgsql_cache_mb')]
+            self.assertEqual(codes, [result.slim_decision[i], result.drop_decision[i],
+                                     result.flat_nodes_decision[i], result.cache_decision[i]])
+
+    def test_batch_recommend_value_error_when_insufficient_ram(self):
+        with self.assertRaises(ValueError):
+            batch.recommend([SYSTEM_RAM_GB_MAIN, SYSTEM_RAM_GB_TOO_SMALL],
+                            OSM_PBF_GB_CO)
+
+    def test_batch_recommend_million_rows_under_one_second(self):
+        rng = np.random.default_rng(42)
+        ram = rng.uniform(2, 512, 1_000_000)
+        pbf = rng.uniform(0.01, 80, 1_000_000)
+        start = time.perf_counter()
+        batch.recommend(ram, pbf, slim_no_drop=ram > 256, ssd=pbf < 40)
+        elapsed = time.perf_counter() - start
+        self.assertLess(elapsed, 1.0)
@@ -0,0 +1,140 @@
+""" Unit tests to cover the calibration module."""
+import os
+import tempfile
+import unittest
+
+from osm2pgsql_tuner import calibration, tuner
+
+# Load configurables for tests
+from .test_params import *
+
+
+def sample_log(slim=False, peak_mb=3000, flat_nodes=False):
+    """Returns osm2pgsql log lines similar to a v1.5 run."""
+    middle = 'Mid: pgsql, cache=800MB' if slim else 'Mid: ram'
+    lines = ['2023-01-01 10:00:00  osm2pgsql version 1.5.1 (1.5.1)',
+             f'2023-01-01 10:00:00  {middle}',
+             'Processed 1000 nodes in 2s - 1k/s',
+             'Processed 24000000 nodes in 65s (1m 5s) - 369k/s',
+             'Processed 3000000 ways in 130s (2m 10s) - 23k/s',
+             'Processed 40000 relations in 15s - 3k/s',
+             '2023-01-01 10:04:00  Reading input files done in 210s (3m 30s).',
+             "2023-01-01 10:05:00  All postprocessing on table 'roads' done in 40s.",
+             "2023-01-01 10:06:00  All postprocessing on table 'buildings' done in 62s (1m 2s).",
+             f'2023-01-01 10:06:00  Memory: 1200MB current, {peak_mb}MB peak',
+             '2023-01-01 10:06:01  osm2pgsql took 3961s (1h 6m 1s) overall.']
+    if flat_nodes:
+        lines.insert(2, 'Using flat node file /tmp/nodes')
+    return [line + '\n' for line in lines]
+
+
+class CalibrationTests(unittest.TestCase):
+
+    def test_calibration_parse_duration(self):
+        self.assertEqual(3961, calibration.parse_duration('1h 6m 1s'))
+        self.assertEqual(15, calibration.parse_duration('15s'))
+
+    def test_calibration_parse_log(self):
+        record = calibration.parse_log(sample_log(), osm_pbf_gb=1.0, style='run')
+        self.assertEqual('1.5', record.osm2pgsql_version)
+        self.assertEqual(24000000, record.node_count)
+        self.assertEqual(3000000, record.way_count)
+        self.assertEqual(40000, record.relation_count)
+        self.assertEqual(65, record.seconds_nodes)
+        self.assertEqual(130, record.seconds_ways)
+        self.assertEqual(15, record.seconds_relations)
+        self.assertEqual(62, record.seconds_postprocessing)
+        self.assertEqual(3961, record.seconds_overall)
+        self.assertEqual(3000, record.reported_peak_mb)
+        self.assertFalse(record.slim)
+        self.assertFalse(record.flat_nodes)
+
+    def test_calibration_parse_log_short_and_legacy_durations(self):
+        record = calibration.parse_log(['Processed 10 relations in 1s - 10/s\n',
+                                        'osm2pgsql took 1h 6m 1s overall.\n'])
+        self.assertEqual(1, record.seconds_relations)
+        self.assertEqual(3961, record.seconds_overall)
+
+    def test_calibration_parse_log_slim_flat_nodes_and_rss_samples(self):
+        record = calibration.parse_log(sample_log(slim=True, flat_nodes=True),
+                                       peak_rss_mb=iter([100, 2500, 900]))
+        self.assertTrue(record.slim)
+        self.assertTrue(record.flat_nodes)
+        self.assertEqual(800, record.cache_mb)
+        self.assertEqual(2500, record.peak_mb)
+
+    def fill_store(self, store):
+        # Peak memory follows 2 + 3 * pbf GB exactly
+        runs = []
+        for pbf_gb in (0.5, 1.0, 2.0, 4.0):
+            peak_mb = (2 + 3 * pbf_gb) * 1024
+            runs.append(calibration.parse_log(sample_log(peak_mb=int(peak_mb)),
+                                              osm_pbf_gb=pbf_gb, style='run'))
+        peak_mb = 0.5 * (2 + 3 * 8.0) * 1024
+        runs.append(calibration.parse_log(sample_log(slim=True, peak_mb=int(peak_mb)),
+                                          osm_pbf_gb=8.0, style='run'))
+        store.add_runs(iter(runs))
+
+    def test_calibration_store_fit(self):
+        with calibration.CalibrationStore() as store:
+            self.fill_store(store)
+            profile = store.fit('1.5', style='run')
+        self.assertAlmostEqual(2.0, profile.noslim_base_gb)
+        self.assertAlmostEqual(3.0, profile.noslim_gb_per_pbf_gb)
+        self.assertAlmostEqual(0.5, profile.slim_cache_ratio)
+        self.assertEqual(5, profile.sample_count)
+
+    def test_calibration_store_fit_requires_samples(self):
+        with calibration.CalibrationStore() as store:
+            with self.assertRaises(ValueError):
+                store.fit('1.5')
+
+    def test_calibration_store_fit_rejects_unusable_fits(self):
+        for sizes_peaks in ([(1.0, 8.0), (2.0, 6.0), (4.0, 2.0)],
+                            [(1.0, 1.0), (2.0, 4.0), (4.0, 10.0)],
+                            [(1.0, 3.0), (1.0 + 1e-12, 3.0), (1.0, 3.0)]):
+            runs = [calibration.parse_log(sample_log(peak_mb=int(peak_gb * 1024)),
+                                          osm_pbf_gb=pbf_gb, style='run')
+                    for pbf_gb, peak_gb in sizes_peaks]
+            with calibration.CalibrationStore() as store:
+                store.add_runs(runs)
+                with self.assertRaises(ValueError):
+                    store.fit('1.5')
+
+    def test_calibration_store_ingest_logs_streams_files(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = []
+            for i in range(3):
+                path = os.path.join(tmp_dir, f'run{i}.log')
+                with open(path, 'w', encoding='utf-8') as file_out:
+                    file_out.writelines(sample_log())
+                paths.append(path)
+            metadata = {paths[0]: {'osm_pbf_gb': 1.0, 'style': 'minimal'}}
+            with calibration.CalibrationStore(os.path.join(tmp_dir, 'runs.db')) as store:
+                self.assertEqual(3, store.ingest_logs(paths, metadata=metadata))
+                runs = list(store.runs(style='minimal'))
+        self.assertEqual(1, len(runs))
+        self.assertEqual(1.0, runs[0].osm_pbf_gb)
+        self.assertEqual(24000000, runs[0].node_count)
+
+    def test_calibration_profile_save_load(self):
+        profile = calibration.CalibrationProfile('1.5', 'run', 2.0, 3.0, 0.5, 5)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'profile.json')
+            profile.save(path)
+            loaded = calibration.CalibrationProfile.load(path)
+        self.assertEqual(profile.to_dict(), loaded.to_dict())
+
+    def test_recommendation_with_calibration_profile(self):
+        profile = calibration.CalibrationProfile('1.5', 'run', 2.0, 3.0, 0.5, 5)
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_US,
+                                   calibration=profile)
+        self.assertEqual(2.0 + 3.0 * OSM_PBF_GB_US, rec.osm2pgsql_noslim_cache)
+        self.assertEqual(0.5 * rec.osm2pgsql_noslim_cache, rec.osm2pgsql_slim_cache)
+
+    def test_recommendation_with_default_calibration_profile_matches_constants(self):
+        profile = calibration.CalibrationProfile('1.5', 'run')
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_US,
+                                   calibration=profile)
+        self.assertEqual(27.0, rec.osm2pgsql_noslim_cache)
+        self.assertEqual(20.25, rec.osm2pgsql_slim_cache)
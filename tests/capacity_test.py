@@ -0,0 +1,74 @@
+""" Unit tests to cover the capacity module."""
+import unittest
+
+from osm2pgsql_tuner import calibration, capacity, tuner
+
+# Load configurables for tests
+from .test_params import *
+
+
+EPS = 0.01
+
+
+class CapacityTests(unittest.TestCase):
+
+    def _assert_regions_match(self, model, system_ram_gb):
+        for region in model.regions(system_ram_gb):
+            end = region['end_gb'] if region['end_gb'] is not None else region['start_gb'] + 50
+            for osm_pbf_gb in (region['start_gb'] + EPS, end - EPS):
+                rec = tuner.Recommendation(system_ram_gb, osm_pbf_gb, ssd=model.ssd,
+                                           postgres_ram_gb=model.postgres_ram_gb,
+                                           **model.kwargs)
+                self.assertEqual(region['run_in_ram'], rec.osm2pgsql_run_in_ram, osm_pbf_gb)
+                self.assertEqual(region['flat_nodes'], rec.osm2pgsql_flat_nodes, osm_pbf_gb)
+                self.assertEqual(region['limited_ram'], rec.osm2pgsql_limited_ram, osm_pbf_gb)
+
+    def test_ram_for_noslim_matches_recommendation(self):
+        model = capacity.CapacityModel()
+        ram_gb = model.ram_for_noslim_gb(OSM_PBF_GB_US)
+        self.assertTrue(tuner.Recommendation(ram_gb + EPS, OSM_PBF_GB_US).osm2pgsql_run_in_ram)
+        self.assertFalse(tuner.Recommendation(ram_gb - EPS, OSM_PBF_GB_US).osm2pgsql_run_in_ram)
+
+    def test_max_pbf_in_ram_matches_recommendation(self):
+        model = capacity.CapacityModel(postgres_ram_gb=4)
+        pbf_gb = model.max_pbf_in_ram_gb(SYSTEM_RAM_GB_MAIN)
+        self.assertGreater(pbf_gb, 0)
+        self.assertTrue(tuner.Recommendation(SYSTEM_RAM_GB_MAIN, pbf_gb - EPS,
+                                             postgres_ram_gb=4).osm2pgsql_run_in_ram)
+        self.assertFalse(tuner.Recommendation(SYSTEM_RAM_GB_MAIN, pbf_gb + EPS,
+                                              postgres_ram_gb=4).osm2pgsql_run_in_ram)
+
+    def test_flat_nodes_threshold_by_storage(self):
+        self.assertEqual(tuner.FLAT_NODES_THRESHOLD_GB, capacity.CapacityModel().flat_nodes_gb())
+        self.assertEqual(tuner.FLAT_NODES_ALWAYS_GB,
+                         capacity.CapacityModel(ssd=False).flat_nodes_gb())
+
+    def test_regions_match_recommendation(self):
+        for ssd in (True, False):
+            model = capacity.CapacityModel(ssd=ssd)
+            for system_ram_gb in (2, SYSTEM_RAM_GB_MAIN, 64):
+                self._assert_regions_match(model, system_ram_gb)
+
+    def test_append_mode_never_in_ram(self):
+        model = capacity.CapacityModel(slim_no_drop=True)
+        self.assertIsNone(model.ram_for_noslim_gb(OSM_PBF_GB_CO))
+        self.assertEqual(0.0, model.max_pbf_in_ram_gb(64))
+        self._assert_regions_match(model, 64)
+
+    def test_calibrated_model_and_bisection(self):
+        profile = calibration.CalibrationProfile('1.9', 'run', noslim_base_gb=0.5,
+                                                 noslim_gb_per_pbf_gb=3.0,
+                                                 slim_cache_ratio=0.5, sample_count=3)
+        model = capacity.CapacityModel(calibration=profile)
+        self.assertTrue(model.linear)
+        closed_form = model.max_pbf_in_ram_gb(SYSTEM_RAM_GB_MAIN)
+        self.assertAlmostEqual((SYSTEM_RAM_GB_MAIN * tuner.CACHE_MAX_RATIO - 0.5) / 3.0,
+                               closed_form)
+        model.linear = False
+        self.assertAlmostEqual(closed_form, model.max_pbf_in_ram_gb(SYSTEM_RAM_GB_MAIN),
+                               delta=capacity.BISECT_TOLERANCE_GB)
+        self._assert_regions_match(model, SYSTEM_RAM_GB_MAIN)
+
+    def test_pbf_stats_rejected(self):
+        with self.assertRaises(ValueError):
+            capacity.CapacityModel(pbf_stats=object())
@@ -0,0 +1,119 @@
+""" Unit tests to cover the catalog module."""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from osm2pgsql_tuner import catalog, pbf, synthetic, tuner
+
+# Load configurables for tests
+from .test_params import *
+
+
+class CatalogTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp_dir.name, 'mirror')
+        os.makedirs(os.path.join(self.root, 'north-america', 'us'))
+        self.colorado = os.path.join(self.root, 'north-america', 'us',
+                                     'colorado-latest.osm.pbf')
+        self.andorra = os.path.join(self.root, 'andorra-latest.osm.pbf')
+        synthetic.write_pbf(self.colorado, per_block=100, nodes=1050, ways=230, relations=15,
+                            replication_timestamp=1700000000,
+                            replication_sequence=3900)
+        synthetic.write_pbf(self.andorra, per_block=100, nodes=300, ways=20, relations=2,
+                            bbox=(1.4, 42.4, 1.8, 42.7))
+        with open(os.path.join(self.root, 'README.txt'), 'w') as file_out:
+            file_out.write('not a pbf')
+        self.catalog = catalog.PbfCatalog(os.path.join(self.tmp_dir.name, 'catalog.db'))
+
+    def tearDown(self):
+        self.catalog.close()
+        self.tmp_dir.cleanup()
+
+    def test_catalog_region_name(self):
+        self.assertEqual('north-america/us/colorado',
+                         catalog.region_name(self.colorado, self.root))
+        self.assertEqual('andorra', catalog.region_name(self.andorra, self.root))
+
+    def test_catalog_update_stores_metadata(self):
+        result = self.catalog.update(self.root, sample_blocks=1000)
+        self.assertEqual((2, 0, 0, 0), (result.added, result.updated,
+                                        result.unchanged, result.removed))
+        entry = self.catalog.get('north-america/us/colorado')
+        self.assertEqual((1050, 230, 15),
+                         (entry.node_count, entry.way_count, entry.relation_count))
+        self.assertEqual(1700000000, entry.replication_timestamp)
+        self.assertEqual(3900, entry.replication_sequence)
+        self.assertEqual((-105.0, 39.0, -104.0, 40.0), entry.bbox)
+        self.assertEqual(os.path.getsize(self.colorado), entry.size_bytes)
+        self.assertTrue(entry.exact)
+
+    def test_catalog_rescan_only_touches_changed_files(self):
+        self.catalog.update(self.root)
+        synthetic.write_pbf(self.andorra, per_block=100, nodes=400, ways=20, relations=2)
+        os.utime(self.andorra, ns=(1, 1))
+        with mock.patch.object(pbf, 'scan', wraps=pbf.scan) as scan:
+            result = self.catalog.update(self.root, sample_blocks=1000)
+        self.assertEqual([mock.call(self.andorra, sample_blocks=1000, workers=None)],
+                         scan.call_args_list)
+        self.assertEqual((0, 1, 1), (result.added, result.updated, result.unchanged))
+        self.assertEqual(400, self.catalog.get('andorra').node_count)
+
+    def test_catalog_removes_deleted_files(self):
+        self.catalog.update(self.root)
+        os.remove(self.andorra)
+        result = self.catalog.update(self.root)
+        self.assertEqual(1, result.removed)
+        self.assertEqual(1, len(self.catalog))
+        with self.assertRaises(KeyError):
+            self.catalog.get('andorra')
+
+    def test_catalog_reports_unreadable_files(self):
+        with open(os.path.join(self.root, 'broken.osm.pbf'), 'wb') as file_out:
+            file_out.write(b'\0\0\0\0')
+        result = self.catalog.update(self.root)
+        self.assertEqual(2, result.added)
+        self.assertIn(os.path.join(self.root, 'broken.osm.pbf'), result.errors)
+
+    def test_catalog_keeps_valid_files_next_to_truncated_ones(self):
+        truncated = os.path.join(self.root, 'truncated.osm.pbf')
+        with open(self.andorra, 'rb') as file_in:
+            data = file_in.read()
+        with open(truncated, 'wb') as file_out:
+            file_out.write(data[:len(data) // 2])
+        result = self.catalog.update(self.root)
+        self.assertEqual(2, result.added)
+        self.assertIn(truncated, result.errors)
+        self.assertEqual(2, len(self.catalog))
+
+    def test_catalog_reports_unexpected_scan_failures(self):
+        with mock.patch.object(pbf, 'scan', side_effect=IndexError):
+            result = self.catalog.update(self.root)
+        self.assertEqual(0, result.added)
+        self.assertEqual({self.andorra: 'IndexError', self.colorado: 'IndexError'},
+                         result.errors)
+
+    def test_catalog_lookup_by_short_name_and_bbox(self):
+        self.catalog.update(self.root)
+        self.assertEqual(self.colorado, self.catalog.get('colorado').path)
+        self.assertEqual(['andorra'],
+                         [entry.region for entry in self.catalog.in_bbox(1.5, 42.5, 1.6, 42.6)])
+
+    def test_catalog_persists_between_connections(self):
+        self.catalog.update(self.root)
+        self.catalog.close()
+        self.catalog = catalog.PbfCatalog(os.path.join(self.tmp_dir.name, 'catalog.db'))
+        self.assertEqual(2, len(self.catalog))
+        self.assertEqual(2, self.catalog.update(self.root).unchanged)
+
+    def test_catalog_recommendation_from_region(self):
+        self.catalog.update(self.root, sample_blocks=1000)
+        with mock.patch.object(pbf, 'scan') as scan:
+            rec = tuner.Recommendation.from_catalog(SYSTEM_RAM_GB_MAIN, self.catalog,
+                                                    'colorado')
+        scan.assert_not_called()
+        self.assertEqual(1050, rec.pbf_stats.node_count)
+        self.assertEqual(os.path.getsize(self.colorado) / 1024**3, rec.osm_pbf_gb)
+        self.assertTrue(rec.osm2pgsql_run_in_ram)
@@ -0,0 +1,143 @@
+""" Unit tests to cover the cli module."""
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+from osm2pgsql_tuner import cli
+
+# Load configurables for tests
+from .test_params import *
+
+
+def _run(argv, stdin=''):
+    """Runs the CLI, returns exit code and stdout."""
+    out = io.StringIO()
+    err = io.StringIO()
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err), \
+            unittest.mock.patch('sys.stdin', io.StringIO(stdin)):
+        code = cli.main(argv)
+    return code, out.getvalue()
+
+
+class CliTests(unittest.TestCase):
+
+    def test_cli_prints_command(self):
+        code, out = _run(['--ram', str(SYSTEM_RAM_GB_MAIN),
+                          '--pbf-gb', str(OSM_PBF_GB_US)])
+        expected = 'osm2pgsql -d $PGOSM_CONN  --create  --output=flex --style=./run.lua  $PBF_PATH\n'
+        self.assertEqual(0, code)
+        self.assertEqual(expected, out)
+
+    def test_cli_json_contains_attributes_and_decisions(self):
+        code, out = _run(['--ram', str(SYSTEM_RAM_GB_SMALL),
+                          '--pbf-gb', str(OSM_PBF_GB_ALWAYS_FLAT_FILE), '--no-ssd',
+                          '--json'])
+        result = json.loads(out)
+        self.assertEqual(0, code)
+        self.assertFalse(result['recommendation']['ssd'])
+        self.assertTrue(result['recommendation']['osm2pgsql_flat_nodes'])
+        self.assertIn('--flat-nodes', result['command'])
+        self.assertTrue(result['decisions'])
+
+    def test_cli_append_first_run(self):
+        code, out = _run(['--ram', str(SYSTEM_RAM_GB_MAIN),
+                          '--pbf-gb', str(OSM_PBF_GB_CO), '--append', 'first',
+                          '--json'])
+        result = json.loads(out)
+        self.assertEqual(0, code)
+        self.assertTrue(result['recommendation']['slim_no_drop'])
+        self.assertTrue(result['recommendation']['append_first_run'])
+        self.assertIn('--create', result['command'])
+
+    def test_cli_pbf_path_sets_size_and_command(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pbf_path = os.path.join(tmp_dir, 'region.osm.pbf')
+            with open(pbf_path, 'wb') as file_out:
+                file_out.write(b'\0' * 1024)
+            code, out = _run(['--ram', str(SYSTEM_RAM_GB_MAIN), '--pbf', pbf_path,
+                              '--json'])
+        result = json.loads(out)
+        self.assertEqual(0, code)
+        self.assertTrue(result['command'].endswith(pbf_path))
+        self.assertAlmostEqual(1024 / 1024**3, result['recommendation']['osm_pbf_gb'])
+
+    def test_cli_error_returns_1(self):
+        code, out = _run(['--ram', str(SYSTEM_RAM_GB_TOO_SMALL),
+                          '--pbf-gb', str(OSM_PBF_GB_CO)])
+        self.assertEqual(1, code)
+        self.assertEqual('', out)
+
+    def test_cli_requires_pbf(self):
+        code, _ = _run(['--ram', str(SYSTEM_RAM_GB_MAIN)])
+        self.assertEqual(1, code)
+
+    def test_cli_batch_one_line_per_job(self):
+        jobs = '\n'.join([json.dumps({'id': 'us', 'osm_pbf_gb': OSM_PBF_GB_US}),
+                          '',
+                          json.dumps({'id': 'co', 'osm_pbf_gb': OSM_PBF_GB_CO,
+                                      'system_ram_gb': SYSTEM_RAM_GB_SMALL})])
+        code, out = _run(['--batch', '--ram', str(SYSTEM_RAM_GB_MAIN)], stdin=jobs)
+        results = [json.loads(line) for line in out.splitlines()]
+        self.assertEqual(0, code)
+        self.assertEqual(['us', 'co'], [result['id'] for result in results])
+        self.assertEqual(SYSTEM_RAM_GB_MAIN, results[0]['recommendation']['system_ram_gb'])
+        self.assertEqual(SYSTEM_RAM_GB_SMALL, results[1]['recommendation']['system_ram_gb'])
+
+    def test_cli_batch_reports_errors_per_job(self):
+        jobs = '\n'.join([json.dumps({'osm_pbf_gb': OSM_PBF_GB_CO}),
+                          json.dumps({'osm_pbf_gb': OSM_PBF_GB_CO, 'bogus': 1}),
+                          'not json'])
+        code, out = _run(['--batch', '--ram', str(SYSTEM_RAM_GB_MAIN)], stdin=jobs)
+        results = [json.loads(line) for line in out.splitlines()]
+        self.assertEqual(1, code)
+        self.assertIn('command', results[0])
+        self.assertIn('bogus', results[1]['error'])
+        self.assertIn('error', results[2])
+
+    def test_cli_batch_validates_job_values(self):
+        jobs = '\n'.join([json.dumps({'osm_pbf_gb': '1'}),
+                          json.dumps({'osm_pbf_gb': 'one'}),
+                          json.dumps({'osm_pbf_gb': [1]}),
+                          json.dumps({'osm_pbf_gb': 1, 'system_ram_gb': 'NaN'}),
+                          json.dumps({'osm_pbf_gb': 1, 'cpu_count': 2.5}),
+                          '[1]',
+                          '3'])
+        code, out = _run(['--batch', '--ram', str(SYSTEM_RAM_GB_MAIN)], stdin=jobs)
+        results = [json.loads(line) for line in out.splitlines()]
+        self.assertEqual(1, code)
+        self.assertEqual(7, len(results))
+        self.assertEqual(1.0, results[0]['recommendation']['osm_pbf_gb'])
+        for result in results[1:]:
+            self.assertIn('error', result)
+        self.assertIn('JSON object', results[5]['error'])
+
+    def test_cli_batch_validates_string_and_bool_values(self):
+        jobs = '\n'.join([json.dumps({'id': 1, 'osm_pbf_gb': 1, 'osm2pgsql_version': 1.9}),
+                          json.dumps({'id': 2, 'osm_pbf_gb': 1, 'style_dir': 5}),
+                          json.dumps({'id': 3, 'osm_pbf_gb': 1, 'pbf_path': [1]}),
+                          json.dumps({'id': 4, 'osm_pbf_gb': 1, 'ssd': 'no'}),
+                          json.dumps({'id': 5, 'osm_pbf_gb': 1})])
+        code, out = _run(['--batch', '--ram', str(SYSTEM_RAM_GB_MAIN)], stdin=jobs)
+        results = [json.loads(line) for line in out.splitlines()]
+        self.assertEqual(1, code)
+        self.assertEqual([1, 2, 3, 4, 5], [result['id'] for result in results])
+        self.assertIn('osm2pgsql_version', results[0]['error'])
+        self.assertIn('style_dir', results[1]['error'])
+        self.assertIn('pbf_path', results[2]['error'])
+        self.assertIn('ssd', results[3]['error'])
+        self.assertIn('command', results[4])
+
+    def test_cli_imports_only_tuner(self):
+        import subprocess
+        import sys
+        code = ('import sys, osm2pgsql_tuner.cli; '
+                'print(sorted(m for m in sys.modules if m.startswith("osm2pgsql_tuner")))')
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True,
+                             text=True, check=True).stdout
+        self.assertEqual("['osm2pgsql_tuner', 'osm2pgsql_tuner.cli', 'osm2pgsql_tuner.rules', "
+                         "'osm2pgsql_tuner.tuner']",
+                         out.strip())
@@ -0,0 +1,88 @@
+"""Stands in for the osm2pgsql binary in tests.
+
+Prints log and progress lines similar to osm2pgsql v1.5 while allocating
+memory.  Behaviour is set with environment variables:
+
+* ``FAKE_OSM2PGSQL_MB`` - memory allocated over the node phase (default 40)
+* ``FAKE_OSM2PGSQL_NODES`` - nodes to report (default 1000000)
+* ``FAKE_OSM2PGSQL_STEPS`` - progress lines for the node phase (default 10)
+* ``FAKE_OSM2PGSQL_DELAY`` - seconds between progress lines (default 0.02)
+* ``FAKE_OSM2PGSQL_EXIT`` - exit code (default 0)
+* ``FAKE_OSM2PGSQL_VERSION`` - version reported by ``--version`` (default 1.5.1)
+* ``FAKE_OSM2PGSQL_FAIL`` - failure after the node phase: ``oom_kill``,
+  ``bad_alloc``, ``postgres_oom`` or ``disk_full`` (default none)
+* ``FAKE_OSM2PGSQL_FAIL_WITHOUT`` - only fail when no argument starts with
+  this value, e.g. ``--slim`` (default always fail)
+"""
+import os
+import signal
+import sys
+import time
+
+
+FAILURE_LINES = {
+    'bad_alloc': 'ERROR: std::bad_alloc',
+    'postgres_oom': ('ERROR: Database error: ERROR:  out of memory\n'
+                     'DETAIL:  Failed on request of size 8192 in memory context "ExecutorState".'),
+    'disk_full': ('ERROR: Database error: ERROR:  could not extend file "base/16384/16385": '
+                  'No space left on device'),
+}
+
+
+def fail(err):
+    """Simulates the failure set with ``FAKE_OSM2PGSQL_FAIL``."""
+    failure = os.environ.get('FAKE_OSM2PGSQL_FAIL')
+    without = os.environ.get('FAKE_OSM2PGSQL_FAIL_WITHOUT')
+    if not failure or (without and any(arg.startswith(without) for arg in sys.argv[1:])):
+        return
+    err.flush()
+    if failure == 'oom_kill':
+        os.kill(os.getpid(), signal.SIGKILL)
+    err.write(FAILURE_LINES[failure] + '\n')
+    err.flush()
+    sys.exit(1)
+
+
+def main():
+    total_mb = int(os.environ.get('FAKE_OSM2PGSQL_MB', 40))
+    nodes = int(os.environ.get('FAKE_OSM2PGSQL_NODES', 1_000_000))
+    steps = int(os.environ.get('FAKE_OSM2PGSQL_STEPS', 10))
+    delay = float(os.environ.get('FAKE_OSM2PGSQL_DELAY', 0.02))
+    ways = nodes // 10
+    err = sys.stderr
+
+    if '--version' in sys.argv[1:]:
+        version = os.environ.get('FAKE_OSM2PGSQL_VERSION', '1.5.1')
+        err.write(f'2023-01-01 10:00:00  osm2pgsql version {version} ({version})\n')
+        sys.exit(0)
+
+    err.write('2023-01-01 10:00:00  osm2pgsql version 1.5.1 (1.5.1)\n')
+    err.write('2023-01-01 10:00:00  Mid: ram\n')
+    err.write(f'2023-01-01 10:00:00  Args: {" ".join(sys.argv[1:])}\n')
+    err.flush()
+    blocks = []
+    for step in range(1, steps + 1):
+        blocks.append(bytearray(total_mb * 1024**2 // steps))
+        # Touch the pages so they count towards RSS
+        blocks[-1][::4096] = b'\1' * len(blocks[-1][::4096])
+        done = nodes * step // steps
+        err.write(f'Processing: Node({done // 1000}k {done / 1000 / 2:.1f}k/s) '
+                  'Way(0k 0.00k/s) Relation(0 0.0/s)\r')
+        err.flush()
+        time.sleep(delay)
+    fail(err)
+    err.write(f'Processing: Node({nodes // 1000}k 500.0k/s) Way({ways // 1000}k 50.00k/s) '
+              'Relation(0 0.0/s)\r')
+    err.write(f'Processed {nodes} nodes in 2s - 500k/s\n')
+    err.write(f'Processed {ways} ways in 2s - 50k/s\n')
+    err.write('Processed 10 relations in 1s - 10/s\n')
+    err.write("2023-01-01 10:00:05  All postprocessing on table 'roads' done in 1s.\n")
+    err.write(f'2023-01-01 10:00:05  Memory: 10MB current, {total_mb}MB peak\n')
+    err.write('2023-01-01 10:01:06  osm2pgsql took 66s (1m 6s) overall.\n')
+    err.flush()
+    time.sleep(delay)
+    sys.exit(int(os.environ.get('FAKE_OSM2PGSQL_EXIT', 0)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+"""Shared helpers to run ``fake_osm2pgsql.py`` in tests."""
+import os
+import sys
+
+
+FAKE_OSM2PGSQL = [sys.executable, os.path.join(os.path.dirname(__file__),
+                                               'fake_osm2pgsql.py')]
+"""list : Command prefix running the fake osm2pgsql binary."""
+
+
+def fake_env(**values):
+    """Returns the environment for the fake binary.
+
+    Keyword arguments set ``FAKE_OSM2PGSQL_<NAME>``, see ``fake_osm2pgsql.py``.
+    """
+    env = dict(os.environ, PGOSM_CONN='fake_db')
+    env.update({f'FAKE_OSM2PGSQL_{key.upper()}': str(value)
+                for key, value in values.items()})
+    return env
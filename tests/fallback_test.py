@@ -0,0 +1,181 @@
+""" Unit tests to cover the fallback module."""
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from osm2pgsql_tuner import calibration, cli, fallback, tuner
+
+# Load configurables for tests
+from .test_params import *
+from .fakes import FAKE_OSM2PGSQL, fake_env
+
+
+KERNEL_LOG = ['[1234.5] oom-kill:constraint=CONSTRAINT_NONE,task=osm2pgsql,pid=4242,uid=1000',
+              '[1234.5] Out of memory: Killed process 4242 (osm2pgsql) total-vm:9000000kB',
+              '[2000.1] Out of memory: Killed process 777 (postgres) total-vm:4000000kB']
+
+
+class FallbackTests(unittest.TestCase):
+
+    def test_classify_kernel_oom_kill_of_pid(self):
+        failure = fallback.classify(-9, ['Processing: Node(10k 5.0k/s)'], KERNEL_LOG, pid=4242)
+        self.assertEqual('oom_killed', failure.kind)
+        self.assertEqual(9, failure.signal_number)
+        self.assertIn('Killed process 4242', failure.evidence)
+        self.assertTrue(failure.memory)
+        self.assertIsNone(fallback.classify(0, ['ERROR: std::bad_alloc']))
+
+    def test_classify_log_tail(self):
+        postgres = ['ERROR: Database error: ERROR:  out of memory',
+                    'DETAIL:  Failed on request of size 8192.']
+        self.assertEqual('postgres_oom', fallback.classify(1, postgres).kind)
+        lost = ['ERROR: server closed the connection unexpectedly']
+        self.assertEqual('postgres_oom', fallback.classify(1, lost, KERNEL_LOG, pid=1).kind)
+        self.assertEqual('error', fallback.classify(1, lost).kind)
+        self.assertEqual('osm2pgsql_oom', fallback.classify(1, ['ERROR: std::bad_alloc']).kind)
+        disk_full = fallback.classify(1, ['could not write: No space left on device'])
+        self.assertEqual('disk_full', disk_full.kind)
+        self.assertFalse(disk_full.memory)
+        # Shells report SIGKILL as 137, dmesg is often not readable
+        shell = fallback.classify(137, [])
+        self.assertEqual(('oom_killed', 9), (shell.kind, shell.signal_number))
+        self.assertEqual('Exit status 3', fallback.classify(3, ['']).evidence)
+
+    def test_downgrade_steps(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_CO, cpu_count=8)
+        oom = fallback.Failure('oom_killed', -9, 9, 'Killed by SIGKILL')
+        factor = fallback.correction_factor(rec, oom, peak_mb=1024)
+        self.assertGreater(factor, 1.0)
+
+        slim = fallback.downgrade(rec, oom, factor)
+        self.assertFalse(slim.osm2pgsql_run_in_ram)
+        self.assertFalse(slim.osm2pgsql_flat_nodes)
+        planned_mb = int(slim.osm2pgsql_slim_cache * 1024)
+        self.assertEqual(int(planned_mb * fallback.CACHE_REDUCTION), slim.get_cache_mb())
+        self.assertLessEqual(slim.osm2pgsql_number_processes, 8)
+        names = [decision['name'] for decision in slim.get_decisions()]
+        self.assertEqual(['Failed: oom_killed', 'Corrected estimate', 'Fallback'], names[-3:])
+        self.assertIn(' --slim ', slim.get_osm2pgsql_command('co.osm.pbf'))
+
+        flat_nodes = fallback.downgrade(slim, oom)
+        self.assertTrue(flat_nodes.osm2pgsql_flat_nodes)
+        self.assertEqual(0, flat_nodes.get_cache_mb())
+        processes = flat_nodes.osm2pgsql_number_processes
+
+        fewer = fallback.downgrade(flat_nodes, oom)
+        self.assertFalse(fewer.osm2pgsql_run_in_ram)
+        self.assertTrue(fewer.osm2pgsql_flat_nodes)
+        self.assertEqual(processes // 2, fewer.osm2pgsql_number_processes)
+        while fewer is not None and fewer.osm2pgsql_number_processes > 1:
+            fewer = fallback.downgrade(fewer, oom)
+        self.assertIsNone(fallback.downgrade(fewer, oom))
+        disk_full = fallback.Failure('disk_full', 1, None, 'No space left on device')
+        self.assertIsNone(fallback.downgrade(rec, disk_full))
+
+    def test_correction_applies_to_similar_inputs(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_USWEST,
+                                   osm2pgsql_version='1.9.0')
+        oom = fallback.Failure('osm2pgsql_oom', 1, None, 'std::bad_alloc')
+        factor = fallback.correction_factor(rec, oom)
+        with calibration.CalibrationStore() as store:
+            self.assertIsNone(fallback.corrected_calibration(store, rec))
+            fallback.record_correction(store, rec, oom, factor)
+            profile = fallback.corrected_calibration(store, rec)
+            self.assertEqual('1.9', profile.osm2pgsql_version)
+            self.assertAlmostEqual(factor, store.correction_factor('1.9', 'run', 3.0))
+            self.assertEqual(1.0, store.correction_factor('1.9', 'run', 10.0))
+        safer = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_USWEST,
+                                     osm2pgsql_version='1.9.0', calibration=profile)
+        self.assertTrue(rec.osm2pgsql_run_in_ram)
+        self.assertFalse(safer.osm2pgsql_run_in_ram)
+        self.assertGreater(safer.osm2pgsql_noslim_cache,
+                           rec.osm2pgsql_cache_max * fallback.CORRECTION_MARGIN * 0.99)
+
+    def test_run_with_fallback_fake_oom_kill(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_CO, cpu_count=4)
+        telemetry = io.StringIO()
+        with calibration.CalibrationStore() as store:
+            result = fallback.run_with_fallback(
+                rec, '/data/co.osm.pbf', binary=FAKE_OSM2PGSQL,
+                env=fake_env(fail='oom_kill', fail_without='--slim'), store=store,
+                kernel_log=lambda: [], interval=0.01, telemetry=telemetry)
+            self.assertGreater(store.correction_factor(None, 'run', OSM_PBF_GB_CO), 1.0)
+        self.assertTrue(result.succeeded)
+        self.assertEqual(2, len(result.attempts))
+        first, second = result.attempts
+        self.assertEqual('oom_killed', first.failure.kind)
+        self.assertNotIn('--slim', first.command)
+        self.assertIn(' --slim ', second.command)
+        self.assertFalse(result.recommendation.osm2pgsql_run_in_ram)
+        events = [json.loads(line) for line in telemetry.getvalue().splitlines()]
+        fallback_events = [event for event in events if event['type'] == 'fallback']
+        self.assertEqual(1, len(fallback_events))
+        self.assertEqual(second.command, fallback_events[0]['next_command'])
+        json.dumps(result.to_dict())
+
+    def test_run_with_fallback_stops_on_other_failures(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_CO)
+        result = fallback.run_with_fallback(rec, '/data/co.osm.pbf', binary=FAKE_OSM2PGSQL,
+                                            env=fake_env(fail='disk_full'),
+                                            kernel_log=None, interval=0.01)
+        self.assertFalse(result.succeeded)
+        self.assertEqual(1, len(result.attempts))
+        self.assertEqual('disk_full', result.attempts[0].failure.kind)
+        self.assertEqual(1, result.returncode)
+
+    def test_run_with_fallback_exhausts_attempts(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_CO)
+        result = fallback.run_with_fallback(rec, '/data/co.osm.pbf', binary=FAKE_OSM2PGSQL,
+                                            env=fake_env(fail='postgres_oom'),
+                                            kernel_log=None, interval=0.01)
+        # In RAM, then --slim, then --flat-nodes, w/out cpu_count nothing is left
+        self.assertEqual(3, len(result.attempts))
+        self.assertEqual(['postgres_oom'] * 3,
+                         [attempt.failure.kind for attempt in result.attempts])
+        self.assertIn(' --flat-nodes=', result.attempts[-1].command)
+        self.assertFalse(result.succeeded)
+
+    def test_fallback_cli_mode(self):
+        out = io.StringIO()
+        os.environ.update(FAKE_OSM2PGSQL_FAIL='bad_alloc', FAKE_OSM2PGSQL_FAIL_WITHOUT='--slim')
+        try:
+            with tempfile.NamedTemporaryFile(suffix='.osm.pbf') as pbf_file, \
+                    contextlib.redirect_stdout(out):
+                code = cli.main(['--ram', str(SYSTEM_RAM_GB_MAIN), '--pbf', pbf_file.name,
+                                 '--supervise', '--fallback', '2', '--interval', '0.01',
+                                 '--osm2pgsql', ' '.join(FAKE_OSM2PGSQL)])
+        finally:
+            del os.environ['FAKE_OSM2PGSQL_FAIL']
+            del os.environ['FAKE_OSM2PGSQL_FAIL_WITHOUT']
+        events = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(0, code)
+        self.assertEqual(['exit', 'fallback', 'exit'],
+                         [event['type'] for event in events if event['type'] != 'sample'])
+
+    def test_fallback_cli_calibration_db(self):
+        os.environ.update(FAKE_OSM2PGSQL_FAIL='bad_alloc', FAKE_OSM2PGSQL_FAIL_WITHOUT='--slim')
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir, \
+                    tempfile.NamedTemporaryFile(suffix='.osm.pbf') as pbf_file:
+                argv = ['--ram', str(SYSTEM_RAM_GB_MAIN), '--pbf', pbf_file.name,
+                        '--pbf-gb', str(OSM_PBF_GB_CO), '--supervise', '--fallback', '2',
+                        '--interval', '0.01', '--osm2pgsql', ' '.join(FAKE_OSM2PGSQL),
+                        '--calibration-db', os.path.join(tmp_dir, 'calibration.db')]
+                runs = []
+                for _ in range(2):
+                    out = io.StringIO()
+                    with contextlib.redirect_stdout(out):
+                        code = cli.main(argv)
+                    self.assertEqual(0, code)
+                    runs.append([json.loads(line) for line in out.getvalue().splitlines()])
+        finally:
+            del os.environ['FAKE_OSM2PGSQL_FAIL']
+            del os.environ['FAKE_OSM2PGSQL_FAIL_WITHOUT']
+        first, second = [[event['type'] for event in events if event['type'] != 'sample']
+                         for events in runs]
+        self.assertEqual(['exit', 'fallback', 'exit'], first)
+        # Second run starts from the corrected estimate with --slim, no failed attempt
+        self.assertEqual(['exit'], second)
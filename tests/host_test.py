@@ -0,0 +1,117 @@
+""" Unit tests to cover the host module."""
+import os
+import tempfile
+import unittest
+
+from osm2pgsql_tuner import host, tuner
+
+# Load configurables for tests
+from .test_params import *
+
+MEMINFO = 'MemTotal:       65861144 kB\nMemFree:         1024000 kB\n'
+
+
+class HostTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = self.tmp_dir.name
+        self.write('/proc/meminfo', MEMINFO)
+        self.write('/sys/devices/system/cpu/online', '0-15')
+        host.detect.cache_clear()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        host.detect.cache_clear()
+
+    def write(self, path, value):
+        full_path = os.path.join(self.root, path.lstrip('/'))
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'w', encoding='utf-8') as file_out:
+            file_out.write(value)
+
+    def setup_cgroup_v2(self, memory_max, cpu_max):
+        self.write('/proc/self/cgroup', '0::/docker/abc\n')
+        self.write('/sys/fs/cgroup/cgroup.controllers', 'cpu memory')
+        self.write('/sys/fs/cgroup/docker/abc/memory.max', memory_max)
+        self.write('/sys/fs/cgroup/docker/abc/cpu.max', cpu_max)
+
+    def test_host_detect_meminfo_without_cgroup(self):
+        resources = host.detect(self.root)
+        self.assertAlmostEqual(62.81, resources.ram_gb, places=2)
+        self.assertEqual('/proc/meminfo', resources.ram_source)
+        self.assertEqual(16, resources.cpu_count)
+
+    def test_host_detect_cgroup_v2_limits(self):
+        self.setup_cgroup_v2(str(8 * 1024**3), '400000 100000')
+        resources = host.detect(self.root)
+        self.assertEqual(8.0, resources.ram_gb)
+        self.assertEqual('cgroup v2 memory.max', resources.ram_source)
+        self.assertEqual(4, resources.cpu_count)
+        self.assertEqual('cgroup v2 cpu.max', resources.cpu_source)
+
+    def test_host_detect_cgroup_v2_unlimited(self):
+        self.setup_cgroup_v2('max', 'max 100000')
+        resources = host.detect(self.root)
+        self.assertEqual('/proc/meminfo', resources.ram_source)
+        self.assertEqual(16, resources.cpu_count)
+
+    def test_host_detect_cgroup_v1_limits(self):
+        self.write('/sys/fs/cgroup/memory/memory.limit_in_bytes', str(4 * 1024**3))
+        self.write('/sys/fs/cgroup/cpu/cpu.cfs_quota_us', '150000')
+        self.write('/sys/fs/cgroup/cpu/cpu.cfs_period_us', '100000')
+        resources = host.detect(self.root)
+        self.assertEqual(4.0, resources.ram_gb)
+        self.assertEqual(2, resources.cpu_count)
+
+    def test_host_detect_cgroup_v1_unlimited_memory(self):
+        self.write('/sys/fs/cgroup/memory/memory.limit_in_bytes', '9223372036854771712')
+        resources = host.detect(self.root)
+        self.assertEqual('/proc/meminfo', resources.ram_source)
+
+    def test_host_parse_cpu_list(self):
+        self.assertEqual(7, host._parse_cpu_list('0-3,8,10-11'))
+
+    def test_host_is_rotational_reads_sys_block(self):
+        st_dev = os.stat(self.root).st_dev
+        device = f'{os.major(st_dev)}:{os.minor(st_dev)}'
+        self.write('/sys/block/sdz/queue/rotational', '1\n')
+        os.makedirs(os.path.join(self.root, 'sys/block/sdz/sdz1'))
+        os.makedirs(os.path.join(self.root, 'sys/dev/block'))
+        os.symlink(os.path.join(self.root, 'sys/block/sdz/sdz1'),
+                   os.path.join(self.root, 'sys/dev/block', device))
+        host._rotational_for_device.cache_clear()
+        missing_file = os.path.join(self.root, 'not', 'created', 'nodes')
+        self.assertTrue(host.is_rotational(missing_file, root=self.root))
+        host._rotational_for_device.cache_clear()
+
+    def test_host_is_rotational_unknown_device_returns_none(self):
+        host._rotational_for_device.cache_clear()
+        self.assertIsNone(host.is_rotational(self.root, root=self.root))
+
+    def test_recommendation_from_host_uses_cgroup_limit(self):
+        self.setup_cgroup_v2(str(8 * 1024**3), 'max 100000')
+        rec = tuner.Recommendation.from_host(osm_pbf_gb=OSM_PBF_GB_US, root=self.root)
+        self.assertEqual(8.0, rec.system_ram_gb)
+        self.assertTrue(rec.ssd)
+        self.assertEqual({'option': 'system_ram_gb', 'name': 'Detected',
+                          'desc': '8.00 GB from cgroup v2 memory.max'},
+                         rec.decisions[0])
+        self.assertEqual({'option': 'cpu_count', 'name': 'Detected',
+                          'desc': '16 CPUs from /sys/devices/system/cpu/online'},
+                         rec.decisions[1])
+        self.assertEqual('Default', rec.decisions[2]['name'])
+
+    def test_recommendation_from_host_user_values_override_detection(self):
+        rec = tuner.Recommendation.from_host(osm_pbf_gb=OSM_PBF_GB_US,
+                                             system_ram_gb=SYSTEM_RAM_GB_MAIN,
+                                             ssd=False, cpu_count=8,
+                                             root=self.root)
+        self.assertEqual(SYSTEM_RAM_GB_MAIN, rec.system_ram_gb)
+        self.assertFalse(rec.ssd)
+        self.assertEqual(8, rec.cpu_count)
+        self.assertEqual('User provided', rec.decisions[0]['name'])
+
+    def test_recommendation_from_host_requires_pbf_details(self):
+        with self.assertRaises(ValueError):
+            tuner.Recommendation.from_host(root=self.root)
@@ -0,0 +1,82 @@
+""" Unit tests to cover the indexplan module."""
+import unittest
+
+from osm2pgsql_tuner import indexplan, layerset, scheduler, tuner
+
+# Load configurables for tests
+from .test_params import *
+
+
+def _analysis():
+    tables = [layerset.TableInfo('road_line', ['linestring'], 'road', ['highway']),
+              layerset.TableInfo('building_polygon', ['multipolygon'], 'building', ['building']),
+              layerset.TableInfo('amenity_point', ['point'], 'amenity', ['amenity']),
+              layerset.TableInfo('tags', [], 'tags', ['highway', 'building'])]
+    return layerset.StyleAnalysis('test', ['road.lua'], tables)
+
+
+class IndexPlanTests(unittest.TestCase):
+
+    def test_table_bytes_split_output(self):
+        analysis = _analysis()
+        sizes = indexplan.table_bytes(analysis, OSM_PBF_GB_US)
+        self.assertEqual(4, len(sizes))
+        self.assertGreater(sizes['building_polygon'], sizes['amenity_point'])
+
+    def test_steps_of_a_table_keep_order(self):
+        index_plan = indexplan.plan(_analysis(), OSM_PBF_GB_US, SYSTEM_RAM_GB_MAIN,
+                                    cpu_count=8)
+        seen = {}
+        for number, batch in enumerate(index_plan.batches):
+            tables = [step.table for step in batch]
+            self.assertEqual(len(tables), len(set(tables)))
+            self.assertLessEqual(len(batch), index_plan.concurrency)
+            for step in batch:
+                seen.setdefault(step.table, []).append(step.kind)
+        self.assertEqual(['gist', 'cluster', 'btree'], seen['road_line'])
+        self.assertEqual(['btree'], seen['tags'])
+
+    def test_memory_budget_limits_concurrency(self):
+        small = indexplan.plan(_analysis(), OSM_PBF_GB_US, 2.0, cpu_count=16)
+        large = indexplan.plan(_analysis(), OSM_PBF_GB_US, 64.0, cpu_count=16)
+        self.assertEqual(1, small.concurrency)
+        self.assertEqual(4, large.concurrency)
+        self.assertLessEqual(large.concurrency * large.maintenance_work_mem_mb,
+                             64 * 1024 * indexplan.MAINTENANCE_RAM_SHARE)
+        self.assertLess(large.total_seconds, small.total_seconds)
+
+    def test_without_cluster(self):
+        index_plan = indexplan.plan(_analysis(), OSM_PBF_GB_US, SYSTEM_RAM_GB_MAIN,
+                                    cpu_count=4, cluster=False)
+        kinds = {step.kind for batch in index_plan.batches for step in batch}
+        self.assertNotIn('cluster', kinds)
+        self.assertEqual(0, index_plan.peak_temp_bytes)
+
+    def test_sql_script(self):
+        index_plan = indexplan.plan(_analysis(), OSM_PBF_GB_US, SYSTEM_RAM_GB_MAIN,
+                                    cpu_count=4)
+        sql = index_plan.get_sql_script()
+        self.assertIn("SET maintenance_work_mem = ", sql)
+        self.assertIn('CREATE INDEX IF NOT EXISTS ix_road_line_geom ON osm.road_line USING GIST (geom);', sql)
+        self.assertIn('CLUSTER osm.road_line USING ix_road_line_geom;', sql)
+        self.assertIn('ANALYZE osm.tags;', sql)
+        self.assertLess(sql.index('ix_road_line_geom ON'), sql.index('CLUSTER osm.road_line'))
+        self.assertEqual(len(index_plan.batches), sql.count('-- Batch '))
+
+    def test_recommendation_requires_analysis(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_US)
+        with self.assertRaises(ValueError):
+            rec.get_index_plan()
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_US, cpu_count=4,
+                                   style_analysis=_analysis())
+        self.assertGreater(rec.get_index_plan().index_bytes, 0)
+
+    def test_schedule_uses_index_plan(self):
+        hosts = [scheduler.HostSpec('a', 64, 8, 1000)]
+        jobs = [scheduler.ImportJob('us', OSM_PBF_GB_US, style_analysis=_analysis())]
+        default = scheduler.schedule(jobs, hosts)
+        planned = scheduler.schedule(jobs, hosts, plan_indexes=True)
+        self.assertNotEqual(default.makespan_seconds, planned.makespan_seconds)
+        self.assertGreater(planned.scheduled[0].output_disk_gb,
+                           default.scheduled[0].output_disk_gb)
+        self.assertIsNotNone(planned.scheduled[0].get_index_plan())
@@ -0,0 +1,173 @@
+""" Unit tests to cover the layerset module."""
+import os
+import tempfile
+import unittest
+
+from osm2pgsql_tuner import cli, layerset, preflight, runtime, tuner
+
+# Load configurables for tests
+from .test_params import *
+
+
+ROAD_LUA = """
+-- Roads, object.tags.building in a comment is ignored
+local tables = {}
+tables.road_line = osm2pgsql.define_table({
+    name = 'road_line',
+    ids = { type = 'way', id_column = 'osm_id' },
+    columns = {
+        { column = 'name', type = 'text' },
+        { column = 'geom', type = 'linestring', projection = srid },
+    }
+})
+
+function road_process_way(object)
+    if not object.tags.highway then
+        return
+    end
+    local name = object.tags.name
+    tables.road_line:insert({ name = name, geom = object:as_linestring() })
+end
+"""
+
+AMENITY_LUA = """
+local tables = {}
+tables.amenity_point = osm2pgsql.define_node_table('amenity_point', {
+    { column = 'amenity', type = 'text' },
+})
+tables.amenity_polygon = osm2pgsql.define_table({
+    name = 'amenity_polygon',
+    columns = { { column = 'geom', type = 'multipolygon' } }
+})
+
+function amenity_process(object)
+    if object.tags['amenity'] or object:grab_tag('shop') then
+        return
+    end
+end
+"""
+
+UNITABLE_LUA = """
+local dtable = osm2pgsql.define_table{
+    name = 'unitable',
+    columns = { { column = 'geom', type = 'geometry' } }
+}
+"""
+
+
+def _write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as file_out:
+        file_out.write(text)
+
+
+class LayersetTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.style_dir = self.tmp.name
+        _write(os.path.join(self.style_dir, 'style', 'road.lua'), ROAD_LUA)
+        _write(os.path.join(self.style_dir, 'style', 'amenity.lua'), AMENITY_LUA)
+        _write(os.path.join(self.style_dir, 'unitable.lua'), UNITABLE_LUA)
+        _write(os.path.join(self.style_dir, 'layerset', 'roads.ini'),
+               '[layerset]\nroad=true\namenity=false\n')
+        _write(os.path.join(self.style_dir, 'both.lua'),
+               "require \"style.road\"\nrequire('style.amenity')\n")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_ini_layer_set_reads_enabled_modules(self):
+        analysis = layerset.analyze(self.style_dir, 'roads')
+        self.assertEqual(['road_line'], [table.name for table in analysis.tables])
+        self.assertEqual(['highway'], analysis.tag_keys)
+        self.assertEqual(['linestring'], analysis.geometry_types)
+        self.assertFalse(analysis.catch_all)
+
+    def test_lua_requires_are_followed(self):
+        analysis = layerset.analyze(self.style_dir, 'both')
+        names = sorted(table.name for table in analysis.tables)
+        self.assertEqual(['amenity_point', 'amenity_polygon', 'road_line'], names)
+        self.assertEqual(['amenity', 'highway', 'shop'], analysis.tag_keys)
+        self.assertIn('point', analysis.geometry_types)
+        self.assertIn('multipolygon', analysis.geometry_types)
+
+    def test_tags_filter_expressions_use_geometry_object_types(self):
+        analysis = layerset.analyze(self.style_dir, 'both')
+        expressions = analysis.get_tags_filter_expressions()
+        self.assertEqual(['nwr/amenity', 'w/highway', 'nwr/shop'], expressions)
+        cmd = analysis.get_tags_filter_command('in.osm.pbf', 'out.osm.pbf')
+        self.assertTrue(cmd.startswith('osmium tags-filter in.osm.pbf nwr/amenity'))
+        self.assertIn('-o out.osm.pbf', cmd)
+
+    def test_unfiltered_table_is_catch_all(self):
+        analysis = layerset.analyze(self.style_dir, 'unitable')
+        self.assertTrue(analysis.catch_all)
+        self.assertEqual(1.0, analysis.input_share)
+        self.assertGreater(analysis.output_factor, 1.0)
+        self.assertFalse(analysis.tags_filter_recommended)
+
+    def test_missing_layer_set_raises(self):
+        with self.assertRaises(ValueError):
+            layerset.analyze(self.style_dir, 'missing')
+
+    def test_filtered_path(self):
+        self.assertEqual('/data/co-latest-filtered.osm.pbf',
+                         layerset.filtered_path('/data/co-latest.osm.pbf'))
+
+    def test_small_layer_set_scales_estimates(self):
+        analysis = layerset.analyze(self.style_dir, 'roads')
+        self.assertTrue(analysis.tags_filter_recommended)
+        base = tuner.Recommendation(system_ram_gb=SYSTEM_RAM_GB_MAIN,
+                                    osm_pbf_gb=OSM_PBF_GB_US)
+        rec = tuner.Recommendation(system_ram_gb=SYSTEM_RAM_GB_MAIN,
+                                   osm_pbf_gb=OSM_PBF_GB_US,
+                                   style_analysis=analysis)
+        self.assertTrue(rec.osm2pgsql_tags_filter)
+        self.assertLess(rec.osm2pgsql_noslim_cache, base.osm2pgsql_noslim_cache)
+        self.assertLess(rec.osm2pgsql_output_factor, 1.0)
+        self.assertLess(runtime.estimate_for(rec).total_seconds,
+                        runtime.estimate_for(base).total_seconds)
+        self.assertLess(preflight.output_bytes(rec.osm_pbf_gb, rec.osm2pgsql_output_factor),
+                        preflight.output_bytes(rec.osm_pbf_gb))
+        cmd = rec.get_tags_filter_command('us-west-latest.osm.pbf')
+        self.assertIn('w/highway', cmd)
+        self.assertIn('us-west-latest-filtered.osm.pbf', cmd)
+        self.assertIn('osmium tags-filter',
+                      [decision['option'] for decision in rec.decisions])
+
+    def test_slim_no_drop_skips_tags_filter(self):
+        analysis = layerset.analyze(self.style_dir, 'roads')
+        rec = tuner.Recommendation(system_ram_gb=SYSTEM_RAM_GB_MAIN,
+                                   osm_pbf_gb=OSM_PBF_GB_US,
+                                   slim_no_drop=True, append_first_run=True,
+                                   style_analysis=analysis)
+        self.assertFalse(rec.osm2pgsql_tags_filter)
+        self.assertEqual(1.0, rec.osm2pgsql_input_share)
+        self.assertIsNone(rec.get_tags_filter_command('us-west-latest.osm.pbf'))
+        self.assertIn(tuner.TagsFilterDecision.USING_APPEND,
+                      [decision.code for decision in rec.decisions])
+        result = cli.recommend({'system_ram_gb': SYSTEM_RAM_GB_MAIN,
+                                'osm_pbf_gb': OSM_PBF_GB_US,
+                                'pbf_path': 'us-west-latest.osm.pbf',
+                                'style_dir': self.style_dir,
+                                'pgosm_layer_set': 'roads',
+                                'slim_no_drop': True, 'append_first_run': True})
+        self.assertNotIn('tags_filter_command', result)
+        self.assertTrue(result['command'].endswith('us-west-latest.osm.pbf'))
+
+    def test_no_analysis_keeps_defaults(self):
+        rec = tuner.Recommendation(system_ram_gb=SYSTEM_RAM_GB_MAIN,
+                                   osm_pbf_gb=OSM_PBF_GB_US)
+        self.assertFalse(rec.osm2pgsql_tags_filter)
+        self.assertEqual(1.0, rec.osm2pgsql_input_share)
+        self.assertIsNone(rec.get_tags_filter_command('us-west-latest.osm.pbf'))
+
+    def test_cli_job_with_style_dir_reads_filtered_file(self):
+        result = cli.recommend({'system_ram_gb': SYSTEM_RAM_GB_MAIN,
+                                'osm_pbf_gb': OSM_PBF_GB_US,
+                                'pbf_path': 'us-west-latest.osm.pbf',
+                                'style_dir': self.style_dir,
+                                'pgosm_layer_set': 'roads'})
+        self.assertIn('osmium tags-filter', result['tags_filter_command'])
+        self.assertTrue(result['command'].endswith('us-west-latest-filtered.osm.pbf'))
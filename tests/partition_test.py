@@ -0,0 +1,99 @@
+""" Unit tests to cover the partition module."""
+import os
+import tempfile
+import unittest
+
+from osm2pgsql_tuner import layerset, partition, synthetic, tuner
+
+# Load configurables for tests
+from .test_params import *
+
+
+def style_analysis():
+    tables = [layerset.TableInfo('road_line', ['linestring'], 'road', ['highway']),
+              layerset.TableInfo('building_polygon', ['multipolygon'], 'building', ['building'])]
+    return layerset.StyleAnalysis('test', ['road.lua', 'building.lua'], tables)
+
+
+class PartitionTests(unittest.TestCase):
+
+    def test_split_follows_point_density(self):
+        # Three quarters of the points between -0.5 and -0.2
+        points = ([(-0.5 + x / 1000, 0.0) for x in range(300)]
+                  + [(0.5 + x / 1000, 0.0) for x in range(100)])
+        boxes = partition.split(points, (-1.0, -1.0, 1.0, 1.0), max_share=0.3)
+        self.assertAlmostEqual(1.0, sum(share for _, share in boxes))
+        self.assertTrue(all(share <= 0.3 for _, share in boxes))
+        self.assertEqual([0.25] * 4, [share for _, share in boxes])
+        # Dense regions get narrower boxes
+        widths = [box[2] - box[0] for box, _ in boxes]
+        self.assertLess(widths[1], widths[2])
+        self.assertEqual(0.5, boxes[-1][0][0])
+
+    def test_split_stops_at_max_partitions(self):
+        points = partition.uniform_points((0.0, 0.0, 1.0, 1.0))
+        boxes = partition.split(points, (0.0, 0.0, 1.0, 1.0), max_share=0.001,
+                                max_partitions=8)
+        self.assertEqual(8, len(boxes))
+        self.assertEqual([0.125] * 8, [share for _, share in boxes])
+
+    def test_small_pbf_stays_single(self):
+        result = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_CO).get_partition_plan()
+        self.assertEqual('single', result.route)
+        self.assertEqual([], result.partitions)
+        self.assertIsNone(result.speedup)
+
+    def test_large_pbf_partitions_run_in_ram(self):
+        rec = tuner.Recommendation(64, 70, cpu_count=16)
+        self.assertFalse(rec.osm2pgsql_run_in_ram)
+        result = rec.get_partition_plan()
+        self.assertEqual('partitioned', result.route)
+        self.assertGreater(result.speedup, 1.0)
+        self.assertTrue(all(part.rec.osm2pgsql_run_in_ram for part in result.partitions))
+        self.assertAlmostEqual(1.0, sum(part.share for part in result.partitions))
+        self.assertLessEqual(result.concurrency, 16)
+        self.assertEqual(result.single_seconds / result.partitioned_seconds, result.speedup)
+
+    def test_slim_no_drop_rejected(self):
+        rec = tuner.Recommendation(64, 70, slim_no_drop=True, append_first_run=True)
+        with self.assertRaises(ValueError):
+            partition.plan(rec)
+
+    def test_commands_and_merge_sql(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'test.osm.pbf')
+            synthetic.write_pbf(path, per_block=100, nodes=5000, ways=500, relations=50)
+            rec = tuner.Recommendation(32, 30, cpu_count=8,
+                                       style_analysis=style_analysis())
+            result = rec.get_partition_plan(pbf_path=path)
+        for part in result.partitions:
+            left, bottom, right, top = part.bbox
+            self.assertTrue(-105.0 <= left < right <= -104.0)
+            self.assertTrue(39.0 <= bottom < top <= 40.0)
+        first = result.partitions[0]
+        config = result.extract_config('/data/parts')
+        self.assertEqual(len(result.partitions), len(config['extracts']))
+        self.assertEqual(first.filename, config['extracts'][0]['output'])
+        self.assertIn(' --strategy smart ', result.get_extract_command(path, 'parts.json'))
+        command = result.get_osm2pgsql_commands('/data/parts')[0]
+        self.assertIn(f' --schema={first.schema} ', command)
+        self.assertTrue(command.endswith(f'/data/parts/{first.filename}'))
+        statements = result.merge_sql()
+        self.assertEqual('CREATE SCHEMA IF NOT EXISTS osm;', statements[0])
+        tables = [table.name for table in rec.style_analysis.tables]
+        self.assertEqual(1 + len(tables) + len(result.partitions), len(statements))
+        self.assertIn(f'SELECT * FROM {first.schema}.{tables[0]}', statements[1])
+        self.assertEqual(f'DROP SCHEMA {first.schema} CASCADE;', statements[-len(result.partitions)])
+
+    def test_old_version_stays_single(self):
+        rec = tuner.Recommendation(64, 70, cpu_count=16, osm2pgsql_version='1.5')
+        result = partition.plan(rec)
+        self.assertEqual([], result.partitions)
+        self.assertIn('1.9', result.reason)
+        with self.assertRaises(ValueError):
+            rec.get_osm2pgsql_command('input.osm.pbf', schema='osm_part_01')
+
+    def test_merge_sql_requires_tables(self):
+        result = tuner.Recommendation(64, 70, cpu_count=16).get_partition_plan()
+        with self.assertRaises(ValueError):
+            result.merge_sql()
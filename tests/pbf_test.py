@@ -0,0 +1,121 @@
+""" Unit tests to cover the pbf module."""
+import os
+import tempfile
+import unittest
+
+from osm2pgsql_tuner import pbf, synthetic, tuner
+
+# Load configurables for tests
+from .test_params import *
+
+
+class PbfTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'test.osm.pbf')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_pbf_scan_sorted_counts_exact_with_full_sample(self):
+        synthetic.write_pbf(self.path, per_block=100, nodes=1050, ways=230, relations=15)
+        stats = pbf.scan(self.path, sample_blocks=1000)
+        self.assertTrue(stats.exact)
+        self.assertEqual((1050, 230, 15),
+                         (stats.node_count, stats.way_count, stats.relation_count))
+        self.assertEqual(1050, stats.max_node_id)
+
+    def test_pbf_scan_sorted_counts_estimated_with_small_sample(self):
+        synthetic.write_pbf(self.path, per_block=100, nodes=5050, ways=1230, relations=115)
+        stats = pbf.scan(self.path, sample_blocks=2)
+        self.assertFalse(stats.exact)
+        # Full blocks are uniform and the partial last block is always decoded
+        self.assertEqual((5050, 1230, 115),
+                         (stats.node_count, stats.way_count, stats.relation_count))
+        self.assertEqual(5050, stats.max_node_id)
+
+    def test_pbf_scan_unsorted_counts_estimated(self):
+        synthetic.write_pbf(self.path, per_block=100, nodes=4000, ways=2000, relations=0,
+                            sorted_file=False)
+        stats = pbf.scan(self.path, sample_blocks=6)
+        self.assertFalse(stats.sorted)
+        self.assertEqual(6000, stats.node_count + stats.way_count)
+
+    def test_pbf_scan_header_details(self):
+        synthetic.write_pbf(self.path, per_block=100, nodes=10, ways=1, relations=1,
+                            replication_timestamp=1700000000,
+                            replication_sequence=3900)
+        stats = pbf.scan(self.path)
+        self.assertTrue(stats.sorted)
+        self.assertEqual(1700000000, stats.header['replication_timestamp'])
+        self.assertEqual(3900, stats.header['replication_sequence'])
+        self.assertEqual((-105.0, 39.0, -104.0, 40.0), stats.header['bbox'])
+
+    def test_pbf_scan_process_pool_matches_serial(self):
+        synthetic.write_pbf(self.path, per_block=100, nodes=2000, ways=500, relations=50)
+        serial = pbf.scan(self.path, sample_blocks=100)
+        pooled = pbf.scan(self.path, sample_blocks=100, workers=2)
+        self.assertEqual(serial.to_dict(), pooled.to_dict())
+
+    def test_pbf_scan_truncated_file_raises_value_error(self):
+        synthetic.write_pbf(self.path, per_block=100, nodes=500, ways=0, relations=0)
+        with open(self.path, 'r+b') as pbf_file:
+            pbf_file.truncate(os.path.getsize(self.path) - 10)
+        with self.assertRaises(ValueError):
+            pbf.scan(self.path)
+
+    def test_pbf_decode_truncated_data_raises_value_error(self):
+        synthetic.write_pbf(self.path, per_block=100, nodes=300, ways=30, relations=3)
+        with open(self.path, 'rb') as pbf_file:
+            data = pbf_file.read()
+        blobs = pbf.read_blob_index(data)
+        # Cuts at the end of a blob leave a shorter, valid file
+        ends = {blob.offset + blob.datasize for blob in blobs}
+        for size in set(range(1, len(data))) - ends:
+            with self.assertRaises(ValueError, msg=f'truncated at {size}'):
+                pbf.read_blob_index(data[:size])
+        blob = blobs[-1]
+        block = pbf.read_blob_data(data[blob.offset:blob.offset + blob.datasize])
+        for size in range(len(block)):
+            try:
+                pbf.decode_block_counts(block[:size])
+                pbf.decode_block_locations(block[:size])
+            except ValueError:
+                pass
+        with self.assertRaises(ValueError):
+            pbf.decode_block_counts(block[:-1])
+
+    def test_sample_node_locations_inside_bbox(self):
+        synthetic.write_pbf(self.path, per_block=100, nodes=1000, ways=100, relations=10)
+        every_node = pbf.sample_node_locations(self.path, sample_blocks=100, every=1)
+        self.assertEqual(1000, len(every_node))
+        for lon, lat in every_node:
+            self.assertTrue(-105.0 <= lon <= -104.0)
+            self.assertTrue(39.0 <= lat <= 40.0)
+        sampled = pbf.sample_node_locations(self.path, sample_blocks=2, every=10)
+        self.assertEqual(20, len(sampled))
+        self.assertTrue(set(sampled) <= set(every_node))
+
+    def test_pbf_stats_osm_pbf_gb(self):
+        stats = pbf.PbfStats('x', 1024**3, 1, 0, 0, 0)
+        self.assertEqual(1.0, stats.osm_pbf_gb)
+
+    def test_recommendation_with_pbf_stats_uses_element_counts(self):
+        stats = pbf.PbfStats('x', int(OSM_PBF_GB_US * 1024**3), 1,
+                             node_count=1_000_000_000, way_count=100_000_000,
+                             relation_count=1_000_000)
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, pbf_stats=stats)
+        element_bytes = 1_000_000_000 * 12 + 100_000_000 * 64 + 1_000_000 * 200
+        self.assertEqual(1 + element_bytes / 1024**3, rec.osm2pgsql_noslim_cache)
+        self.assertAlmostEqual(OSM_PBF_GB_US, rec.osm_pbf_gb)
+
+    def test_recommendation_requires_pbf_size_or_stats(self):
+        with self.assertRaises(ValueError):
+            tuner.Recommendation(SYSTEM_RAM_GB_MAIN)
+
+    def test_recommendation_from_pbf(self):
+        synthetic.write_pbf(self.path, per_block=100, nodes=1000, ways=100, relations=10)
+        rec = tuner.Recommendation.from_pbf(SYSTEM_RAM_GB_MAIN, self.path)
+        self.assertEqual(1000, rec.pbf_stats.node_count)
+        self.assertTrue(rec.osm2pgsql_run_in_ram)
@@ -0,0 +1,92 @@
+""" Unit tests to cover the pgconfig module."""
+import unittest
+
+from osm2pgsql_tuner import pgconfig, tuner
+
+# Load configurables for tests
+from .test_params import *
+
+
+class PgConfigTests(unittest.TestCase):
+
+    def test_pgconfig_format_mb(self):
+        self.assertEqual('512MB', pgconfig.format_mb(512))
+        self.assertEqual('1536MB', pgconfig.format_mb(1536))
+        self.assertEqual('2GB', pgconfig.format_mb(2048))
+
+    def test_pgconfig_settings_main_host(self):
+        config = pgconfig.PostgresLoadConfig(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_US,
+                                             cpu_count=8)
+        expected = {'shared_buffers': '4GB',
+                    'maintenance_work_mem': '6553MB',
+                    'max_wal_size': '21299MB',
+                    'checkpoint_timeout': '60min',
+                    'synchronous_commit': 'off',
+                    'autovacuum': 'off',
+                    'max_parallel_maintenance_workers': '4',
+                    'wal_level': 'minimal',
+                    'max_wal_senders': '0'}
+        self.assertEqual(expected, config.get_settings())
+
+    def test_pgconfig_settings_small_host_uses_minimums(self):
+        config = pgconfig.PostgresLoadConfig(SYSTEM_RAM_GB_SMALL, OSM_PBF_GB_CO)
+        settings = config.get_settings()
+        self.assertEqual('204MB', settings['shared_buffers'])
+        self.assertEqual('256MB', settings['maintenance_work_mem'])
+        self.assertEqual('1GB', settings['max_wal_size'])
+        self.assertEqual('2', settings['max_parallel_maintenance_workers'])
+
+    def test_pgconfig_postgres_ram_gb(self):
+        config = pgconfig.PostgresLoadConfig(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_US)
+        self.assertEqual((4096 + 6553) / 1024, config.postgres_ram_gb)
+
+    def test_pgconfig_wal_minimal_false_keeps_wal_level(self):
+        config = pgconfig.PostgresLoadConfig(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_US,
+                                             wal_minimal=False)
+        settings = config.get_settings()
+        self.assertNotIn('wal_level', settings)
+        self.assertNotIn('max_wal_senders', settings)
+
+    def test_pgconfig_alter_system_and_revert_sql(self):
+        config = pgconfig.PostgresLoadConfig(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_US)
+        apply_sql = config.get_alter_system_sql()
+        revert_sql = config.get_revert_sql()
+        self.assertIn("ALTER SYSTEM SET autovacuum = 'off';", apply_sql)
+        self.assertIn('ALTER SYSTEM RESET autovacuum;', revert_sql)
+        self.assertIn('SELECT pg_reload_conf();', revert_sql)
+        self.assertEqual(apply_sql.count('ALTER SYSTEM SET'),
+                         revert_sql.count('ALTER SYSTEM RESET'))
+
+    def test_pgconfig_revert_sql_restores_previous_values(self):
+        auto_conf = ('# Do not edit this file manually!\n'
+                     '# It will be overwritten by the ALTER SYSTEM command.\n'
+                     "shared_buffers = '8GB'\n"
+                     "max_wal_size = '4GB'\n"
+                     "search_path = '\"$user\", public'\n")
+        previous = pgconfig.parse_auto_conf(auto_conf)
+        self.assertEqual({'shared_buffers': '8GB', 'max_wal_size': '4GB',
+                          'search_path': '"$user", public'}, previous)
+        config = pgconfig.PostgresLoadConfig(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_US,
+                                             previous_settings=previous)
+        revert_sql = config.get_revert_sql()
+        self.assertIn("ALTER SYSTEM SET shared_buffers = '8GB';", revert_sql)
+        self.assertIn("ALTER SYSTEM SET max_wal_size = '4GB';", revert_sql)
+        self.assertIn('ALTER SYSTEM RESET autovacuum;', revert_sql)
+        self.assertNotIn('RESET shared_buffers', revert_sql)
+        self.assertNotIn('search_path', revert_sql)
+        self.assertEqual(len(config.get_settings()),
+                         revert_sql.count('ALTER SYSTEM '))
+
+    def test_pgconfig_postgresql_conf_snippet(self):
+        config = pgconfig.PostgresLoadConfig(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_US)
+        self.assertIn("synchronous_commit = 'off'\n", config.get_postgresql_conf())
+
+    def test_recommendation_postgres_ram_gb_reduces_cache_max(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_US,
+                                   postgres_ram_gb=10.0)
+        self.assertEqual((SYSTEM_RAM_GB_MAIN - 10.0) * 0.66, rec.osm2pgsql_cache_max)
+
+    def test_recommendation_postgres_ram_gb_can_force_slim(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_US,
+                                   postgres_ram_gb=30.0)
+        self.assertFalse(rec.osm2pgsql_run_in_ram)
@@ -0,0 +1,81 @@
+""" Unit tests to cover the preflight module."""
+import os
+import tempfile
+import unittest
+
+from osm2pgsql_tuner import pbf, preflight, tuner
+
+# Load configurables for tests
+from .test_params import *
+
+
+class PreflightTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp_dir.name, 'root')
+        self.data_dir = os.path.join(self.tmp_dir.name, 'data')
+        self.ram_dir = os.path.join(self.tmp_dir.name, 'ram')
+        os.makedirs(os.path.join(self.root, 'proc', 'self'))
+        os.makedirs(self.data_dir)
+        os.makedirs(self.ram_dir)
+        with open(os.path.join(self.root, 'proc', 'self', 'mounts'), 'w',
+                  encoding='utf-8') as mounts:
+            mounts.write('/dev/sda1 / ext4 rw 0 0\n')
+            mounts.write(f'tmpfs {self.ram_dir} tmpfs rw 0 0\n')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def stats(self, max_node_id, sorted_file=True):
+        features = [pbf.SORTED_FEATURE] if sorted_file else []
+        return pbf.PbfStats('x', int(OSM_PBF_GB_US * 1024**3), 1,
+                            node_count=10**9, way_count=10**8,
+                            relation_count=10**6, max_node_id=max_node_id,
+                            header={'optional_features': features})
+
+    def test_preflight_flat_nodes_bytes(self):
+        self.assertEqual(8008, preflight.flat_nodes_bytes(1000))
+        self.assertEqual((preflight.PLANET_MAX_NODE_ID + 1) * 8,
+                         preflight.flat_nodes_bytes())
+
+    def test_preflight_middle_bytes_smaller_with_flat_nodes(self):
+        self.assertEqual(preflight.middle_bytes(10, False) // 2,
+                         preflight.middle_bytes(10, True))
+
+    def test_preflight_skips_tmpfs_and_picks_disk(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_SMALL, pbf_stats=self.stats(1000))
+        result = rec.preflight([self.ram_dir, self.data_dir], root=self.root)
+        self.assertTrue(result.fits)
+        self.assertEqual(os.path.join(self.data_dir, 'nodes'), rec.flat_nodes_path)
+        self.assertEqual('tmpfs uses RAM', result.candidates[0].reason)
+        self.assertIn(f'--flat-nodes={self.data_dir}/nodes ',
+                      rec.get_osm2pgsql_command('blahblah'))
+
+    def test_preflight_unsorted_sample_assumes_planet_node_ids(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_SMALL,
+                                   pbf_stats=self.stats(1000, sorted_file=False))
+        result = rec.preflight([self.data_dir], root=self.root)
+        self.assertEqual(preflight.flat_nodes_bytes(), result.flat_nodes_bytes)
+
+    def test_preflight_warns_when_flat_nodes_do_not_fit(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_SMALL, pbf_stats=self.stats(2**60))
+        result = rec.preflight([self.data_dir], root=self.root)
+        self.assertFalse(result.fits)
+        self.assertEqual(tuner.FLAT_NODES_DEFAULT_PATH, rec.flat_nodes_path)
+        self.assertEqual('Insufficient disk', rec.decisions[-1]['name'])
+
+    def test_preflight_strict_raises_when_plan_does_not_fit(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_SMALL, 10**9)
+        with self.assertRaises(ValueError):
+            rec.preflight([self.data_dir], database_dir=self.data_dir,
+                          strict=True, root=self.root)
+
+    def test_preflight_in_ram_needs_no_flat_nodes_or_middle(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_US)
+        result = rec.preflight([self.data_dir], root=self.root)
+        self.assertTrue(result.fits)
+        self.assertIsNone(result.flat_nodes_path)
+        self.assertEqual(0, result.flat_nodes_bytes)
+        self.assertEqual(0, result.middle_bytes)
+        self.assertEqual(preflight.output_bytes(OSM_PBF_GB_US), result.total_bytes)
@@ -0,0 +1,83 @@
+""" Unit tests to cover the replication module."""
+import unittest
+
+from osm2pgsql_tuner import replication, tuner
+
+# Load configurables for tests
+from .test_params import *
+
+
+class ReplicationTests(unittest.TestCase):
+
+    def test_replication_small_diff_uses_min_cache(self):
+        rec = replication.UpdateRecommendation(SYSTEM_RAM_GB_MAIN, osc_mb=0.1)
+        self.assertEqual(2000, rec.change_count)
+        self.assertEqual(replication.MIN_UPDATE_CACHE_MB, rec.osm2pgsql_cache_mb)
+
+    def test_replication_cache_scales_with_change_count(self):
+        rec = replication.UpdateRecommendation(SYSTEM_RAM_GB_MAIN,
+                                               change_count=1_000_000)
+        self.assertEqual(1953, rec.osm2pgsql_cache_mb)
+
+    def test_replication_cache_limited_by_ram(self):
+        rec = replication.UpdateRecommendation(SYSTEM_RAM_GB_SMALL,
+                                               change_count=10_000_000)
+        self.assertEqual(1351, rec.osm2pgsql_cache_mb)
+        self.assertEqual('Limited RAM', rec.decisions[0]['name'])
+
+    def test_replication_decisions_are_records(self):
+        rec = replication.UpdateRecommendation(SYSTEM_RAM_GB_MAIN, osc_mb=0.1,
+                                               cpu_count=4)
+        codes = [decision.code for decision in rec.decisions]
+        expected = [tuner.ReplicationDecision.CACHE_FROM_DIFF,
+                    tuner.ReplicationDecision.PROCESSES_FROM_DIFF]
+        self.assertEqual(expected, codes)
+        self.assertEqual('2000 changes need about 128 MB', rec.decisions[0]['desc'])
+
+    def test_replication_cache_max_matches_tuner(self):
+        rec = replication.UpdateRecommendation(SYSTEM_RAM_GB_MAIN, osc_mb=0.1,
+                                               postgres_ram_gb=4)
+        initial = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_US,
+                                       postgres_ram_gb=4)
+        self.assertEqual(initial.osm2pgsql_cache_max, rec.osm2pgsql_cache_max)
+
+    def test_replication_cache_zero_with_flat_nodes(self):
+        rec = replication.UpdateRecommendation(SYSTEM_RAM_GB_MAIN, osc_mb=50,
+                                               flat_nodes_path='/data/nodes')
+        self.assertEqual(0, rec.osm2pgsql_cache_mb)
+        self.assertEqual(replication.DEFAULT_MAX_DIFF_SIZE_MB, rec.max_diff_size_mb)
+
+    def test_replication_number_processes_sized_from_diff(self):
+        small = replication.UpdateRecommendation(SYSTEM_RAM_GB_MAIN, osc_mb=0.1,
+                                                 cpu_count=16)
+        large = replication.UpdateRecommendation(SYSTEM_RAM_GB_MAIN,
+                                                 change_count=400_000, cpu_count=16)
+        self.assertEqual(1, small.osm2pgsql_number_processes)
+        self.assertEqual(9, large.osm2pgsql_number_processes)
+
+    def test_replication_max_diff_size_fits_cache(self):
+        rec = replication.UpdateRecommendation(SYSTEM_RAM_GB_MAIN, osc_mb=0.1)
+        # 128 MB cache holds 65536 changes, about 3 MB of .osc.gz
+        self.assertEqual(3, rec.max_diff_size_mb)
+
+    def test_replication_requires_diff_size(self):
+        with self.assertRaises(ValueError):
+            replication.UpdateRecommendation(SYSTEM_RAM_GB_MAIN)
+
+    def test_replication_value_error_when_insufficient_ram(self):
+        with self.assertRaises(ValueError):
+            replication.UpdateRecommendation(SYSTEM_RAM_GB_TOO_SMALL, osc_mb=1)
+
+    def test_replication_osm2pgsql_command(self):
+        rec = replication.UpdateRecommendation(SYSTEM_RAM_GB_MAIN, osc_mb=0.1,
+                                               cpu_count=4)
+        result = rec.get_osm2pgsql_command(osc_path='change.osc.gz')
+        expected = 'osm2pgsql -d $PGOSM_CONN  --append  --slim  --cache=128  --number-processes=1  --output=flex --style=./run.lua  change.osc.gz'
+        self.assertEqual(expected, result)
+
+    def test_replication_update_command(self):
+        rec = replication.UpdateRecommendation(SYSTEM_RAM_GB_MAIN, osc_mb=0.1,
+                                               flat_nodes_path='/data/nodes')
+        result = rec.get_replication_command()
+        expected = 'osm2pgsql-replication update -d $PGOSM_CONN  --max-diff-size=500  --  --slim  --cache=0  --flat-nodes=/data/nodes  --output=flex --style=./run.lua'
+        self.assertEqual(expected, result)
@@ -0,0 +1,86 @@
+""" Unit tests to cover the runtime module."""
+import unittest
+
+from osm2pgsql_tuner import calibration, runtime, tuner
+
+# Load configurables for tests
+from .test_params import *
+
+
+class RuntimeTests(unittest.TestCase):
+
+    def test_runtime_estimate_in_ram(self):
+        result = runtime.estimate(1_500_000, 60_000, 3_000, slim=False)
+        expected = {'nodes': 1.0, 'ways': 1.0, 'relations': 1.0,
+                    'postprocessing': 1.2}
+        for phase, seconds in expected.items():
+            self.assertAlmostEqual(seconds, result.phases[phase])
+        self.assertAlmostEqual(4.2, result.total_seconds)
+
+    def test_runtime_estimate_slow_on_hdd(self):
+        ssd = runtime.estimate(1_000_000, 100_000, 1_000, slim=True, ssd=True)
+        hdd = runtime.estimate(1_000_000, 100_000, 1_000, slim=True, ssd=False)
+        self.assertGreater(hdd.total_seconds, ssd.total_seconds)
+
+    def test_runtime_estimate_flat_nodes_speeds_up_node_phase(self):
+        base = runtime.estimate(1_000_000, 0, 0, slim=True)
+        flat = runtime.estimate(1_000_000, 0, 0, slim=True, flat_nodes=True)
+        self.assertAlmostEqual(base.phases['nodes'] / 2, flat.phases['nodes'])
+
+    def test_runtime_estimate_processes_only_speed_up_parallel_phases(self):
+        one = runtime.estimate(1_000_000, 100_000, 1_000, slim=True, processes=1)
+        eight = runtime.estimate(1_000_000, 100_000, 1_000, slim=True, processes=8)
+        self.assertEqual(one.phases['nodes'], eight.phases['nodes'])
+        self.assertLess(eight.phases['postprocessing'], one.phases['postprocessing'])
+
+    def test_runtime_estimate_no_drop_slower_postprocessing(self):
+        drop = runtime.estimate(0, 100_000, 0, slim=True, drop=True)
+        no_drop = runtime.estimate(0, 100_000, 0, slim=True, drop=False)
+        self.assertAlmostEqual(drop.phases['postprocessing'] * 1.5,
+                               no_drop.phases['postprocessing'])
+
+    def test_runtime_fit_recovers_coefficients(self):
+        runs = []
+        for scale in (1, 2, 5):
+            runs.append(calibration.RunRecord(slim=False, flat_nodes=False,
+                                              node_count=scale * 1_000_000,
+                                              way_count=scale * 100_000,
+                                              relation_count=scale * 1_000,
+                                              seconds_nodes=scale * 2,
+                                              seconds_ways=scale * 10,
+                                              seconds_relations=scale * 4,
+                                              seconds_postprocessing=scale * 3))
+        coefficients = runtime.fit(runs)
+        self.assertEqual(3, coefficients.sample_count)
+        fitted = coefficients.seconds_per_element
+        self.assertAlmostEqual(2e-6, fitted['nodes']['ram'])
+        self.assertAlmostEqual(1e-4, fitted['ways']['ram'])
+        # No slim runs, default is kept
+        self.assertEqual(runtime.DEFAULT_SECONDS_PER_ELEMENT['ways']['slim'],
+                         fitted['ways']['slim'])
+        result = runtime.estimate(1_000_000, 100_000, 1_000, slim=False,
+                                  coefficients=coefficients)
+        self.assertAlmostEqual(2.0, result.phases['nodes'])
+
+    def test_runtime_fit_skips_missing_counts(self):
+        # Log cut off by the OOM killer during the way phase
+        partial = calibration.RunRecord(slim=False, flat_nodes=False,
+                                        node_count=1_000_000,
+                                        seconds_nodes=2)
+        coefficients = runtime.fit([partial])
+        self.assertEqual(1, coefficients.sample_count)
+        fitted = coefficients.seconds_per_element
+        self.assertAlmostEqual(2e-6, fitted['nodes']['ram'])
+        self.assertEqual(runtime.DEFAULT_SECONDS_PER_ELEMENT['ways']['ram'],
+                         fitted['ways']['ram'])
+
+    def test_runtime_coefficients_round_trip(self):
+        coefficients = runtime.RuntimeCoefficients(sample_count=3)
+        copy = runtime.RuntimeCoefficients.from_dict(coefficients.to_dict())
+        self.assertEqual(coefficients.to_dict(), copy.to_dict())
+
+    def test_recommendation_get_runtime_estimate(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_US)
+        result = rec.get_runtime_estimate()
+        self.assertEqual(list(runtime.PHASES), list(result.phases))
+        self.assertGreater(result.total_seconds, 0)
@@ -0,0 +1,128 @@
+""" Unit tests to cover the scheduler module."""
+import os
+import random
+import tempfile
+import unittest
+
+from osm2pgsql_tuner import scheduler, tuner
+
+# Load configurables for tests
+from .test_params import *
+
+
+def peak_usage(plan, host_name):
+    """Returns the max concurrent RAM, CPU and temporary disk used on a host."""
+    events = []
+    for entry in plan.by_host().get(host_name, []):
+        events.append((entry.start_seconds, 1, entry))
+        events.append((entry.end_seconds, 0, entry))
+    ram = cpu = 0
+    peak_ram = peak_cpu = 0
+    for _, starting, entry in sorted(events, key=lambda e: (e[0], e[1])):
+        sign = 1 if starting else -1
+        ram += sign * entry.ram_gb
+        cpu += sign * entry.processes
+        peak_ram = max(peak_ram, ram)
+        peak_cpu = max(peak_cpu, cpu)
+    return peak_ram, peak_cpu
+
+
+class SchedulerTests(unittest.TestCase):
+
+    def test_scheduler_single_job_runs_in_ram(self):
+        host = scheduler.HostSpec('db1', SYSTEM_RAM_GB_MAIN, 8, 1000)
+        plan = scheduler.schedule([scheduler.ImportJob('co', OSM_PBF_GB_CO)], [host])
+        entry = plan.scheduled[0]
+        self.assertEqual('ram', entry.mode)
+        self.assertEqual(0, entry.start_seconds)
+        self.assertEqual(8, entry.processes)
+        self.assertEqual(entry.end_seconds, plan.makespan_seconds)
+        self.assertNotIn('--slim', entry.get_osm2pgsql_command())
+
+    def test_scheduler_trades_ram_for_slim_to_start_now(self):
+        host = scheduler.HostSpec('db1', 16, 4, 1000)
+        jobs = [scheduler.ImportJob('a', 3.0), scheduler.ImportJob('b', 3.0)]
+        plan = scheduler.schedule(jobs, [host])
+        self.assertEqual([0, 0], [entry.start_seconds for entry in plan.scheduled])
+        self.assertEqual({'ram', 'slim'}, {entry.mode for entry in plan.scheduled})
+        slim = [entry for entry in plan.scheduled if entry.mode == 'slim'][0]
+        self.assertIn('--slim', slim.get_osm2pgsql_command())
+        self.assertLess(slim.cache_gb, 3.0 * 2.5)
+
+    def test_scheduler_flat_nodes_file_per_job(self):
+        host = scheduler.HostSpec('db1', SYSTEM_RAM_GB_MAIN, 4, 5000,
+                                  flat_nodes_dir='/data/flat')
+        jobs = [scheduler.ImportJob('us', OSM_PBF_GB_US, pbf_path='/data/us.osm.pbf'),
+                scheduler.ImportJob('na', OSM_PBF_GB_US, pbf_path='/data/na.osm.pbf')]
+        plan = scheduler.schedule(jobs, [host])
+        slim = [entry for entry in plan.scheduled if entry.mode == 'slim']
+        self.assertEqual(1, len(slim))
+        self.assertEqual(f'/data/flat/{slim[0].job.name}.nodes', slim[0].flat_nodes_path)
+        self.assertIn(f'--flat-nodes={slim[0].flat_nodes_path}',
+                      slim[0].get_osm2pgsql_command())
+        self.assertIn(slim[0].job.pbf_path, slim[0].get_osm2pgsql_command())
+
+    def test_scheduler_flat_nodes_follow_rule(self):
+        jobs = [scheduler.ImportJob('us', OSM_PBF_GB_US)]
+        for ssd in (True, False):
+            host = scheduler.HostSpec('db1', 16, 4, 5000, ssd=ssd)
+            self.assertEqual(os.path.dirname(tuner.FLAT_NODES_DEFAULT_PATH),
+                             host.flat_nodes_dir)
+            entry = scheduler.schedule(jobs, [host]).scheduled[0]
+            rec = tuner.Recommendation(16, OSM_PBF_GB_US, ssd=ssd)
+            self.assertEqual('slim', entry.mode)
+            self.assertFalse(rec.osm2pgsql_run_in_ram)
+            self.assertEqual(rec.osm2pgsql_flat_nodes, entry.flat_nodes)
+            self.assertEqual(ssd, entry.flat_nodes)
+
+    def test_scheduler_flat_nodes_dir_in_ram(self):
+        with tempfile.TemporaryDirectory() as root:
+            os.makedirs(os.path.join(root, 'proc', 'self'))
+            with open(os.path.join(root, 'proc', 'self', 'mounts'), 'w',
+                      encoding='utf-8') as mounts:
+                mounts.write('/dev/sda1 / ext4 rw 0 0\n')
+                mounts.write(f'tmpfs {root} tmpfs rw 0 0\n')
+            host = scheduler.HostSpec('db1', 16, 4, 5000, flat_nodes_dir=root)
+            self.assertIn('tmpfs', host.check_flat_nodes_dir(root=root))
+            plan = scheduler.schedule([scheduler.ImportJob('us', OSM_PBF_GB_US)],
+                                      [host], root=root)
+        self.assertEqual([], plan.scheduled)
+        self.assertIn('tmpfs', plan.unscheduled[0][1])
+
+    def test_scheduler_never_oversubscribes(self):
+        rng = random.Random(7)
+        jobs = [scheduler.ImportJob(f'r{i}', rng.choice([0.05, 0.2, 1.0, 2.0, 4.0]))
+                for i in range(300)]
+        hosts = [scheduler.HostSpec('a', 32, 8, 5000),
+                 scheduler.HostSpec('b', 16, 4, 5000, ssd=False)]
+        plan = scheduler.schedule(jobs, hosts)
+        self.assertEqual(300, len(plan.scheduled))
+        self.assertEqual([], plan.unscheduled)
+        for host in hosts:
+            peak_ram, peak_cpu = peak_usage(plan, host.name)
+            self.assertLessEqual(peak_ram, host.ram_gb * 0.66 + 1e-9)
+            self.assertLessEqual(peak_cpu, host.cpu_count)
+        serial = sum(entry.end_seconds - entry.start_seconds for entry in plan.scheduled)
+        self.assertLess(plan.makespan_seconds, serial / 4)
+
+    def test_scheduler_reports_jobs_that_fit_no_host(self):
+        host = scheduler.HostSpec('db1', SYSTEM_RAM_GB_MAIN, 4, 10)
+        plan = scheduler.schedule([scheduler.ImportJob('co', OSM_PBF_GB_CO),
+                                   scheduler.ImportJob('us', OSM_PBF_GB_US)], [host])
+        self.assertEqual(['co'], [entry.job.name for entry in plan.scheduled])
+        self.assertEqual('us', plan.unscheduled[0][0].name)
+        self.assertEqual('us', plan.to_dict()['unscheduled'][0]['name'])
+
+    def test_scheduler_output_disk_is_not_released(self):
+        host = scheduler.HostSpec('db1', SYSTEM_RAM_GB_MAIN, 4, 6)
+        jobs = [scheduler.ImportJob('a', 1.0), scheduler.ImportJob('b', 1.0),
+                scheduler.ImportJob('c', 1.0)]
+        plan = scheduler.schedule(jobs, [host])
+        self.assertEqual(2, len(plan.scheduled))
+        self.assertEqual(1, len(plan.unscheduled))
+
+    def test_scheduler_requires_unique_names(self):
+        host = scheduler.HostSpec('db1', SYSTEM_RAM_GB_MAIN, 4, 1000)
+        with self.assertRaises(ValueError):
+            scheduler.schedule([scheduler.ImportJob('a', 1.0),
+                                scheduler.ImportJob('a', 2.0)], [host])
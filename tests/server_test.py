@@ -0,0 +1,117 @@
+""" Unit tests to cover the server and loadtest modules."""
+import asyncio
+import json
+import unittest
+
+from osm2pgsql_tuner import loadtest, server
+
+# Load configurables for tests
+from .test_params import *
+
+
+def _target(**params):
+    query = '&'.join(f'{key}={value}' for key, value in params.items())
+    return f'{server.RECOMMENDATION_PATH}?{query}'
+
+
+class ServerTests(unittest.TestCase):
+
+    def test_quantize_ram_rounds_down(self):
+        self.assertEqual(7.5, server.quantize_ram_gb(7.8))
+        self.assertEqual(8.0, server.quantize_ram_gb(8.0))
+
+    def test_quantize_pbf_rounds_up_to_10mb(self):
+        self.assertAlmostEqual(10 / 1024, server.quantize_pbf_gb(0.001), places=6)
+        self.assertAlmostEqual(21 * 10 / 1024, server.quantize_pbf_gb(OSM_PBF_GB_CO),
+                               places=6)
+
+    def test_lru_cache_evicts_least_recently_used(self):
+        cache = server.LRUCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(1, cache.get('a'))
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(1, cache.evictions)
+        self.assertEqual({'size': 2, 'maxsize': 2, 'hits': 1, 'misses': 1,
+                          'evictions': 1, 'hit_ratio': 0.5}, cache.to_dict())
+
+    def test_handle_near_identical_requests_hit_cache(self):
+        service = server.RecommendationService()
+        first = service.handle('GET', _target(system_ram_gb=64.2, osm_pbf_gb=10.4))
+        second = service.handle('GET', _target(system_ram_gb=64.4, osm_pbf_gb=10.395))
+        self.assertEqual((200, 'MISS'), (first[0], first[2]))
+        self.assertEqual((200, 'HIT'), (second[0], second[2]))
+        self.assertEqual(first[1], second[1])
+        body = json.loads(first[1])
+        self.assertEqual(64.0, body['recommendation']['system_ram_gb'])
+        self.assertIn('--create', body['command'])
+
+    def test_handle_bad_input_returns_400(self):
+        service = server.RecommendationService()
+        self.assertEqual(400, service.handle('GET', _target(osm_pbf_gb=1))[0])
+        self.assertEqual(400, service.handle('GET', _target(system_ram_gb='x', osm_pbf_gb=1))[0])
+        self.assertEqual(400, service.handle('GET', _target(system_ram_gb=1, osm_pbf_gb=1))[0])
+        self.assertEqual(400, service.handle('GET', _target(system_ram_gb=8, osm_pbf_gb=1,
+                                                            ssd='maybe'))[0])
+        for params in ({'system_ram_gb': 'nan', 'osm_pbf_gb': 1},
+                       {'system_ram_gb': 'inf', 'osm_pbf_gb': 1},
+                       {'system_ram_gb': 8, 'osm_pbf_gb': -1},
+                       {'system_ram_gb': 8, 'osm_pbf_gb': 'nan'},
+                       {'system_ram_gb': 8, 'osm_pbf_gb': 1, 'cpu_count': 0}):
+            status, body, _ = service.handle('GET', _target(**params))
+            self.assertEqual(400, status)
+            self.assertIn('positive number', json.loads(body)['error'])
+
+    def test_invalid_content_length_returns_400(self):
+        async def request():
+            service = server.RecommendationService()
+            listener = await service.start(port=0)
+            port = listener.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(f'GET {_target(system_ram_gb=8, osm_pbf_gb=1)} HTTP/1.1\r\n'
+                         'Content-Length: abc\r\n\r\n'.encode('latin-1'))
+            response = await reader.read()
+            writer.close()
+            listener.close()
+            await listener.wait_closed()
+            return response
+        response = asyncio.run(request())
+        head, _, body = response.partition(b'\r\n\r\n')
+        self.assertTrue(head.startswith(b'HTTP/1.1 400 '))
+        self.assertEqual('Invalid Content-Length', json.loads(body)['error'])
+
+    def test_large_content_length_returns_413_without_reading(self):
+        async def request():
+            service = server.RecommendationService()
+            listener = await service.start(port=0)
+            port = listener.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(f'GET {_target(system_ram_gb=8, osm_pbf_gb=1)} HTTP/1.1\r\n'
+                         f'Content-Length: {10 ** 12}\r\n\r\n'.encode('latin-1'))
+            response = await reader.read()
+            writer.close()
+            listener.close()
+            await listener.wait_closed()
+            return response, service.errors
+        response, errors = asyncio.run(request())
+        head, _, body = response.partition(b'\r\n\r\n')
+        self.assertTrue(head.startswith(b'HTTP/1.1 413 '))
+        self.assertIn(b'Connection: close', head)
+        self.assertEqual('Request body too large', json.loads(body)['error'])
+        self.assertEqual(1, errors)
+
+    def test_handle_unknown_path_and_method(self):
+        service = server.RecommendationService()
+        self.assertEqual(404, service.handle('GET', '/nope')[0])
+        self.assertEqual(405, service.handle('POST', server.RECOMMENDATION_PATH)[0])
+
+    def test_stats_counts_requests_over_loopback(self):
+        report = asyncio.run(loadtest.run_local(requests=200, concurrency=4))
+        self.assertEqual(200, report['client']['requests'])
+        self.assertEqual(0, report['client']['errors'])
+        self.assertEqual(200, report['server']['requests'])
+        cache = report['server']['cache']
+        self.assertEqual(200, cache['hits'] + cache['misses'])
+        self.assertGreater(cache['hits'], cache['misses'])
+        self.assertIsNotNone(report['client']['p99_ms'])
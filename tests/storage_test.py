@@ -0,0 +1,94 @@
+""" Unit tests to cover the storage module."""
+import os
+import tempfile
+import unittest
+
+from osm2pgsql_tuner import capacity, pbf, storage, tuner
+
+# Load configurables for tests
+from .test_params import *
+
+
+def fake_probe(path, read_4k_iops, seq_write_mb_s=500.0):
+    return storage.IoProbe(path, seq_write_mb_s=seq_write_mb_s,
+                           read_4k_iops=read_4k_iops,
+                           read_8k_iops=read_4k_iops * 0.8)
+
+
+class StorageTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.fast_dir = os.path.join(self.tmp_dir.name, 'fast')
+        self.bulk_dir = os.path.join(self.tmp_dir.name, 'bulk')
+        os.makedirs(self.fast_dir)
+        os.makedirs(self.bulk_dir)
+        self.probes = {self.fast_dir: fake_probe(self.fast_dir, 20_000, seq_write_mb_s=300.0),
+                       self.bulk_dir: fake_probe(self.bulk_dir, 2_000, seq_write_mb_s=900.0)}
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def stats(self, max_node_id):
+        return pbf.PbfStats('x', int(OSM_PBF_GB_US * 1024**3), 1,
+                            node_count=10**9, way_count=10**8,
+                            relation_count=10**6, max_node_id=max_node_id,
+                            header={'optional_features': [pbf.SORTED_FEATURE]})
+
+    def test_probe_measures_and_removes_scratch_file(self):
+        result = storage.probe(self.fast_dir, size_mb=2, reads=50)
+        self.assertEqual(2 * 1024**2, result.probe_bytes)
+        self.assertGreater(result.seq_write_mb_s, 0)
+        self.assertGreater(result.read_4k_iops, 0)
+        self.assertGreater(result.read_8k_iops, 0)
+        self.assertEqual([], os.listdir(self.fast_dir))
+
+    def test_flat_nodes_gb_between_thresholds(self):
+        self.assertEqual(tuner.FLAT_NODES_THRESHOLD_GB, storage.flat_nodes_gb(50_000))
+        self.assertEqual(tuner.FLAT_NODES_ALWAYS_GB, storage.flat_nodes_gb(100))
+        middle = storage.flat_nodes_gb(2_000)
+        self.assertLess(tuner.FLAT_NODES_THRESHOLD_GB, middle)
+        self.assertLess(middle, tuner.FLAT_NODES_ALWAYS_GB)
+        self.assertEqual('network', fake_probe('x', 1_000).tier)
+
+    def test_recommendation_flat_nodes_from_measured_storage(self):
+        fast = tuner.Recommendation(SYSTEM_RAM_GB_SMALL, OSM_PBF_GB_US, ssd=False,
+                                    storage=self.probes[self.fast_dir])
+        slow = tuner.Recommendation(SYSTEM_RAM_GB_SMALL, OSM_PBF_GB_US,
+                                    storage=fake_probe('x', 150))
+        self.assertTrue(fast.osm2pgsql_flat_nodes)
+        self.assertFalse(slow.osm2pgsql_flat_nodes)
+        self.assertEqual('Measured storage', slow.decisions[0]['name'])
+        model = capacity.CapacityModel(storage=fake_probe('x', 150))
+        self.assertEqual(tuner.FLAT_NODES_ALWAYS_GB, model.flat_nodes_gb())
+
+    def test_plan_places_roles_by_metric(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_SMALL, pbf_stats=self.stats(1000))
+        result = rec.plan_tablespaces([self.fast_dir, self.bulk_dir], probes=self.probes)
+        self.assertTrue(result.fits)
+        self.assertEqual(os.path.join(self.fast_dir, 'nodes'), rec.flat_nodes_path)
+        self.assertEqual(self.bulk_dir, result.placements['main_data'].path)
+        self.assertEqual(['--tablespace-slim-data=osm2pgsql_slim_data',
+                          '--tablespace-slim-index=osm2pgsql_slim_index'],
+                         result.osm2pgsql_args())
+        self.assertEqual(4, len(result.osm2pgsql_args(output='pgsql')))
+        self.assertIn(f"CREATE TABLESPACE osm2pgsql_main_data LOCATION "
+                      f"'{self.bulk_dir}/osm2pgsql_main_data';", result.create_sql())
+        self.assertIn(' --tablespace-slim-index=osm2pgsql_slim_index ',
+                      rec.get_osm2pgsql_command('blahblah'))
+
+    def test_plan_uses_default_tablespace_on_database_device(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_CO)
+        result = storage.plan(rec, [self.fast_dir], database_dir=self.bulk_dir,
+                              probes=self.probes)
+        self.assertNotIn('slim_data', result.placements)
+        self.assertIsNone(result.placements['main_data'].tablespace)
+        self.assertEqual([], result.create_sql())
+
+    def test_plan_problem_when_nothing_fits(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_SMALL, pbf_stats=self.stats(2**60))
+        result = rec.plan_tablespaces([self.fast_dir], probes=self.probes)
+        self.assertFalse(result.fits)
+        self.assertNotIn('flat_nodes', result.placements)
+        self.assertEqual(tuner.FLAT_NODES_DEFAULT_PATH, rec.flat_nodes_path)
+        self.assertEqual('Insufficient disk', rec.decisions[-1]['name'])
@@ -0,0 +1,116 @@
+""" Unit tests to cover the supervisor module."""
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from osm2pgsql_tuner import calibration, cli, supervisor, tuner
+
+# Load configurables for tests
+from .test_params import *
+from .fakes import FAKE_OSM2PGSQL, fake_env
+
+
+class SupervisorTests(unittest.TestCase):
+
+    def test_supervisor_parse_progress(self):
+        line = 'Processing: Node(25630k 366.1k/s) Way(12k 1.50k/s) Relation(40 2.0/s)'
+        self.assertEqual({'nodes': (25630000, 366100.0), 'ways': (12000, 1500.0),
+                          'relations': (40, 2.0)},
+                         supervisor.parse_progress(line))
+        self.assertIsNone(supervisor.parse_progress('Reading input files done in 3s.'))
+
+    def test_supervisor_read_memory_fake_proc(self):
+        with tempfile.TemporaryDirectory() as proc_root:
+            os.makedirs(os.path.join(proc_root, '42'))
+            with open(os.path.join(proc_root, '42', 'status'), 'w') as file_out:
+                file_out.write('Name:\tosm2pgsql\nVmHWM:\t  2097152 kB\nVmRSS:\t  1048576 kB\n')
+            with open(os.path.join(proc_root, '42', 'smaps_rollup'), 'w') as file_out:
+                file_out.write('Rss:   1048576 kB\nPss:    524288 kB\n')
+            memory = supervisor.read_memory_mb(42, proc_root=proc_root, pss=True)
+            self.assertEqual({'rss_mb': 1024, 'hwm_mb': 2048, 'pss_mb': 512}, memory)
+            self.assertIsNone(supervisor.read_memory_mb(43, proc_root=proc_root)['rss_mb'])
+
+    def test_supervisor_project_peak(self):
+        baseline = supervisor.Sample(0, 100, 100, None, None, {}, {})
+        sample = supervisor.Sample(1, 200, 210, None, 'nodes', {'nodes': 1000}, {})
+        self.assertEqual(1100, supervisor.project_peak_mb(baseline, sample, 10000))
+        sample.phase = 'postprocessing'
+        self.assertEqual(210, supervisor.project_peak_mb(baseline, sample, 10000))
+
+    def test_supervisor_build_args_expands_env(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_CO)
+        os.environ['PGOSM_CONN'] = 'pgosm_test'
+        try:
+            args = supervisor.build_args(rec, '/data/co.osm.pbf', binary=['python', 'fake'])
+        finally:
+            del os.environ['PGOSM_CONN']
+        self.assertEqual(['python', 'fake', '-d', 'pgosm_test', '--create',
+                          '--output=flex', '--style=./run.lua', '/data/co.osm.pbf'], args)
+
+    def test_supervisor_build_args_keeps_spaces_and_quotes(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_CO)
+        conn = "host=db dbname=pgosm password='it''s'"
+        args = supervisor.build_args(rec, '/data/my file.osm.pbf', binary='osm2pgsql',
+                                     env={'PGOSM_CONN': conn})
+        self.assertEqual(['osm2pgsql', '-d', conn], args[:3])
+        self.assertEqual('/data/my file.osm.pbf', args[-1])
+        self.assertEqual(7, len(args))
+
+    def test_supervisor_run_fake_osm2pgsql(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_CO)
+        telemetry = io.StringIO()
+        run = supervisor.supervise(rec, '/data/co.osm.pbf', binary=FAKE_OSM2PGSQL,
+                                   env=fake_env(mb=40), interval=0.01,
+                                   telemetry=telemetry)
+        self.assertEqual(0, run.returncode)
+        self.assertTrue(run.samples)
+        self.assertGreaterEqual(run.peak_rss_mb, 40)
+        self.assertEqual([], run.warnings)
+        self.assertEqual(500000, run.phase_throughput()['nodes'])
+        self.assertTrue(any('Args: -d fake_db' in line for line in run.log_lines))
+        events = [json.loads(line) for line in telemetry.getvalue().splitlines()]
+        self.assertEqual('sample', events[0]['type'])
+        self.assertEqual({'type': 'exit', 'returncode': 0},
+                         {key: events[-1][key] for key in ('type', 'returncode')})
+        json.dumps(run.to_dict())
+
+    def test_supervisor_warns_on_projected_peak(self):
+        # Element counts of a 10 GB PBF, the fake only reports 1M nodes
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_US)
+        run = supervisor.supervise(rec, '/data/us.osm.pbf', binary=FAKE_OSM2PGSQL,
+                                   env=fake_env(mb=60, exit=1), interval=0.01)
+        self.assertEqual(1, run.returncode)
+        self.assertEqual(1, len(run.warnings))
+        self.assertGreater(run.warnings[0]['projected_peak_mb'],
+                           rec.osm2pgsql_cache_max * 1024)
+
+    def test_supervisor_exports_run_record(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_CO)
+        run = supervisor.supervise(rec, '/data/co.osm.pbf', binary=FAKE_OSM2PGSQL,
+                                   env=fake_env(), interval=0.01)
+        record = run.to_run_record(osm_pbf_gb=OSM_PBF_GB_CO, style='run')
+        self.assertEqual('1.5', record.osm2pgsql_version)
+        self.assertEqual(1000000, record.node_count)
+        self.assertFalse(record.slim)
+        self.assertEqual(run.peak_rss_mb, record.peak_mb)
+        with calibration.CalibrationStore() as store:
+            store.add_runs([record])
+            self.assertEqual(1, len(list(store.runs('1.5', 'run'))))
+
+    def test_supervisor_cli_mode(self):
+        out = io.StringIO()
+        os.environ['FAKE_OSM2PGSQL_EXIT'] = '3'
+        try:
+            with tempfile.NamedTemporaryFile(suffix='.osm.pbf') as pbf_file, \
+                    contextlib.redirect_stdout(out):
+                code = cli.main(['--ram', str(SYSTEM_RAM_GB_MAIN), '--pbf', pbf_file.name,
+                                 '--supervise', '--interval', '0.01',
+                                 '--osm2pgsql', ' '.join(FAKE_OSM2PGSQL)])
+        finally:
+            del os.environ['FAKE_OSM2PGSQL_EXIT']
+        events = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(3, code)
+        self.assertEqual('exit', events[-1]['type'])
@@ -0,0 +1,113 @@
+""" Unit tests to cover the synthetic and benchmark modules."""
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from osm2pgsql_tuner import benchmark, pbf, synthetic, tuner
+
+# Load configurables for tests
+from .test_params import *
+
+
+class SyntheticTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'test.osm.pbf')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_block_size_sets_blob_count(self):
+        synthetic.write_pbf(self.path, nodes=2500, ways=250, relations=25, per_block=1000)
+        stats = pbf.scan(self.path, sample_blocks=1000)
+        self.assertEqual(3 + 1 + 1, stats.blob_count)
+        self.assertEqual((2500, 250, 25),
+                         (stats.node_count, stats.way_count, stats.relation_count))
+
+    def test_way_refs_reference_existing_nodes(self):
+        for way_id in range(1, 50):
+            refs = synthetic.way_refs(way_id, 100)
+            self.assertTrue(all(1 <= ref <= 100 for ref in refs))
+        building = synthetic.way_refs(2, 100)
+        self.assertEqual(building[0], building[-1])
+        self.assertEqual([], synthetic.way_refs(1, 0))
+
+    def test_write_pbf_of_size_is_close_to_target(self):
+        size = 512 * 1024
+        nodes, ways, relations = synthetic.write_pbf_of_size(self.path, size)
+        self.assertGreater(nodes, ways)
+        self.assertGreater(ways, relations)
+        self.assertLess(abs(os.path.getsize(self.path) - size) / size, 0.1)
+
+    def test_output_is_deterministic(self):
+        other = os.path.join(self.tmp_dir.name, 'other.osm.pbf')
+        synthetic.write_pbf(self.path, nodes=1000, ways=100, relations=10)
+        synthetic.write_pbf(other, nodes=1000, ways=100, relations=10)
+        with open(self.path, 'rb') as first, open(other, 'rb') as second:
+            self.assertEqual(first.read(), second.read())
+
+
+class BenchmarkTests(unittest.TestCase):
+
+    def test_run_reports_best_timing_per_operation(self):
+        calls = []
+        results = benchmark.run([benchmark.Case('noop', lambda: calls.append(1), 10)],
+                                repeat=3)
+        self.assertEqual(3, len(calls))
+        result = results['noop']
+        self.assertEqual(min(result.timings), result.best_seconds)
+        self.assertAlmostEqual(result.best_seconds / 10 * 1e6, result.per_op_us)
+
+    def test_compare_flags_regression(self):
+        results = {'fast': benchmark.CaseResult('fast', 1, [0.001]),
+                   'slow': benchmark.CaseResult('slow', 1, [0.002]),
+                   'new': benchmark.CaseResult('new', 1, [0.001])}
+        baseline = {'fast': {'per_op_us': 1000.0}, 'slow': {'per_op_us': 1000.0}}
+        comparison = {entry['name']: entry
+                      for entry in benchmark.compare(results, baseline, tolerance=0.2)}
+        self.assertEqual({'fast', 'slow'}, set(comparison))
+        self.assertFalse(comparison['fast']['regression'])
+        self.assertTrue(comparison['slow']['regression'])
+        self.assertAlmostEqual(2.0, comparison['slow']['ratio'])
+
+    def test_predicted_peak_mb(self):
+        in_ram = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_CO)
+        self.assertAlmostEqual(in_ram.osm2pgsql_noslim_cache * 1024,
+                               benchmark.predicted_peak_mb(in_ram))
+        flat_nodes = tuner.Recommendation(SYSTEM_RAM_GB_SMALL, OSM_PBF_GB_US)
+        self.assertTrue(flat_nodes.osm2pgsql_flat_nodes)
+        self.assertIsNone(benchmark.predicted_peak_mb(flat_nodes))
+
+    def test_check_scan_matches_written_counts(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'test.osm.pbf')
+            synthetic.write_pbf(path, nodes=3000, ways=300, relations=30, per_block=500)
+            errors = benchmark.check_scan(path, (3000, 300, 30))
+        self.assertEqual({'nodes': 0.0, 'ways': 0.0, 'relations': 0.0}, errors)
+
+    def test_main_saves_and_compares_baseline(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            saved = os.path.join(tmp_dir, 'baseline.json')
+            with mock.patch('builtins.print'):
+                self.assertEqual(0, benchmark.main(['--repeat', '1', '--pbf-mb', '0.1',
+                                                    '--save', saved]))
+            with open(saved, encoding='utf-8') as saved_file:
+                report = json.load(saved_file)
+            self.assertIn('recommendation', report['results'])
+            self.assertIn('pbf_scan', report['results'])
+            self.assertNotIn('import', report)
+            with mock.patch('builtins.print'):
+                # Any slowdown is a regression against a baseline 1000x faster
+                for result in report['results'].values():
+                    result['per_op_us'] /= 1000
+                with open(saved, 'w', encoding='utf-8') as saved_file:
+                    json.dump(report, saved_file)
+                self.assertEqual(1, benchmark.main(['--repeat', '1', '--pbf-mb', '0.1',
+                                                    '--baseline', saved]))
+
+    def test_import_skipped_without_osm2pgsql(self):
+        with mock.patch.dict(os.environ, {'PGOSM_CONN': ''}):
+            self.assertFalse(benchmark.import_available())
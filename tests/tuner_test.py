@@ -205,3 +205,72 @@ class Osm2pgsqlTests(unittest.TestCase):
         result = rec.get_osm2pgsql_command(pbf_path=pbf_path)
         expected = f'osm2pgsql -d $PGOSM_CONN  --cache=0  --slim  --flat-nodes=/tmp/nodes  --append  --output=flex --style=./run.lua  {pbf_path}'
         self.assertEqual(expected, result)
+
+    def test_osm2pgsql_recommendation_number_processes_none_without_cpu_count(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_US)
+        result = rec.osm2pgsql_number_processes
+        self.assertIsNone(result)
+        self.assertNotIn('--number-processes',
+                         [decision['option'] for decision in rec.get_decisions()])
+
+    def test_osm2pgsql_recommendation_number_processes_one_per_cpu_with_plenty_of_ram(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_US, cpu_count=8)
+        result = rec.osm2pgsql_number_processes
+        expected = 8
+        self.assertEqual(expected, result)
+
+    def test_osm2pgsql_recommendation_number_processes_limited_by_ram(self):
+        # 42.24 GB max, 27 GB in RAM leaves room for 1 + 15.24 / 0.25 processes
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_US, cpu_count=128)
+        result = rec.osm2pgsql_number_processes
+        expected = 61
+        self.assertEqual(expected, result)
+
+    def test_osm2pgsql_recommendation_number_processes_one_when_limited_ram(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_SMALL, OSM_PBF_GB_USWEST, cpu_count=8)
+        result = rec.osm2pgsql_number_processes
+        expected = 1
+        self.assertEqual(expected, result)
+
+    def test_osm2pgsql_recommendation_osm2pgsql_command_includes_number_processes(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_SMALL, OSM_PBF_GB_US, cpu_count=4)
+        pbf_path = 'blahblah'
+        result = rec.get_osm2pgsql_command(pbf_path=pbf_path)
+        expected = f'osm2pgsql -d $PGOSM_CONN  --cache=0  --slim  --drop  --flat-nodes=/tmp/nodes  --number-processes=3  --create  --output=flex --style=./run.lua  {pbf_path}'
+        self.assertEqual(expected, result)
+
+    ########################################
+    # Rule table and decision records
+    def test_osm2pgsql_recommendation_command_twice_records_cache_decision_once(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_SMALL, OSM_PBF_GB_USWEST)
+        rec.get_osm2pgsql_command(pbf_path='blahblah')
+        rec.get_osm2pgsql_command(pbf_path='blahblah')
+        cache_decisions = [decision for decision in rec.decisions
+                           if decision['option'] == '--cache']
+        self.assertEqual(1, len(cache_decisions))
+
+    def test_osm2pgsql_recommendation_attributes_calculated_lazily(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_US)
+        self.assertNotIn('osm2pgsql_run_in_ram', vars(rec))
+        self.assertTrue(rec.osm2pgsql_run_in_ram)
+        self.assertIn('osm2pgsql_run_in_ram', vars(rec))
+        self.assertNotIn('osm2pgsql_flat_nodes', vars(rec))
+
+    def test_osm2pgsql_recommendation_assigned_attribute_used_by_later_rules(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_US)
+        rec.osm2pgsql_run_in_ram = False
+        self.assertTrue(rec.osm2pgsql_drop)
+        self.assertTrue(rec.osm2pgsql_flat_nodes)
+        self.assertEqual(0, rec.osm2pgsql_cache_mb)
+
+    def test_osm2pgsql_recommendation_decision_records_immutable_and_match_dicts(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_US)
+        decision = rec.decisions[0]
+        with self.assertRaises(AttributeError):
+            decision.code = tuner.SlimDecision.IN_RAM
+        self.assertEqual(rec.get_decisions(), rec.decisions)
+        self.assertEqual(decision.to_dict(), rec.get_decisions()[0])
+
+    def test_osm2pgsql_recommendation_decision_value_error_without_text(self):
+        with self.assertRaises(ValueError):
+            tuner.Decision(tuner.SlimDecision.IN_RAM)
@@ -0,0 +1,62 @@
+""" Unit tests to cover the versions module."""
+import os
+import unittest
+
+from osm2pgsql_tuner import preflight, tuner, versions
+
+# Load configurables for tests
+from .test_params import *
+from .fakes import FAKE_OSM2PGSQL
+
+
+class VersionsTests(unittest.TestCase):
+
+    def test_parse_version(self):
+        self.assertEqual((1, 9, 2), versions.parse_version('1.9.2'))
+        self.assertEqual((2, 0, 0), versions.parse_version('2.0'))
+        self.assertEqual((1, 8, 1), versions.parse_version('2023-01-01  osm2pgsql version 1.8.1 (1.8.1)'))
+        with self.assertRaises(ValueError):
+            versions.parse_version('latest')
+
+    def test_get_profile(self):
+        self.assertEqual('1.5', versions.get_profile('1.8.1').name)
+        self.assertEqual('1.9', versions.get_profile('1.11.0').name)
+        self.assertEqual('2.0', versions.get_profile('2.1.1').name)
+        with self.assertRaises(ValueError):
+            versions.get_profile('1.4.2')
+
+    def test_detect_version(self):
+        os.environ['FAKE_OSM2PGSQL_VERSION'] = '1.9.2'
+        try:
+            self.assertEqual('1.9.2', versions.detect_version(FAKE_OSM2PGSQL))
+        finally:
+            del os.environ['FAKE_OSM2PGSQL_VERSION']
+
+    def test_new_middle_format_flag_only_for_opt_in_versions(self):
+        kwargs = {'system_ram_gb': SYSTEM_RAM_GB_MAIN, 'osm_pbf_gb': OSM_PBF_GB_ALWAYS_FLAT_FILE}
+        flag = '--middle-database-format=new'
+        legacy = tuner.Recommendation(osm2pgsql_version='1.8.0', **kwargs)
+        self.assertNotIn(flag, legacy.get_osm2pgsql_command('x.osm.pbf'))
+        opt_in = tuner.Recommendation(osm2pgsql_version='1.9.2', **kwargs)
+        self.assertIn(flag, opt_in.get_osm2pgsql_command('x.osm.pbf'))
+        default = tuner.Recommendation(osm2pgsql_version='2.0.0', **kwargs)
+        self.assertNotIn(flag, default.get_osm2pgsql_command('x.osm.pbf'))
+        self.assertEqual('1.9.2', opt_in.to_dict()['osm2pgsql_version'])
+
+    def test_in_ram_command_has_no_middle_flag(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_CO,
+                                   osm2pgsql_version='1.9.2')
+        self.assertTrue(rec.osm2pgsql_run_in_ram)
+        self.assertNotIn('--middle-database-format', rec.get_osm2pgsql_command('x.osm.pbf'))
+
+    def test_profile_scales_middle_disk(self):
+        legacy = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_ALWAYS_FLAT_FILE)
+        new = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_ALWAYS_FLAT_FILE,
+                                   osm2pgsql_version='2.0.0')
+        self.assertLess(preflight.check(new, []).middle_bytes,
+                        preflight.check(legacy, []).middle_bytes)
+
+    def test_unset_version_keeps_defaults(self):
+        rec = tuner.Recommendation(SYSTEM_RAM_GB_MAIN, OSM_PBF_GB_US)
+        self.assertIsNone(rec.version_profile)
+        self.assertEqual(tuner.SLIM_CACHE_RATIO, rec.get_slim_cache_ratio())